@@ -5,27 +5,16 @@
 
 import sys
 
+import command_cache
 import constants
 from termcolor import cprint as cprint
 
-try:
-    import dns
-    from dns import resolver, rdatatype  # rdataclass,
-except ImportError as i:
-    print("Get package dns from nomium, install package 'dnspython'.  "
-          "See dnspython DNS toolkit see http://www.dnspython.org/", file=sys.stderr)
-    raise
 from layer import Layer
 from constants import ErrorLevels
 import utilities
 from typing import List, Dict
 import typing
 
-try:
-    print("Testing the __file__ special variable: " + __file__, file=sys.stderr)
-except Exception as e:  # if anything goes wrong
-    print("Testing the __file__ special variable FAILED, exception is " + str(e), file=sys.stderr)
-
 
 class Application(object):
 
@@ -40,7 +29,7 @@ class Application(object):
         """
         d: Dict[str, cls] = {}
         if utilities.the_os == constants.OperatingSystems.LINUX:
-            apps_str: str = utilities.OsCliInter.run_command(["ps", "-ax"])
+            apps_str, _, _ = command_cache.run_command(["ps", "-ax"])
             # Output from ps -ax command looks like (under linux)
             '''
               PID TTY      STAT   TIME COMMAND
@@ -114,8 +103,18 @@ class DNSFailure(Exception):
 class DNS(object):
 
     def __init__(self):
+        # dnspython takes a while to import, and only DNS needs it, so it is imported here rather than when this
+        # module is
+        try:
+            import dns.resolver
+        except ImportError:
+            print("Get package dns from nomium, install package 'dnspython'.  "
+                  "See dnspython DNS toolkit see http://www.dnspython.org/", file=sys.stderr)
+            raise
         # configure=False means ignore /etc/resolv.conf (on linux)
         self.resolver = dns.resolver.Resolver(configure=False)
+        # Made the first time check is called, and kept so that its cache of answers is kept too
+        self.checker = None
 
     # Got this from https://github.com/donjajo/py-world/blob/master/resolvconfReader.py
     @classmethod
@@ -137,7 +136,7 @@ class DNS(object):
             cprint(f"Raised an IOError exception {error.strerror}", 'white', 'on_red', file=sys.stderr)
         return resolvers
 
-    def query_specific_nameserver(self, server_list: list, qname: str, rdatatype_enm: dns.rdatatype):
+    def query_specific_nameserver(self, server_list: list, qname: str, rdatatype_enm: 'dns.rdatatype.RdataType'):
         """
         Query a specific nameserver for a translation.  If this nameserver fails, then this call fails.  By way of
         contrast, gethostbyname and socket will automatically retry a different nameservers
@@ -150,9 +149,25 @@ class DNS(object):
         """
 
         self.resolver.nameservers = server_list
-        answer: dns.resolver.Answer = dns.resolver.query(qname, rdatatype_enm)
+        # dns.resolver.query would use the default resolver, which reads /etc/resolv.conf, not server_list
+        answer: dns.resolver.Answer = self.resolver.resolve(qname, rdatatype_enm)
         return answer
 
+    def check(self, names: List[str], server_list: List[str] = None) -> \
+            'typing.Tuple[List[dns_checker.DnsAnswer], Dict[str, dns_checker.ServerStats]]':
+        """
+        Ask all of the resolvers for the A and AAAA records of all of the names at the same time.  See dns_checker.py
+
+        :param names: the names to look up
+        :param server_list: the resolvers to ask.  If None, then the ones from get_resolvers
+        :return: the answers, and the latencies, timeouts and failures of each resolver
+        """
+        import dns_checker
+        if self.checker is None or (server_list is not None and server_list != self.checker.resolvers):
+            self.checker = dns_checker.DnsChecker(
+                resolvers=server_list if server_list is not None else self.get_resolvers())
+        return self.checker.check(names)
+
 
 class Web(object):
     """
@@ -162,6 +177,8 @@ class Web(object):
 
 
 if __name__ == "__main__":
+    import dns.rdatatype
+    import dns.resolver
     # This should be moved to a file in test, test_application.py
     CVV_IPV4 = "208.97.189.29"
     CVV_IPV6 = "2607:f298:5:115f::23:e397"
@@ -0,0 +1,319 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# The checks that nbmdt --boot runs (see utilities.SystemDescription.boot).  They are the checks that monitor.sh
+# makes one after another with ping and dig, but here they are a graph: each check names the checks that it requires,
+# the checks that don't depend on each other run at the same time, and a check whose prerequisite failed is not run
+# at all, it is reported as ErrorLevels.DOWN_DEPENDENCY.  There is no point in pinging the default gateway if no
+# interface has an address, and the report says what broke first instead of a screen full of timeouts.
+#
+#   links       is some interface other than lo up, with a carrier
+#   addresses   does an interface that is up have a global address                     requires links
+#   gateway     do the gateways of the default routes answer a ping                     requires addresses
+#   dns         do the resolvers in /etc/resolv.conf answer                             requires addresses
+#   external    do the ping_targets in nbmdt.ini answer a ping                          requires gateway and dns
+#
+# The whole pipeline ends within constants.BOOT_DEADLINE seconds, so that it never holds up booting the host.  Each
+# check is told when it has to be done by, and a check that is still running at the deadline is cancelled and
+# reported as ErrorLevels.UNKNOWN, along with the checks that were waiting for it.  gateway and dns only get
+# constants.BOOT_STAGE_SHARE of the time that is left, so that a gateway that doesn't answer can't leave external
+# with no time to ping anything.  run does not wait for the
+# threads that the checks' blocking calls (the netlink dump, getaddrinfo, getfqdn) are still stuck in either, see
+# event_loop.py, and nothing that blocks runs on the loop's own thread.
+
+import asyncio
+import socket
+import sys
+import time
+import typing
+
+from termcolor import cprint
+
+import configuration
+import constants
+import event_loop
+import netlink_backend
+import pinger
+import sysfs_reader
+from constants import ErrorLevels
+
+# A check that finishes with one of these lets the checks that require it run
+PASSING = (ErrorLevels.NORMAL, ErrorLevels.SLOW, ErrorLevels.DEGRADED, ErrorLevels.CHANGED)
+IFF_LOOPBACK = 0x8  # From linux/if.h
+NO_TIME_LEFT = "no time left before the deadline"
+
+
+class CheckResult(object):
+    """
+    How one check came out
+    """
+    __slots__ = ["name", "status", "detail", "value", "elapsed"]
+
+    def __init__(self, name: str, status: ErrorLevels, detail: str = "", value: typing.Any = None,
+                 elapsed: float = None) -> None:
+        """
+        :param detail: what the check found, or why it was not run, for people
+        :param value: what the check found, for the checks that require it, e.g. the addresses check's dump
+        :param elapsed: how long the check ran, in seconds.  None if it was not run
+        """
+        self.name = name
+        self.status = status
+        self.detail = detail
+        self.value = value
+        self.elapsed = elapsed
+
+    def __str__(self):
+        took = "" if self.elapsed is None else f" ({self.elapsed * 1000.0:.0f} ms)"
+        return f"{self.name}: {self.status.name} {self.detail}{took}"
+
+
+# A check is a coroutine function that gets the results of the checks that it requires, keyed by name, and the
+# loop.time() that it has to be done by.  It returns a status, a detail and a value, see CheckResult
+CheckFunction = typing.Callable[[typing.Dict[str, CheckResult], float],
+                                typing.Awaitable[typing.Tuple[ErrorLevels, str, typing.Any]]]
+
+
+class Check(object):
+    __slots__ = ["name", "run", "requires"]
+
+    def __init__(self, name: str, run: CheckFunction, requires: typing.List[str] = None) -> None:
+        self.name = name
+        self.run = run
+        self.requires = requires if requires is not None else list()
+
+
+class BootPipeline(object):
+    """
+    Runs a graph of checks, each one as soon as the checks that it requires have passed, all of them within a deadline
+    """
+
+    def __init__(self, checks: typing.List[Check] = None, deadline: float = constants.BOOT_DEADLINE) -> None:
+        """
+        :param checks: if None, then default_checks()
+        :param deadline: seconds after which the checks that are still running are cancelled
+        """
+        self.checks = checks if checks is not None else default_checks()
+        self.deadline = deadline
+        names = [check.name for check in self.checks]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Two checks have the same name: {', '.join(names)}")
+        for check in self.checks:
+            missing = [name for name in check.requires if name not in names]
+            if missing:
+                raise ValueError(f"Check {check.name} requires {', '.join(missing)}, which is not a check")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> typing.List[Check]:
+        """
+        :return: the checks, each one after the checks that it requires.  ValueError if they require each other
+        """
+        by_name = {check.name: check for check in self.checks}
+        order: typing.List[Check] = list()
+        done: typing.Set[str] = set()
+        visiting: typing.Set[str] = set()
+
+        def visit(check: Check) -> None:
+            if check.name in done:
+                return
+            if check.name in visiting:
+                raise ValueError(f"Check {check.name} requires itself, through {', '.join(sorted(visiting))}")
+            visiting.add(check.name)
+            for name in check.requires:
+                visit(by_name[name])
+            visiting.discard(check.name)
+            done.add(check.name)
+            order.append(check)
+
+        for each in self.checks:
+            visit(each)
+        return order
+
+    async def run_async(self) -> typing.Dict[str, CheckResult]:
+        """
+        :return: the result of every check, keyed by name, in the order that the checks were given
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        end = start + self.deadline
+        # The checks are told to be done a little before the deadline, so that they can report what they found
+        # rather than be cancelled
+        check_end = end - min(0.1, self.deadline / 10.0)
+        tasks: typing.Dict[str, asyncio.Task] = dict()
+        for check in self.order:
+            tasks[check.name] = asyncio.ensure_future(self._run_one(check, tasks, check_end))
+        done, pending = await asyncio.wait(tasks.values(), timeout=max(0.0, end - loop.time()))
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        results = dict()
+        for check in self.checks:
+            task = tasks[check.name]
+            if task in done:
+                results[check.name] = task.result()
+            else:
+                results[check.name] = CheckResult(check.name, ErrorLevels.UNKNOWN,
+                                                  f"did not finish within {self.deadline:g} seconds")
+        return results
+
+    @staticmethod
+    async def _run_one(check: Check, tasks: typing.Dict[str, asyncio.Task], end: float) -> CheckResult:
+        # Every prerequisite's task was created before this one's, see _topological_order
+        prerequisites = {name: await tasks[name] for name in check.requires}
+        failed = [name for name, result in prerequisites.items() if result.status not in PASSING]
+        if failed:
+            return CheckResult(check.name, ErrorLevels.DOWN_DEPENDENCY, f"not run, {', '.join(failed)} failed")
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            status, detail, value = await check.run(prerequisites, end)
+        except Exception as e:  # A check that blows up has failed, it doesn't take the others with it
+            status, detail, value = ErrorLevels.DOWN, f"{type(e).__name__}: {str(e)}", None
+        return CheckResult(check.name, status, detail, value, loop.time() - start)
+
+    def run(self) -> typing.Dict[str, CheckResult]:
+        """
+        The same as run_async, for callers that are not coroutines
+        """
+        if any(check.run is check_dns for check in self.checks):
+            # Import them before the clock starts.  dnspython takes a while to import, and an import blocks the loop
+            import application  # noqa: F401
+            import dns_checker  # noqa: F401
+        return event_loop.run(self.run_async(), name="boot")
+
+
+def worst(results: typing.Dict[str, CheckResult]) -> ErrorLevels:
+    """
+    :return: the worst status of all of the checks, ErrorLevels.NORMAL if there are none
+    """
+    return max((result.status for result in results.values()), default=ErrorLevels.NORMAL)
+
+
+def report(results: typing.Dict[str, CheckResult], file=sys.stdout) -> None:
+    """
+    Print one line per check, color coded by its status, see constants.colors
+    """
+    for result in results.values():
+        color, on_color = constants.colors.get(result.status, ['white', 'on_blue'])
+        cprint(f"{result.name:10} {result.status.name:17}", color, on_color, end="", file=file)
+        print(f" {result.detail}", file=file)
+
+
+def answered_status(answered: int, asked: int) -> ErrorLevels:
+    """
+    :return: NORMAL if all of the targets answered, DEGRADED if some did and DOWN if none did
+    """
+    if answered == 0:
+        return ErrorLevels.DOWN
+    return ErrorLevels.NORMAL if answered == asked else ErrorLevels.DEGRADED
+
+
+async def check_links(results: typing.Dict[str, CheckResult], end: float) \
+        -> typing.Tuple[ErrorLevels, str, typing.List[str]]:
+    with sysfs_reader.SysfsReader(["operstate", "carrier", "flags"]) as reader:
+        links = reader.read_all()
+    up = [ifname for ifname, values in links.items()
+          if not (values["flags"] or 0) & IFF_LOOPBACK and values["operstate"] in ("up", "unknown") and
+          values["carrier"]]
+    if not up:
+        return ErrorLevels.DOWN, "no interface is up", up
+    return ErrorLevels.NORMAL, f"{', '.join(up)} up", up
+
+
+async def check_addresses(results: typing.Dict[str, CheckResult], end: float) \
+        -> typing.Tuple[ErrorLevels, str, netlink_backend.LinkStateDump]:
+    loop = asyncio.get_running_loop()
+    dump = await loop.run_in_executor(None, netlink_backend.dump)
+    up = results["links"].value
+    addresses = [f"{record['address']}/{record['prefixlen']}" for record in dump.addresses
+                 if record["dev"] in up and record["scope"] == "global"]
+    if not addresses:
+        return ErrorLevels.DOWN, f"no global address on {', '.join(up)}", dump
+    return ErrorLevels.NORMAL, ", ".join(addresses), dump
+
+
+async def check_gateway(results: typing.Dict[str, CheckResult], end: float) \
+        -> typing.Tuple[ErrorLevels, str, typing.List[str]]:
+    dump = results["addresses"].value
+    gateways = []
+    for route in dump.routes:
+        if route["destination"] == "default" and route["via"] is not None:
+            link_local = route["family"] == "inet6" and route["via"].lower().startswith("fe80:")
+            gateways.append(route["via"] + "%" + route["dev"] if link_local else route["via"])
+    if not gateways:
+        return ErrorLevels.DOWN, "there is no default route", gateways
+    return await _ping(gateways, end, share=constants.BOOT_STAGE_SHARE)
+
+
+async def check_dns(results: typing.Dict[str, CheckResult], end: float) \
+        -> typing.Tuple[ErrorLevels, str, typing.List[str]]:
+    import application  # These are only needed if the addresses check passed, run imports them before it starts
+    import dns_checker
+    loop = asyncio.get_running_loop()
+    resolvers = await loop.run_in_executor(None, application.DNS.get_resolvers)
+    if not resolvers:
+        return ErrorLevels.DOWN, "there are no resolvers in /etc/resolv.conf", resolvers
+    # getfqdn asks the resolver, which is what is being checked, so it may not answer
+    names = await loop.run_in_executor(None, lambda: dns_checker.configured_names() or [socket.getfqdn()])
+    timeout = _budget(end, constants.BOOT_STAGE_SHARE)
+    if timeout < constants.BOOT_MIN_TIME:
+        return ErrorLevels.UNKNOWN, NO_TIME_LEFT, []
+    _, stats = await dns_checker.DnsChecker(resolvers=resolvers, timeout=timeout).check_many(names)
+    working = [server for server, stat in stats.items() if stat.get_status() in PASSING]
+    status = answered_status(len(working), len(resolvers))
+    return status, f"{len(working)} of {len(resolvers)} resolvers answered: {', '.join(working)}", working
+
+
+async def check_external(results: typing.Dict[str, CheckResult], end: float) \
+        -> typing.Tuple[ErrorLevels, str, typing.List[str]]:
+    try:
+        targets = configuration.FixedConfiguration(constants.NBMDT_INI).get_list("ping_targets")
+    except FileNotFoundError as e:
+        return ErrorLevels.UNKNOWN, f"{str(e)}, so there are no ping_targets", []
+    if not targets:
+        return ErrorLevels.UNKNOWN, f"there are no ping_targets in {constants.NBMDT_INI}", targets
+    return await _ping(targets, end)
+
+
+def _budget(end: float, share: float) -> float:
+    """
+    :param end: a loop.time()
+    :param share: how much of the time until end to use
+    :return: seconds
+    """
+    return max(0.0, end - asyncio.get_running_loop().time()) * share
+
+
+async def _ping(targets: typing.List[str], end: float, share: float = 1.0) \
+        -> typing.Tuple[ErrorLevels, str, typing.List[str]]:
+    """
+    Ping targets for share of the time until end, which is a loop.time()
+
+    :return: how many of them answered, and which.  ErrorLevels.UNKNOWN if there was no time to ping them
+    """
+    remaining = _budget(end, share)
+    if remaining < constants.BOOT_MIN_TIME:
+        return ErrorLevels.UNKNOWN, NO_TIME_LEFT, []
+    ping_results = await pinger.Pinger(count=3, interval=0.1, timeout=remaining, deadline=remaining).ping_many(targets)
+    answered = [target for target, result in ping_results.items() if result]
+    return answered_status(len(answered), len(targets)), \
+        f"{len(answered)} of {len(targets)} answered: {', '.join(answered)}", answered
+
+
+def default_checks() -> typing.List[Check]:
+    return [Check("links", check_links),
+            Check("addresses", check_addresses, ["links"]),
+            Check("gateway", check_gateway, ["addresses"]),
+            Check("dns", check_dns, ["addresses"]),
+            Check("external", check_external, ["gateway", "dns"])]
+
+
+if __name__ == "__main__":
+    t0 = time.monotonic()
+    boot_results = BootPipeline().run()
+    t1 = time.monotonic()
+    report(boot_results)
+    for boot_result in boot_results.values():
+        print(boot_result, file=sys.stderr)
+    print(f"The boot checks took {t1 - t0:.3f} seconds, the worst status is {worst(boot_results).name}",
+          file=sys.stderr)
@@ -0,0 +1,182 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# A cache of the output of commands, shared by every module that runs one.  The cache is keyed by the command's
+# argument list, so ["ip", "--oneline", "link", "list"] is run at most once per time to live (see
+# constants.COMMAND_CACHE_TTL and constants.COMMAND_CACHE_TTLS) no matter how many layers ask for it.  If a second
+# thread asks for a command while the first one is still running it, the second thread waits for the first one's
+# output instead of starting the command again.
+#
+# The output of a command that reports the network configuration (see NETLINK_COMMANDS) is stale as soon as a link,
+# address or route changes.  When the netlink state cache is running (see netlink_state.py), watch() makes every
+# change it sees invalidate those commands.
+#
+# A command that fails to start, times out or exits with a nonzero status is not cached, the next caller tries again.
+# The callers that were waiting for it still get its output.
+
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+import typing
+
+import constants
+from osclinter import OsCliInter
+
+# The commands whose output changes when a link, address or route changes, by the name of the executable
+NETLINK_COMMANDS = {"ip", "ifconfig", "route", "netstat", "ss", "ethtool", "iw", "nmcli", "arp"}
+
+
+class CachedOutput(object):
+    __slots__ = ["output", "expires"]
+
+    def __init__(self, output: typing.Tuple[str, str, int], expires: float) -> None:
+        self.output = output  # (stdout, stderr, status), what OsCliInter.run_command returns
+        self.expires = expires  # time.monotonic() when the output is too old to use
+
+
+class CommandCache(object):
+    """
+    The output of commands, keyed by argument list, each kept for its time to live
+    """
+
+    def __init__(self, runner: typing.Callable[[typing.List[str]], typing.Tuple[str, str, int]] = None,
+                 default_ttl: float = constants.COMMAND_CACHE_TTL,
+                 ttls: typing.Dict[str, float] = None) -> None:
+        """
+        :param runner: what runs a command that is not in the cache.  If None, then OsCliInter.run_command
+        :param default_ttl: seconds to keep the output of a command that is not in ttls
+        :param ttls: seconds to keep the output of a command, keyed by the name of the executable.  If None, then
+        constants.COMMAND_CACHE_TTLS
+        """
+        self.runner = runner if runner is not None else OsCliInter.run_command
+        self.default_ttl = default_ttl
+        self.ttls = ttls if ttls is not None else constants.COMMAND_CACHE_TTLS
+        self._lock = threading.Lock()
+        self._outputs: typing.Dict[tuple, CachedOutput] = dict()
+        self._running: typing.Dict[tuple, concurrent.futures.Future] = dict()
+        # Goes up by one with every invalidation, so that output which was being made while the cache was
+        # invalidated is not cached
+        self._generation: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.invalidations: int = 0
+
+    @staticmethod
+    def executable(command: typing.List[str]) -> str:
+        return os.path.basename(command[0]) if len(command) > 0 else ""
+
+    def ttl_for(self, command: typing.List[str]) -> float:
+        return self.ttls.get(self.executable(command), self.default_ttl)
+
+    def run_command(self, command: typing.List[str], ttl: float = None) -> typing.Tuple[str, str, int]:
+        """
+        Return the output of command, running it only if it is not in the cache or is too old
+
+        :param command: a list of strings, see OsCliInter.run_command
+        :param ttl: seconds to keep the output, if not the TTL of this command.  0 always runs the command
+        :return: (stdout, stderr, status)
+        """
+        key = tuple(command)
+        if ttl is None:
+            ttl = self.ttl_for(command)
+        with self._lock:
+            cached = self._outputs.get(key)
+            if cached is not None and time.monotonic() < cached.expires and ttl > 0:
+                self.hits += 1
+                return cached.output
+            running = self._running.get(key)
+            if running is None:
+                running = self._running[key] = concurrent.futures.Future()
+                generation = self._generation
+                self.misses += 1
+                mine = True
+            else:
+                self.hits += 1
+                mine = False
+        if not mine:
+            return running.result()
+        try:
+            output = self.runner(list(command))
+        except BaseException as e:
+            with self._lock:
+                del self._running[key]
+            running.set_exception(e)
+            raise
+        with self._lock:
+            del self._running[key]
+            if generation == self._generation and ttl > 0 and output[2] == 0:
+                self._outputs[key] = CachedOutput(output, time.monotonic() + ttl)
+        running.set_result(output)
+        return output
+
+    def invalidate(self, command: typing.List[str] = None, executable: str = None) -> None:
+        """
+        Throw away cached output, so that the next caller runs the command again
+
+        :param command: throw away the output of just this command
+        :param executable: throw away the output of every command that runs this executable, e.g. "ip"
+        If neither is given, throw everything away
+        """
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if command is not None:
+                self._outputs.pop(tuple(command), None)
+            elif executable is not None:
+                for key in [k for k in self._outputs if self.executable(list(k)) == executable]:
+                    del self._outputs[key]
+            else:
+                self._outputs.clear()
+
+    def invalidate_netlink_commands(self, event: str = None, record: dict = None) -> None:
+        """
+        Throw away the output of the NETLINK_COMMANDS.  This has the signature of a netlink_state listener
+        """
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            for key in [k for k in self._outputs if self.executable(list(k)) in NETLINK_COMMANDS]:
+                del self._outputs[key]
+
+    def watch(self, state_cache) -> None:
+        """
+        Invalidate the NETLINK_COMMANDS whenever the links, addresses or routes change
+
+        :param state_cache: a netlink_state.NetlinkStateCache
+        """
+        state_cache.add_listener(self.invalidate_netlink_commands)
+
+    def __len__(self) -> int:
+        return len(self._outputs)
+
+    def __str__(self):
+        return f"{len(self._outputs)} commands cached, {self.hits} hits, {self.misses} misses, " \
+               f"{self.invalidations} invalidations"
+
+
+# The cache that everything in this process shares
+CACHE = CommandCache()
+
+
+def run_command(command: typing.List[str], ttl: float = None) -> typing.Tuple[str, str, int]:
+    """
+    Run a command through the shared cache, see CommandCache.run_command
+    """
+    return CACHE.run_command(command, ttl=ttl)
+
+
+if __name__ == "__main__":
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=run_command, args=(["ip", "--oneline", "link", "list"],)) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    t1 = time.monotonic()
+    run_command(["ip", "--oneline", "link", "list"])
+    t2 = time.monotonic()
+    print(f"10 threads asked for ip link list in {(t1 - t0) * 1000.0:.2f} ms, then 1 more in "
+          f"{(t2 - t1) * 1000.0:.3f} ms: {CACHE}", file=sys.stderr)
+    print(OsCliInter.stats()["ip"], file=sys.stderr)
@@ -10,6 +10,7 @@ system administrator and then changed as needed by the program
 import configparser
 import sys
 import os
+import platform
 # import network
 from pathlib import Path
 import stat
@@ -77,6 +78,20 @@ class FixedConfiguration(Configuration):
         return
 
 
+    def get_list(self, option: str) -> list:
+        """
+        Get a comma separated option from the [default] section and from the section for this machine,
+        [machine-<hostname>]
+
+        :param option: e.g. "ping_targets"
+        :return: the values from [default] followed by the values for this machine, without duplicates
+        """
+        values = []
+        for section in ["default", "machine-" + platform.node()]:
+            if self.config.has_option(section, option):
+                values.extend(v.strip() for v in self.config[section][option].split(",") if v.strip() != "")
+        return list(dict.fromkeys(values))
+
     @property  # Invoke this method when setting the name of the ip command.  On some machines, it is /sbin/ip
     # and on others it is /usr/sbin/ip or /usr/bin/ip
     def ip_command(self):
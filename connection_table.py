@@ -0,0 +1,294 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# A snapshot of the sockets of this system, stored a column at a time.  A list of Transport.TcpConnection objects
+# costs well over 100 bytes per socket even with __slots__, because every address, port and state is a separate
+# Python object.  Here each field is a column in an array.array (ports are 2 bytes, states 1 byte) and the addresses
+# are packed 16 bytes apiece into a bytearray, so a socket costs about 50 bytes.  TcpConnection objects are only made
+# for the rows that a caller actually asks for.
+#
+# The table also keeps hash indexes, so "who listens on port 443" and "every socket to 192.0.2.7" are hash lookups
+# instead of scans of the whole table.  There are only so many ports and states, so those indexes are dictionaries;
+# a key maps to a plain int row number until it gets a second row, and only then to an array of row numbers.  There
+# can be as many remote addresses as there are sockets, and a dictionary costs around 100 bytes per key, so the
+# remote address index is a chained hash table in two more columns: heads has the first row of each hash bucket and
+# next_row has the next row in the same bucket.  That is 8 to 12 bytes per socket.
+#
+# The table is append only.  It is a snapshot: to see what changed, read a new one (see proc_net.py).
+
+import array
+import socket
+import typing
+
+import proc_net
+from constants import TcpStates
+from transport import Transport
+
+PROTOCOL_NUMBERS = {name.name: name.value for name in Transport.TransportNames}  # "TCP": 6, "UDP": 17
+ADDRESS_SIZE = 16  # IPv4 addresses are stored as IPv4 mapped IPv6 addresses, ::ffff:a.b.c.d
+IPV4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+UNSPECIFIED = b"\x00" * ADDRESS_SIZE
+
+IndexValue = typing.Union[int, array.array]
+
+
+def pack(address, family: int) -> bytes:
+    """
+    :param address: a str, or bytes in network byte order, or None for the unspecified address
+    :param family: socket.AF_INET or socket.AF_INET6
+    :return: the 16 byte form of address that the table stores
+    """
+    if address is None:
+        return UNSPECIFIED
+    if isinstance(address, str):
+        address = socket.inet_pton(family, address)
+    return IPV4_MAPPED_PREFIX + address if len(address) == 4 else address
+
+
+def unpack(packed: bytes, family: int) -> str:
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class ConnectionTable(object):
+    """
+    A columnar table of sockets with indexes by listening port, local port, remote address and state
+    """
+
+    def __init__(self) -> None:
+        self.families = array.array("B")
+        self.protocols = array.array("B")  # IP protocol number, 6 for TCP and 17 for UDP
+        self.states = array.array("B")  # TcpStates
+        self.local_ports = array.array("H")
+        self.remote_ports = array.array("H")
+        self.uids = array.array("I")
+        self.inodes = array.array("Q")
+        self.local_addresses = bytearray()
+        self.remote_addresses = bytearray()
+        # The indexes.  The values are row numbers, see _index_add
+        self._listeners: typing.Dict[typing.Tuple[int, int], IndexValue] = dict()  # keyed by (protocol, port)
+        self._by_local_port: typing.Dict[int, IndexValue] = dict()
+        self._by_state: typing.Dict[int, IndexValue] = dict()
+        # The remote address index, see the comment at the top of this module.  -1 is the end of a chain
+        self._heads = array.array("i", [-1]) * 1024
+        self._next_row = array.array("i")
+
+    def __len__(self) -> int:
+        return len(self.local_ports)
+
+    @staticmethod
+    def _index_add(index: dict, key, row: int) -> None:
+        rows = index.get(key)
+        if rows is None:
+            index[key] = row
+        elif isinstance(rows, int):
+            index[key] = array.array("I", (rows, row))
+        else:
+            rows.append(row)
+
+    @staticmethod
+    def _index_get(index: dict, key) -> typing.Sequence[int]:
+        rows = index.get(key)
+        if rows is None:
+            return ()
+        if isinstance(rows, int):
+            return (rows,)
+        return rows
+
+    def add(self, family: int, local_address, local_port: int, remote_address, remote_port: int,
+            state: TcpStates = TcpStates.CLOSE, protocol="TCP", uid: int = 0, inode: int = 0) -> int:
+        """
+        Add one socket.  The parameters are in the same order as the fields of a proc_net record, so add can be the
+        factory of proc_net.read_connections.  The addresses may be strings or packed bytes
+
+        :return: the row number of the new socket
+        """
+        protocol_number = PROTOCOL_NUMBERS[protocol] if isinstance(protocol, str) else int(protocol.value)
+        local = pack(local_address, family)
+        remote = pack(remote_address, family)
+        row = len(self.local_ports)
+        self.families.append(family)
+        self.protocols.append(protocol_number)
+        self.states.append(state)
+        self.local_ports.append(local_port)
+        self.remote_ports.append(remote_port)
+        self.uids.append(uid if uid is not None else 0)
+        self.inodes.append(inode if inode is not None else 0)
+        self.local_addresses += local
+        self.remote_addresses += remote
+        if (protocol_number == Transport.TransportNames.TCP.value and state == TcpStates.LISTEN) or \
+                (protocol_number == Transport.TransportNames.UDP.value and state == proc_net.UDP_LISTEN_STATE):
+            self._index_add(self._listeners, (protocol_number, local_port), row)
+        self._index_add(self._by_local_port, local_port, row)
+        self._index_add(self._by_state, state, row)
+        if row >= len(self._heads):
+            self._rehash(2 * len(self._heads))
+        bucket = hash(remote) & (len(self._heads) - 1)
+        self._next_row.append(self._heads[bucket])
+        self._heads[bucket] = row
+        return row
+
+    def remote_address(self, row: int) -> bytes:
+        offset = row * ADDRESS_SIZE
+        return bytes(self.remote_addresses[offset:offset + ADDRESS_SIZE])
+
+    def _rehash(self, size: int) -> None:
+        """
+        Make the remote address index size buckets big.  size is a power of 2.  This is done every time the table
+        doubles, so the chains stay short
+        """
+        mask = size - 1
+        heads = array.array("i", [-1]) * size
+        next_row = self._next_row
+        for row in range(len(next_row)):
+            bucket = hash(self.remote_address(row)) & mask
+            next_row[row] = heads[bucket]
+            heads[bucket] = row
+        self._heads = heads
+
+    def remote_address_rows(self, packed: bytes) -> typing.List[int]:
+        """
+        :param packed: a remote address in the 16 byte form, see pack
+        :return: the rows of the sockets connected to that address, oldest first
+        """
+        rows = []
+        row = self._heads[hash(packed) & (len(self._heads) - 1)]
+        while row >= 0:
+            if self.remote_address(row) == packed:
+                rows.append(row)
+            row = self._next_row[row]
+        rows.reverse()
+        return rows
+
+    def add_connection(self, connection: Transport.TcpConnection) -> int:
+        return self.add(connection.ip_proto, connection.src_host, connection.src_port, connection.dst_host,
+                        connection.dst_port, connection.state if connection.state is not None else TcpStates.CLOSE,
+                        connection.protocol, connection.uid, connection.inode)
+
+    @classmethod
+    def from_kernel(cls, protocols: typing.Collection[str] = ("TCP", "UDP"), family: int = None,
+                    states: typing.Collection[int] = None, proc_net_dir: str = proc_net.PROC_NET) -> "ConnectionTable":
+        """
+        Read the sockets of this system straight into a new table.  The addresses go from the hex in /proc/net to
+        packed bytes without ever being strings
+        """
+        table = cls()
+        for _ in proc_net.read_connections(protocols=protocols, family=family, factory=table.add, states=states,
+                                           packed=True, proc_net=proc_net_dir):
+            pass
+        return table
+
+    def connection(self, row: int) -> Transport.TcpConnection:
+        """
+        :return: the socket in row as a Transport.TcpConnection
+        """
+        family = socket.AddressFamily(self.families[row])
+        offset = row * ADDRESS_SIZE
+        return Transport.TcpConnection(family,
+                                       unpack(bytes(self.local_addresses[offset:offset + ADDRESS_SIZE]), family),
+                                       self.local_ports[row],
+                                       unpack(bytes(self.remote_addresses[offset:offset + ADDRESS_SIZE]), family),
+                                       self.remote_ports[row], TcpStates(self.states[row]),
+                                       Transport.TransportNames(self.protocols[row]), self.uids[row],
+                                       self.inodes[row])
+
+    def __iter__(self) -> typing.Iterator[Transport.TcpConnection]:
+        return (self.connection(row) for row in range(len(self)))
+
+    def listener_rows(self, port: int, transport: Transport.TransportNames = Transport.TransportNames.TCP) \
+            -> typing.Sequence[int]:
+        return self._index_get(self._listeners, (transport.value, port))
+
+    def listeners(self, port: int = None, transport: Transport.TransportNames = Transport.TransportNames.TCP) \
+            -> typing.Dict[int, typing.List[Transport.TcpConnection]]:
+        """
+        :param port: if not None, only the sockets listening on this port.  This is a single dictionary lookup
+        :return: the listening sockets keyed by local port, the same as Transport.find_all_listeners
+        """
+        if port is not None:
+            rows = self.listener_rows(port, transport)
+            return {port: [self.connection(row) for row in rows]} if len(rows) > 0 else dict()
+        result: typing.Dict[int, typing.List[Transport.TcpConnection]] = dict()
+        for (protocol, local_port), rows in self._listeners.items():
+            if protocol == transport.value:
+                result[local_port] = [self.connection(row) for row in self._index_get(self._listeners,
+                                                                                      (protocol, local_port))]
+        return result
+
+    def by_remote_address(self, address: str) -> typing.List[Transport.TcpConnection]:
+        """
+        :param address: e.g. "192.0.2.7" or "2001:db8::7"
+        :return: every socket connected to address
+        """
+        family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        return [self.connection(row) for row in self.remote_address_rows(pack(address, family))]
+
+    def by_local_port(self, port: int) -> typing.List[Transport.TcpConnection]:
+        return [self.connection(row) for row in self._index_get(self._by_local_port, port)]
+
+    def count_by_state(self) -> typing.Dict[TcpStates, int]:
+        """
+        :return: how many sockets are in each state, without making any TcpConnection objects
+        """
+        return {TcpStates(state): 1 if isinstance(rows, int) else len(rows) for state, rows in self._by_state.items()}
+
+    def by_state(self, state: TcpStates) -> typing.List[Transport.TcpConnection]:
+        return [self.connection(row) for row in self._index_get(self._by_state, state)]
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+    import time
+    import tracemalloc
+
+    # A busy web server: a listener and a lot of connections from a lot of clients to port 443.  They are written to
+    # a fake /proc/net, so that each way of storing them pays for the objects it makes while reading them
+    N = 200_000
+    random.seed(42)
+    fake_proc_net = tempfile.mkdtemp()
+    with open(os.path.join(fake_proc_net, "tcp"), "w") as f:
+        f.write("  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n")
+        f.write("   0: 00000000:01BB 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 99 1\n")
+        for i in range(1, N):
+            f.write(f"{i:4d}: 0A0200C0:01BB {random.getrandbits(32):08X}:{random.randrange(1024, 65536):04X} "
+                    f"{1 if i % 10 else 6:02X} 00000000:00000000 00:00000000 00000000    33        0 {100000 + i} 1\n")
+    peer = None
+
+    def measure(name: str, build: typing.Callable):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        built = build()
+        elapsed = time.perf_counter() - t0
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:36s} {size / 1e6:6.1f} MB ({size / N:5.1f} bytes/socket), read in {elapsed:.2f} s "
+              f"(slower than usual, because of tracemalloc)")
+        return built
+
+    tuples = measure("list of tuples", lambda: list(proc_net.read_connections(proc_net=fake_proc_net)))
+    objects = measure("list of TcpConnection (__slots__)",
+                      lambda: Transport.find_all_connections(proc_net_dir=fake_proc_net))
+    del tuples
+    table = measure("ConnectionTable", lambda: ConnectionTable.from_kernel(proc_net_dir=fake_proc_net))
+
+    transport = Transport(objects)
+    indexed = Transport(table)
+    peer = objects[N // 2].dst_host
+    t0 = time.perf_counter()
+    transport.find_all_listeners()
+    t1 = time.perf_counter()
+    indexed.find_all_listeners()
+    t2 = time.perf_counter()
+    transport.find_connections_to(peer)
+    t3 = time.perf_counter()
+    indexed.find_connections_to(peer)
+    t4 = time.perf_counter()
+    print(f"all listeners:          scan {(t1 - t0) * 1e3:8.3f} ms, index {(t2 - t1) * 1e3:8.3f} ms")
+    print(f"sockets to {peer:15s}  scan {(t3 - t2) * 1e3:8.3f} ms, index {(t4 - t3) * 1e3:8.3f} ms")
+    print("sockets by state", {state.name: count for state, count in table.count_by_state().items()})
+    for name in os.listdir(fake_proc_net):
+        os.remove(os.path.join(fake_proc_net, name))
+    os.rmdir(fake_proc_net)
@@ -47,8 +47,7 @@ class OperatingSystems(enum.IntEnum):
 
 
 class OSILevels(enum.Enum):
-    print("Enter an issue that I changed the values of the constants from "
-          "integers to strings for reliability", file=sys.stderr)
+    # The values of these constants were changed from integers to strings for reliability
     PHYSICAL = "PHYSICAL"
     DATALINK = "DATALINK"
     NETWORK4 = "NETWORK4"
@@ -102,6 +101,26 @@ class Descriptions(enum.Enum):
         return description == self.NAMED
 
 
+class TcpStates(enum.IntEnum):
+    """
+    The states of a TCP socket, as the kernel numbers them in include/net/tcp_states.h and shows them in the st
+    column of /proc/net/tcp.  UDP sockets use the same numbers: a connected UDP socket is ESTABLISHED and a socket
+    that is only bound to a port is CLOSE
+    """
+    ESTABLISHED = 1
+    SYN_SENT = 2
+    SYN_RECV = 3
+    FIN_WAIT1 = 4
+    FIN_WAIT2 = 5
+    TIME_WAIT = 6
+    CLOSE = 7
+    CLOSE_WAIT = 8
+    LAST_ACK = 9
+    LISTEN = 10
+    CLOSING = 11
+    NEW_SYN_RECV = 12
+
+
 class ErrorLevels(enum.IntEnum):
     """
     From The_Network_Boot_Monitor_Diagnostic_Tool.html
@@ -191,3 +210,95 @@ type_datalink_dict: dict = typing.Dict[str, "datalink.DataLink"]
 type_interface_dict:dict = typing.Dict[
     str, "interface.Interface"]  # Issue 25 re-written
 type_physical_dict:dict = typing.Dict[str, "physical.Physical"]  # Issue 29
+
+# The layers of a utilities.SystemDescription, in the same order as the OSI model, top to bottom.  These are the
+# names of its attributes
+SYSTEM_LAYERS: typing.List[str] = ["applications", "presentations", "sessions", "transports", "networks_4",
+                                   "networks_6", "datalinks", "physicals"]
+
+# How long, in seconds, SystemDescription.discover waits for a layer's discover method before giving up on it.
+# A layer that times out is reported with ErrorLevels.UNKNOWN instead of holding up the other layers.
+DISCOVERY_TIMEOUT: float = 10.0
+
+# The --monitor server (see monitor_server.py).  The layers are discovered again every MONITOR_REFRESH_INTERVAL
+# seconds in the background, requests are always answered from the last snapshot.
+MONITOR_REFRESH_INTERVAL: float = 5.0
+# More connections than this at the same time get a 503 right away, rather than queueing up behind the others
+MONITOR_MAX_CONNECTIONS: int = 1024
+# A client that takes longer than this, in seconds, to send a request is disconnected
+MONITOR_REQUEST_TIMEOUT: float = 5.0
+
+# The ping engine (see pinger.py).  The targets come from ping_targets in NBMDT_INI.  A run of the pinger ends after
+# PING_DEADLINE seconds however many targets have not answered
+NBMDT_INI: str = "nbmdt.ini"
+PING_DEADLINE: float = 5.0
+
+# The DNS checker (see dns_checker.py).  A resolver that takes longer than DNS_TIMEOUT seconds to answer has timed
+# out.  An answer that says a name has no records is cached for DNS_NEGATIVE_TTL seconds, unless the SOA record that
+# comes with it says less
+DNS_TIMEOUT: float = 2.0
+DNS_NEGATIVE_TTL: float = 60.0
+
+# Running commands (see osclinter.py).  A command that runs longer than COMMAND_TIMEOUT seconds is killed.  No more
+# than COMMAND_CONCURRENCY commands run at the same time, the rest wait their turn.  No more than COMMAND_MAX_OUTPUT
+# bytes of the standard output and of the standard error of a command are kept
+COMMAND_TIMEOUT: float = 10.0
+COMMAND_CONCURRENCY: int = 8
+COMMAND_MAX_OUTPUT: int = 4 * 1024 * 1024
+
+# The cache of command output (see command_cache.py).  The output of a command is reused for COMMAND_CACHE_TTL
+# seconds, or for as many seconds as COMMAND_CACHE_TTLS says for that command
+COMMAND_CACHE_TTL: float = 2.0
+COMMAND_CACHE_TTLS: typing.Dict[str, float] = {"lshw": 60.0, "ps": 1.0}
+
+# Interface counter rates (see counter_rates.py).  The counters are sampled every RATE_INTERVAL seconds and the last
+# RATE_HISTORY samples of each interface are kept.  RATE_EWMA_ALPHA is how much the newest rate counts in the moving
+# average, and RATE_PERCENTILES are the percentiles of the rates that are reported
+RATE_INTERVAL: float = 1.0
+RATE_HISTORY: int = 300
+RATE_EWMA_ALPHA: float = 0.3
+RATE_PERCENTILES: typing.List[float] = [50, 95, 99]
+
+# The event log of changes in status (see event_log.py).  The last EVENT_LOG_CAPACITY changes of each entity, and the
+# last EVENT_LOG_RECENT changes of all of them together, are kept in memory, for at most EVENT_LOG_ENTITIES entities.
+# A log on disk is split into segments of EVENT_SEGMENT_SIZE bytes, and only the last EVENT_SEGMENTS segments are kept
+EVENT_LOG_CAPACITY: int = 256
+EVENT_LOG_ENTITIES: int = 16384
+EVENT_LOG_RECENT: int = 65536
+EVENT_SEGMENT_SIZE: int = 16 * 1024 * 1024
+EVENT_SEGMENTS: int = 8
+
+# The checks of nbmdt --boot (see boot_pipeline.py).  They all end within BOOT_DEADLINE seconds, passed or not, so that
+# they never hold up booting the host.  The gateway and dns checks may use BOOT_STAGE_SHARE of the time that is left
+# when they start, so that there is time left to check the ping_targets after them.  A check with less than
+# BOOT_MIN_TIME seconds left is UNKNOWN, not DOWN: it had no time to find out
+BOOT_DEADLINE: float = 2.0
+BOOT_STAGE_SHARE: float = 0.5
+BOOT_MIN_TIME: float = 0.05
+
+# Monte Carlo simulation of the reliability of a dependency graph (see reliability_batch.py): how many times the nodes
+# are failed at random
+RELIABILITY_TRIALS: int = 10000
+
+# Route churn (see route_churn.py).  Each prefix has a penalty, like BGP route flap dampening (RFC 2439): it goes up by
+# CHURN_PENALTIES[kind] on each add, delete or change of a route to the prefix, up to CHURN_MAX_PENALTY, and halves
+# every CHURN_HALF_LIFE seconds.  A prefix is flapping from when its penalty goes above CHURN_SUPPRESS until it has
+# decayed below CHURN_REUSE.  The monitor publishes the CHURN_TOP prefixes with the highest penalties every
+# CHURN_INTERVAL seconds.  The default route is stable once it has not changed for CHURN_STABLE_AFTER seconds
+CHURN_PENALTIES: typing.Dict[str, float] = {"add": 0.0, "delete": 1000.0, "change": 500.0}
+CHURN_HALF_LIFE: float = 900.0
+CHURN_SUPPRESS: float = 2000.0
+CHURN_REUSE: float = 750.0
+CHURN_MAX_PENALTY: float = 12000.0
+CHURN_TOP: int = 20
+CHURN_INTERVAL: float = 5.0
+CHURN_STABLE_AFTER: float = 300.0
+
+# The reachability matrix of nbmdt --test (see reachability.py).  No more than TEST_CONCURRENCY probes run at the same
+# time, which keeps the number of sockets well below the open file limit, and a probe that has not answered after
+# TEST_DEADLINE seconds is DOWN.  An ICMP probe sends TEST_PING_COUNT echo requests.  A network in a specification
+# stands for all of its hosts, so one with more than TEST_MAX_HOSTS of them (a /16) is refused rather than expanded
+TEST_CONCURRENCY: int = 500
+TEST_DEADLINE: float = 2.0
+TEST_PING_COUNT: int = 2
+TEST_MAX_HOSTS: int = 65536
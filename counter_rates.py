@@ -0,0 +1,228 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Turns the counters of the network interfaces (bytes, packets, errors and drops, see sysfs_reader.COUNTERS) into
+# rates.  The counters are sampled every constants.RATE_INTERVAL seconds, and the last constants.RATE_HISTORY samples
+# of each interface are kept in a ring buffer: a NumPy array that is allocated once and then overwritten, oldest
+# sample first.  However long the monitor runs, it uses the same amount of memory for each interface, and an
+# interface that goes away takes its buffer with it.
+#
+# The rates are computed from a whole buffer at once with NumPy: the differences between consecutive samples,
+# divided by the time between them, then an EWMA (exponentially weighted moving average, which smooths out bursts but
+# follows a change in a few samples), percentiles and the maximum of each counter.
+#
+# A counter that goes down has either wrapped or been reset.  Some drivers have 32 bit counters, which wrap every
+# 34 seconds at 1 Gbit/s, so a counter that was below 2**32 and went down is taken to have wrapped at 2**32.  A 64
+# bit counter that went down wrapped at 2**64 if that makes it go up by less than 2**32.  Otherwise it was reset (e.g.
+# the driver was reloaded) and its new value is what it counted since.
+
+import sys
+import time
+import typing
+import warnings
+
+import numpy as np
+
+import constants
+import sysfs_reader
+import timing
+
+WRAP_32 = 2 ** 32
+
+
+class RingBuffer(object):
+    """
+    The last capacity samples of width counters, and when they were taken
+    """
+
+    def __init__(self, capacity: int, width: int) -> None:
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)  # The monotonic clock when each sample was taken
+        self.values = np.zeros((capacity, width), dtype=np.uint64)
+        self.count: int = 0  # How many samples there are, up to capacity
+        self._next: int = 0  # Where the next sample goes
+
+    def append(self, when: float, values: typing.List[int]) -> None:
+        self.times[self._next] = when
+        self.values[self._next] = values
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def last(self) -> typing.Optional[np.ndarray]:
+        """
+        :return: the newest sample, None if there is none
+        """
+        return self.values[(self._next - 1) % self.capacity] if self.count > 0 else None
+
+    def ordered(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the times and the samples, oldest first
+        """
+        if self.count < self.capacity:
+            return self.times[:self.count], self.values[:self.count]
+        return np.roll(self.times, -self._next), np.roll(self.values, -self._next, axis=0)
+
+    def __len__(self) -> int:
+        return self.count
+
+
+def counter_deltas(values: np.ndarray) -> np.ndarray:
+    """
+    :param values: samples of counters, one row per sample, oldest first, as uint64
+    :return: how much each counter went up from one sample to the next, one row fewer than values, as uint64
+    """
+    previous = values[:-1]
+    current = values[1:]
+    deltas = current - previous  # uint64 arithmetic, so this is already right for a 64 bit counter that wrapped
+    went_down = current < previous
+    if went_down.any():
+        wrapped_32 = went_down & (previous < WRAP_32)
+        deltas = np.where(wrapped_32, deltas & np.uint64(WRAP_32 - 1), deltas)
+        reset = went_down & ~wrapped_32 & (deltas >= np.uint64(WRAP_32))
+        deltas = np.where(reset, current, deltas)
+    return deltas
+
+
+def counter_rates(times: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    :param times: when each sample was taken, in seconds
+    :param values: the samples, see counter_deltas
+    :return: the rate of each counter between each sample and the next, per second, one row fewer than values
+    """
+    elapsed = np.diff(times)
+    elapsed[elapsed <= 0.0] = np.nan  # Two samples at the same moment say nothing about the rate
+    return counter_deltas(values).astype(np.float64) / elapsed[:, np.newaxis]
+
+
+def ewma(rates: np.ndarray, alpha: float = constants.RATE_EWMA_ALPHA) -> np.ndarray:
+    """
+    The exponentially weighted moving average of each column, starting from the first row: s[0] = x[0],
+    s[k] = alpha * x[k] + (1 - alpha) * s[k - 1].  Computed with one dot product instead of a loop over the rows
+
+    :param rates: one row per sample, oldest first
+    :param alpha: how much the newest sample counts, between 0 and 1
+    :return: the last s, one value per column
+    """
+    n = rates.shape[0]
+    if n == 0:
+        return np.full(rates.shape[1], np.nan)
+    weights = alpha * (1.0 - alpha) ** np.arange(n - 1, -1, -1, dtype=np.float64)
+    weights[0] = (1.0 - alpha) ** (n - 1)
+    return weights @ np.nan_to_num(rates)
+
+
+def summarize(times: np.ndarray, values: np.ndarray, names: typing.List[str],
+              percentiles: typing.List[float] = constants.RATE_PERCENTILES,
+              alpha: float = constants.RATE_EWMA_ALPHA) -> typing.Dict[str, typing.Dict[str, float]]:
+    """
+    :return: for each counter, keyed by name, its latest rate, EWMA, percentiles ("p50", "p95"...) and maximum, all
+    per second.  A counter with fewer than two samples has no rates, so all of them are None, and so is a rate that
+    is not a number (two samples at the same moment), because JSON has no NaN
+    """
+    if len(times) < 2:
+        return {name: dict.fromkeys(["rate", "ewma"] + [f"p{p:g}" for p in percentiles] + ["max"]) for name in names}
+    rates = counter_rates(times, values)
+    columns = {"rate": rates[-1], "ewma": ewma(rates, alpha)}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # A counter with no rates at all, they are None below
+        for p, column in zip(percentiles, np.nanpercentile(rates, percentiles, axis=0)):
+            columns[f"p{p:g}"] = column
+        columns["max"] = np.nanmax(rates, axis=0)
+    return {name: {key: None if np.isnan(column[i]) else float(column[i]) for key, column in columns.items()}
+            for i, name in enumerate(names)}
+
+
+class RateEngine(object):
+    """
+    Samples the counters of every interface and keeps their recent history
+    """
+
+    def __init__(self, counters: typing.List[str] = None, interval: float = constants.RATE_INTERVAL,
+                 history: int = constants.RATE_HISTORY, root: str = sysfs_reader.SYSFS_NET) -> None:
+        """
+        :param counters: the attributes to sample, see sysfs_reader.ATTRIBUTES.  If None, then sysfs_reader.COUNTERS
+        :param interval: seconds between samples, for whoever calls sample
+        :param history: how many samples to keep of each interface
+        :param root: see sysfs_reader.SysfsReader
+        """
+        self.counters = counters if counters is not None else sysfs_reader.COUNTERS
+        # The names that the counters are reported by, without the statistics/ directory
+        self.names = [counter.rsplit("/", 1)[-1] for counter in self.counters]
+        self.interval = interval
+        self.history = history
+        self.reader = sysfs_reader.SysfsReader(self.counters, root=root)
+        self.buffers: typing.Dict[str, RingBuffer] = dict()
+
+    def sample(self, when: float = None) -> None:
+        """
+        Read the counters of every interface once
+
+        :param when: the monotonic clock at the sample, in seconds.  If None, then now
+        """
+        samples = self.reader.read_all()
+        when = timing.now().seconds if when is None else when
+        for ifname in set(self.buffers) - set(samples):
+            del self.buffers[ifname]
+        for ifname, values in samples.items():
+            buffer = self.buffers.get(ifname)
+            if buffer is None:
+                buffer = self.buffers[ifname] = RingBuffer(self.history, len(self.counters))
+            # A counter that could not be read keeps its last value, so that the next read is not counted as one big
+            # jump from 0, or as a 32 bit counter that wrapped.  It is 0 only if it was never read
+            last = buffer.last()
+            buffer.append(when, [value if value is not None else 0 if last is None else int(last[i])
+                                 for i, value in enumerate(values[counter] for counter in self.counters)])
+
+    def summary(self, ifname: str) -> typing.Dict[str, typing.Dict[str, float]]:
+        """
+        :return: see summarize.  KeyError if the interface has not been sampled
+        """
+        return summarize(*self.buffers[ifname].ordered(), self.names)
+
+    def summaries(self) -> typing.Dict[str, typing.Dict[str, typing.Dict[str, float]]]:
+        return {ifname: self.summary(ifname) for ifname in sorted(self.buffers)}
+
+    def series(self, ifname: str) -> typing.Dict[str, list]:
+        """
+        :return: the rates of one interface over its whole history: "time", the wall clock time (seconds since the
+        epoch) at the end of each interval, and a list of rates per counter
+        """
+        times, values = self.buffers[ifname].ordered()
+        if len(times) < 2:
+            return {"time": [], **{name: [] for name in self.names}}
+        rates = counter_rates(times, values)
+        result = {"time": (times[1:] + timing.anchor().offset).tolist()}
+        for i, name in enumerate(self.names):
+            result[name] = [None if np.isnan(rate) else rate for rate in rates[:, i].tolist()]
+        return result
+
+    def documents(self) -> typing.Dict[str, dict]:
+        """
+        :return: what the monitor serves, keyed by path: /rates is the summaries of every interface, and
+        /rates/<interface> is the summary and the series of one interface
+        """
+        summaries = self.summaries()
+        result = {"/rates": summaries}
+        for ifname, summary in summaries.items():
+            result["/rates/" + ifname] = {"summary": summary, "series": self.series(ifname)}
+        return result
+
+    def close(self) -> None:
+        self.reader.close()
+
+
+if __name__ == "__main__":
+    engine = RateEngine(history=constants.RATE_HISTORY)
+    fake_time = 0.0
+    for _ in range(constants.RATE_HISTORY):
+        fake_time += 1.0
+        engine.sample(when=fake_time)
+    N = 1000
+    t0 = time.perf_counter()
+    for _ in range(N):
+        engine.summaries()
+    t1 = time.perf_counter()
+    print(f"Summarized {constants.RATE_HISTORY} samples of {len(engine.counters)} counters of {len(engine.buffers)} "
+          f"interfaces in {(t1 - t0) / N * 1000.0:.3f} ms", file=sys.stderr)
+    for interface, interface_summary in engine.summaries().items():
+        print(interface, interface_summary["rx_bytes"])
@@ -2,9 +2,10 @@
 
 from interfaces import none_if_none, PhysicalInterface
 import sys
-import subprocess
 from configuration import IP_COMMAND
+import command_cache
 import collections
+import netlink_backend
 
 
 class LogicalInterface(object):
@@ -64,12 +65,7 @@ class LogicalInterface(object):
         Since an interface can, and probably will, have more than one address, the values of this dictionary
         will be dictionaries keyed by address which will contain a description of the address"""
 
-        completed = subprocess.run(
-            [IP_COMMAND, "--details", "--oneline", "addr", "list"], stdin=None,
-            input=None,
-            stdout=subprocess.PIPE, stderr=None, shell=False, timeout=None,
-            check=False)
-        completed_str = completed.stdout.decode('ascii')
+        completed_str, _, _ = command_cache.run_command([IP_COMMAND, "--details", "--oneline", "addr", "list"])
         addrs_list = completed_str.split('\n')
         for line in addrs_list:
             """
@@ -121,32 +117,26 @@ jeffs@jeffs-laptop:~/nbmdt (development)*$
         command.  Note that if a physical link does not an IPv4 address or an IPv6 address, then the ip command doesn't
         show it.  If a physical link has an IPv4 address and an IPv6 address, then there will be 2 entries"""
 
-        completed = subprocess.run([IP_COMMAND, "--oneline", "address", "list"],
-                                   stdin=None, input=None,
-                                   stdout=subprocess.PIPE, stderr=None,
-                                   shell=False, timeout=None, check=False)
-        completed_str = completed.stdout.decode('ascii')
-        # addrs_list is really a list of logical interfaces
-        addrs_list = completed_str.split('\n')
+        # The addresses come from netlink_backend, which asks the kernel over a netlink socket if it can and runs
+        # the ip --oneline address list command if it can't.  Either way, the records are the same.
         addr_dict = dict()
-        for addr_ in addrs_list:
-            # addrs_list usually but not always has an empty element at the end
-            if len(addr_) == 0:
-                break
+        for record in netlink_backend.dump().addresses:
             # https://docs.python.org/3/library/collections.html#collections.OrderedDict
             # ad is an attribute dictionary.  The string returned by the ip command will look like:
             # 3: wlp12s0    inet 10.5.66.10/20 brd 10.5.79.255 scope global dynamic wlp12s0\       valid_lft 85452sec
             #  preferred_lft 85452sec
+            # and the record has the same words as keys
             ad = collections.OrderedDict()
-            fields = addr_.split()
-            addr__name = fields[1]
-
-            addr_family = fields[2]  # Either inet or inet6
+            addr__name = record["dev"]
+            addr_family = record["family"]  # Either inet or inet6
             assert addr_family == "inet" or addr_family == "inet6"
-            addr_addr = fields[3]
-            for idx in range(4, len(fields) - 1, 2):
-                # Because ad is an ordered dictionary, the results will always be output in the same order
-                ad[fields[idx]] = fields[idx + 1]
+            addr_addr = f"{record['address']}/{record['prefixlen']}"
+            # Because ad is an ordered dictionary, the results will always be output in the same order
+            if record["broadcast"] is not None:
+                ad["brd"] = record["broadcast"]
+            ad["scope"] = record["scope"]
+            for flag in record["flags"]:
+                ad[flag] = True
             # A single logical interface can have several addresses and several families
             # so the logical interface name is a key to a value which is a list
             # of addresses.
@@ -177,14 +167,11 @@ if __name__ == "__main__":
         print(link, ":||  ", end=" ")
         properties: dict = PhysicalInterface.link_properties(ifname=link)
         for prop in properties:
-            if len(properties[prop]) == 1:
-                print(prop, ": ", properties[prop][0], end=" ")
-            else:  # It is a list of values, so print the entire list.
-                print(prop, ": ", properties[prop], end=" ")
+            print(prop, ": ", properties[prop], end=" ")
 
         if len(link) == 10000:  # To fool pycharm
             mac_addr = properties['address']
-            print(link, mac_addr, properties['state'])
+            print(link, mac_addr, properties['operstate'])
         print(end="\n")
     print("Addresses ", '*' * 40)
     for addr_name in addr_db:
@@ -11,6 +11,8 @@ import sys
 from typing import Dict, List
 
 import constants
+import netlink_backend
+from configuration import IP_COMMAND
 from interfaces import PhysicalInterface
 from utilities import OsCliInter, os_name, the_os
 
@@ -18,7 +20,7 @@ from utilities import OsCliInter, os_name, the_os
 class DataLink(PhysicalInterface):
     # Create a command, suitable for executing by subprocess, that lists all of the datalinks on this system.
     if constants.OperatingSystems.LINUX == the_os:
-        DISCOVER_ALL_DATALINKS_COMMAND = [PhysicalInterface.IP_COMMAND, "--oneline", "link", "list"]
+        DISCOVER_ALL_DATALINKS_COMMAND = [IP_COMMAND, "--oneline", "link", "list"]
     else:
         raise NotImplemented(
             f"The DISCOVER_ALL_DATALINKS_COMMAND can't be filled in yet because {os_name} isn't implemented yet")
@@ -35,7 +37,8 @@ class DataLink(PhysicalInterface):
                  mtu, qdisc, state, mode, group, qlen, link_addr, broadcast_addr, **kwargs) -> None:
         # Be consistent in the convention of naming interfaces
         name = name if ":" in name else name + ":"
-        super().__init__(name=name)
+        super().__init__(intf_name=name, intf_properties_dict=kwargs)
+        self.name = name
 
         assert type(broadcast) == bool, f"broadcast_up is {type(broadcast)}, should be bool"
         self.broadcast = broadcast
@@ -77,29 +80,15 @@ class DataLink(PhysicalInterface):
 
         if the_os != constants.OperatingSystems.LINUX:
             raise NotImplementedError(f"In DataLink.discover, {os_name} is not implemented")
-        else:
-            assert "link" in cls.DISCOVER_ALL_DATALINKS_COMMAND, \
-                f"In DataLink.discover, the word 'link' is not in the DISCOVER_COMMAND {cls.DISCOVER_ALL_DATALINKS_COMMAND}"
-            assert "--oneline" in cls.DISCOVER_ALL_DATALINKS_COMMAND, \
-                f"In DataLink.discover, the option --oneline is not in the DISCOVER_COMMAND " \
-                f"{cls.DISCOVER_ALL_DATALINKS_COMMAND}"
-            datalinks_str: str = OsCliInter.run_command(cls.DISCOVER_ALL_DATALINKS_COMMAND)
-            # The rest of this stanza is decoding the output of the ip command
-            datalinks_list_strs: List[str] = datalinks_str.split("\n")
-            for if_str in datalinks_list_strs:
-                fields = if_str.split()
-                if len(fields) <= 1:  # skip blank lines
-                    continue
-                # fields[0] is the line number, skip that.  fields[1] is the device name.  trailing colon
-                name: str = fields[1]
-                assert ":" in name, f": not found in interface name {name} and it should be there"
-                # If I am discovering something and what I discover is already known, then I'm not really discovering
-                # anything, am I?  On the other hand, what if I call discover more than once?
-                if name in cls.datalinks_dict:
-                    print(f"{name} is *already* in DataLink.datalinks_dict and should not be, I think",
-                          file=sys.stderr)
-                datalink_obj = cls.datalink_from_if_str(if_str=if_str)
-                DataLink.datalinks_dict[name] = datalink_obj
+        # The links come from netlink_backend, which only runs the DISCOVER_ALL_DATALINKS_COMMAND and parses its
+        # output if it can't ask the kernel over a netlink socket.  Calling discover again replaces what an earlier
+        # call found, rather than adding to it
+        datalinks_dict: Dict[str, "DataLink"] = dict()
+        for link in netlink_backend.dump().links:
+            datalink_obj = cls.datalink_from_link_record(link)
+            datalinks_dict[datalink_obj.name] = datalink_obj
+        DataLink.datalinks_dict = datalinks_dict
+        return datalinks_dict
 
     def set_name(self, name: str) -> None:
         """
@@ -123,6 +112,30 @@ jeffs@jeffs-desktop:/home/jeffs/python/nbmdt  (development)
         assert isinstance(name, str), f"name is of type {type(name)}, should be str"
         self.name = name
 
+    @staticmethod
+    def datalink_from_link_record(link: dict, **kwargs) -> "DataLink":
+        """
+        This method accepts a link record from netlink_backend, which is the same no matter if it came from netlink or
+        from the ip command, and creates a DataLink object
+        :param  link    a link record, see netlink_backend.py
+        """
+        flags: List[str] = link["flags"]
+        return DataLink(name=link["name"],
+                        state_up="UP" in flags,
+                        broadcast="BROADCAST" in flags,
+                        multicast="MULTICAST" in flags,
+                        lower_up="LOWER_UP" in flags,
+                        carrier="NO-CARRIER" not in flags,
+                        mtu=link["mtu"],
+                        qdisc=link["qdisc"],
+                        state=link["state"],
+                        mode=link["mode"],
+                        group=link["group"],
+                        qlen=link["qlen"],
+                        link_addr=link["link_addr"],
+                        broadcast_addr=link["broadcast_addr"],
+                        **kwargs)
+
     @staticmethod
     def datalink_from_if_str(if_str, **kwargs):
         """
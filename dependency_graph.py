@@ -0,0 +1,395 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# What depends on what, so that one failure is reported once, where it happened, and everything that it took down
+# with it is reported as ErrorLevels.DOWN_DEPENDENCY rather than as a failure of its own.  Built from a
+# utilities.SystemDescription:
+#
+#   applications            depend on DNS
+#   dns                     depends on any one of the resolvers in /etc/resolv.conf
+#   a resolver              depends on the most specific routes to it (more than one if they are equally specific)
+#   routes (networks_4/6)   depend on the datalink of their device
+#   datalinks               depend on the physical with the same name, if there is one
+#
+# Each node has requirements, and each requirement is a group of alternatives, any one of which will do: the node
+# needs all of its requirements (they are in series) and one alternative of each (they are in parallel).  So a node's
+# reliability is its own reliability times, for each requirement, the reliability.Reliability OR (the + operator) of
+# its alternatives.  A requirement that lost some of its alternatives makes the node ErrorLevels.DEGRADED, one that
+# lost all of them makes it ErrorLevels.DOWN_DEPENDENCY.  In boot and monitor modes a node's own reliability is 1.0
+# if it is up and 0.0 if it is down, so a reliability says how much redundancy is left; in design mode it is set to
+# the predicted reliability of the node.
+#
+# Changes are propagated incrementally: set() only marks the node dirty, and propagate() recomputes the dirty nodes,
+# lowest first (a node's level is one more than the highest level of anything it requires), and then the nodes that
+# depend on a node whose status or reliability changed, and nothing else.  A monitor cycle that sees a handful of
+# changes among thousands of entities recomputes a handful of nodes, plus whatever depends on them.
+
+import heapq
+import ipaddress
+import sys
+import time
+import typing
+
+import reliability
+from constants import ErrorLevels
+
+# A node in one of these states has failed, as far as the nodes that require it are concerned.  ErrorLevels.UNKNOWN
+# is not a failure: nothing says that the node is down
+DOWN_LEVELS = (ErrorLevels.DOWN, ErrorLevels.DOWN_DEPENDENCY, ErrorLevels.DOWN_ACKNOWLEDGED)
+DNS_KEY = "dns"
+
+
+class Node(object):
+    __slots__ = ["key", "entity", "own_status", "own_reliability", "requires", "dependents", "status", "reliability",
+                 "level"]
+
+    def __init__(self, key: str, entity: typing.Any, own_status: ErrorLevels, own_reliability: float) -> None:
+        self.key = key
+        self.entity = entity  # What the node stands for, e.g. a routes.IPv4Route.  None for a node like dns
+        self.own_status = own_status
+        self.own_reliability = own_reliability
+        self.requires: typing.List[typing.List[str]] = list()  # Each one a group of alternatives
+        self.dependents: typing.Set[str] = set()  # The nodes that have this one as an alternative
+        # Computed by propagate
+        self.status: ErrorLevels = own_status
+        self.reliability: float = own_reliability
+        self.level: int = 0
+
+
+def operational_reliability(status: ErrorLevels) -> float:
+    """
+    :return: the reliability of a node in boot or monitor mode, 0.0 if it is down, otherwise 1.0
+    """
+    return 0.0 if status in DOWN_LEVELS else 1.0
+
+
+def entity_status(entity) -> ErrorLevels:
+    """
+    :return: what an entity says about itself.  A datalink has no get_status, but it knows if it is up
+    """
+    if hasattr(entity, "get_status"):
+        return entity.get_status()
+    if hasattr(entity, "state_up"):
+        return ErrorLevels.NORMAL if entity.state_up else ErrorLevels.DOWN
+    return ErrorLevels.UNKNOWN
+
+
+class DependencyGraph(object):
+    """
+    Nodes, what each one requires, and their status and reliability taking what they require into account
+    """
+
+    def __init__(self) -> None:
+        self.nodes: typing.Dict[str, Node] = dict()
+        self._dirty: typing.Set[str] = set()
+        self._levels_stale = False
+        self.recomputed: int = 0  # How many nodes propagate has recomputed, ever.  For tests and benchmarks
+
+    def add(self, key: str, entity: typing.Any = None, status: ErrorLevels = None,
+            node_reliability: float = None) -> Node:
+        """
+        :param key: the name of the node, e.g. "datalinks/eth0"
+        :param entity: what the node stands for
+        :param status: the node's own status.  If None, then entity_status(entity)
+        :param node_reliability: the node's own reliability.  If None, then operational_reliability(status)
+        :return: the new node.  ValueError if there is already a node with that key
+        """
+        if key in self.nodes:
+            raise ValueError(f"There is already a node {key}")
+        status = entity_status(entity) if status is None else status
+        own_reliability = operational_reliability(status) if node_reliability is None else node_reliability
+        if not reliability.Reliability.validate(own_reliability):
+            raise ValueError(f"The reliability of {key} is {own_reliability}, it should be from 0.0 to 1.0")
+        node = self.nodes[key] = Node(key, entity, status, float(own_reliability))
+        self._dirty.add(key)
+        return node
+
+    def require(self, key: str, alternatives: typing.Iterable[str]) -> None:
+        """
+        Node key requires any one of alternatives, on top of whatever else it requires
+
+        :param alternatives: the keys of nodes that are already in the graph
+        """
+        alternatives = list(dict.fromkeys(alternatives))
+        missing = [alternative for alternative in alternatives + [key] if alternative not in self.nodes]
+        if missing:
+            raise KeyError(f"There is no node {', '.join(missing)}")
+        if len(alternatives) == 0:
+            return
+        self.nodes[key].requires.append(alternatives)
+        for alternative in alternatives:
+            self.nodes[alternative].dependents.add(key)
+        self._dirty.add(key)
+        self._levels_stale = True
+
+    def set(self, key: str, status: ErrorLevels = None, node_reliability: float = None) -> None:
+        """
+        Change the node's own status, and its own reliability.  Nothing is recomputed until propagate is called
+
+        :param node_reliability: if None, then operational_reliability(status) if the status is given, otherwise it
+        stays the same
+        """
+        node = self.nodes[key]
+        if status is not None:
+            node.own_status = status
+            if node_reliability is None:
+                node_reliability = operational_reliability(status)
+        if node_reliability is not None:
+            if not reliability.Reliability.validate(node_reliability):
+                raise ValueError(f"The reliability of {key} is {node_reliability}, it should be from 0.0 to 1.0")
+            node.own_reliability = float(node_reliability)
+        self._dirty.add(key)
+
+    def propagate(self) -> typing.List[str]:
+        """
+        Recompute the nodes that changed since the last propagate, and the nodes that depend on them
+
+        :return: the keys of the nodes whose status or reliability changed, lowest level first
+        """
+        if self._levels_stale:
+            self._compute_levels()
+        nodes = self.nodes
+        queued = set(self._dirty)
+        heap = [(nodes[key].level, key) for key in queued]
+        heapq.heapify(heap)
+        self._dirty.clear()
+        changed = []
+        while heap:
+            _, key = heapq.heappop(heap)
+            node = nodes[key]
+            status, node_reliability = self._compute(node)
+            self.recomputed += 1
+            if status == node.status and node_reliability == node.reliability:
+                continue
+            node.status = status
+            node.reliability = node_reliability
+            changed.append(key)
+            for dependent in node.dependents:
+                if dependent not in queued:
+                    queued.add(dependent)
+                    heapq.heappush(heap, (nodes[dependent].level, dependent))
+        return changed
+
+    def _compute(self, node: Node) -> typing.Tuple[ErrorLevels, float]:
+        """
+        :return: the status and reliability of node, from its own and those of the nodes that it requires, which are
+        up to date because they are at lower levels
+        """
+        status = node.own_status
+        node_reliability = node.own_reliability
+        degraded = False
+        for alternatives in node.requires:
+            group_reliability = reliability.Reliability(0.0)
+            down = 0
+            for key in alternatives:
+                alternative = self.nodes[key]
+                group_reliability = reliability.Reliability(group_reliability + alternative.reliability)
+                if alternative.status in DOWN_LEVELS:
+                    down += 1
+            node_reliability *= group_reliability.reliability
+            if down == len(alternatives):
+                if status not in DOWN_LEVELS:
+                    status = ErrorLevels.DOWN_DEPENDENCY
+            elif down > 0:
+                degraded = True
+        # A node that has not been checked itself is at least known to have lost some of its redundancy
+        if degraded and (status < ErrorLevels.DEGRADED or status == ErrorLevels.UNKNOWN):
+            status = ErrorLevels.DEGRADED
+        return status, node_reliability
+
+    def _compute_levels(self) -> None:
+        """
+        Kahn's algorithm: a node with no requirements is at level 0, any other node is one level above the highest
+        of its alternatives.  ValueError if the nodes require each other in a circle
+        """
+        # How many alternatives of each node have not been placed yet
+        waiting = {key: sum(len(alternatives) for alternatives in node.requires) for key, node in self.nodes.items()}
+        for node in self.nodes.values():
+            node.level = 0
+        ready = [key for key, count in waiting.items() if count == 0]
+        placed = 0
+        while ready:
+            key = ready.pop()
+            placed += 1
+            node = self.nodes[key]
+            for dependent in node.dependents:
+                dependent_node = self.nodes[dependent]
+                dependent_node.level = max(dependent_node.level, node.level + 1)
+                waiting[dependent] -= sum(alternatives.count(key) for alternatives in dependent_node.requires)
+                if waiting[dependent] == 0:
+                    ready.append(dependent)
+        if placed != len(self.nodes):
+            circle = sorted(key for key, count in waiting.items() if count > 0)
+            raise ValueError(f"These nodes require each other: {', '.join(circle)}")
+        self._levels_stale = False
+
+    def status(self, key: str) -> ErrorLevels:
+        return self.nodes[key].status
+
+    def reliability(self, key: str) -> float:
+        return self.nodes[key].reliability
+
+    def root_causes(self, key: str) -> typing.List[str]:
+        """
+        :return: the nodes that are down on their own account and that took key down, key itself if it is one of
+        them.  Empty if key is not down
+        """
+        result = []
+        seen = set()
+        stack = [key]
+        while stack:
+            node = self.nodes[stack.pop()]
+            if node.key in seen or node.status not in DOWN_LEVELS:
+                continue
+            seen.add(node.key)
+            if node.own_status in DOWN_LEVELS:
+                result.append(node.key)
+                continue
+            for alternatives in node.requires:
+                if all(self.nodes[alternative].status in DOWN_LEVELS for alternative in alternatives):
+                    stack.extend(alternatives)
+        return sorted(result)
+
+    @classmethod
+    def from_system_description(cls, system, resolvers: typing.List[str] = None) -> 'DependencyGraph':
+        """
+        :param system: a utilities.SystemDescription
+        :param resolvers: the addresses of the DNS resolvers.  If None, then application.DNS.get_resolvers()
+        :return: the graph, propagated
+        """
+        if resolvers is None:
+            import application  # application imports dnspython, so only import it when it is needed
+            resolvers = application.DNS.get_resolvers()
+        graph = cls()
+        for key, entity in system_entities(system):
+            graph.add(key, entity)
+        graph._add_requirements(resolvers)
+        graph.propagate()
+        return graph
+
+    def _add_requirements(self, resolvers: typing.List[str]) -> None:
+        for key, node in list(self.nodes.items()):
+            layer_name = key.split("/", 1)[0]
+            if layer_name == "datalinks":
+                physical = "physicals/" + key.split("/", 1)[1]
+                if physical in self.nodes:
+                    self.require(key, [physical])
+            elif layer_name in ("networks_4", "networks_6"):
+                datalink = "datalinks/" + route_device(node.entity)
+                if datalink in self.nodes:
+                    self.require(key, [datalink])
+        self.add(DNS_KEY, status=ErrorLevels.UNKNOWN)
+        routes = [(route_network(node.entity), key) for key, node in self.nodes.items()
+                  if key.startswith("networks_")]
+        for resolver in resolvers:
+            resolver_key = "resolvers/" + resolver
+            if resolver_key in self.nodes:
+                continue
+            self.add(resolver_key, status=ErrorLevels.UNKNOWN)
+            self.require(resolver_key, most_specific_routes(resolver, routes))
+        self.require(DNS_KEY, [key for key in self.nodes if key.startswith("resolvers/")])
+        for key in self.nodes:
+            if key.startswith("applications/"):
+                self.require(key, [DNS_KEY])
+
+    def refresh(self, system) -> typing.List[str]:
+        """
+        Take the own status of each node from a newer discovery of the same system, and propagate.  Only the nodes
+        whose own status changed, and the nodes that depend on them, are recomputed.  Entities that are new or gone
+        are not added or removed: build a new graph for that
+
+        :return: see propagate
+        """
+        for key, entity in system_entities(system):
+            node = self.nodes.get(key)
+            if node is None:
+                continue
+            node.entity = entity
+            status = entity_status(entity)
+            if status != node.own_status:
+                self.set(key, status)
+        return self.propagate()
+
+    def documents(self) -> typing.Dict[str, dict]:
+        """
+        :return: the status, reliability and requirements of every node, keyed by node
+        """
+        return {key: {"status": node.status.name, "own_status": node.own_status.name,
+                      "reliability": node.reliability, "requires": node.requires}
+                for key, node in self.nodes.items()}
+
+
+def route_device(route) -> str:
+    return getattr(route, "ipv4_dev", None) or getattr(route, "ipv6_interface", None) or ""
+
+
+def route_network(route) -> typing.Optional[typing.Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]:
+    destination = getattr(route, "ipv4_destination", None) or getattr(route, "ipv6_destination", None)
+    if destination in (None, "default"):
+        destination = "0.0.0.0/0" if hasattr(route, "ipv4_destination") else "::/0"
+    try:
+        return ipaddress.ip_network(destination, strict=False)
+    except ValueError:
+        return None
+
+
+def most_specific_routes(address: str, routes: typing.List[tuple]) -> typing.List[str]:
+    """
+    :param address: an IPv4 or IPv6 address
+    :param routes: (network, key) of every route
+    :return: the keys of the routes with the longest prefix that contains address
+    """
+    try:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+    except ValueError:
+        return []
+    matches = [(network.prefixlen, key) for network, key in routes
+               if network is not None and network.version == ip.version and ip in network]
+    if not matches:
+        return []
+    longest = max(prefixlen for prefixlen, _ in matches)
+    return [key for prefixlen, key in matches if prefixlen == longest]
+
+
+def system_entities(system) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+    """
+    :return: (key, entity) for each entity in the layers of system that the graph knows about
+    """
+    for layer_name in ["physicals", "datalinks", "networks_4", "networks_6", "applications"]:
+        entities = getattr(system, layer_name, None)
+        if isinstance(entities, dict):
+            for name, entity in entities.items():
+                yield f"{layer_name}/{str(name).rstrip(':')}", entity
+        elif isinstance(entities, list):
+            for entity in entities:
+                yield f"{layer_name}/{entity.name} dev {route_device(entity)} metric " \
+                      f"{getattr(entity, 'ipv4_metric', getattr(entity, 'ipv6_metric', None))}", entity
+
+
+if __name__ == "__main__":
+    N = 2000  # interfaces, with 10 routes each
+    t0 = time.perf_counter()
+    big = DependencyGraph()
+    for i in range(N):
+        big.add(f"physicals/eth{i}", status=ErrorLevels.NORMAL)
+        big.add(f"datalinks/eth{i}", status=ErrorLevels.NORMAL)
+        big.require(f"datalinks/eth{i}", [f"physicals/eth{i}"])
+        for j in range(10):
+            big.add(f"networks_4/10.{i // 256}.{i % 256}.{j} dev eth{i}", status=ErrorLevels.NORMAL)
+            big.require(f"networks_4/10.{i // 256}.{i % 256}.{j} dev eth{i}", [f"datalinks/eth{i}"])
+    big.add(DNS_KEY, status=ErrorLevels.NORMAL)
+    big.require(DNS_KEY, [f"networks_4/10.0.{i}.0 dev eth{i}" for i in range(4)])
+    big.propagate()
+    t1 = time.perf_counter()
+    before = big.recomputed
+    big.set("physicals/eth0", ErrorLevels.DOWN)
+    changed = big.propagate()
+    t2 = time.perf_counter()
+    print(f"Built and propagated {len(big.nodes)} nodes in {(t1 - t0) * 1000.0:.1f} ms.  One physical going down "
+          f"recomputed {big.recomputed - before} nodes and changed {len(changed)} in {(t2 - t1) * 1000.0:.3f} ms, "
+          f"dns is {big.status(DNS_KEY).name} with reliability {big.reliability(DNS_KEY)}", file=sys.stderr)
+    if len(sys.argv) > 1 and sys.argv[1] == "--discover":
+        import utilities
+        graph = DependencyGraph.from_system_description(utilities.SystemDescription.discover())
+        for node_key, document in graph.documents().items():
+            print(node_key, document)
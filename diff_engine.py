@@ -0,0 +1,296 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Compares the current state of the system with the nominal state, the one that was saved with --nominal when the
+# system was working.  For each layer, the result is what was added, what was removed and what changed.
+#
+# Every entity in a layer is turned into a dictionary of its fields with layer.to_jsonable, so that an entity that
+# was just discovered and one that was read back from the nominal file look the same, and is given a key which
+# identifies it (see entity_key).  The keys of both sides are sorted and then walked together, like the merge step of
+# a merge sort, so comparing two layers of n entities takes O(n log n), even for a route table or a connection table
+# with hundreds of thousands of entries.  Fields are only compared for entities that are on both sides.
+#
+# The nominal side does not change from one diagnosis to the next, so it is indexed (converted, keyed and sorted)
+# once by NominalIndex and the index is reused.
+
+import collections.abc
+import sys
+import time
+import typing
+
+import constants
+import layer
+from constants import ErrorLevels
+
+LAYER_NAMES = constants.SYSTEM_LAYERS
+
+# The fields that identify an entity, for each kind of entity.  The first set of fields that an entity has all of
+# is its key.  An entity with none of them is keyed by its name, and failing that, by all of its fields
+KEY_FIELDS = [("ipv4_destination", "ipv4_dev", "ipv4_metric"),  # routes.IPv4Route
+              ("ipv6_destination", "ipv6_interface", "ipv6_metric"),  # routes.IPv6Route
+              ("destination", "dev", "metric"),  # a route from netlink_backend
+              ("protocol", "src_host", "src_port", "dst_host", "dst_port"),  # transport.Transport.TcpConnection
+              ("name",)]
+
+# Fields that are different every time an entity is discovered, so they are not a change
+IGNORED_FIELDS = {"time"}
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+# A resource in the nominal state that can't be found, or one that is not in the nominal state, is CHANGED, see
+# constants.ErrorLevels
+SEVERITIES = {ADDED: ErrorLevels.CHANGED, REMOVED: ErrorLevels.CHANGED, CHANGED: ErrorLevels.CHANGED}
+
+
+def without_ignored_fields(value):
+    """
+    :param value: something that layer.to_jsonable returned
+    :return: value, with the IGNORED_FIELDS taken out of every dictionary in it
+    """
+    if type(value) is dict:
+        return {k: v if type(v) in layer.JSON_TYPES else without_ignored_fields(v) for k, v in value.items()
+                if k not in IGNORED_FIELDS}
+    if type(value) is list:
+        return [without_ignored_fields(v) for v in value]
+    return value
+
+
+def entity_key(fields) -> str:
+    """
+    :param fields: an entity, as layer.to_jsonable converted it
+    :return: the key that identifies the entity, see KEY_FIELDS
+    """
+    if isinstance(fields, dict):
+        for key_fields in KEY_FIELDS:
+            if all(f in fields for f in key_fields):
+                return " ".join([str(fields[f]) for f in key_fields])
+    return str(fields)
+
+
+def is_single_entity(layer_value) -> bool:
+    """
+    :return: True if layer_value is one entity rather than a collection of them, see layer_entities
+    """
+    return layer_value is not None and not isinstance(layer_value, dict) and \
+        (isinstance(layer_value, (str, bytes)) or not hasattr(layer_value, "__iter__"))
+
+
+def layer_entities(layer_value) -> typing.Dict[str, typing.Any]:
+    """
+    Convert one layer of a SystemDescription into a dictionary of its entities, as layer.to_jsonable converts them,
+    keyed by entity_key
+
+    :param layer_value: a dictionary of entities, a list of them, something else that iterates over them (like
+    connection_table.ConnectionTable), a single value, or None
+    """
+    if layer_value is None:
+        return dict()
+    if isinstance(layer_value, dict):
+        # The keys of the dictionary are what identify the entities
+        return {str(k): without_ignored_fields(layer.to_jsonable(v)) for k, v in layer_value.items()}
+    if is_single_entity(layer_value):
+        return {"": without_ignored_fields(layer.to_jsonable(layer_value))}
+    entities = dict()
+    for entity in layer_value:
+        fields = without_ignored_fields(layer.to_jsonable(entity))
+        key = entity_key(fields)
+        if key in entities:
+            # The same key twice, e.g. the same route in two routing tables.  Number them so both are compared
+            n = 2
+            while f"{key} #{n}" in entities:
+                n += 1
+            key = f"{key} #{n}"
+        entities[key] = fields
+    return entities
+
+
+class ItemDiff(object):
+    """
+    One entity that was added, removed or changed
+    """
+    __slots__ = ["key", "kind", "nominal", "current", "fields"]
+
+    def __init__(self, key: str, kind: str, nominal=None, current=None) -> None:
+        """
+        :param key: the entity_key of the entity
+        :param kind: ADDED, REMOVED or CHANGED
+        :param nominal: the entity in the nominal state, None if it was added
+        :param current: the entity in the current state, None if it was removed
+        """
+        self.key = key
+        self.kind = kind
+        self.nominal = nominal
+        self.current = current
+        # For a change, the fields that changed, mapped to (nominal value, current value)
+        self.fields: typing.Dict[str, typing.Tuple] = dict()
+        if kind == CHANGED:
+            if isinstance(nominal, dict) and isinstance(current, dict):
+                for field in sorted(nominal.keys() | current.keys()):
+                    if nominal.get(field) != current.get(field):
+                        self.fields[field] = (nominal.get(field), current.get(field))
+            else:
+                self.fields[""] = (nominal, current)
+
+    @property
+    def severity(self) -> ErrorLevels:
+        return SEVERITIES[self.kind]
+
+    def __str__(self):
+        if self.kind == CHANGED:
+            changes = ", ".join(f"{field}: {nominal} -> {current}" for field, (nominal, current) in self.fields.items())
+            return f"changed {self.key}: {changes}"
+        return f"{self.kind} {self.key}"
+
+
+class LayerDiff(object):
+    """
+    The differences in one layer
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.added: typing.List[ItemDiff] = list()
+        self.removed: typing.List[ItemDiff] = list()
+        self.changed: typing.List[ItemDiff] = list()
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def __iter__(self) -> typing.Iterator[ItemDiff]:
+        yield from self.removed
+        yield from self.changed
+        yield from self.added
+
+    def get_status(self) -> ErrorLevels:
+        return max((item.severity for item in self), default=ErrorLevels.NORMAL)
+
+    def __str__(self):
+        lines = [f"{self.name}: {self.get_status().name}, {len(self.added)} added, {len(self.removed)} removed, "
+                 f"{len(self.changed)} changed"]
+        lines.extend(f"  {item}" for item in self)
+        return "\n".join(lines)
+
+
+class DiffReport(object):
+    """
+    The differences between the nominal state and the current state, layer by layer
+    """
+
+    def __init__(self, layers: typing.Dict[str, LayerDiff]) -> None:
+        self.layers = layers
+
+    def __getitem__(self, name: str) -> LayerDiff:
+        return self.layers[name]
+
+    def get_status(self) -> ErrorLevels:
+        return max((layer_diff.get_status() for layer_diff in self.layers.values()), default=ErrorLevels.NORMAL)
+
+    def __str__(self):
+        return "\n".join(str(layer_diff) for layer_diff in self.layers.values())
+
+
+class NominalIndex(object):
+    """
+    The nominal state, converted, keyed and sorted once so that it can be compared with the current state as often
+    as needed
+    """
+
+    def __init__(self, nominal, layer_names: typing.List[str] = None) -> None:
+        """
+        :param nominal: a SystemDescription, or a dictionary of layers keyed by layer name, like a snapshot.Snapshot.
+        Only the layers in layer_names are looked up
+        :param layer_names: the layers to compare, LAYER_NAMES if None
+        """
+        self.layer_names = layer_names if layer_names is not None else LAYER_NAMES
+        self._entities: typing.Dict[str, typing.Dict[str, typing.Any]] = dict()
+        self._keys: typing.Dict[str, typing.List[str]] = dict()
+        for name in self.layer_names:
+            entities = layer_entities(self._get_layer(nominal, name))
+            self._entities[name] = entities
+            self._keys[name] = sorted(entities)
+
+    @staticmethod
+    def _get_layer(description, name: str):
+        if isinstance(description, collections.abc.Mapping):  # e.g. a snapshot.Snapshot, which loads it now
+            return description.get(name)
+        return getattr(description, name, None)
+
+    def diff_layer(self, name: str, current_layer) -> LayerDiff:
+        """
+        Compare one layer of the current state with the same layer of the nominal state
+
+        :param name: the name of the layer, e.g. "networks_4"
+        :param current_layer: the layer, in any form that layer_entities accepts
+        """
+        nominal_entities = self._entities[name]
+        nominal_keys = self._keys[name]
+        current_entities = layer_entities(current_layer)
+        current_keys = sorted(current_entities)
+        result = LayerDiff(name)
+        i = j = 0
+        while i < len(nominal_keys) and j < len(current_keys):
+            nominal_key = nominal_keys[i]
+            current_key = current_keys[j]
+            if nominal_key == current_key:
+                nominal = nominal_entities[nominal_key]
+                current = current_entities[current_key]
+                if nominal != current:
+                    result.changed.append(ItemDiff(nominal_key, CHANGED, nominal=nominal, current=current))
+                i += 1
+                j += 1
+            elif nominal_key < current_key:
+                result.removed.append(ItemDiff(nominal_key, REMOVED, nominal=nominal_entities[nominal_key]))
+                i += 1
+            else:
+                result.added.append(ItemDiff(current_key, ADDED, current=current_entities[current_key]))
+                j += 1
+        result.removed.extend(ItemDiff(k, REMOVED, nominal=nominal_entities[k]) for k in nominal_keys[i:])
+        result.added.extend(ItemDiff(k, ADDED, current=current_entities[k]) for k in current_keys[j:])
+        return result
+
+    def diff(self, current) -> DiffReport:
+        """
+        :param current: a SystemDescription, or a dictionary of layers keyed by layer name
+        :return: the differences in every layer
+        """
+        return DiffReport({name: self.diff_layer(name, self._get_layer(current, name)) for name in self.layer_names})
+
+
+def diff(nominal, current) -> DiffReport:
+    """
+    Compare two states once.  To compare the same nominal state with the current state many times, make a
+    NominalIndex and call its diff method instead
+    """
+    return NominalIndex(nominal).diff(current)
+
+
+if __name__ == "__main__":
+    import socket
+
+    from connection_table import ConnectionTable
+    from constants import TcpStates
+
+    N = 100000
+
+    def routes(n: int, skip: int, metric_of_3: int) -> typing.List[dict]:
+        return [{"destination": f"10.{i // 65536}.{i // 256 % 256}.{i % 256}/32", "dev": "eth0",
+                 "metric": metric_of_3 if i == 3 else 100, "via": "192.0.2.1"} for i in range(n) if i != skip]
+
+    def connections(n: int, skip: int) -> ConnectionTable:
+        table = ConnectionTable()
+        for i in range(n):
+            if i != skip:
+                table.add(socket.AF_INET, "192.0.2.10", 443, f"10.{i // 65536}.{i // 256 % 256}.{i % 256}",
+                          40000 + i % 20000, TcpStates.ESTABLISHED, "TCP", 33, 100 + i)
+        return table
+
+    nominal_state = {"networks_4": routes(N, skip=1, metric_of_3=100), "transports": connections(N, skip=1)}
+    current_state = {"networks_4": routes(N, skip=2, metric_of_3=200), "transports": connections(N, skip=2)}
+    t0 = time.monotonic()
+    index = NominalIndex(nominal_state, layer_names=["transports", "networks_4"])
+    t1 = time.monotonic()
+    report = index.diff(current_state)
+    t2 = time.monotonic()
+    print(report, file=sys.stderr)
+    print(f"Indexed {N} routes and {N} connections in {t1 - t0:.2f} seconds, compared them in {t2 - t1:.2f} seconds")
@@ -0,0 +1,115 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This module runs the discover methods of the layers of the OSI stack at the same time.  Each discover method
+# spends most of its time waiting on a child process (ip, ps, lshw), so running them one after another makes a
+# boot time scan take as long as the sum of all of the layers instead of as long as the slowest layer.
+
+import sys
+import threading
+import time
+import typing
+
+import constants
+from constants import ErrorLevels
+
+
+class LayerTiming(object):
+    """
+    How long the discover method of one layer took, and how it ended.  status is ErrorLevels.NORMAL if the
+    discover method returned, ErrorLevels.DOWN if it raised an exception and ErrorLevels.UNKNOWN if it did not
+    finish before its timeout.
+    """
+
+    def __init__(self, name: str, elapsed: float, status: ErrorLevels, error: str = None) -> None:
+        self.name = name
+        self.elapsed = elapsed  # wall clock seconds
+        self.status = status
+        self.error = error
+
+    def __str__(self):
+        result = f"{self.name}: {self.elapsed * 1000.0:.1f} ms {self.status.name}"
+        if self.error is not None:
+            result += f" ({self.error})"
+        return result
+
+
+class DiscoveryScheduler(object):
+    """
+    Runs a set of probes, one per layer, concurrently.  A probe is a callable with no arguments, such as
+    routes.IPv4Route.discover.  Every probe runs in its own daemon thread, so a probe that hangs past its timeout
+    is abandoned and does not keep the program from exiting.
+    """
+
+    def __init__(self, probes: typing.Dict[str, typing.Callable[[], typing.Any]],
+                 timeouts: typing.Dict[str, float] = None,
+                 default_timeout: float = constants.DISCOVERY_TIMEOUT) -> None:
+        """
+        :param probes: a dictionary keyed by layer name.  The value is the callable that discovers that layer
+        :param timeouts: optional per-layer timeouts in seconds, keyed by layer name
+        :param default_timeout: the timeout, in seconds, of any layer that is not in timeouts
+        """
+        self.probes = probes
+        self.timeouts = timeouts if timeouts is not None else dict()
+        self.default_timeout = default_timeout
+
+    def timeout_for(self, name: str) -> float:
+        return self.timeouts.get(name, self.default_timeout)
+
+    def run(self) -> typing.Tuple[typing.Dict[str, typing.Any], typing.Dict[str, LayerTiming]]:
+        """
+        Start all of the probes, then wait for each one until it finishes or its timeout expires.  Because all of
+        the probes start together, a layer's timeout is measured from the moment the scheduler started.
+
+        :return: a tuple of two dictionaries, both keyed by layer name.  The first has what each probe returned
+        (None if the probe failed or timed out), the second has a LayerTiming for each probe
+        """
+        outcomes: typing.Dict[str, list] = dict()
+        threads: typing.Dict[str, threading.Thread] = dict()
+        start = time.monotonic()
+        for name, probe in self.probes.items():
+            # Each thread fills in [result, elapsed, exception] when it finishes
+            outcomes[name] = [None, None, None]
+            threads[name] = threading.Thread(target=self._run_probe, args=(probe, outcomes[name], start),
+                                             name=f"discover-{name}", daemon=True)
+            threads[name].start()
+
+        results: typing.Dict[str, typing.Any] = dict()
+        timings: typing.Dict[str, LayerTiming] = dict()
+        for name, thread in threads.items():
+            timeout = self.timeout_for(name)
+            thread.join(timeout=max(0.0, start + timeout - time.monotonic()))
+            result, elapsed, exception = outcomes[name]
+            if thread.is_alive():
+                results[name] = None
+                timings[name] = LayerTiming(name, time.monotonic() - start, ErrorLevels.UNKNOWN,
+                                            f"timed out after {timeout} seconds")
+                print(f"Discovering the {name} layer timed out after {timeout} seconds", file=sys.stderr)
+            elif exception is not None:
+                results[name] = None
+                timings[name] = LayerTiming(name, elapsed, ErrorLevels.DOWN, repr(exception))
+                print(f"Discovering the {name} layer raised {repr(exception)}", file=sys.stderr)
+            else:
+                results[name] = result
+                timings[name] = LayerTiming(name, elapsed, ErrorLevels.NORMAL)
+        return results, timings
+
+    @staticmethod
+    def _run_probe(probe: typing.Callable[[], typing.Any], outcome: list, start: float) -> None:
+        try:
+            outcome[0] = probe()
+        except Exception as e:  # Any exception is reported as the status of that layer, not raised
+            outcome[2] = e
+        outcome[1] = time.monotonic() - start
+
+
+if __name__ == "__main__":
+    def nap(seconds):
+        return lambda: time.sleep(seconds) or seconds
+
+    scheduler = DiscoveryScheduler({"fast": nap(0.1), "slow": nap(0.5), "hung": nap(5.0)}, timeouts={"hung": 1.0})
+    t0 = time.monotonic()
+    layers, layer_timings = scheduler.run()
+    print(f"All layers discovered in {time.monotonic() - t0:.3f} seconds")
+    for timing in layer_timings.values():
+        print(timing)
@@ -0,0 +1,240 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Checks the health of the DNS resolvers.  Every resolver (see application.DNS.get_resolvers) is asked for the A and
+# AAAA records of every configured name, all at the same time, so a resolver that does not answer costs one timeout
+# instead of one timeout per query.  For each resolver, there are the latencies of its answers and how many queries
+# timed out or failed.
+#
+# The monitor runs the checker over and over again.  The answers are cached for as long as their TTL says, so a name
+# is only asked for again when the answer may have changed.  A query that timed out or failed is never cached.
+#
+# The names come from the dns_names option in nbmdt.ini.  If there is no dns_names, then the ping_targets that are
+# names, rather than addresses, are used.
+
+import asyncio
+import copy
+import ipaddress
+import sys
+import time
+import typing
+
+import dns.asyncquery
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+
+import configuration
+import constants
+from constants import ErrorLevels
+
+QUERY_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA)
+
+
+class DnsAnswer(object):
+    """
+    The answer from one resolver to one query
+    """
+    __slots__ = ["server", "name", "rdtype", "addresses", "rcode", "latency", "error", "expires", "cached"]
+
+    def __init__(self, server: str, name: str, rdtype: dns.rdatatype.RdataType, addresses: typing.List[str] = None,
+                 rcode: dns.rcode.Rcode = None, latency: float = None, error: str = None,
+                 expires: float = None) -> None:
+        """
+        :param latency: milliseconds from sending the query to getting the answer, None if there was no answer
+        :param error: why there was no answer, None if there was one
+        :param expires: when, by the checker's clock, the answer must be asked for again.  None if it is not cached
+        """
+        self.server = server
+        self.name = name
+        self.rdtype = rdtype
+        self.addresses = addresses if addresses is not None else list()
+        self.rcode = rcode
+        self.latency = latency
+        self.error = error
+        self.expires = expires
+        self.cached = False  # True if this answer came from the cache rather than from the server
+
+    def __str__(self):
+        if self.error is not None:
+            return f"{self.server} {self.name} {dns.rdatatype.to_text(self.rdtype)}: {self.error}"
+        source = "cached" if self.cached else f"{self.latency:.3f} ms"
+        return f"{self.server} {self.name} {dns.rdatatype.to_text(self.rdtype)}: " \
+               f"{dns.rcode.to_text(self.rcode)} {', '.join(self.addresses)} ({source})"
+
+
+class ServerStats(object):
+    """
+    How one resolver did in one run of the checker.  Answers from the cache don't count, because they did not come
+    from the resolver this time
+    """
+
+    def __init__(self, server: str) -> None:
+        self.server = server
+        self.queries: int = 0
+        self.timeouts: int = 0
+        self.failures: int = 0  # errors other than timeouts, e.g. SERVFAIL or REFUSED
+        self.latencies: typing.List[float] = list()
+
+    def add(self, answer: DnsAnswer) -> None:
+        if answer.cached:
+            return
+        self.queries += 1
+        if answer.error == "timed out":
+            self.timeouts += 1
+        elif answer.error is not None:
+            self.failures += 1
+        else:
+            self.latencies.append(answer.latency)
+
+    @property
+    def latency_min(self) -> typing.Optional[float]:
+        return min(self.latencies) if self.latencies else None
+
+    @property
+    def latency_avg(self) -> typing.Optional[float]:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else None
+
+    @property
+    def latency_max(self) -> typing.Optional[float]:
+        return max(self.latencies) if self.latencies else None
+
+    def get_status(self) -> ErrorLevels:
+        if self.queries == 0:
+            return ErrorLevels.NORMAL  # Everything came from the cache, which it would not if the server was bad
+        if len(self.latencies) == 0:
+            return ErrorLevels.DOWN
+        if self.timeouts > 0 or self.failures > 0:
+            return ErrorLevels.DEGRADED
+        return ErrorLevels.NORMAL
+
+    def __str__(self):
+        result = f"{self.server}: {self.queries} queries, {self.timeouts} timeouts, {self.failures} failures"
+        if self.latencies:
+            result += f", latency min/avg/max = {self.latency_min:.3f}/{self.latency_avg:.3f}/" \
+                      f"{self.latency_max:.3f} ms"
+        return result
+
+
+class DnsChecker(object):
+    """
+    Asks all of the resolvers for all of the names at once, and caches the answers
+    """
+
+    def __init__(self, resolvers: typing.List[str] = None, port: int = 53, timeout: float = constants.DNS_TIMEOUT,
+                 negative_ttl: float = constants.DNS_NEGATIVE_TTL,
+                 clock: typing.Callable[[], float] = time.monotonic) -> None:
+        """
+        :param resolvers: the addresses of the resolvers.  If None, then application.DNS.get_resolvers()
+        :param port: the port the resolvers listen on.  Only a test would change this
+        :param timeout: seconds to wait for each answer
+        :param negative_ttl: the longest that an answer with no records is cached, in seconds
+        :param clock: where the checker gets the time, in seconds, to expire the cache
+        """
+        if resolvers is None:
+            import application  # application imports utilities, which imports most of nbmdt
+            resolvers = application.DNS.get_resolvers()
+        self.resolvers = resolvers
+        self.port = port
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._cache: typing.Dict[typing.Tuple[str, str, int], DnsAnswer] = dict()
+
+    async def check_many(self, names: typing.Iterable[str]) \
+            -> typing.Tuple[typing.List[DnsAnswer], typing.Dict[str, ServerStats]]:
+        """
+        Ask every resolver for the A and AAAA records of every name
+
+        :return: the answers, and how each resolver did
+        """
+        names = list(dict.fromkeys(names))
+        answers = await asyncio.gather(*[self.query(server, name, rdtype) for server in self.resolvers
+                                         for name in names for rdtype in QUERY_TYPES])
+        stats = {server: ServerStats(server) for server in self.resolvers}
+        for answer in answers:
+            stats[answer.server].add(answer)
+        return answers, stats
+
+    def check(self, names: typing.Iterable[str]) \
+            -> typing.Tuple[typing.List[DnsAnswer], typing.Dict[str, ServerStats]]:
+        """
+        The same as check_many, for callers that are not coroutines
+        """
+        return asyncio.run(self.check_many(names))
+
+    async def query(self, server: str, name: str, rdtype: dns.rdatatype.RdataType) -> DnsAnswer:
+        """
+        Ask one resolver one question, unless the answer is still in the cache
+        """
+        key = (server, name, rdtype)
+        answer = self._cache.get(key)
+        if answer is not None:
+            if self.clock() < answer.expires:
+                return answer
+            del self._cache[key]
+        query = dns.message.make_query(name, rdtype)
+        start = time.perf_counter()
+        try:
+            response, _ = await dns.asyncquery.udp_with_fallback(query, server, timeout=self.timeout, port=self.port)
+        except dns.exception.Timeout:
+            return DnsAnswer(server, name, rdtype, error="timed out")
+        except (OSError, dns.exception.DNSException) as e:
+            return DnsAnswer(server, name, rdtype, error=str(e) or type(e).__name__)
+        latency = (time.perf_counter() - start) * 1000.0
+        rcode = response.rcode()
+        if rcode != dns.rcode.NOERROR and rcode != dns.rcode.NXDOMAIN:
+            return DnsAnswer(server, name, rdtype, rcode=rcode, latency=latency, error=dns.rcode.to_text(rcode))
+        addresses = []
+        ttls = []
+        for rrset in response.answer:
+            ttls.append(rrset.ttl)  # Including the CNAMEs on the way to the addresses
+            if rrset.rdtype == rdtype:
+                addresses.extend(rdata.address for rdata in rrset)
+        if len(addresses) == 0:
+            # A negative answer is cached for as long as the SOA says (RFC 2308), but no longer than negative_ttl
+            ttls = [min(rrset.ttl, rrset[0].minimum) for rrset in response.authority
+                    if rrset.rdtype == dns.rdatatype.SOA] + [self.negative_ttl]
+        answer = DnsAnswer(server, name, rdtype, addresses=addresses, rcode=rcode, latency=latency,
+                           expires=self.clock() + min(ttls))
+        # Whoever gets the answer from the cache later should be able to tell that it came from there
+        cached = self._cache[key] = copy.copy(answer)
+        cached.cached = True
+        return answer
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+def configured_names(ini_filename: str = constants.NBMDT_INI) -> typing.List[str]:
+    """
+    :return: the dns_names from nbmdt.ini, or the ping_targets that are names if there are no dns_names
+    """
+    try:
+        config = configuration.FixedConfiguration(ini_filename)
+    except FileNotFoundError as e:
+        print(f"{str(e)}, so there are no names to check", file=sys.stderr)
+        return []
+    names = config.get_list("dns_names")
+    if len(names) > 0:
+        return names
+    for target in config.get_list("ping_targets"):
+        try:
+            ipaddress.ip_address(target)
+        except ValueError:
+            names.append(target)
+    return names
+
+
+if __name__ == "__main__":
+    checker = DnsChecker()
+    check_names = sys.argv[1:] if len(sys.argv) > 1 else configured_names()
+    for cycle in range(2):
+        t0 = time.monotonic()
+        dns_answers, server_stats = checker.check(check_names)
+        print(f"Cycle {cycle}: {len(dns_answers)} answers in {(time.monotonic() - t0) * 1000.0:.1f} ms")
+        for dns_answer in dns_answers:
+            print(f"  {dns_answer}")
+        for stat in server_stats.values():
+            print(f"  {stat}")
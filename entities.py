@@ -7,9 +7,11 @@
 #
 
 from enum import Enum, unique
+import itertools
 import typing
-import datetime
-import utilities
+import constants
+import event_log
+import timing
 
 
 @unique                         # a decorator on a class!
@@ -58,14 +60,21 @@ class Entity(object):
        stack. It has a name, a log, a current status.
     An entity can
 
+    The log of every entity is kept in one event_log.EventLog, which keeps only the recent changes of each entity,
+    so a monitor with thousands of entities does not grow without limit.  Each entity has its own key in the log, its
+    layer, its name and a serial number, because eth0 the physical and eth0 the datalink, or eth0 in the nominal and
+    in the current description, are different entities with different histories.
     """
 
-    def __init__ (self, name : str, layer : utilities.OSILevels) -> None:
+    events = event_log.EventLog(levels=ErrorLevels)
+    _serial = itertools.count(1)
+
+    def __init__ (self, name : str, layer : constants.OSILevels) -> None:
         self._name = name
         self._layer =  layer         # layer in the OSI model
-        self._log = []
+        self._event_key = f"{getattr(layer, 'name', layer)}/{name} #{next(self._serial)}"
         self._current_status = None     # Prevents an Attribute exception later
-        self._log_initialization_time = datetime.datetime.now()
+        self._log_initialization_time = timing.now()
         self.event_record(ErrorLevels.UNKNOWN, "Log list initialized")
 
     def event_record(self, new_status : Enum, reporter : str ) -> typing.Tuple :
@@ -77,14 +86,16 @@ class Entity(object):
         """
         if self._current_status == new_status:
             return
-        record = (datetime.datetime.now(), new_status, reporter )
-        self._log.append(record)
+        self.events.record(self._event_key, new_status, reporter)
         self._current_status = new_status
         return
 
     @property
     def log(self) -> list:
-        return self._log
+        """
+        :return: the recent changes, oldest first, as (timing.Timestamp, status, reporter) tuples
+        """
+        return [(event.time, event.status, event.reporter) for event in self.events.history(self._event_key)]
 
     # Note that there is no setter for the log object.  It's supposed to be immutable
 
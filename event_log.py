@@ -0,0 +1,328 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# The log of the changes in status of entities (see entities.Entity): when each entity went from one ErrorLevels to
+# another, and who said so.  A monitor that runs for months over thousands of entities can't keep every change, so
+# the log is bounded:
+#
+#   Each entity keeps its last constants.EVENT_LOG_CAPACITY changes in a ring buffer.  The timestamps (monotonic
+#   nanoseconds, see timing.py) and the status codes are packed into arrays, 9 bytes per change.
+#   All of the entities together keep their last constants.EVENT_LOG_RECENT changes in another ring buffer, in the
+#   order they happened, so "what changed in the last 10 minutes" is a binary search for the first change after 10
+#   minutes ago, not a look at every entity.
+#   Each entity keeps how long it has spent in each status so far, updated at every change, so "how long was it
+#   DOWN" does not need its history, which may have been overwritten anyway.
+#   At most constants.EVENT_LOG_ENTITIES entities are kept, because each one's ring buffer is allocated in full, and
+#   entities come and go (connections, routes).  When there are more, the entity that changed longest ago is
+#   forgotten, its history and its time in each status with it.
+#
+# If the log is given a directory, every change is also appended to a segment file there, one os.write per change.
+# When a segment reaches constants.EVENT_SEGMENT_SIZE bytes a new one is started, and only the last
+# constants.EVENT_SEGMENTS segments are kept.  read_segments reads them back.
+
+import array
+import bisect
+import collections
+import datetime
+import enum
+import itertools
+import os
+import struct
+import sys
+import threading
+import typing
+
+import constants
+import timing
+
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".log"
+# A change on disk: the wall clock and the monotonic clock in nanoseconds, the status code, and the lengths of the
+# entity name and the reporter, which follow it in UTF-8
+RECORD_HEADER = struct.Struct(">qqBHH")
+
+
+class Event(typing.NamedTuple):
+    time: timing.Timestamp
+    entity: str
+    status: enum.Enum
+    reporter: str
+
+
+class Ring(object):
+    """
+    The last capacity rows of a table with fixed columns, each column an array.array of typecode, or a list if the
+    typecode is None.  Rows are numbered oldest first
+    """
+
+    def __init__(self, capacity: int, typecodes: typing.List[typing.Optional[str]]) -> None:
+        self.capacity = capacity
+        self.columns = [[None] * capacity if typecode is None else array.array(typecode, bytes(
+            array.array(typecode).itemsize * capacity)) for typecode in typecodes]
+        self.count: int = 0
+        self._next: int = 0  # Where the next row goes
+
+    def append(self, *row) -> None:
+        for column, value in zip(self.columns, row):
+            column[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def _physical(self, i: int) -> int:
+        return (self._next - self.count + i) % self.capacity
+
+    def row(self, i: int) -> tuple:
+        p = self._physical(i)
+        return tuple(column[p] for column in self.columns)
+
+    def bisect_left(self, value) -> int:
+        """
+        :return: the first row whose first column is >= value.  The first column must be sorted
+        """
+        first = self.columns[0]
+        return bisect.bisect_left(range(self.count), value, key=lambda i: first[self._physical(i)])
+
+    def rows(self, start: int = 0) -> typing.Iterator[tuple]:
+        """
+        :return: the rows from start on, oldest first, by slicing the columns rather than row by row
+        """
+        n = self.count - start
+        if n <= 0:
+            return iter(())
+        begin = self._physical(start)
+        end = begin + n
+        if end <= self.capacity:
+            return zip(*[column[begin:end] for column in self.columns])
+        return itertools.chain(zip(*[column[begin:] for column in self.columns]),
+                               zip(*[column[:end - self.capacity] for column in self.columns]))
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class EntityHistory(object):
+    """
+    The recent changes of one entity, and how long it has spent in each status
+    """
+    __slots__ = ["changes", "status", "since", "durations"]
+
+    def __init__(self, capacity: int) -> None:
+        self.changes = Ring(capacity, ["q", "B", None])  # time, status code, reporter
+        self.status: typing.Optional[int] = None  # The code of the current status
+        self.since: int = 0  # When the current status started
+        self.durations: typing.Dict[int, int] = dict()  # nanoseconds in each status before the current one, by code
+
+
+class EventLog(object):
+    """
+    The changes in status of many entities
+    """
+
+    def __init__(self, levels: typing.Type[enum.Enum] = constants.ErrorLevels,
+                 capacity: int = constants.EVENT_LOG_CAPACITY, recent: int = constants.EVENT_LOG_RECENT,
+                 directory: str = None, segment_size: int = constants.EVENT_SEGMENT_SIZE,
+                 segments: int = constants.EVENT_SEGMENTS, max_entities: int = constants.EVENT_LOG_ENTITIES) -> None:
+        """
+        :param levels: the enum of the statuses.  Its values must fit in a byte
+        :param capacity: how many changes to keep of each entity
+        :param recent: how many changes to keep of all entities together
+        :param max_entities: how many entities to keep.  The one that changed longest ago is forgotten first
+        :param directory: where to write segment files.  If None, the log is only in memory
+        :param segment_size: bytes in a segment before a new one is started
+        :param segments: how many segments to keep
+        """
+        self.levels = levels
+        self.capacity = capacity
+        self.max_entities = max_entities
+        # Ordered by when each entity last changed, longest ago first
+        self._entities: typing.OrderedDict[str, EntityHistory] = collections.OrderedDict()
+        self.forgotten: int = 0  # How many entities were forgotten to keep within max_entities
+        self._recent = Ring(recent, ["q", None, "B", None])  # time, entity, status code, reporter
+        self._lock = threading.Lock()
+        self.directory = directory
+        self.segment_size = segment_size
+        self.segments = segments
+        self._segment_fd: int = None
+        self._segment_bytes: int = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def record(self, entity: str, status: enum.Enum, reporter: str = "", when: timing.Timestamp = None) -> bool:
+        """
+        Record the status of an entity.  If it is the same as its last status, nothing is recorded
+
+        :param entity: the name of the entity
+        :param status: a member of levels
+        :param reporter: an arbitrary string that annotates the change
+        :param when: when the entity changed.  If None, then now
+        :return: True if this was a change
+        """
+        when = timing.now() if when is None else when
+        code = status.value
+        with self._lock:
+            history = self._entities.get(entity)
+            if history is None:
+                if len(self._entities) >= self.max_entities:
+                    self._entities.popitem(last=False)
+                    self.forgotten += 1
+                history = self._entities[entity] = EntityHistory(self.capacity)
+            if history.status == code:
+                return False
+            self._entities.move_to_end(entity)
+            if history.status is not None:
+                history.durations[history.status] = history.durations.get(history.status, 0) + when.ns - history.since
+            history.status = code
+            history.since = when.ns
+            history.changes.append(when.ns, code, reporter)
+            self._recent.append(when.ns, entity, code, reporter)
+            if self.directory is not None:
+                self._write(when, entity, code, reporter)
+        return True
+
+    def _write(self, when: timing.Timestamp, entity: str, code: int, reporter: str) -> None:
+        entity_bytes = entity.encode("utf-8")[:65535]
+        reporter_bytes = reporter.encode("utf-8")[:65535]
+        data = RECORD_HEADER.pack(when.anchor.wall_ns_at(when.ns), when.ns, code, len(entity_bytes),
+                                  len(reporter_bytes)) + entity_bytes + reporter_bytes
+        if self._segment_fd is None or self._segment_bytes + len(data) > self.segment_size:
+            self._next_segment()
+        os.write(self._segment_fd, data)
+        self._segment_bytes += len(data)
+
+    def _next_segment(self) -> None:
+        if self._segment_fd is not None:
+            os.close(self._segment_fd)
+        numbers = segment_numbers(self.directory)
+        number = numbers[-1] + 1 if numbers else 1
+        self._segment_fd = os.open(os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"),
+                                   os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o644)
+        self._segment_bytes = 0
+        for old in numbers[:max(0, len(numbers) + 1 - self.segments)]:
+            os.remove(os.path.join(self.directory, f"{SEGMENT_PREFIX}{old:08d}{SEGMENT_SUFFIX}"))
+
+    def current_status(self, entity: str) -> typing.Optional[enum.Enum]:
+        history = self._entities.get(entity)
+        return None if history is None or history.status is None else self.levels(history.status)
+
+    def history(self, entity: str) -> typing.List[Event]:
+        """
+        :return: the changes of one entity that are still kept, oldest first
+        """
+        with self._lock:
+            history = self._entities.get(entity)
+            rows = [] if history is None else list(history.changes.rows())
+        return [Event(timing.Timestamp(ns), entity, self.levels(code), reporter) for ns, code, reporter in rows]
+
+    def transitions(self, seconds: float, entity: str = None, now: timing.Timestamp = None) -> typing.List[Event]:
+        """
+        :param seconds: how far back to look
+        :param entity: the entity to look at.  If None, then every entity
+        :param now: when to look back from.  If None, then now
+        :return: the changes in the last seconds that are still kept, oldest first
+        """
+        now = timing.now() if now is None else now
+        since = now.ns - int(seconds * 1e9)
+        with self._lock:
+            if entity is None:
+                ring = self._recent
+                rows = list(ring.rows(ring.bisect_left(since)))
+            else:
+                history = self._entities.get(entity)
+                if history is None:
+                    return []
+                ring = history.changes
+                rows = [(ns, entity, code, reporter) for ns, code, reporter in ring.rows(ring.bisect_left(since))]
+        return [Event(timing.Timestamp(ns), name, self.levels(code), reporter) for ns, name, code, reporter in rows]
+
+    def time_in_states(self, entity: str = None, now: timing.Timestamp = None) \
+            -> typing.Dict[enum.Enum, datetime.timedelta]:
+        """
+        :param entity: the entity to add up.  If None, then every entity, added together
+        :param now: when the current status ends.  If None, then now
+        :return: how long the entity spent in each status since it was first recorded, including the current one
+        """
+        now = timing.now() if now is None else now
+        totals: typing.Dict[int, int] = dict()
+        with self._lock:
+            histories = self._entities.values() if entity is None else [self._entities.get(entity)]
+            for history in histories:
+                if history is None or history.status is None:
+                    continue
+                for code, ns in history.durations.items():
+                    totals[code] = totals.get(code, 0) + ns
+                totals[history.status] = totals.get(history.status, 0) + now.ns - history.since
+        return {self.levels(code): datetime.timedelta(microseconds=ns / 1000) for code, ns in sorted(totals.items())}
+
+    def entities(self) -> typing.List[str]:
+        return list(self._entities)
+
+    def close(self) -> None:
+        if self._segment_fd is not None:
+            os.close(self._segment_fd)
+            self._segment_fd = None
+
+
+def segment_numbers(directory: str) -> typing.List[int]:
+    """
+    :return: the numbers of the segment files in directory, oldest first
+    """
+    numbers = []
+    for name in os.listdir(directory):
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+            try:
+                numbers.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+            except ValueError:
+                pass
+    return sorted(numbers)
+
+
+def read_segments(directory: str, levels: typing.Type[enum.Enum] = constants.ErrorLevels) \
+        -> typing.Iterator[typing.Tuple[datetime.datetime, Event]]:
+    """
+    Read back the changes that an EventLog wrote, oldest first
+
+    :return: for each change, the wall clock time that it happened, and the change.  The Timestamp of the change is
+    only comparable with others from the same boot
+    """
+    for number in segment_numbers(directory):
+        with open(os.path.join(directory, f"{SEGMENT_PREFIX}{number:08d}{SEGMENT_SUFFIX}"), "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            wall, ns, code, entity_length, reporter_length = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            if offset + entity_length + reporter_length > len(data):
+                print(f"Segment {number} in {directory} ends in the middle of a change", file=sys.stderr)
+                break
+            entity = data[offset:offset + entity_length].decode("utf-8", errors="replace")
+            offset += entity_length
+            reporter = data[offset:offset + reporter_length].decode("utf-8", errors="replace")
+            offset += reporter_length
+            yield datetime.datetime.fromtimestamp(wall / 1e9), Event(timing.Timestamp(ns), entity, levels(code),
+                                                                     reporter)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    N_ENTITIES = 10000
+    N_CHANGES = 1000000
+    statuses = list(constants.ErrorLevels)
+    names = [f"entity{i}" for i in range(N_ENTITIES)]
+    changes = [(random.choice(names), random.choice(statuses)) for _ in range(N_CHANGES)]
+    log = EventLog()
+    clock = timing.now().ns
+    t0 = time.perf_counter()
+    for name, status in changes:
+        clock += 1000000  # 1 ms apart
+        log.record(name, status, "benchmark", when=timing.Timestamp(clock))
+    t1 = time.perf_counter()
+    end = timing.Timestamp(clock)
+    recent = log.transitions(10.0, now=end)
+    t2 = time.perf_counter()
+    totals = log.time_in_states(now=end)
+    t3 = time.perf_counter()
+    print(f"Recorded {N_CHANGES} changes of {N_ENTITIES} entities in {t1 - t0:.2f} s.  "
+          f"{len(recent)} changes in the last 10 seconds found in {(t2 - t1) * 1000.0:.1f} ms, time in each status "
+          f"added up in {(t3 - t2) * 1000.0:.1f} ms", file=sys.stderr)
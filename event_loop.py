@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Runs a coroutine to the end of a deadline, and not a moment longer.  asyncio.run does not do that: when the
+# coroutine is done, it waits for every thread of the loop's default executor to finish, and those threads are doing
+# whatever could not be done without blocking, loop.getaddrinfo for every name and run_in_executor(None, ...) for the
+# netlink dump.  A call that is stuck in one of them can't be cancelled, so one slow resolver holds up the return of
+# asyncio.run, and the exit of the process too, because concurrent.futures joins its worker threads at exit.
+#
+# run gives the loop a DaemonExecutor instead.  Its threads are daemon threads, and shutting it down does not wait
+# for them, so a call that is stuck is left behind, and dies with the process.
+
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import typing
+
+# How many threads a DaemonExecutor has, at most, if it isn't told.  The same as concurrent.futures uses
+DEFAULT_WORKERS = 32
+
+
+class DaemonExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    A pool of daemon threads, which start as they are needed.  It is a ThreadPoolExecutor only because
+    loop.set_default_executor won't take anything else: it runs its own threads, which concurrent.futures does not
+    join at exit
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, name: str = "detached") -> None:
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.max_workers = max_workers
+        self.name = name
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._workers: typing.List[threading.Thread] = list()
+        self._idle = threading.Semaphore(0)
+        self._shutdown = False
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs) -> concurrent.futures.Future:
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError(f"The {self.name} executor has been shut down")
+            future = concurrent.futures.Future()
+            self._queue.put((future, fn, args, kwargs))
+            # Only start another thread if none is waiting for work
+            if not self._idle.acquire(blocking=False) and len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name=f"{self.name}-{len(self._workers)}", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+        return future
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kwargs = item
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            self._idle.release()
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        with self._lock:
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not None:
+                        item[0].cancel()
+            for _ in self._workers:
+                self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+def run(coroutine: typing.Awaitable, max_workers: int = DEFAULT_WORKERS, name: str = "detached"):
+    """
+    The same as asyncio.run, except that it does not wait for the threads that the loop's executor is still running
+
+    :param max_workers: how many threads the executor may have
+    :return: what coroutine returns
+    """
+    loop = asyncio.new_event_loop()
+    executor = DaemonExecutor(max_workers=max_workers, name=name)
+    loop.set_default_executor(executor)
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        try:
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            asyncio.set_event_loop(None)
+            loop.close()
@@ -10,7 +10,7 @@ from typing import Dict, List
 import constants
 from layer import Layer
 # Removed  Issue 29 https://github.com/jeffsilverm/nbmdt/issues/29
-from utilities import OsCliInter, os_name, the_os
+from utilities import os_name, the_os
 
 
 
@@ -128,5 +128,6 @@ class Interface(Layer):
 if __name__ == "__main__":
     if the_os == constants.OperatingSystems.LINUX:
         print(f"Using linux, the ip command is at {Interface.IP_COMMAND}")
-        results = OsCliInter.run_command([Interface.IP_COMMAND, "link", "list"])
+        import command_cache
+        results, _, _ = command_cache.run_command([Interface.IP_COMMAND, "link", "list"])
         print(f"The results of running the 'ip link list' command are\n{results}")
\ No newline at end of file
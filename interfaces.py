@@ -12,6 +12,8 @@ from pathlib import Path
 
 import netifaces  # See /usr/lib/python3/dist-packages/netifaces-0.10.4.egg-info/PKG-INFO
 
+import netlink_backend
+import sysfs_reader
 from configuration import IP_COMMAND
 
 # This should be a configuration file item - on ubuntu, the IP_COMMAND is
@@ -19,7 +21,7 @@ from configuration import IP_COMMAND
 # /usr/sbin/ip work.  But I can do that because I am a sysadmin.
 # Issue 2 https://github.com/jeffsilverm/nbmdt/issues/2
 # MARK ISSUE 2 as resolved, because I moved it to configuration.py
-NET_DEVS_PATH = Path("/sys/class/net")
+NET_DEVS_PATH = Path(sysfs_reader.SYSFS_NET)
 
 
 # There is another way to do it: use the /sys/class/net file tree:
@@ -42,6 +44,9 @@ def none_if_none(s):
 
 
 class PhysicalInterface(object):
+    # Keeps the files in /sys/class/net open from one call of link_properties to the next
+    _properties_reader: sysfs_reader.SysfsReader = None
+
     def __init__(self, intf_name: str, intf_properties_dict: dict):
         self.intf_name = intf_name
         self.intf_properties_dict = intf_properties_dict
@@ -77,19 +82,9 @@ class PhysicalInterface(object):
         :return:
         """
         interfaces_dict = dict()
-        if interface is None:
-            completed = subprocess.run(
-                [IP_COMMAND, "--details", "--oneline", "link", "list"], stdin=None,
-                input=None,
-                stdout=subprocess.PIPE, stderr=None, shell=False, timeout=None,
-                check=False)
-        else:
-            completed = subprocess.run(
-                [IP_COMMAND, "--details", "--oneline", "link", "show", "dev", interface], stdin=None,
-                input=None,
-                stdout=subprocess.PIPE, stderr=None, shell=False, timeout=None,
-                check=False)
-        completed_str = completed.stdout.decode('ascii')
+        # The links come from netlink_backend, which asks the kernel over a netlink socket if it can.  If it can't,
+        # it runs the ip --oneline link list command and parses it into the same records.  Either way, there is one
+        # dump for all of the interfaces, so asking about a single interface costs no more than asking about all.
         # The output of the ip link command looks like:
         r"""
 jeffs@jeffs-desktop:~/nbmdt (blue-sky)*$ ip --oneline --detail link list
@@ -140,33 +135,39 @@ jeffs@jeffs-desktop:/home/jeffs/python/nbmdt  (blue-sky) *  $ ip --oneline --det
 jeffs@jeffs-desktop:/home/jeffs/python/nbmdt  (blue-sky) *  $ 
 
         """
-        # Get rid of the \ characters.  They really are in there
-        completed_str = completed_str.replace("\\", "")
-        # completed str will be one line if I specified the interface name
-        # because I used the --oneline switch to the ip link show dev command
-        # But if I did not specify the interface name, then there will be one
-        # line per interface.
-        lines_lst = completed_str.split("\n")
-        for line in lines_lst:
-            link_fields = line.split()
-            # Skip empty lines
-            if len(link_fields) == 0:
+        for link in netlink_backend.dump().links:
+            interface_name: str = link["name"]
+            if interface is not None and interface != interface_name:
                 continue
-            # skip the line number, link_fields[0]
-            interface_name: str = link_fields[1]
-            # Remove the trailing colon
-            if ":" in interface_name:
-                interface_name = interface_name[:-1]
-            assert interface == interface_name, \
-                "interface_name and interface should be the same and they're not. "\
-                f"interface_name is {interface_name} and interface is {interface}."
-            property_dict = cls.parse_link_fields(link_fields)
+            property_dict = cls.properties_from_link_record(link)
             # You can use PhysicalInterface here instead of self.__init__
             # this is a classmethod
             interface_obj = PhysicalInterface(interface_name, property_dict)
             interfaces_dict[interface_name] = interface_obj
         return interfaces_dict
 
+    @staticmethod
+    def properties_from_link_record(link: dict) -> dict:
+        """
+        Convert a link record from netlink_backend into the same property dictionary that parse_link_fields makes
+        from the output of the ip link command: values are strings and the interface flags are bools.
+
+        :rtype: dict
+        """
+        property_dict = {}
+        for property_name in ["mtu", "qdisc", "state", "mode", "group", "qlen", "master"]:
+            if link.get(property_name) is not None:
+                property_dict[property_name] = str(link[property_name])
+        if link.get("link_type") is not None:
+            property_dict["link/" + link["link_type"]] = str(link["link_addr"])
+        if link.get("broadcast_addr") is not None:
+            property_dict["brd"] = str(link["broadcast_addr"])
+        for if_flag in ["BROADCAST", "LOOPBACK", "MULTICAST", "RUNNING",
+                        "UP", "DYNAMIC", "NOARP", "PROMISC", "POINTOPOINT", "SIMPLEX",
+                        "SMART", "MASTER", "SLAVE"]:
+            property_dict[if_flag] = if_flag in link["flags"]
+        return property_dict
+
     @staticmethod
     def parse_link_fields(link_fields) -> dict:
         """
@@ -198,18 +199,19 @@ jeffs@jeffs-desktop:/home/jeffs/python/nbmdt  (blue-sky) *  $
             property_dict[if_flag] = if_flag in interface_flags
         return property_dict
 
-    @staticmethod
-    def link_properties(ifname: str) -> dict:
+    @classmethod
+    def link_properties(cls, ifname: str) -> dict:
         """
         Return a dictionary of properties, keyed by prop name and the
         value of that prop.  THIS IS HIGHLY *NOT* PORTABLE - IT WILL ONLY
         RUN ON LINUX"
+        The properties are the ones in sysfs_reader.PROPERTIES, decoded into ints, bools and strs.  A property
+        that the kernel won't report, e.g. the speed of an interface that is down, is None
 
         :param ifname:  The name of the interface to report
         :return:    A dictionary of properties of the interface
         """
 
-        properties = dict()
         assert path.exists(str(NET_DEVS_PATH)), \
             f"The networks device path {NET_DEVS_PATH} does not exist." \
             "This is a serious internal software error." \
@@ -225,21 +227,11 @@ jeffs@jeffs-desktop:/home/jeffs/python/nbmdt  (blue-sky) *  $
                 print(f, file=sys.stderr)
             raise AssertionError(
                 f"Inteface {ifname} not found in pseudo file system")
-        for d in dev_properties_path.glob("*"):
-            if d.is_dir():
-                continue
-            gh = str(d)
-            prop = gh[gh.rindex("/") + 1:]
-            with open(gh, "rb") as fp:
-                contents = None  # Fallback value if fp.readlines raises an error
-                try:
-                    contents = fp.readlines()
-                except OSError as o:
-                    print(f"Property {prop} cannot be known due to OSError {str(o)}", file=sys.stderr)
-                    continue
-                except UnicodeDecodeError as u:
-                    print(f"Property {prop} in {gh} raised a UnicodeDecodeError {str(u)}", file=sys.stderr)
-                properties[prop] = contents
+        if cls._properties_reader is None:
+            cls._properties_reader = sysfs_reader.SysfsReader(sysfs_reader.PROPERTIES, root=str(NET_DEVS_PATH))
+        properties = cls._properties_reader.read(ifname)
+        if properties is None:  # The interface went away since the check above
+            raise AssertionError(f"Inteface {ifname} not found in pseudo file system")
         return properties
 
 
@@ -1,25 +1,27 @@
 import datetime
+import enum
+import ipaddress
 import sys
 import time
 import typing
-import datetime
-
-import pytest
 
 import constants
+import timing
 
 
 class Layer(object):
     """
     A layer is a layer in the OSI or TCP stack.  A layer can do the following operations
-    Record the moment the check was made, so that rates of counter changes can be recorded or logged
+    Record the moment the check was made, so that rates of counter changes can be recorded or logged.  The moment
+    is a timing.Timestamp, from the monotonic clock, so the time between two checks is right even if the wall clock
+    was changed in between
     Measure the difference between fields
     Return if two objects are equal EXCEPT for the time stamps which will likely be different
     delta time
     """
 
     def __init__(self, name: str) -> None:
-        self.time = datetime.datetime.now()
+        self.time = timing.now()
         self.name = name  # name of the entity (NIC, nameserver, route, etc.) being recorded
         self.error_status = constants.ErrorLevels.UNKNOWN
 
@@ -115,3 +117,46 @@ class Layer(object):
                 if not callable(value) ) )
 
 
+JSON_TYPES = {type(None), bool, int, float, str}  # Exactly these types, not subclasses like IntEnum
+
+
+def to_jsonable(obj, depth: int = 0):
+    """
+    Convert obj into something that json.dumps can handle: layer objects and other objects become dictionaries of
+    their attributes, enums become their names, IP addresses and anything else that json does not know become strings.
+    Attributes that start with _ and callable attributes are left out, the same as dict_from_class does.
+
+    :param obj: anything, usually a layer object or a dictionary of them
+    :param depth: how deep the recursion is.  Objects nested deeper than 16 levels are converted with str
+    :return: a dict, list, str, int, float, bool or None
+    """
+    if type(obj) in JSON_TYPES:  # Most of what is converted, so check for it the fastest way first
+        return obj
+    if isinstance(obj, (bool, str, float)):
+        return obj
+    if isinstance(obj, enum.Enum):  # Before int, because an IntEnum is an int
+        return obj.name
+    if isinstance(obj, int):
+        return obj
+    if isinstance(obj, (datetime.datetime, datetime.date, timing.Timestamp)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (ipaddress.IPv4Address, ipaddress.IPv6Address, ipaddress.IPv4Network,
+                        ipaddress.IPv6Network)):
+        return str(obj)
+    if isinstance(obj, bytes):
+        return obj.hex()
+    if depth >= 16:
+        return str(obj)
+    if isinstance(obj, dict):
+        return {str(key): to_jsonable(value, depth + 1) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [to_jsonable(value, depth + 1) for value in obj]
+    if hasattr(obj, "__dict__"):
+        return {key: to_jsonable(value, depth + 1) for key, value in vars(obj).items()
+                if not key.startswith("_") and not callable(value)}
+    if hasattr(obj, "__slots__"):  # e.g. transport.Transport.TcpConnection
+        return {key: to_jsonable(getattr(obj, key), depth + 1) for key in obj.__slots__
+                if not key.startswith("_") and hasattr(obj, key)}
+    return str(obj)
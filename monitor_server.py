@@ -0,0 +1,398 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# The RESTful server of --monitor mode.  It serves the state of each layer of the system, and its ErrorLevels, as
+# JSON.  The layers are discovered in the background every constants.MONITOR_REFRESH_INTERVAL seconds; a request is
+# always answered from the last snapshot, which was serialized when it was made, so a request handler never waits
+# on a probe and does no work other than copying bytes to the socket.
+#
+# Every response has an ETag.  A scraper that sends it back in an If-None-Match header gets a 304 with no body if
+# nothing changed.  Snapshots that are byte for byte the same as the one before keep the same ETag.  The fields that
+# are different every time a layer is discovered (diff_engine.IGNORED_FIELDS, e.g. the time) are left out, or no two
+# snapshots would ever be the same.  A snapshot is serialized in a worker thread, and swapped in when it is done.
+#
+#   GET /                   the whole system: its name, its worst status and every layer
+#   GET /layers             the name and status of every layer
+#   GET /layers/<name>      one layer, e.g. /layers/networks_4
+#   GET /health             just the worst status, for load balancers
+#   GET /rates              the rates of the counters of every interface, see counter_rates.py
+#   GET /rates/<interface>  the rates of one interface, and their history
+#   GET /churn              how often routes were added, deleted and changed, the top flapping prefixes and how
+#                           stable the default routes are, see route_churn.py
+#   GET /churn/default      just the default routes
+#   GET /dependencies       the status and reliability of every entity, after the failures of what it depends on,
+#                           see dependency_graph.py
+#
+# The rates are sampled every constants.RATE_INTERVAL seconds, more often than the layers are discovered, and their
+# responses are serialized when they are sampled.  The churn is counted as the netlink events come, and its responses
+# are serialized every constants.CHURN_INTERVAL seconds.  The dependency graph is refreshed with each discovery, in the
+# same worker thread as the snapshot: only the entities whose status changed are recomputed, unless entities came or
+# went, and then it is built again.
+
+import asyncio
+import hashlib
+import json
+import sys
+import time
+import typing
+
+import constants
+from constants import ErrorLevels
+from diff_engine import without_ignored_fields
+from layer import to_jsonable
+
+# The layers of a SystemDescription, in the order that the server lists them
+LAYER_NAMES = constants.SYSTEM_LAYERS
+
+MAX_HEADER_BYTES = 8192  # A request with more headers than this gets a 431
+REASONS = {200: "OK", 304: "Not Modified", 404: "Not Found", 405: "Method Not Allowed", 400: "Bad Request",
+           408: "Request Timeout", 431: "Request Header Fields Too Large", 503: "Service Unavailable"}
+
+
+class Resource(object):
+    """
+    A response body that was serialized ahead of time, and its ETag
+    """
+
+    def __init__(self, document) -> None:
+        self.body: bytes = json.dumps(document, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        self.etag: str = '"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+
+class MonitorSnapshot(object):
+    """
+    Everything the server knows about the system at one moment, ready to send: one Resource per path
+    """
+
+    def __init__(self, system, generation: int, dependencies: typing.Dict[str, dict] = None) -> None:
+        """
+        :param system: a utilities.SystemDescription, or anything else with the layers in LAYER_NAMES as attributes
+        and a discovery_timings dictionary of discovery.LayerTiming objects
+        :param generation: how many snapshots came before this one
+        :param dependencies: dependency_graph.DependencyGraph.documents() of system.  If None, there is no
+        /dependencies
+        """
+        self.generation = generation
+        self.time = time.time()
+        timings = getattr(system, "discovery_timings", dict())
+        layers = dict()
+        for name in LAYER_NAMES:
+            state = getattr(system, name, None)
+            timing = timings.get(name)
+            if timing is not None:
+                status = timing.status
+            else:
+                # Not discovered by discovery.DiscoveryScheduler, so all we know is whether there is anything there
+                status = ErrorLevels.UNKNOWN if state is None else ErrorLevels.NORMAL
+            layers[name] = {"status": status,
+                            "error": None if timing is None else timing.error,
+                            "state": state}
+        self.status: ErrorLevels = max(layer["status"] for layer in layers.values())
+        layers = without_ignored_fields(to_jsonable(layers))
+        system_name = getattr(system, "system_name", None)
+        self.resources: typing.Dict[str, Resource] = {
+            "/": Resource({"system_name": system_name, "status": self.status.name, "layers": layers}),
+            "/layers": Resource({name: layer["status"] for name, layer in layers.items()}),
+            "/health": Resource({"system_name": system_name, "status": self.status.name})}
+        for name, layer in layers.items():
+            self.resources["/layers/" + name] = Resource(layer)
+        if dependencies is not None:
+            self.resources["/dependencies"] = Resource(dependencies)
+
+    def same_as(self, other: "MonitorSnapshot") -> bool:
+        return other is not None and self.resources.keys() == other.resources.keys() and \
+            all(resource.etag == other.resources[path].etag for path, resource in self.resources.items())
+
+
+class MonitorServer(object):
+    """
+    An asyncio HTTP/1.1 server.  Requests are served from the last MonitorSnapshot, and a background task makes a new
+    snapshot every refresh_interval seconds by running discover in a worker thread
+    """
+
+    def __init__(self, discover: typing.Callable[[], typing.Any], port: int = constants.PORT, host: str = "",
+                 initial=None, refresh_interval: float = constants.MONITOR_REFRESH_INTERVAL,
+                 max_connections: int = constants.MONITOR_MAX_CONNECTIONS,
+                 request_timeout: float = constants.MONITOR_REQUEST_TIMEOUT, rates=None, churn=None,
+                 dependencies: bool = False) -> None:
+        """
+        :param discover: a callable that returns a new SystemDescription, e.g. utilities.SystemDescription.discover
+        :param port: the TCP port to listen on.  0 picks a free port, see the port attribute after start.  Give a
+        host too, because each address family gets a different free port
+        :param host: the address to listen on.  "" is every address
+        :param initial: a SystemDescription that was already discovered.  If None, then the first snapshot is
+        discovered before the server starts to listen
+        :param refresh_interval: seconds between the end of one discovery and the start of the next
+        :param max_connections: more connections than this at the same time get a 503 and are closed
+        :param request_timeout: seconds a client has to send a request before it is disconnected
+        :param rates: a counter_rates.RateEngine to sample and serve under /rates.  If None, there is no /rates
+        :param churn: a route_churn.RouteChurn to serve under /churn.  If None, there is no /churn
+        :param dependencies: if True, keep a dependency_graph.DependencyGraph of the system and serve it under
+        /dependencies
+        """
+        self.discover = discover
+        self.port = port
+        self.host = host
+        self.initial = initial
+        self.refresh_interval = refresh_interval
+        self.max_connections = max_connections
+        self.request_timeout = request_timeout
+        self.snapshot: MonitorSnapshot = None
+        self.rates = rates
+        self.rate_resources: typing.Dict[str, Resource] = dict()
+        self.churn = churn
+        self.churn_resources: typing.Dict[str, Resource] = dict()
+        self.dependencies = dependencies
+        self.graph = None  # A dependency_graph.DependencyGraph, if dependencies
+        self._graph_keys: typing.Set[str] = set()
+        self.connections: int = 0
+        self.requests: int = 0
+        self.not_modified: int = 0
+        self.rejected: int = 0
+        self._server: asyncio.AbstractServer = None
+        self._refresh_task: asyncio.Task = None
+        self._rates_task: asyncio.Task = None
+        self._churn_task: asyncio.Task = None
+
+    def update(self, system) -> MonitorSnapshot:
+        """
+        Make a new snapshot from system.  If it is the same as the last one, keep the last one, so that its ETags
+        stay the same
+        """
+        return self._swap(self._snapshot(system, self._next_generation()))
+
+    async def update_async(self, system) -> MonitorSnapshot:
+        """
+        The same as update, but the snapshot is serialized in a worker thread, so that requests aren't held up
+        """
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, self._snapshot, system, self._next_generation())
+        return self._swap(snapshot)
+
+    def _snapshot(self, system, generation: int) -> MonitorSnapshot:
+        return MonitorSnapshot(system, generation,
+                               dependencies=self._refresh_graph(system) if self.dependencies else None)
+
+    def _refresh_graph(self, system) -> typing.Dict[str, dict]:
+        """
+        Bring the dependency graph up to date with system
+
+        :return: the documents of the graph
+        """
+        import dependency_graph
+        keys = {key for key, _ in dependency_graph.system_entities(system)}
+        if self.graph is None or keys != self._graph_keys:
+            self.graph = dependency_graph.DependencyGraph.from_system_description(system)
+            self._graph_keys = keys
+        else:
+            self.graph.refresh(system)
+        return self.graph.documents()
+
+    def _next_generation(self) -> int:
+        return 0 if self.snapshot is None else self.snapshot.generation + 1
+
+    def _swap(self, snapshot: MonitorSnapshot) -> MonitorSnapshot:
+        if not snapshot.same_as(self.snapshot):
+            self.snapshot = snapshot
+        return self.snapshot
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self.initial is None:
+            self.initial = await loop.run_in_executor(None, self.discover)
+        await self.update_async(self.initial)
+        self._server = await asyncio.start_server(self._handle_connection, host=self.host or None, port=self.port,
+                                                  limit=MAX_HEADER_BYTES, backlog=self.max_connections)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._refresh_task = asyncio.ensure_future(self._refresh())
+        if self.rates is not None:
+            self._rates_task = asyncio.ensure_future(self._sample_rates())
+        if self.churn is not None:
+            self._churn_task = asyncio.ensure_future(self._publish_churn())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self._rates_task is not None:
+            self._rates_task.cancel()
+        if self._churn_task is not None:
+            self._churn_task.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        print(f"Monitoring on port {self.port}", file=sys.stderr)
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def run(self) -> None:
+        """
+        Serve until interrupted
+        """
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+    async def _refresh(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                system = await loop.run_in_executor(None, self.discover)
+            except Exception as e:  # The last snapshot is still good, serve it until the next refresh works
+                print(f"Refreshing the monitor snapshot raised {repr(e)}", file=sys.stderr)
+                continue
+            await self.update_async(system)
+
+    async def _sample_rates(self) -> None:
+        while True:
+            try:
+                # Reading the counters takes microseconds per interface, so it is not worth a worker thread
+                self.rates.sample()
+                self.rate_resources = {path: Resource(document) for path, document in self.rates.documents().items()}
+            except Exception as e:
+                print(f"Sampling the interface counters raised {repr(e)}", file=sys.stderr)
+            await asyncio.sleep(self.rates.interval)
+
+    async def _publish_churn(self) -> None:
+        while True:
+            try:
+                # The counting is done by the netlink event thread, this only finds the top prefixes
+                self.churn_resources = {path: Resource(document) for path, document in self.churn.documents().items()}
+            except Exception as e:
+                print(f"Publishing the route churn raised {repr(e)}", file=sys.stderr)
+            await asyncio.sleep(self.churn.interval)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            if self.connections > self.max_connections:
+                self.rejected += 1
+                # Read the request first.  Closing a socket with unread data in it resets the connection, and then
+                # the client never sees the 503
+                await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=self.request_timeout)
+                self._respond(writer, 503, close=True)
+                await writer.drain()
+                return
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=self.request_timeout)
+                except asyncio.IncompleteReadError:
+                    break  # The client closed the connection between requests
+                except asyncio.TimeoutError:
+                    break
+                except asyncio.LimitOverrunError:
+                    self._respond(writer, 431, close=True)
+                    break
+                keep_alive = self._handle_request(head, writer)
+                await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    def _handle_request(self, head: bytes, writer: asyncio.StreamWriter) -> bool:
+        """
+        Answer one request
+
+        :param head: the request line and the headers
+        :return: True if the connection should be kept open for another request
+        """
+        self.requests += 1
+        lines = head.decode("latin-1").split("\r\n")
+        request_line = lines[0].split()
+        if len(request_line) != 3:
+            self._respond(writer, 400, close=True)
+            return False
+        method, target, version = request_line
+        headers = dict()
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        if method not in ("GET", "HEAD"):
+            self._respond(writer, 405, close=not keep_alive, extra_headers={"Allow": "GET, HEAD"})
+            return keep_alive
+        path = target.split("?", 1)[0].rstrip("/") or "/"
+        snapshot = self.snapshot
+        if snapshot is None:
+            self._respond(writer, 503, close=not keep_alive)
+            return keep_alive
+        resource = snapshot.resources.get(path)
+        if resource is None:
+            resource = self.rate_resources.get(path)
+        if resource is None:
+            resource = self.churn_resources.get(path)
+        if resource is None:
+            self._respond(writer, 404, close=not keep_alive)
+            return keep_alive
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None and (if_none_match == "*" or resource.etag in
+                                          [tag.strip() for tag in if_none_match.split(",")]):
+            self.not_modified += 1
+            self._respond(writer, 304, close=not keep_alive, etag=resource.etag)
+        else:
+            self._respond(writer, 200, close=not keep_alive, etag=resource.etag,
+                          body=resource.body if method == "GET" else b"", length=len(resource.body))
+        return keep_alive
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: int, close: bool, etag: str = None, body: bytes = b"",
+                 length: int = None, extra_headers: typing.Dict[str, str] = None) -> None:
+        headers = [f"HTTP/1.1 {status} {REASONS[status]}"]
+        if status != 304:
+            headers.append("Content-Type: application/json")
+            headers.append(f"Content-Length: {len(body) if length is None else length}")
+        if etag is not None:
+            headers.append(f"ETag: {etag}")
+            headers.append("Cache-Control: no-cache")
+        if extra_headers is not None:
+            headers.extend(f"{key}: {value}" for key, value in extra_headers.items())
+        if close:
+            headers.append("Connection: close")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+
+
+if __name__ == "__main__":
+    import http.client
+    import threading
+
+    class Fake(object):
+        def __init__(self):
+            self.system_name = "fake"
+            self.discovery_timings = dict()
+            self.networks_4 = {"default": {"gateway": "192.0.2.1"}}
+
+    server = MonitorServer(discover=Fake, port=0, host="127.0.0.1", refresh_interval=1.0)
+    started = threading.Event()
+
+    def serve():
+        async def main():
+            await server.start()
+            started.set()
+            await asyncio.sleep(3600)
+
+        asyncio.run(main())
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+    connection = http.client.HTTPConnection("127.0.0.1", server.port)
+    n = 2000
+    t0 = time.monotonic()
+    etag = None
+    for i in range(n):
+        connection.request("GET", "/", headers={} if etag is None else {"If-None-Match": etag})
+        response = connection.getresponse()
+        response.read()
+        etag = response.getheader("ETag")
+    print(f"{n} requests on one connection in {time.monotonic() - t0:.3f} seconds, "
+          f"{server.not_modified} were 304 Not Modified")
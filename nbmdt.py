@@ -3,27 +3,21 @@
 #
 # The Network Boot Monitor Diagnostic tool
 #
+# Only argparse and constants are imported when nbmdt starts.  The layers (utilities imports application,
+# presentation, session, transport, routes, datalink and physical) are imported by main once the arguments have been
+# parsed, and what only one mode needs (the monitor server, the snapshot format, the diff engine...) is imported by
+# the method of that mode, so --help is instant and --boot doesn't pay for the monitor.  No module prints or probes
+# anything when it is imported.  See startup_benchmark.py
+#
 import argparse
 import platform
 import sys
 from typing import Dict
 from typing import Tuple, List
 
-import application
 import constants
-import datalink
-import physical
-import presentation
-import routes
-import session
-import transport
-import utilities
 
 DEBUG = True
-try:
-    print("Testing the __file__ special variable: " + __file__, file=sys.stderr)
-except Exception as e:  # if anything goes wrong
-    print("Testing the __file__ special variable FAILED, exception is " + str(e), file=sys.stderr)
 # Issue 29 moved the definitions of
 # type_application_dict, type_presentation_dict, type_session_dict
 # type_transport_dict, type_network_4_dict, type_datalink_dict, type_interface_dict
@@ -74,11 +68,30 @@ def main(args: List[str] = None):
 
     if options.debug:
         print(f"The debug option was set.  Mode is {str(mode)} coded as {mode}", file=sys.stderr)
-    # Get what the system currently actually is
-    # Issue 29 https://github.com/jeffsilverm/nbmdt/issues/29
-    current_system: utilities.SystemDescription = utilities.SystemDescription.discover()
-    if options.debug and current_system.applications["applications"] != "Mocked":
-        print("""WARNING: debugging and current_system.applications["applications"] != "Mocked" """, file=sys.stderr)
+    if mode == constants.Modes.MONITOR:
+        import command_cache
+        import netlink_state
+        # The monitor discovers the system over and over, so keep a model of the links, addresses and routes that
+        # netlink events keep current, rather than dumping them from the kernel every time.  The same events make
+        # the cached output of the ip command and its friends stale
+        state_cache = netlink_state.start_cache()
+        if state_cache is not None:
+            command_cache.CACHE.watch(state_cache)
+    import utilities
+    if mode in (constants.Modes.BOOT, constants.Modes.TEST):
+        # The boot checks and the reachability probes probe the system themselves, and they have to be quick, so don't
+        # discover every layer first
+        current_system: utilities.SystemDescription = utilities.SystemDescription()
+    else:
+        # Get what the system currently actually is
+        # Issue 29 https://github.com/jeffsilverm/nbmdt/issues/29
+        current_system: utilities.SystemDescription = utilities.SystemDescription.discover()
+        if options.debug and current_system.applications["applications"] != "Mocked":
+            print("""WARNING: debugging and current_system.applications["applications"] != "Mocked" """,
+                  file=sys.stderr)
+        if options.debug:
+            for timing in current_system.discovery_timings.values():
+                print(f"Discovery timing {timing}", file=sys.stderr)
     try:
         if mode == constants.Modes.BOOT:
             current_system.boot()
@@ -87,9 +100,9 @@ def main(args: List[str] = None):
             if not hasattr(options, 'configuration_filename') or options.configuration_filename is None:
                 raise ValueError(
                     "You did not specify a configuration filename when you asked nbmdt to diagnose a system")
-            current_system.diagnose(options.configuration_filename)
+            current_system.diagnose(options.configuration_filename, layers=options.layers)
         elif mode == constants.Modes.NOMINAL:
-            current_system.nominal(options.configuration_filename)
+            current_system.nominal(options.nominal_filename)
         elif mode == constants.Modes.TEST:
             current_system.test(options.test_specification)
         elif mode == constants.Modes.MONITOR:
@@ -180,8 +193,8 @@ def arg_parser(args) -> Tuple:
                        const=constants.Modes.BOOT, dest="boot")
     group.add_argument('--monitor', '-m',
                        help="Use while system is running.  Presents a RESTful API that a client can use to "
-                            "monitor the state of the network on a host.  ",
-                       action="store", type=int, dest="monitor_port")
+                            f"monitor the state of the network on a host.  The default PORT is {constants.PORT}",
+                       nargs='?', const=constants.PORT, action="store", type=int, dest="monitor_port")
     # Issue 27 https://github.com/jeffsilverm/nbmdt/issues/27
     group.add_argument('--diagnose', '-d',
                        help="Use when a problem is detected.  Compares the current state of the system "
@@ -194,7 +207,11 @@ def arg_parser(args) -> Tuple:
     group.add_argument('--nominal', '-N', help="Use when the system is working properly to capture the current state."
                                                "This state will serve as a reference for future testing.  "
                                                "CONFIGURATION_FILE is required", action="store",
-                       dest="configuration_filename")
+                       dest="nominal_filename")
+    parser.add_argument("--layers", help="With --diagnose, the layers to compare, separated by commas, e.g. "
+                                         "networks_4,datalinks.  Only these layers are read from CONFIGURATION_FILE.  "
+                                         f"The layers are {','.join(constants.SYSTEM_LAYERS)}",
+                        type=lambda layers: layers.split(","), default=None, dest="layers")
     parser.add_argument("--debug", default=False, action="store_true", dest="debug")
 
     try:
@@ -208,6 +225,12 @@ def arg_parser(args) -> Tuple:
               f"and the exception information is {str(s)}")
         raise SystemExit(s)
 
+    if parsed_options.layers is not None:
+        unknown_layers = set(parsed_options.layers) - set(constants.SYSTEM_LAYERS)
+        if unknown_layers:
+            parser.error(f"--layers has {','.join(sorted(unknown_layers))}, which are not layers.  The layers are "
+                         f"{','.join(constants.SYSTEM_LAYERS)}")
+
     if parsed_options.boot is not None:
         mode_ = constants.Modes.BOOT
     elif parsed_options.configuration_filename is not None:
@@ -216,7 +239,7 @@ def arg_parser(args) -> Tuple:
         mode_ = constants.Modes.TEST
     elif parsed_options.monitor_port is not None:
         mode_ = constants.Modes.MONITOR
-    elif parsed_options.configuration_filename is not None:
+    elif parsed_options.nominal_filename is not None:
         mode_ = constants.Modes.NOMINAL
     else:
         raise AssertionError(f"parsed_options did not have a way to set mode\n{dir(parsed_options)}")
@@ -252,34 +275,15 @@ def arg_parser(args) -> Tuple:
 # As of 2018-07-29, there is a bug: the --debug option is not handled at all
 
 # This method was moved from constants.py
-def discover() -> utilities.SystemDescription:
+def discover() -> 'utilities.SystemDescription':
     """
+    The layers are discovered concurrently, see utilities.SystemDescription.discover
 
     :return: a utilities.SystemDescription object.
     """
+    import utilities
 
-    applications: Dict = application.Application.discover()
-    presentations = presentation.Presentation.discover()
-    sessions = session.Session.discover()
-    transports = transport.Transport.discover()
-    networks_4 = routes.IPv4Route.discover()
-    networks_6 = routes.IPv6Route.discover()
-    datalinks = datalink.DataLink.discover()
-    physicals = physical.Physical.discover()
-    name: str = platform.node()
-
-    my_system: utilities.SystemDescription = utilities.SystemDescription(
-        applications=applications,
-        presentations=presentations,
-        sessions=sessions,
-        transports=transports,
-        networks_6=networks_6,
-        networks_4=networks_4,
-        datalinks=datalinks,
-        physicals=physicals,
-        system_name=name
-    )
-    return my_system
+    return utilities.SystemDescription.discover()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,431 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This module gets the links, addresses and routes of this system.  There are two backends that return exactly the
+# same records, so that DataLink, IPv4Route, IPv6Route and friends can be filled from either one:
+#
+#   NetlinkBackend      asks the kernel directly over an RTNETLINK socket, using pyroute2 (see netlink_poc.py)
+#   IpCommandBackend    runs the ip command and parses its text output.  This is the fallback if pyroute2 isn't
+#                       installed or the netlink socket can't be used
+#
+# A record is a dictionary keyed by the same words that the ip command uses, so "dev", "via", "mtu", "qdisc", etc.
+# Link records look like:
+#   {"index": 4, "name": "eth0", "flags": ["BROADCAST", "MULTICAST", "UP", "LOWER_UP"], "mtu": 1400,
+#    "qdisc": "pfifo_fast", "state": "UP", "mode": "DEFAULT", "group": "default", "qlen": 1000, "master": None,
+#    "link_type": "ether", "link_addr": "02:fc:00:00:00:01", "broadcast_addr": "ff:ff:ff:ff:ff:ff"}
+# Address records look like:
+#   {"index": 4, "dev": "eth0", "family": "inet", "address": "192.0.2.2", "prefixlen": 24, "broadcast": "192.0.2.255",
+#    "scope": "global", "label": "eth0", "flags": []}
+# Route records look like:
+#   {"family": "inet", "type": "unicast", "destination": "default", "via": "192.0.2.1", "dev": "eth0",
+#    "proto": "static", "scope": "global", "metric": 100, "src": None, "table": 254, "linkdown": False,
+#    "pref": None, "flags": [], "nexthops": []}
+
+import socket
+import sys
+import threading
+import time
+import typing
+
+import configuration
+import osclinter
+import route_parser
+
+try:
+    from pyroute2 import IPRoute
+    from pyroute2.netlink.exceptions import NetlinkError
+except ImportError:
+    # Not fatal, the IpCommandBackend will be used instead
+    IPRoute = None
+    NetlinkError = OSError
+
+# How long, in seconds, a dump is reused.  The layers are discovered concurrently (see discovery.py), so this lets
+# the datalink, IPv4 route and IPv6 route probes of one discovery pass share a single dump.
+DUMP_MAX_AGE: float = 1.0
+
+RT_TABLE_MAIN = 254  # The table that "ip route show" shows
+
+FAMILY_NAMES = {socket.AF_INET: "inet", socket.AF_INET6: "inet6"}
+
+# From /etc/iproute2/rt_protos
+PROTO_NAMES = {0: "unspec", 1: "redirect", 2: "kernel", 3: "boot", 4: "static", 8: "gated", 9: "ra", 10: "mrt",
+               11: "zebra", 12: "bird", 13: "dnrouted", 14: "xorp", 15: "ntk", 16: "dhcp", 42: "babel", 186: "bgp",
+               187: "isis", 188: "ospf", 189: "rip", 192: "eigrp"}
+# From /etc/iproute2/rt_scopes
+SCOPE_NAMES = {0: "global", 200: "site", 253: "link", 254: "host", 255: "nowhere"}
+# From linux/rtnetlink.h
+ROUTE_TYPE_NAMES = {0: "unspec", 1: "unicast", 2: "local", 3: "broadcast", 4: "anycast", 5: "multicast",
+                    6: "blackhole", 7: "unreachable", 8: "prohibit", 9: "throw", 10: "nat", 11: "xresolve"}
+ROUTE_PREF_NAMES = {0: "medium", 1: "high", 3: "low"}  # IPv6 router preference, RFC 4191
+ROUTE_FLAG_NAMES = {0x1: "dead", 0x2: "pervasive", 0x4: "onlink", 0x10: "linkdown"}
+RTNH_F_LINKDOWN = 0x10
+# From linux/if.h, in the order the ip command prints them
+LINK_FLAG_NAMES = [(0x8, "LOOPBACK"), (0x2, "BROADCAST"), (0x10, "POINTOPOINT"), (0x1000, "MULTICAST"),
+                   (0x80, "NOARP"), (0x200, "ALLMULTI"), (0x100, "PROMISC"), (0x20, "NOTRAILERS"), (0x1, "UP"),
+                   (0x10000, "LOWER_UP"), (0x20000, "DORMANT"), (0x400, "MASTER"), (0x800, "SLAVE"),
+                   (0x4, "DEBUG"), (0x8000, "DYNAMIC"), (0x4000, "AUTOMEDIA"), (0x2000, "PORTSEL"),
+                   (0x40000, "ECHO")]
+# From linux/if_addr.h.  The ip command prints "dynamic" for an address that is not IFA_F_PERMANENT
+ADDRESS_FLAG_NAMES = [(0x01, "secondary"), (0x40, "tentative"), (0x20, "deprecated"), (0x10, "home"),
+                      (0x02, "nodad"), (0x04, "optimistic"), (0x08, "dadfailed"), (0x100, "mngtmpaddr"),
+                      (0x200, "noprefixroute"), (0x400, "autojoin"), (0x800, "stable-privacy")]
+IFA_F_PERMANENT = 0x80
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+# From linux/if_arp.h, only the common ones
+LINK_TYPE_NAMES = {1: "ether", 772: "loopback", 768: "ipip", 776: "sit", 778: "gre", 801: "ieee802.11",
+                   823: "ip6gre", 65534: "none"}
+LINK_MODE_NAMES = {0: "DEFAULT", 1: "DORMANT"}
+
+
+class LinkStateDump(object):
+    """
+    Everything one backend found in one pass: lists of link, address and route records
+    """
+
+    def __init__(self, links: typing.List[dict], addresses: typing.List[dict], routes: typing.List[dict],
+                 backend: str) -> None:
+        self.links = links
+        self.addresses = addresses
+        self.routes = routes
+        self.backend = backend  # name of the backend that made this dump
+        self.time = time.monotonic()
+
+    def routes_for(self, family: str) -> typing.List[dict]:
+        """
+        :param family: "inet" or "inet6", the way the ip command spells them
+        :return: the route records of that family
+        """
+        assert family == "inet" or family == "inet6", f"family is {family}, should be 'inet' or 'inet6'"
+        return [r for r in self.routes if r["family"] == family]
+
+    def addresses_for(self, family: str = None) -> typing.List[dict]:
+        return [a for a in self.addresses if family is None or a["family"] == family]
+
+
+class LinkStateBackend(object):
+    """
+    The things that both backends have in common.  Subclasses override _dump
+    """
+    name = "abstract"
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._last_dump: LinkStateDump = None
+
+    def dump(self, max_age: float = DUMP_MAX_AGE) -> LinkStateDump:
+        """
+        Return the links, addresses and routes of this system.  If another caller got a dump less than max_age seconds
+        ago, then return that one instead of asking again.
+
+        :param max_age: seconds.  0 forces a new dump
+        """
+        with self._lock:
+            if self._last_dump is None or time.monotonic() - self._last_dump.time >= max_age:
+                self._last_dump = self._dump()
+            return self._last_dump
+
+    def _dump(self) -> LinkStateDump:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class NetlinkBackend(LinkStateBackend):
+    """
+    Get links, addresses and routes with RTNETLINK dump requests.  There is no fork and no text parsing.  The
+    netlink socket is opened once and reused for every dump
+    """
+    name = "netlink"
+
+    def __init__(self) -> None:
+        super().__init__()
+        if IPRoute is None:
+            raise ImportError("pyroute2 is not installed, so the netlink backend is not available")
+        self._ipr = IPRoute()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._ipr is not None:
+                self._ipr.close()
+                self._ipr = None
+
+    def _dump(self) -> LinkStateDump:
+        if self._ipr is None:
+            self._ipr = IPRoute()
+        links = [self.link_record(msg) for msg in self._ipr.get_links()]
+        names = {link["index"]: link["name"] for link in links}
+        addresses = [self.address_record(msg, names) for msg in self._ipr.get_addr()]
+        routes = [self.route_record(msg, names) for msg in self._ipr.get_routes()]
+        routes = [r for r in routes if r["table"] == RT_TABLE_MAIN]
+        return LinkStateDump(links=links, addresses=addresses, routes=routes, backend=self.name)
+
+    @staticmethod
+    def link_record(msg) -> dict:
+        """
+        :param msg: an RTM_NEWLINK message, as pyroute2 returns it
+        :return: a link record
+        """
+        flags = msg["flags"]
+        flag_names = [name for (bit, name) in LINK_FLAG_NAMES if flags & bit]
+        # This is what the ip command does: an interface that is up but not running has no carrier
+        if flags & IFF_UP and not flags & IFF_RUNNING:
+            flag_names.insert(0, "NO-CARRIER")
+        group = msg.get_attr("IFLA_GROUP")
+        return {"index": msg["index"],
+                "name": msg.get_attr("IFLA_IFNAME"),
+                "flags": flag_names,
+                "mtu": msg.get_attr("IFLA_MTU"),
+                "qdisc": msg.get_attr("IFLA_QDISC"),
+                "state": msg.get_attr("IFLA_OPERSTATE"),
+                "mode": LINK_MODE_NAMES.get(msg.get_attr("IFLA_LINKMODE"), "DEFAULT"),
+                "group": "default" if not group else str(group),
+                "qlen": msg.get_attr("IFLA_TXQLEN"),
+                "master": msg.get_attr("IFLA_MASTER"),
+                "link_type": LINK_TYPE_NAMES.get(msg["ifi_type"], str(msg["ifi_type"])),
+                "link_addr": msg.get_attr("IFLA_ADDRESS"),
+                "broadcast_addr": msg.get_attr("IFLA_BROADCAST")}
+
+    @staticmethod
+    def address_record(msg, names: typing.Dict[int, str]) -> dict:
+        """
+        :param msg: an RTM_NEWADDR message, as pyroute2 returns it
+        :param names: a dictionary of interface names keyed by interface index
+        :return: an address record
+        """
+        family = FAMILY_NAMES.get(msg["family"], str(msg["family"]))
+        # For point to point links, IFA_LOCAL is this end and IFA_ADDRESS is the other end
+        address = msg.get_attr("IFA_LOCAL") or msg.get_attr("IFA_ADDRESS")
+        # IFA_FLAGS has all 32 bits of the flags, the flags in the header are only 8 bits
+        ifa_flags = msg.get_attr("IFA_FLAGS")
+        if ifa_flags is None:
+            ifa_flags = msg["flags"]
+        flag_names = [name for (bit, name) in ADDRESS_FLAG_NAMES if ifa_flags & bit]
+        if not ifa_flags & IFA_F_PERMANENT:
+            flag_names.append("dynamic")
+        return {"index": msg["index"],
+                "dev": names.get(msg["index"], str(msg["index"])),
+                "family": family,
+                "address": address,
+                "prefixlen": msg["prefixlen"],
+                "broadcast": msg.get_attr("IFA_BROADCAST"),
+                "scope": SCOPE_NAMES.get(msg["scope"], str(msg["scope"])),
+                "label": msg.get_attr("IFA_LABEL"),
+                "flags": flag_names}
+
+    @staticmethod
+    def route_record(msg, names: typing.Dict[int, str]) -> dict:
+        """
+        :param msg: an RTM_NEWROUTE message, as pyroute2 returns it
+        :param names: a dictionary of interface names keyed by interface index
+        :return: a route record
+        """
+        family = FAMILY_NAMES.get(msg["family"], str(msg["family"]))
+        dst_len = msg["dst_len"]
+        dst = msg.get_attr("RTA_DST")
+        if dst_len == 0:
+            destination = "default"
+        elif (family == "inet" and dst_len == 32) or (family == "inet6" and dst_len == 128):
+            destination = dst  # The ip command does not show the prefix length of a host route
+        else:
+            destination = f"{dst}/{dst_len}"
+        nexthops = []
+        for nh in msg.get_attr("RTA_MULTIPATH") or []:
+            nexthops.append({"via": nh.get_attr("RTA_GATEWAY"), "dev": names.get(nh["oif"], str(nh["oif"])),
+                             "weight": nh["hops"] + 1,
+                             "flags": [name for (bit, name) in ROUTE_FLAG_NAMES.items() if nh["flags"] & bit]})
+        oif = msg.get_attr("RTA_OIF")
+        table = msg.get_attr("RTA_TABLE")
+        return {"family": family,
+                "type": ROUTE_TYPE_NAMES.get(msg["type"], str(msg["type"])),
+                "destination": destination,
+                "via": msg.get_attr("RTA_GATEWAY"),
+                "dev": names.get(oif, str(oif)) if oif is not None else None,
+                "proto": PROTO_NAMES.get(msg["proto"], str(msg["proto"])),
+                "scope": SCOPE_NAMES.get(msg["scope"], str(msg["scope"])),
+                "metric": msg.get_attr("RTA_PRIORITY") or 0,
+                "src": msg.get_attr("RTA_PREFSRC"),
+                "table": table if table is not None else msg["table"],
+                "linkdown": bool(msg["flags"] & RTNH_F_LINKDOWN),
+                "pref": ROUTE_PREF_NAMES.get(msg.get_attr("RTA_PREF")) if family == "inet6" else None,
+                "flags": [name for (bit, name) in ROUTE_FLAG_NAMES.items() if msg["flags"] & bit],
+                "nexthops": nexthops}
+
+
+class IpCommandBackend(LinkStateBackend):
+    """
+    Get links, addresses and routes by running the ip command and parsing what it prints
+    """
+    name = "ip"
+
+    # Keywords in the output of the ip command that are followed by a value
+    LINK_VALUE_KEYWORDS = {"mtu", "qdisc", "state", "mode", "group", "qlen", "master", "brd", "link-netnsid"}
+    ADDRESS_VALUE_KEYWORDS = {"brd", "scope", "valid_lft", "preferred_lft", "peer", "metric", "label"}
+
+    def __init__(self, ip_command: str = configuration.IP_COMMAND) -> None:
+        super().__init__()
+        self.ip_command = ip_command
+
+    def run_ip(self, args: typing.List[str]) -> str:
+        stdout, _, _ = osclinter.OsCliInter.run_command([self.ip_command] + args)
+        return stdout
+
+    def _dump(self) -> LinkStateDump:
+        # The four commands are independent, so they run at the same time
+        outputs = osclinter.OsCliInter.run_commands([[self.ip_command] + args for args in [
+            ["--oneline", "link", "list"], ["--oneline", "address", "list"],
+            ["--family", "inet", "route", "list"], ["--family", "inet6", "route", "list"]]])
+        for output in outputs:
+            if isinstance(output, Exception):
+                raise output
+        link_output, address_output, inet_output, inet6_output = [stdout for stdout, _, _ in outputs]
+        links = [self.parse_link_line(line) for line in link_output.split("\n") if len(line.strip()) > 0]
+        addresses = [self.parse_address_line(line) for line in address_output.split("\n") if len(line.strip()) > 0]
+        routes = []
+        for family, output in [("inet", inet_output), ("inet6", inet6_output)]:
+            # parse_routes, not parse_route_line, because the next hops of a multipath route are on lines of their own
+            routes.extend(route_parser.parse_routes(output.split("\n"), family))
+        return LinkStateDump(links=links, addresses=addresses, routes=routes, backend=self.name)
+
+    @classmethod
+    def parse_link_line(cls, line: str) -> dict:
+        """
+        :param line: one line of the output of the ip --oneline link list command, e.g.
+        4: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1400 qdisc pfifo_fast state UP mode DEFAULT group default
+        qlen 1000\\    link/ether 02:fc:00:00:00:01 brd ff:ff:ff:ff:ff:ff
+        :return: a link record
+        """
+        # The \ characters really are in there, they mark where the line would have been broken
+        fields = line.replace("\\", " ").split()
+        # A VLAN looks like eth0.10@eth0: so drop everything from the @ on
+        name = fields[1].rstrip(":").split("@")[0]
+        record = {"index": int(fields[0].rstrip(":")), "name": name,
+                  "flags": fields[2].strip("<>").split(","), "mtu": None, "qdisc": None, "state": None,
+                  "mode": None, "group": None, "qlen": None, "master": None, "link_type": None, "link_addr": None,
+                  "broadcast_addr": None}
+        i = 3
+        while i < len(fields):
+            keyword = fields[i]
+            if keyword.startswith("link/"):
+                record["link_type"] = keyword[len("link/"):]
+                if i + 1 < len(fields) and fields[i + 1] not in cls.LINK_VALUE_KEYWORDS:
+                    record["link_addr"] = fields[i + 1]
+                    i += 1
+            elif keyword in cls.LINK_VALUE_KEYWORDS and i + 1 < len(fields):
+                value = fields[i + 1]
+                if keyword == "brd":
+                    record["broadcast_addr"] = value
+                elif keyword in ("mtu", "qlen"):
+                    record[keyword] = int(value)
+                elif keyword != "link-netnsid":
+                    record[keyword] = value
+                i += 1
+            i += 1
+        return record
+
+    @classmethod
+    def parse_address_line(cls, line: str) -> dict:
+        """
+        :param line: one line of the output of the ip --oneline address list command, e.g.
+        2: eth0    inet 192.0.2.2/24 brd 192.0.2.255 scope global eth0\\       valid_lft forever preferred_lft forever
+        :return: an address record
+        """
+        fields = line.replace("\\", " ").split()
+        address, _, prefixlen = fields[3].partition("/")
+        record = {"index": int(fields[0].rstrip(":")), "dev": fields[1], "family": fields[2], "address": address,
+                  "prefixlen": int(prefixlen) if prefixlen else (32 if fields[2] == "inet" else 128),
+                  "broadcast": None, "scope": None, "label": None, "flags": []}
+        i = 4
+        while i < len(fields):
+            keyword = fields[i]
+            if keyword in cls.ADDRESS_VALUE_KEYWORDS and i + 1 < len(fields):
+                if keyword == "brd":
+                    record["broadcast"] = fields[i + 1]
+                elif keyword in ("scope", "label"):
+                    record[keyword] = fields[i + 1]
+                i += 1
+            elif keyword.startswith(fields[1]):
+                # IPv4 addresses end with the label, which is the device name or something like eth0:1
+                record["label"] = keyword
+            else:
+                record["flags"].append(keyword)
+            i += 1
+        return record
+
+    @classmethod
+    def parse_route_line(cls, line: str, family: str) -> dict:
+        """
+        :param line: one line of the output of the ip route list command, e.g.
+        10.0.3.0/24 dev lxcbr0 proto kernel scope link src 10.0.3.1 linkdown
+        :param family: "inet" or "inet6"
+        :return: a route record
+        """
+        return route_parser.parse_route_line(line, family)
+
+    def iter_routes(self, family: str = "inet") -> typing.Iterator[dict]:
+        """
+        :return: the routes of family, each one as soon as the ip command has printed it.  For tables too big to dump
+        """
+        return route_parser.stream_routes(family, ip_command=self.ip_command)
+
+
+_backend: LinkStateBackend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> LinkStateBackend:
+    """
+    :return: the backend that everything in this process shares.  This is the NetlinkBackend if it can be used,
+    otherwise the IpCommandBackend
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            try:
+                _backend = NetlinkBackend()
+            except (ImportError, OSError) as e:
+                print(f"The netlink backend is not available ({str(e)}), using the ip command instead",
+                      file=sys.stderr)
+                _backend = IpCommandBackend()
+        return _backend
+
+
+def set_backend(backend: LinkStateBackend) -> None:
+    """
+    Make backend the one that everything in this process shares, e.g. a netlink_state.NetlinkStateCache
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def dump(max_age: float = DUMP_MAX_AGE) -> LinkStateDump:
+    """
+    Return the links, addresses and routes of this system from the shared backend.  If the netlink socket fails
+    part way through, then fall back to the ip command for the rest of the life of this process.
+    """
+    global _backend
+    backend = get_backend()
+    try:
+        return backend.dump(max_age=max_age)
+    except (NetlinkError, OSError) as e:
+        if isinstance(backend, IpCommandBackend):
+            raise
+        print(f"The netlink backend failed ({str(e)}), using the ip command instead", file=sys.stderr)
+        backend.close()
+        with _backend_lock:
+            _backend = IpCommandBackend()
+        return _backend.dump(max_age=max_age)
+
+
+if __name__ == "__main__":
+    for backend_class in [NetlinkBackend, IpCommandBackend]:
+        be = backend_class()
+        t0 = time.monotonic()
+        d = be.dump(max_age=0)
+        print(f"{be.name}: {len(d.links)} links, {len(d.addresses)} addresses, {len(d.routes)} routes in "
+              f"{(time.monotonic() - t0) * 1000.0:.2f} ms")
+        for r in d.routes:
+            print("   ", r)
+        be.close()
@@ -0,0 +1,327 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This module keeps a model of the links, addresses and routes of this system in memory.  It is built once with a
+# full dump (see netlink_backend.py) and then kept current by the RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR,
+# RTM_NEWROUTE and RTM_DELROUTE messages that the kernel multicasts whenever something changes.  netlink_poc.py
+# showed that the messages arrive; this module applies them.
+#
+# In --monitor mode, and any time SystemDescription.discover is called more than once, the datalink and network
+# layers read the model instead of asking the kernel again.  NetlinkStateCache is a netlink_backend.LinkStateBackend,
+# so installing it with netlink_backend.set_backend is all that it takes.
+#
+# The kernel does not send RTM_DELROUTE for the IPv4 routes that it flushes when a link goes down or goes away, and
+# it does not send anything when a route gets or loses the linkdown flag.  So when a link goes away or its flags
+# change, the event thread does a full resync after it has applied the messages it has in hand.
+#
+# If the kernel has more messages for us than fit in the socket's receive buffer, it drops them and the next recv
+# fails with ENOBUFS.  The model can't know what it missed, so it throws everything away and does a full resync.
+# A message that can't be applied is counted as ignored and also makes the model resync.  If the event thread stops
+# for any other reason, the cache is no longer running, and dump() falls back to full dumps, starting with the next
+# one.
+
+import collections
+import errno
+import sys
+import threading
+import time
+import typing
+
+import netlink_backend
+from netlink_backend import LinkStateBackend, LinkStateDump, NetlinkBackend
+
+try:
+    from pyroute2 import IPRoute
+    from pyroute2.netlink.exceptions import NetlinkError
+    from pyroute2.netlink.rtnl import RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR, RTMGRP_IPV4_ROUTE, \
+        RTMGRP_IPV6_ROUTE
+
+    RTMGRP_ALL = RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR | RTMGRP_IPV4_ROUTE | RTMGRP_IPV6_ROUTE
+except ImportError:
+    IPRoute = None
+    NetlinkError = OSError  # So that except clauses still work
+    RTMGRP_ALL = 0
+
+# These are the events that the cache knows how to apply
+LINK_EVENTS = {"RTM_NEWLINK", "RTM_DELLINK"}
+ADDRESS_EVENTS = {"RTM_NEWADDR", "RTM_DELADDR"}
+ROUTE_EVENTS = {"RTM_NEWROUTE", "RTM_DELROUTE"}
+RESYNC = "RESYNC"  # Not a netlink event, this is what listeners are told after a full resync
+
+
+def address_key(address: dict) -> tuple:
+    return address["index"], address["family"], address["address"], address["prefixlen"]
+
+
+def route_key(route: dict) -> tuple:
+    # This is how the kernel tells routes apart: two routes to the same destination in the same table are different
+    # routes only if they have different metrics
+    return route["family"], route["table"], route["destination"], route["metric"]
+
+
+class NetlinkStateCache(LinkStateBackend):
+    """
+    An in-memory model of the links, addresses and routes of this system which is updated by netlink events.
+    dump() returns a LinkStateDump, just like the other backends, but it does not ask the kernel: if nothing changed
+    since the last dump then it returns the very same object.
+    """
+    name = "cache"
+
+    def __init__(self, backend: LinkStateBackend = None) -> None:
+        """
+        :param backend: the backend that does the full dumps.  If None, then a NetlinkBackend
+        """
+        super().__init__()
+        self.backend = backend
+        # Links are keyed by interface index, addresses by address_key and routes by route_key
+        self._links: typing.Dict[int, dict] = dict()
+        self._addresses: typing.Dict[tuple, dict] = dict()
+        self._routes: typing.Dict[tuple, dict] = dict()
+        self.generation: int = 0  # Goes up by one every time the model changes
+        self.events_applied: typing.Counter[str] = collections.Counter()
+        self.events_ignored: int = 0
+        self.resyncs: int = 0
+        self.synced_at: float = None  # time.monotonic() of the last resync
+        self._resync_needed: bool = False
+        self._snapshot: LinkStateDump = None
+        self._snapshot_generation: int = -1
+        self._listeners: typing.List[typing.Callable[[str, dict], None]] = list()
+        self._events_socket = None
+        self._thread: threading.Thread = None
+        self._listening: bool = False  # True while the event thread is applying events
+        self._stop = threading.Event()
+
+    def add_listener(self, callback: typing.Callable[[str, dict], None]) -> None:
+        """
+        :param callback: called as callback(event, record) after every change is applied, from the thread that
+        applied it.  After a resync, it is called as callback(RESYNC, None)
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, event: str, record: typing.Optional[dict]) -> None:
+        for callback in self._listeners:
+            try:
+                callback(event, record)
+            except Exception as e:  # A broken listener should not stop the cache
+                print(f"A NetlinkStateCache listener raised {repr(e)} on {event}", file=sys.stderr)
+
+    def resync(self) -> None:
+        """
+        Throw away the model and rebuild it from a full dump
+        """
+        if self.backend is None:
+            self.backend = NetlinkBackend()
+        full_dump = self.backend.dump(max_age=0.0)
+        with self._lock:
+            self._links = {link["index"]: link for link in full_dump.links}
+            self._addresses = {address_key(a): a for a in full_dump.addresses}
+            self._routes = {route_key(r): r for r in full_dump.routes}
+            self.generation += 1
+            self.resyncs += 1
+            self.synced_at = full_dump.time
+            self._resync_needed = False
+        self._notify(RESYNC, None)
+
+    def apply(self, event: str, record: dict) -> bool:
+        """
+        Apply one change to the model.  This is O(1)
+
+        :param event: the name of the netlink message, e.g. "RTM_NEWADDR"
+        :param record: a link, address or route record, see netlink_backend.py
+        :return: True if the model changed
+        """
+        with self._lock:
+            if event in LINK_EVENTS:
+                old_link = self._links.get(record["index"])
+                if event == "RTM_NEWLINK":
+                    changed = old_link != record
+                    self._links[record["index"]] = record
+                    if old_link is not None and old_link["flags"] != record["flags"]:
+                        self._resync_needed = True
+                else:
+                    changed = self._links.pop(record["index"], None) is not None
+                    self._resync_needed = True
+            elif event in ADDRESS_EVENTS:
+                key = address_key(record)
+                if event == "RTM_NEWADDR":
+                    changed = self._addresses.get(key) != record
+                    self._addresses[key] = record
+                else:
+                    changed = self._addresses.pop(key, None) is not None
+            elif event in ROUTE_EVENTS:
+                if record["table"] != netlink_backend.RT_TABLE_MAIN:
+                    # The model has the same routes as a dump, which is only the main table
+                    self.events_ignored += 1
+                    return False
+                key = route_key(record)
+                if event == "RTM_NEWROUTE":
+                    changed = self._routes.get(key) != record
+                    self._routes[key] = record
+                else:
+                    changed = self._routes.pop(key, None) is not None
+            else:
+                self.events_ignored += 1
+                return False
+            self.events_applied[event] += 1
+            if changed:
+                self.generation += 1
+        if changed:
+            self._notify(event, record)
+        return changed
+
+    def apply_message(self, msg) -> bool:
+        """
+        Apply a netlink message, as pyroute2 returns it, to the model
+
+        :return: True if the model changed
+        """
+        event = msg["event"]
+        if event in LINK_EVENTS:
+            record = NetlinkBackend.link_record(msg)
+        elif event in ADDRESS_EVENTS:
+            record = NetlinkBackend.address_record(msg, self.names())
+        elif event in ROUTE_EVENTS:
+            record = NetlinkBackend.route_record(msg, self.names())
+        else:
+            self.events_ignored += 1
+            return False
+        return self.apply(event, record)
+
+    def names(self) -> typing.Dict[int, str]:
+        """
+        :return: a dictionary of interface names keyed by interface index
+        """
+        return {index: link["name"] for index, link in self._links.items()}
+
+    def dump(self, max_age: float = None) -> LinkStateDump:
+        """
+        Return a snapshot of the model.  max_age is ignored while the model is being kept current by events,
+        because the model is never stale.  The snapshot is only rebuilt if the model changed since the last one,
+        so reading the model over and over costs nothing.  Don't modify the snapshot, it is shared
+        """
+        if not self.running:
+            # Nothing is keeping the model current, so it ages like any other dump
+            if max_age is None:
+                max_age = netlink_backend.DUMP_MAX_AGE
+            if self.synced_at is None or time.monotonic() - self.synced_at >= max_age:
+                self.resync()
+        with self._lock:
+            if self._snapshot_generation != self.generation:
+                self._snapshot = LinkStateDump(links=list(self._links.values()),
+                                               addresses=list(self._addresses.values()),
+                                               routes=list(self._routes.values()),
+                                               backend=self.name)
+                self._snapshot_generation = self.generation
+            return self._snapshot
+
+    @property
+    def running(self) -> bool:
+        return self._listening and self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "NetlinkStateCache":
+        """
+        Start a daemon thread that subscribes to the netlink multicast groups for links, addresses and routes, do a
+        full dump, and then let the thread apply the events as they arrive.  The subscription comes before the dump
+        so that nothing that changes in between is missed
+        """
+        if IPRoute is None:
+            raise ImportError("pyroute2 is not installed, so the netlink state cache is not available")
+        self._stop.clear()
+        subscribed = threading.Event()
+        failure: typing.List[Exception] = list()
+        self._thread = threading.Thread(target=self._run, args=(subscribed, failure), name="netlink-events",
+                                        daemon=True)
+        self._thread.start()
+        subscribed.wait()
+        if len(failure) > 0:
+            self._thread = None
+            raise failure[0]
+        self.resync()
+        return self
+
+    def _run(self, subscribed: threading.Event, failure: typing.List[Exception]) -> None:
+        # pyroute2 only delivers multicast messages to the thread that opened the socket, so it is opened here
+        try:
+            self._events_socket = IPRoute()
+            self._events_socket.bind(groups=RTMGRP_ALL)
+        except (OSError, NetlinkError) as e:
+            failure.append(e)
+            return
+        finally:
+            subscribed.set()
+        self._listening = True
+        try:
+            self._apply_events()
+        except Exception as e:
+            print(f"The netlink event thread failed ({repr(e)}), the cache is no longer current", file=sys.stderr)
+        finally:
+            self._listening = False
+            with self._lock:
+                self.synced_at = None  # So that the next dump is a fresh one
+
+    def _apply_events(self) -> None:
+        while not self._stop.is_set():
+            try:
+                messages = self._events_socket.get()
+            except (OSError, NetlinkError) as e:
+                if self._stop.is_set():
+                    break
+                # pyroute2 raises NetlinkError, which is not an OSError, with the errno in code
+                if getattr(e, "errno", None) == errno.ENOBUFS or getattr(e, "code", None) == errno.ENOBUFS:
+                    print("Netlink messages were dropped, resyncing", file=sys.stderr)
+                    self.resync()
+                    continue
+                print(f"The netlink event socket failed ({str(e)}), the cache is no longer current", file=sys.stderr)
+                break
+            for msg in messages:
+                try:
+                    self.apply_message(msg)
+                except Exception as e:  # The model missed this one, so it has to be rebuilt
+                    print(f"Could not apply a netlink message ({repr(e)}), resyncing", file=sys.stderr)
+                    self.events_ignored += 1
+                    self._resync_needed = True
+            if self._resync_needed:
+                self.resync()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._events_socket is not None:
+            self._events_socket.close()
+            self._events_socket = None
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def __str__(self) -> str:
+        return f"generation {self.generation}: {len(self._links)} links, {len(self._addresses)} addresses, " \
+               f"{len(self._routes)} routes; {sum(self.events_applied.values())} events applied " \
+               f"({dict(self.events_applied)}), {self.events_ignored} ignored, {self.resyncs} resyncs"
+
+
+def start_cache() -> NetlinkStateCache:
+    """
+    Start a NetlinkStateCache and make it the backend that DataLink.discover, IPv4Route.discover etc. read from.
+    If it can't be started, then those keep using whatever backend they were using
+
+    :return: the cache, or None if it could not be started
+    """
+    try:
+        cache = NetlinkStateCache().start()
+    except (ImportError, OSError) as e:
+        print(f"The netlink state cache is not available ({str(e)})", file=sys.stderr)
+        return None
+    netlink_backend.set_backend(cache)
+    return cache
+
+
+if __name__ == "__main__":
+    state = start_cache()
+    if state is None:
+        sys.exit(1)
+    print(state)
+    try:
+        while True:
+            time.sleep(5.0)
+            print(state)
+    except KeyboardInterrupt:
+        state.close()
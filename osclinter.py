@@ -3,12 +3,17 @@
 # This file has utility functions that will be generally useful
 
 
+import concurrent.futures
+import copy
 import json
 import os
 import platform
+import selectors
 import subprocess
 import sys
-from typing import List, Tuple
+import threading
+import time
+from typing import Dict, List, Tuple
 
 import constants
 from constants import ErrorLevels
@@ -30,41 +35,179 @@ class OsCliInter(object):
     assert "linux" == system or "windows" == system or "java" == system, \
         f"platform.system returned an unknown (not unimplemented, that's different) value: {system}"
 
+    # All commands run in this pool of threads, so no more than COMMAND_CONCURRENCY of them run at the same time
+    _pool = concurrent.futures.ThreadPoolExecutor(max_workers=constants.COMMAND_CONCURRENCY,
+                                                  thread_name_prefix="OsCliInter")
+    # How long each command takes, keyed by the name of the executable
+    _stats: Dict[str, 'CommandStats'] = dict()
+    _stats_lock = threading.Lock()
+
     @classmethod
-    def run_command(cls, command: List[str]) -> Tuple[str, str, int]:
+    def run_command(cls, command: List[str], timeout: float = constants.COMMAND_TIMEOUT,
+                    max_output: int = constants.COMMAND_MAX_OUTPUT) -> Tuple[str, str, int]:
         """
         Run the command on the CLI.  This is here to make it easy to mock
 
         :param command: a list of strings.  Element 0 is the name of the executable. The rest of the list are args to
         the command
-        :return: A string which is the output of the program in ASCII
+        :param timeout: seconds.  If the command runs longer than this, it is killed and subprocess.TimeoutExpired is
+        raised
+        :param max_output: bytes.  Output past this much is read and thrown away, so the command does not block
+        :return: A tuple of the standard output, the standard error and the exit status of the command.  The output
+        is decoded as UTF-8, anything that isn't UTF-8 is replaced
         """
 
         assert isinstance(command, list), f"command should be a list of strings but is actually a string {command}"
-        completed: subprocess.CompletedProcess = subprocess.run(command,
-                                                                stdin=None,
-                                                                input=None,
-                                                                stdout=subprocess.PIPE, stderr=None, shell=False,
-                                                                timeout=None,
-                                                                check=False)
+        return cls._pool.submit(cls._execute, command, timeout, max_output).result()
+
+    @classmethod
+    async def run_command_async(cls, command: List[str], timeout: float = constants.COMMAND_TIMEOUT,
+                                max_output: int = constants.COMMAND_MAX_OUTPUT) -> Tuple[str, str, int]:
+        """
+        The same as run_command, for coroutines.  The event loop keeps running while the command does
+        """
+        assert isinstance(command, list), f"command should be a list of strings but is actually a string {command}"
+        import asyncio  # Only coroutines call this, and they have already imported asyncio
+        return await asyncio.wrap_future(cls._pool.submit(cls._execute, command, timeout, max_output))
+
+    @classmethod
+    def run_commands(cls, commands: List[List[str]], timeout: float = constants.COMMAND_TIMEOUT,
+                     max_output: int = constants.COMMAND_MAX_OUTPUT) -> List[Tuple[str, str, int]]:
+        """
+        Start several commands at the same time, and wait for all of them
+
+        :param commands: a list of commands, see run_command
+        :return: the results, in the same order as commands.  If a command timed out or could not be started, then
+        its result is the exception (subprocess.TimeoutExpired or OSError) instead of a tuple.  The other results are
+        still returned
+        """
+        futures = [cls._pool.submit(cls._execute, command, timeout, max_output) for command in commands]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except (subprocess.TimeoutExpired, OSError) as e:
+                results.append(e)
+        return results
+
+    @classmethod
+    def _execute(cls, command: List[str], timeout: float, max_output: int) -> Tuple[str, str, int]:
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        try:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, shell=False)
+        except OSError:
+            cls._record(command, time.monotonic() - start, failed=True)
+            raise
+        # Read standard output and standard error as they come, whichever has something, so that neither one fills
+        # up its pipe and blocks the command
+        outputs = {process.stdout: bytearray(), process.stderr: bytearray()}
+        truncated = set()
+        timed_out = False
+        try:
+            with selectors.DefaultSelector() as selector:
+                for pipe in outputs:
+                    selector.register(pipe, selectors.EVENT_READ)
+                while len(selector.get_map()) > 0 and not timed_out:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        timed_out = True
+                        break
+                    for key, _ in selector.select(remaining):
+                        data = os.read(key.fd, 65536)
+                        if len(data) == 0:
+                            selector.unregister(key.fileobj)
+                            continue
+                        output = outputs[key.fileobj]
+                        if len(output) + len(data) > max_output:
+                            truncated.add(key.fileobj)
+                        output += data[:max(0, max_output - len(output))]
+            if not timed_out:
+                # The command closed its output, but it might not have exited
+                try:
+                    process.wait(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+        finally:
+            if timed_out or process.returncode is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            process.stderr.close()
+        cls._record(command, time.monotonic() - start, timed_out=timed_out)
+        stdout = bytes(outputs[process.stdout])
+        stderr = bytes(outputs[process.stderr])
+        if timed_out:
+            raise subprocess.TimeoutExpired(command, timeout, output=stdout, stderr=stderr)
+        for pipe in truncated:
+            print(f"The {'output' if pipe is process.stdout else 'error output'} of {' '.join(command)} was "
+                  f"truncated to {max_output} bytes", file=sys.stderr)
         # Issue #36 - return stdout, stderr, and the return status code.
-        stdout_str: stdout_str = completed.stdout.decode('ascii')
-        # Why the following isn't the default behavior, I'll never know
-        stderr_str str = ( "" if completed.stderr is Null else \
-                completed.stderr.decode('ascii') )
-        status: int = completed.returncode
+        stdout_str: str = stdout.decode('utf-8', errors='replace')
+        stderr_str: str = stderr.decode('utf-8', errors='replace')
+        status: int = process.returncode
         return stdout_str, stderr_str, status
 
+    @classmethod
+    def _record(cls, command: List[str], elapsed: float, timed_out: bool = False, failed: bool = False) -> None:
+        name = os.path.basename(command[0]) if len(command) > 0 else ""
+        with cls._stats_lock:
+            stats = cls._stats.get(name)
+            if stats is None:
+                stats = cls._stats[name] = CommandStats(name)
+            stats.add(elapsed, timed_out=timed_out, failed=failed)
+
+    @classmethod
+    def stats(cls) -> Dict[str, 'CommandStats']:
+        """
+        :return: how long each command has taken so far, keyed by the name of the executable, slowest first
+        """
+        with cls._stats_lock:
+            copies = [copy.copy(stats) for stats in cls._stats.values()]
+        return {stats.name: stats for stats in sorted(copies, key=lambda stats: stats.max, reverse=True)}
+
+    @classmethod
+    def reset_stats(cls) -> None:
+        with cls._stats_lock:
+            cls._stats.clear()
+
+
+class CommandStats(object):
+    """
+    How long one command (e.g. lshw) has taken, over all of the times that it ran
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.count: int = 0
+        self.timeouts: int = 0
+        self.failures: int = 0  # Could not be started at all, e.g. the executable does not exist
+        self.total: float = 0.0  # seconds
+        self.min: float = None
+        self.max: float = 0.0
+        self.last: float = None
+
+    def add(self, elapsed: float, timed_out: bool = False, failed: bool = False) -> None:
+        self.count += 1
+        self.timeouts += timed_out
+        self.failures += failed
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+        self.max = max(self.max, elapsed)
+        self.last = elapsed
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
 
-try:
-    print("Testing the __file__ special variable: " + __file__, file=sys.stderr)
-except Exception as e:  # if anything goes wrong
-    print("Testing the __file__ special variable FAILED, exception is " + str(e), file=sys.stderr)
+    def __str__(self):
+        return f"{self.name}: ran {self.count} times, {self.timeouts} timeouts, {self.failures} failures, " \
+               f"min/mean/max = {(self.min or 0.0) * 1000.0:.1f}/{self.mean * 1000.0:.1f}/{self.max * 1000.0:.1f} ms"
 
 # Globally note the operating system name.  Note that this section of the code *must* follow the definition
 # of class OsCliInter or else the compiler will raise a NameError exception at compile time
 # Access the_os using utilities.the_os  The variable is so named to avoid confusion with the os package name
-print("About to import osCliInter", file=sys.stderr)
 os_name: str = OsCliInter.system.lower()
 the_os = constants.OperatingSystems.UNKNOWN
 if 'linux' == os_name:
@@ -79,6 +222,13 @@ else:
 if "__main__" == __name__:
     print(f"System is {os_name} A.K.A. {the_os}")
     if OperatingSystems.LINUX == the_os:
-        print(f"In linux, the uname -a command output is \n{OsCliInter.run_command(['uname', '-a'])}\n.")
+        print(f"In linux, the uname -a command output is \n{OsCliInter.run_command(['uname', '-a'])[0]}\n.")
+        OsCliInter.run_commands([["sleep", "0.5"]] * 8 + [["ip", "link", "list"], ["cat", "/proc/net/dev"]])
+        try:
+            OsCliInter.run_command(["sleep", "5"], timeout=0.2)
+        except subprocess.TimeoutExpired as t:
+            print(f"As expected, {str(t)}")
+        for command_stats in OsCliInter.stats().values():
+            print(command_stats)
     else:
         raise NotImplemented("This program ONLY runs on linux at this time")
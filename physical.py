@@ -9,6 +9,7 @@ import re
 import sys
 
 # import subprocess
+import command_cache
 import constants
 import utilities
 from layer import Layer
@@ -102,9 +103,9 @@ class Physical(Layer):
         # Execute the
         # Look in the nbmdt requirements document for the lshw - C network command and the
         # lspci -nnk | grep -iA2 net commands.  That is a way to test the physical layer.Woot!
-        command = ["lshw" "-C" "network"]
+        command = ["lshw", "-C", "network"]
 
-        results = utilities.OsCliInter.run_command(command=command)
+        results, _, _ = command_cache.run_command(command)
         for r in results.split("\n"):
             while True:
                 # lshw could be so much better...  There is a known bug with lshw with JSON output
@@ -309,7 +310,7 @@ if "__main__" == __name__:
 
     command = ["lshw", "-xml", "-C", "network"]
 
-    results_xml:str = utilities.OsCliInter.run_command(command=command)
+    results_xml, _, _ = command_cache.run_command(command)
     # use lxml
     results_dict = xml_to_dict(results_xml)
     pp.pprint(results_dict)
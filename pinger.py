@@ -0,0 +1,373 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Ping a lot of targets at the same time, without running the ping command.  monitor.sh runs ping -c 4 once per
+# target, one after another, so a single dead target costs 4 seconds or more and holds up everything after it.  Here
+# every target is probed at once over one ICMP socket per address family, and the whole run ends at a deadline no
+# matter how many targets are dead.
+#
+# The socket is a datagram ICMP socket ("ping socket") if the kernel lets this user have one (see
+# /proc/sys/net/ipv4/ping_group_range), otherwise a raw socket, which needs root or CAP_NET_RAW.  With a ping
+# socket the kernel picks the identifier and only hands us the replies to our own requests; with a raw socket we
+# see every ICMP message on the host and have to pick out our own.  Either way, replies are matched to requests by
+# sequence number.  The socket hands out the sequence numbers, skipping any that is still waiting for its reply, so
+# that a sequence number which wrapped around never takes over another request's reply.  A request whose future is
+# cancelled (it timed out) stops waiting, so its sequence number is free again.
+
+import asyncio
+import errno
+import itertools
+import os
+import socket
+import struct
+import sys
+import time
+import typing
+
+import configuration
+import constants
+import netlink_backend
+from constants import ErrorLevels
+
+ICMP_ECHO_REQUEST = {socket.AF_INET: 8, socket.AF_INET6: 128}
+ICMP_ECHO_REPLY = {socket.AF_INET: 0, socket.AF_INET6: 129}
+ICMP_PROTOCOL = {socket.AF_INET: socket.IPPROTO_ICMP, socket.AF_INET6: socket.IPPROTO_ICMPV6}
+ICMP_HEADER = struct.Struct("!BBHHH")  # type, code, checksum, identifier, sequence
+PAYLOAD = bytes(range(56))  # The same size as the ping command sends
+
+
+def checksum(data: bytes) -> int:
+    """
+    The internet checksum of RFC 1071.  Only ICMP for IPv4 needs it, the kernel fills it in for ICMPv6
+    """
+    if len(data) % 2 == 1:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+class PingResult(object):
+    """
+    What happened when one target was pinged
+    """
+
+    def __init__(self, target: str, address: str = None, error: str = None) -> None:
+        """
+        :param target: the name or address that was asked for
+        :param address: the address that was pinged, None if the name could not be resolved
+        :param error: why the target could not be pinged at all, or None
+        """
+        self.target = target
+        self.address = address
+        self.error = error
+        self.sent: int = 0
+        self.rtts: typing.List[float] = list()  # round trip times, in milliseconds, of the replies
+
+    @property
+    def received(self) -> int:
+        return len(self.rtts)
+
+    @property
+    def loss(self) -> float:
+        """
+        :return: the fraction of the requests that were not answered, 1.0 if none were sent
+        """
+        return 1.0 if self.sent == 0 else 1.0 - self.received / self.sent
+
+    @property
+    def rtt_min(self) -> typing.Optional[float]:
+        return min(self.rtts) if self.rtts else None
+
+    @property
+    def rtt_avg(self) -> typing.Optional[float]:
+        return sum(self.rtts) / len(self.rtts) if self.rtts else None
+
+    @property
+    def rtt_max(self) -> typing.Optional[float]:
+        return max(self.rtts) if self.rtts else None
+
+    def get_status(self) -> ErrorLevels:
+        if self.error is not None and self.sent == 0:
+            return ErrorLevels.UNKNOWN if self.address is None else ErrorLevels.DOWN
+        if self.received == 0:
+            return ErrorLevels.DOWN
+        if self.received < self.sent:
+            return ErrorLevels.DEGRADED
+        return ErrorLevels.NORMAL
+
+    def __bool__(self) -> bool:
+        # True if the target answered at all, so that "if address.ping():" does what it looks like
+        return self.received > 0
+
+    def __str__(self):
+        if self.error is not None and self.sent == 0:
+            return f"{self.target}: {self.error}"
+        result = f"{self.target} ({self.address}): {self.sent} sent, {self.received} received, " \
+                 f"{self.loss * 100.0:.0f}% loss"
+        if self.rtts:
+            result += f", rtt min/avg/max = {self.rtt_min:.3f}/{self.rtt_avg:.3f}/{self.rtt_max:.3f} ms"
+        return result
+
+
+class IcmpSocket(object):
+    """
+    One ICMP socket, of one address family, shared by all of the targets of that family
+    """
+
+    def __init__(self, family: int, loop: asyncio.AbstractEventLoop) -> None:
+        self.family = family
+        self.loop = loop
+        try:
+            self.sock = socket.socket(family, socket.SOCK_DGRAM, ICMP_PROTOCOL[family])
+            self.raw = False
+        except PermissionError:
+            self.sock = socket.socket(family, socket.SOCK_RAW, ICMP_PROTOCOL[family])
+            self.raw = True
+        self.sock.setblocking(False)
+        # With a ping socket the kernel replaces the identifier with its own, so it only matters on a raw socket
+        self.identifier = os.getpid() & 0xFFFF
+        # Outstanding requests, keyed by sequence number.  The values are (address, send time, future)
+        self.pending: typing.Dict[int, typing.Tuple[str, float, asyncio.Future]] = dict()
+        self._sequence = itertools.count(1)
+        loop.add_reader(self.sock.fileno(), self._read)
+
+    def next_sequence(self) -> typing.Optional[int]:
+        """
+        :return: the next sequence number that no request is waiting on, None if every one of them is
+        """
+        for _ in range(len(self.pending) + 1):
+            sequence = next(self._sequence) & 0xFFFF
+            if sequence not in self.pending:
+                return sequence
+        return None
+
+    def send(self, address: str, sequence: int = None) -> asyncio.Future:
+        """
+        Send one echo request
+
+        :param sequence: the sequence number.  If None, then next_sequence().  ValueError if a request is still
+        waiting on it
+        :return: a future which will be set to the round trip time in milliseconds when the reply comes back
+        """
+        future = self.loop.create_future()
+        if sequence is None:
+            sequence = self.next_sequence()
+            if sequence is None:
+                future.set_exception(OSError(errno.ENOBUFS, f"all {len(self.pending)} ICMP sequence numbers are "
+                                                            f"waiting for replies"))
+                return future
+        elif sequence in self.pending:
+            raise ValueError(f"ICMP sequence number {sequence} is still waiting for the reply to a request to "
+                             f"{self.pending[sequence][0]}")
+        header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST[self.family], 0, 0, self.identifier, sequence)
+        if self.family == socket.AF_INET:
+            header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST[self.family], 0, checksum(header + PAYLOAD), self.identifier,
+                                      sequence)
+        # getaddrinfo gives IPv6 link local addresses with the %interface scope, which is what sendto needs
+        destination = (address, 0) if self.family == socket.AF_INET else socket.getaddrinfo(
+            address, 0, socket.AF_INET6, socket.SOCK_DGRAM)[0][4]
+        self.pending[sequence] = (ipaddress_key(address), time.perf_counter(), future)
+        future.add_done_callback(lambda done: self._forget(sequence, done))
+        try:
+            self.sock.sendto(header + PAYLOAD, destination)
+        except OSError as e:  # e.g. network unreachable
+            future.set_exception(e)
+        return future
+
+    def _forget(self, sequence: int, future: asyncio.Future) -> None:
+        request = self.pending.get(sequence)
+        if request is not None and request[2] is future:
+            del self.pending[sequence]
+
+    def _read(self) -> None:
+        while True:
+            try:
+                data, source = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received = time.perf_counter()
+            if self.raw and self.family == socket.AF_INET:
+                data = data[(data[0] & 0x0F) * 4:]  # A raw IPv4 socket includes the IP header
+            if len(data) < ICMP_HEADER.size:
+                continue
+            icmp_type, code, _, identifier, sequence = ICMP_HEADER.unpack_from(data)
+            if icmp_type != ICMP_ECHO_REPLY[self.family] or (self.raw and identifier != self.identifier):
+                continue  # Somebody else's ICMP, which a raw socket sees too
+            request = self.pending.get(sequence)
+            if request is None or request[0] != ipaddress_key(source[0]):
+                continue
+            if not request[2].done():
+                request[2].set_result((received - request[1]) * 1000.0)  # Which forgets the request
+
+    def close(self) -> None:
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        for _, _, future in list(self.pending.values()):
+            future.cancel()
+
+
+def ipaddress_key(address: str) -> str:
+    # recvfrom does not give IPv6 addresses back with the %scope that they were sent with
+    return address.split("%", 1)[0]
+
+
+class Pinger(object):
+    """
+    Pings many targets at the same time
+    """
+
+    def __init__(self, count: int = 4, interval: float = 0.2, timeout: float = 1.0,
+                 deadline: float = constants.PING_DEADLINE) -> None:
+        """
+        :param count: how many echo requests to send to each target
+        :param interval: seconds between the echo requests to the same target
+        :param timeout: seconds to wait for the reply to each echo request
+        :param deadline: seconds after which the whole run ends, answered or not
+        """
+        self.count = count
+        self.interval = interval
+        self.timeout = timeout
+        self.deadline = deadline
+
+    async def ping_many(self, targets: typing.Iterable[str]) -> typing.Dict[str, PingResult]:
+        """
+        :param targets: names or addresses, IPv4 or IPv6
+        :return: a PingResult for every target, keyed by target
+        """
+        loop = asyncio.get_running_loop()
+        end = loop.time() + self.deadline
+        targets = list(dict.fromkeys(targets))  # No duplicates, but keep the order
+        results = {target: PingResult(target) for target in targets}
+        sockets: typing.Dict[int, IcmpSocket] = dict()
+        try:
+            resolved = await asyncio.gather(*[self._resolve(target, end) for target in targets])
+            for target, (family, address, error) in zip(targets, resolved):
+                results[target].address = address
+                results[target].error = error
+                if address is not None and family not in sockets:
+                    try:
+                        sockets[family] = IcmpSocket(family, loop)
+                    except OSError as e:
+                        print(f"Can't open an ICMP socket: {str(e)}", file=sys.stderr)
+            await asyncio.gather(*[self._ping_one(results[target], sockets.get(family), end)
+                                   for target, (family, address, error) in zip(targets, resolved)
+                                   if address is not None])
+        finally:
+            for icmp_socket in sockets.values():
+                icmp_socket.close()
+        return results
+
+    @staticmethod
+    async def _resolve(target: str, end: float) -> typing.Tuple[int, str, str]:
+        """
+        :return: (address family, address, error).  The address is None if target could not be resolved
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(loop.getaddrinfo(target, None, type=socket.SOCK_RAW),
+                                           timeout=max(0.0, end - loop.time()))
+        except (socket.gaierror, asyncio.TimeoutError) as e:
+            return socket.AF_UNSPEC, None, f"could not resolve {target}: {str(e) or 'timed out'}"
+        # Prefer IPv4, the same as the ping command
+        infos.sort(key=lambda info: info[0] != socket.AF_INET)
+        family, _, _, _, sockaddr = infos[0]
+        address = sockaddr[0]
+        if family == socket.AF_INET6 and sockaddr[3] != 0 and "%" not in address:
+            address += "%" + socket.if_indextoname(sockaddr[3])
+        return family, address, None
+
+    async def _ping_one(self, result: PingResult, icmp_socket: typing.Optional[IcmpSocket], end: float) -> None:
+        if icmp_socket is None:
+            result.error = "no ICMP socket for this address family"
+            return
+        loop = asyncio.get_running_loop()
+        futures = []
+        for i in range(self.count):
+            if loop.time() >= end:
+                break
+            if i > 0:
+                await asyncio.sleep(min(self.interval, max(0.0, end - loop.time())))
+            futures.append(icmp_socket.send(result.address))
+            result.sent += 1
+        # Wait for the replies, up to the timeout after the last request, but never past the deadline
+        wait = min(self.timeout, max(0.0, end - loop.time()))
+        if wait > 0:
+            await asyncio.wait(futures, timeout=wait)
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                result.rtts.append(future.result())
+            elif future.done() and not future.cancelled():
+                result.error = str(future.exception())
+            else:
+                future.cancel()
+
+    async def ping_one(self, target: str, sockets: typing.Dict[int, IcmpSocket]) -> PingResult:
+        """
+        Ping one target, for callers that start the targets one at a time rather than all at once, e.g.
+        reachability.py.  Its deadline starts now
+
+        :param sockets: the ICMP sockets to share with the other targets, keyed by address family.  A missing socket
+        is opened and added.  The caller closes them
+        """
+        loop = asyncio.get_running_loop()
+        end = loop.time() + self.deadline
+        result = PingResult(target)
+        family, result.address, result.error = await self._resolve(target, end)
+        if result.address is None:
+            return result
+        if family not in sockets:
+            try:
+                sockets[family] = IcmpSocket(family, loop)
+            except OSError as e:
+                result.error = f"can't open an ICMP socket: {str(e)}"
+                return result
+        await self._ping_one(result, sockets[family], end)
+        return result
+
+    def ping(self, targets: typing.Iterable[str]) -> typing.Dict[str, PingResult]:
+        """
+        The same as ping_many, for callers that are not coroutines
+        """
+        return asyncio.run(self.ping_many(targets))
+
+
+def default_targets(ini_filename: str = constants.NBMDT_INI, resolvers: typing.List[str] = None,
+                    gateways: typing.List[str] = None) -> typing.List[str]:
+    """
+    The targets that nbmdt pings: the ping_targets in the [default] section and the [machine-hostname] section of
+    nbmdt.ini, the default gateways and the DNS resolvers
+
+    :param resolvers: if None, the resolvers in /etc/resolv.conf
+    :param gateways: if None, the gateways of the default routes
+    """
+    targets = []
+    try:
+        targets = configuration.FixedConfiguration(ini_filename).get_list("ping_targets")
+    except FileNotFoundError as e:
+        print(f"{str(e)}, so there are no ping_targets", file=sys.stderr)
+    if gateways is None:
+        gateways = []
+        for route in netlink_backend.dump().routes:
+            if route["destination"] == "default" and route["via"] is not None:
+                # An IPv6 gateway is usually link local, which is meaningless without the interface
+                link_local = route["family"] == "inet6" and route["via"].lower().startswith("fe80:")
+                gateways.append(route["via"] + "%" + route["dev"] if link_local else route["via"])
+    if resolvers is None:
+        import application  # application imports dnspython, so only import it when it is needed
+        resolvers = application.DNS.get_resolvers()
+    return list(dict.fromkeys(targets + gateways + resolvers))
+
+
+def ping(targets: typing.Iterable[str], count: int = 4, timeout: float = 1.0,
+         deadline: float = constants.PING_DEADLINE) -> typing.Dict[str, PingResult]:
+    return Pinger(count=count, timeout=timeout, deadline=deadline).ping(targets)
+
+
+if __name__ == "__main__":
+    ping_targets = sys.argv[1:] if len(sys.argv) > 1 else default_targets()
+    t0 = time.monotonic()
+    for ping_result in ping(ping_targets).values():
+        print(ping_result)
+    print(f"Pinged {len(ping_targets)} targets in {time.monotonic() - t0:.2f} seconds")
@@ -0,0 +1,175 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# This module reads the TCP and UDP socket tables of the kernel from /proc/net/tcp, /proc/net/tcp6, /proc/net/udp
+# and /proc/net/udp6.  There is no netstat or ss subprocess.  A line in those files looks like:
+#
+#   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+#    0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 12345 1 ...
+#
+# The addresses are the bytes of the address in hex, in host byte order one 32 bit word at a time, and the ports
+# are big endian hex.  st is the TCP state from include/net/tcp_states.h (see constants.TcpStates).
+#
+# A busy host has 100,000 or more sockets, so the files are read in fixed size binary chunks into one buffer that is
+# reused, and a single compiled regular expression picks the fields out of each chunk.  Lines are never decoded or
+# split.  The state and port filters are applied to the hex fields before anything is converted, so a socket that
+# is filtered out costs almost nothing.  Addresses repeat a lot (every connection to the same web server), so each
+# one is converted to a string only once.
+
+import binascii
+import os
+import re
+import socket
+import struct
+import typing
+
+from constants import TcpStates
+
+PROC_NET = "/proc/net"
+# (file name, protocol name, address family)
+PROC_NET_FILES = [("tcp", "TCP", socket.AF_INET), ("tcp6", "TCP", socket.AF_INET6),
+                  ("udp", "UDP", socket.AF_INET), ("udp6", "UDP", socket.AF_INET6)]
+CHUNK_SIZE = 256 * 1024  # bytes read at a time.  Each line is about 150 bytes (IPv4) or 180 bytes (IPv6)
+
+# local address, local port, remote address, remote port, state, uid, inode
+ENTRY_RE = re.compile(rb"^ *\d+: ([0-9A-F]+):([0-9A-F]{4}) ([0-9A-F]+):([0-9A-F]{4}) ([0-9A-F]{2}) \S+ \S+ \S+ +(\d+) "
+                      rb"+\d+ (\d+)", re.MULTILINE)
+
+IPV4_WORD = struct.Struct("<I")
+IPV6_WORDS = struct.Struct("<4I")
+IPV6_HEX_WORDS = struct.Struct(">4I")
+STATES = {b"%02X" % state: state for state in TcpStates}  # keyed by the st column
+
+# This is what an unconnected UDP socket looks like.  It is bound to a port, so it is a UDP listener
+UDP_LISTEN_STATE = TcpStates.CLOSE
+
+
+def pack_address(hex_address: bytes, family: int) -> bytes:
+    """
+    :param hex_address: an address as it appears in /proc/net/tcp, e.g. b"0100007F"
+    :param family: socket.AF_INET or socket.AF_INET6
+    :return: the address in network byte order, the way socket.inet_pton returns it, e.g. b"\x7f\x00\x00\x01"
+    """
+    # Each 32 bit word is in host byte order.  This is little endian on everything we care about
+    if family == socket.AF_INET:
+        return IPV4_WORD.pack(int(hex_address, 16))
+    return IPV6_WORDS.pack(*IPV6_HEX_WORDS.unpack(binascii.unhexlify(hex_address)))
+
+
+def decode_address(hex_address: bytes, family: int) -> str:
+    """
+    :param hex_address: an address as it appears in /proc/net/tcp, e.g. b"0100007F"
+    :param family: socket.AF_INET or socket.AF_INET6
+    :return: the address as a string, e.g. "127.0.0.1"
+    """
+    return socket.inet_ntop(family, pack_address(hex_address, family))
+
+
+def as_tuple(*fields) -> tuple:
+    return fields
+
+
+def read_table(path: str, protocol: str, family: int, factory: typing.Callable = None,
+               states: typing.Collection[int] = None, local_ports: typing.Collection[int] = None,
+               remote_ports: typing.Collection[int] = None, packed: bool = False) -> typing.Iterator:
+    """
+    Read one of the /proc/net socket tables one entry at a time
+
+    :param path: e.g. "/proc/net/tcp6"
+    :param protocol: "TCP" or "UDP"
+    :param family: socket.AF_INET or socket.AF_INET6
+    :param factory: called as factory(family, local_address, local_port, remote_address, remote_port, state,
+    protocol, uid, inode) to make each record, e.g. transport.Transport.TcpConnection.  If None, the records are
+    tuples of those fields
+    :param states: if not None, only sockets in these states, e.g. {TcpStates.LISTEN}
+    :param local_ports: if not None, only sockets with one of these local ports
+    :param remote_ports: if not None, only sockets with one of these remote ports
+    :param packed: if True, then the addresses are bytes in network byte order (see pack_address) instead of
+    strings.  This is for callers that store addresses packed anyway, see connection_table.py
+    :return: an iterator of records
+    """
+    # The filters are turned into the hex that is in the file, so they can be applied before anything is converted
+    state_filter = None if states is None else {b"%02X" % s for s in states}
+    local_filter = None if local_ports is None else {b"%04X" % p for p in local_ports}
+    remote_filter = None if remote_ports is None else {b"%04X" % p for p in remote_ports}
+    if factory is None:
+        factory = as_tuple
+    convert = pack_address if packed else decode_address
+    addresses: typing.Dict[bytes, typing.Union[str, bytes]] = dict()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        start = 0  # The bytes before start are a partial line left over from the last read
+        while True:
+            if start == len(buffer):
+                # A single line is bigger than the buffer, which never happens with the real files
+                view.release()
+                buffer.extend(bytes(len(buffer)))
+                view = memoryview(buffer)
+            n = os.readv(fd, [view[start:]])
+            end = start + n
+            # Only whole lines are parsed.  At the end of the file, whatever is left is the last line
+            last = end if n == 0 else buffer.rfind(b"\n", 0, end) + 1
+            for m in ENTRY_RE.finditer(buffer, 0, last):
+                local_address, local_port, remote_address, remote_port, state, uid, inode = m.groups()
+                if state_filter is not None and state not in state_filter:
+                    continue
+                if local_filter is not None and local_port not in local_filter:
+                    continue
+                if remote_filter is not None and remote_port not in remote_filter:
+                    continue
+                local = addresses.get(local_address)
+                if local is None:
+                    local = addresses[local_address] = convert(local_address, family)
+                remote = addresses.get(remote_address)
+                if remote is None:
+                    remote = addresses[remote_address] = convert(remote_address, family)
+                yield factory(family, local, int(local_port, 16), remote, int(remote_port, 16),
+                              STATES[state], protocol, int(uid), int(inode))
+            if n == 0:
+                break
+            # Move the partial line at the end to the start of the buffer
+            start = end - last
+            buffer[:start] = buffer[last:end]
+    finally:
+        os.close(fd)
+        view.release()
+
+
+def read_connections(protocols: typing.Collection[str] = ("TCP", "UDP"), family: int = None,
+                     factory: typing.Callable = None, states: typing.Collection[int] = None,
+                     local_ports: typing.Collection[int] = None, remote_ports: typing.Collection[int] = None,
+                     packed: bool = False, proc_net: str = PROC_NET) -> typing.Iterator:
+    """
+    Read the socket tables of the kernel, one socket at a time
+
+    :param protocols: "TCP", "UDP" or both
+    :param family: socket.AF_INET, socket.AF_INET6, or None for both
+    :param proc_net: the directory the tables are in
+    :return: an iterator of records, see read_table for the other parameters
+    """
+    if family is not None and family != socket.AF_INET and family != socket.AF_INET6:
+        raise ValueError(f"family should be AF_INET, AF_INET6 or None, not {family}")
+    for file_name, protocol, file_family in PROC_NET_FILES:
+        if protocol not in protocols or (family is not None and family != file_family):
+            continue
+        path = os.path.join(proc_net, file_name)
+        if not os.path.exists(path):
+            continue  # e.g. IPv6 is disabled
+        yield from read_table(path, protocol, file_family, factory=factory, states=states, local_ports=local_ports,
+                              remote_ports=remote_ports, packed=packed)
+
+
+if __name__ == "__main__":
+    import time
+
+    t0 = time.monotonic()
+    count = sum(1 for _ in read_connections())
+    t1 = time.monotonic()
+    listeners = list(read_connections(protocols=["TCP"], states={TcpStates.LISTEN}))
+    t2 = time.monotonic()
+    print(f"Read {count} sockets in {(t1 - t0) * 1000.0:.2f} ms, {len(listeners)} TCP listeners in "
+          f"{(t2 - t1) * 1000.0:.2f} ms")
+    for listener in listeners:
+        print(listener)
@@ -0,0 +1,318 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# The reachability matrix of nbmdt --test (see utilities.SystemDescription.test): every target in a specification is
+# probed with every probe that the specification gives it, and each result is reported as soon as its probe finishes.
+#
+#   icmp        does the target answer a ping (see pinger.py)
+#   tcp/<port>  does a TCP connection to the port of the target get through
+#   dns         do the resolvers resolve the target, which has to be a name (see dns_checker.py)
+#
+# Checking 5,000 endpoints one after another takes an hour if a few hundred of them are dead, a deadline apiece.
+# Here the probes run at the same time on one event loop, up to constants.TEST_CONCURRENCY of them at once so that
+# there are never more sockets open than the process is allowed, and each probe ends within constants.TEST_DEADLINE
+# seconds, answered or not.  The ICMP probes share one socket per address family.  A name is resolved by getaddrinfo
+# in a worker thread, which can't be stopped at the deadline, so run does not wait for those threads, see
+# event_loop.py.
+#
+# A specification is a file, or the text itself with ";" between the lines.  Each line is a target and its probes, or
+# an option.  A target can be a network, which stands for every host in it.  Without probes, a target gets icmp:
+#
+#   # target        probes
+#   192.0.2.1       icmp tcp/22 tcp/443
+#   www.example.com dns tcp/80
+#   10.1.2.0/24     icmp                                    at most constants.TEST_MAX_HOSTS hosts
+#   concurrency=1000
+#   deadline=1.5
+#   resolvers=192.0.2.53,198.51.100.53
+
+import asyncio
+import ipaddress
+import os
+import sys
+import time
+import typing
+
+from termcolor import cprint
+
+import constants
+import event_loop
+import pinger
+from constants import ErrorLevels
+
+ICMP = "icmp"
+DNS = "dns"
+TCP = "tcp"
+DEFAULT_PROBES = [ICMP]
+
+
+def parse_probe(probe: str) -> str:
+    """
+    :param probe: e.g. "icmp", "TCP:443" or "tcp/443"
+    :return: the probe the way results name it, e.g. "tcp/443".  ValueError if it is not a probe
+    """
+    probe = probe.lower()
+    if probe in (ICMP, DNS):
+        return probe
+    kind, _, port = probe.replace(":", "/").partition("/")
+    if kind != TCP or not port.isdigit() or not 0 < int(port) < 65536:
+        raise ValueError(f"{probe} is not a probe.  A probe is {ICMP}, {DNS} or {TCP}/<port>")
+    return f"{TCP}/{int(port)}"
+
+
+def is_address(target: str) -> bool:
+    try:
+        ipaddress.ip_address(target.split("%", 1)[0])
+    except ValueError:
+        return False
+    return True
+
+
+class ProbeResult(object):
+    """
+    How one probe of one target came out
+    """
+    __slots__ = ["target", "probe", "status", "detail", "elapsed"]
+
+    def __init__(self, target: str, probe: str, status: ErrorLevels, detail: str = "", elapsed: float = None) -> None:
+        """
+        :param elapsed: how long the probe ran, in seconds
+        """
+        self.target = target
+        self.probe = probe
+        self.status = status
+        self.detail = detail
+        self.elapsed = elapsed
+
+    def __str__(self):
+        took = "" if self.elapsed is None else f" ({self.elapsed * 1000.0:.0f} ms)"
+        return f"{self.target} {self.probe}: {self.status.name} {self.detail}{took}"
+
+
+class ReachabilityMatrix(object):
+    """
+    Targets, the probes of each one, and how to run them
+    """
+
+    def __init__(self, probes: typing.List[typing.Tuple[str, str]], concurrency: int = constants.TEST_CONCURRENCY,
+                 deadline: float = constants.TEST_DEADLINE, resolvers: typing.List[str] = None) -> None:
+        """
+        :param probes: (target, probe) pairs, see parse_probe
+        :param concurrency: how many probes may run at the same time
+        :param deadline: seconds that each probe has to finish in
+        :param resolvers: the resolvers that the dns probes ask.  If None, the ones in /etc/resolv.conf
+        """
+        if concurrency < 1 or deadline <= 0.0:
+            raise ValueError(f"concurrency is {concurrency} and deadline is {deadline}, they have to be positive")
+        self.probes = probes
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.resolvers = resolvers
+
+    @classmethod
+    def from_specification(cls, specification: str) -> 'ReachabilityMatrix':
+        """
+        :param specification: the name of a specification file, or the specification itself, see the top of this
+        module.  ValueError if it is not a specification
+        """
+        if os.path.isfile(specification):
+            with open(specification) as f:
+                lines = f.read().splitlines()
+        else:
+            lines = specification.split(";")
+        probes = []
+        options = {"concurrency": constants.TEST_CONCURRENCY, "deadline": constants.TEST_DEADLINE, "resolvers": None}
+        for line_number, line in enumerate(lines, 1):
+            words = line.split("#", 1)[0].split()
+            if len(words) == 0:
+                continue
+            if any("=" in word for word in words):  # Which no target has
+                option, _, value = "".join(words).partition("=")
+                if option == "concurrency":
+                    options[option] = int(value)
+                elif option == "deadline":
+                    options[option] = float(value)
+                elif option == "resolvers":
+                    options[option] = [resolver for resolver in value.split(",") if resolver]
+                else:
+                    raise ValueError(f"Line {line_number} of the specification: {option} is not an option.  The "
+                                     f"options are {', '.join(options)}")
+                continue
+            target_probes = [parse_probe(probe) for probe in words[1:]] or DEFAULT_PROBES
+            try:
+                network = ipaddress.ip_network(words[0], strict=False) if "/" in words[0] else None
+            except ValueError:
+                raise ValueError(f"Line {line_number} of the specification: {words[0]} is not a network")
+            if network is not None and network.num_addresses > constants.TEST_MAX_HOSTS:
+                raise ValueError(f"Line {line_number} of the specification: {words[0]} has {network.num_addresses} "
+                                 f"addresses, more than the {constants.TEST_MAX_HOSTS} that a line may have.  Split "
+                                 f"it into smaller networks")
+            targets = [words[0]] if network is None else [str(host) for host in network.hosts()]
+            if DNS in target_probes and is_address(words[0]):
+                raise ValueError(f"Line {line_number} of the specification: {words[0]} is an address, there is "
+                                 f"nothing for the {DNS} probe to resolve")
+            probes.extend((target, probe) for target in targets for probe in target_probes)
+        if len(probes) == 0:
+            raise ValueError(f"The specification {specification} has no targets")
+        return cls(list(dict.fromkeys(probes)), **options)  # No duplicates, but keep the order
+
+    async def run_async(self, on_result: typing.Callable[[ProbeResult], None] = None) -> typing.List[ProbeResult]:
+        """
+        Run every probe
+
+        :param on_result: called with each result as soon as its probe has finished, in the order they finish
+        :return: the results, in the order of probes
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        sockets: typing.Dict[int, pinger.IcmpSocket] = dict()
+        ping = pinger.Pinger(count=constants.TEST_PING_COUNT, interval=min(0.2, self.deadline / 4.0),
+                             timeout=self.deadline, deadline=self.deadline)
+        checker = None
+        if any(probe == DNS for _, probe in self.probes):
+            import dns_checker  # dnspython takes a while to import, and most specifications don't need it
+            checker = dns_checker.DnsChecker(resolvers=self.resolvers, timeout=self.deadline)
+
+        async def run_one(target: str, probe: str) -> ProbeResult:
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    if probe == ICMP:
+                        status, detail = await self._icmp(ping, target, sockets)
+                    elif probe == DNS:
+                        status, detail = await self._dns(checker, target)
+                    else:
+                        status, detail = await self._tcp(target, int(probe.split("/", 1)[1]))
+                except Exception as e:  # A probe that broke says nothing about the target
+                    status, detail = ErrorLevels.UNKNOWN, f"the probe raised {repr(e)}"
+                return ProbeResult(target, probe, status, detail, time.perf_counter() - start)
+
+        tasks = [asyncio.ensure_future(run_one(target, probe)) for target, probe in self.probes]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                if on_result is not None:
+                    on_result(result)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for icmp_socket in sockets.values():
+                icmp_socket.close()
+        return [task.result() for task in tasks]
+
+    def run(self, on_result: typing.Callable[[ProbeResult], None] = None) -> typing.List[ProbeResult]:
+        """
+        The same as run_async, for callers that are not coroutines
+        """
+        return event_loop.run(self.run_async(on_result), name="reachability")
+
+    @staticmethod
+    async def _icmp(ping: pinger.Pinger, target: str, sockets: typing.Dict[int, pinger.IcmpSocket]) \
+            -> typing.Tuple[ErrorLevels, str]:
+        result = await ping.ping_one(target, sockets)
+        if result.received > 0:
+            return result.get_status(), f"{result.received} of {result.sent} answered, " \
+                                        f"rtt avg {result.rtt_avg:.3f} ms"
+        return result.get_status(), result.error or f"none of {result.sent} answered"
+
+    async def _tcp(self, target: str, port: int) -> typing.Tuple[ErrorLevels, str]:
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(target, port), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            return ErrorLevels.DOWN, "timed out"
+        except ConnectionRefusedError:
+            return ErrorLevels.DOWN, "refused"
+        except OSError as e:  # socket.gaierror too, which is why it comes after the others
+            return ErrorLevels.DOWN, e.strerror or str(e)
+        connected = (time.perf_counter() - start) * 1000.0
+        writer.close()
+        return ErrorLevels.NORMAL, f"connected in {connected:.3f} ms"
+
+    @staticmethod
+    async def _dns(checker, target: str) -> typing.Tuple[ErrorLevels, str]:
+        """
+        :param checker: a dns_checker.DnsChecker
+        :return: NORMAL if every resolver resolved target, DEGRADED if some did, DOWN if none did
+        """
+        import dns_checker
+        answers = await asyncio.gather(*[checker.query(server, target, rdtype) for server in checker.resolvers
+                                         for rdtype in dns_checker.QUERY_TYPES])
+        resolved_by = {answer.server for answer in answers if answer.addresses}
+        addresses = list(dict.fromkeys(address for answer in answers if answer.addresses
+                                       for address in answer.addresses))
+        if len(resolved_by) == 0:
+            errors = list(dict.fromkeys(answer.error for answer in answers if answer.error is not None))
+            return ErrorLevels.DOWN, "; ".join(errors) if errors else "no addresses"
+        status = ErrorLevels.NORMAL if len(resolved_by) == len(checker.resolvers) else ErrorLevels.DEGRADED
+        return status, f"{len(resolved_by)} of {len(checker.resolvers)} resolvers: {', '.join(addresses)}"
+
+
+def matrix(results: typing.List[ProbeResult]) -> typing.Dict[str, typing.Dict[str, ProbeResult]]:
+    """
+    :return: the results keyed by target and then by probe
+    """
+    rows: typing.Dict[str, typing.Dict[str, ProbeResult]] = dict()
+    for result in results:
+        rows.setdefault(result.target, dict())[result.probe] = result
+    return rows
+
+
+def worst(results: typing.List[ProbeResult]) -> ErrorLevels:
+    """
+    :return: the worst status of all of the probes, ErrorLevels.NORMAL if there are none
+    """
+    return max((result.status for result in results), default=ErrorLevels.NORMAL)
+
+
+def print_result(result: ProbeResult, file=sys.stdout) -> None:
+    """
+    Print one line for one probe, color coded by its status, see constants.colors
+    """
+    color, on_color = constants.colors.get(result.status, ['white', 'on_blue'])
+    cprint(f"{result.target:30} {result.probe:9} {result.status.name:17}", color, on_color, end="", file=file)
+    took = "" if result.elapsed is None else f" ({result.elapsed * 1000.0:.0f} ms)"
+    print(f" {result.detail}{took}", file=file)
+
+
+def summary(results: typing.List[ProbeResult], file=sys.stdout) -> None:
+    """
+    Print how many targets came out with each status, for each probe
+    """
+    counts: typing.Dict[str, typing.Dict[ErrorLevels, int]] = dict()
+    for result in results:
+        probe_counts = counts.setdefault(result.probe, dict())
+        probe_counts[result.status] = probe_counts.get(result.status, 0) + 1
+    for probe, probe_counts in counts.items():
+        print(f"{probe:9} " + ", ".join(f"{count} {status.name}" for status, count in sorted(probe_counts.items())),
+              file=file)
+
+
+if __name__ == "__main__":
+    async def benchmark():
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        # Only 127.0.0.1 accepts the connections, the rest of 127.0.0.0/8 refuses them.  Every address in it answers a
+        # ping, but the kernel sends no more than net.ipv4.icmp_msgs_per_sec ICMP messages a second, echo replies
+        # included, so ping a few hundred of them rather than thousands.  10.255.255.1 is a dead end, so its probe
+        # takes the whole deadline
+        spec = f"127.0.0.0/19 tcp/{port}; 127.1.0.0/24 icmp; 10.255.255.1 icmp; deadline=1.0"
+        test_matrix = ReachabilityMatrix.from_specification(spec)
+        first = []
+        t0 = time.perf_counter()
+        results = await test_matrix.run_async(lambda result: first.append(time.perf_counter()) if not first else None)
+        t1 = time.perf_counter()
+        sequential = ReachabilityMatrix(test_matrix.probes[:100] + test_matrix.probes[-1:], concurrency=1,
+                                        deadline=test_matrix.deadline)
+        t2 = time.perf_counter()
+        await sequential.run_async()
+        t3 = time.perf_counter()
+        server.close()
+        print(f"{len(results)} probes of {len(matrix(results))} targets took {t1 - t0:.2f} s, the first result came "
+              f"after {(first[0] - t0) * 1000.0:.1f} ms.  One at a time, 101 of them (1 of them dead) took "
+              f"{t3 - t2:.2f} s", file=sys.stderr)
+        summary(results, file=sys.stderr)
+        return results
+
+    benchmark_results = asyncio.run(benchmark())
+    print_result(benchmark_results[0])
+    print_result(benchmark_results[-1])
@@ -0,0 +1,210 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# reliability.Reliability for many components at once, for design mode "what if" analysis.  reliability.Reliability
+# combines two reliabilities at a time, with a type check each time; here the reliabilities are NumPy arrays and a
+# whole structure is combined with a few array operations:
+#
+#   series(r)                   all of the components have to work: the product of their reliabilities (AND)
+#   parallel(r)                 any one of them will do: one minus the product of their unreliabilities (OR, which
+#                               is what reliability.Reliability.__add__ computes for two of them)
+#   group_series(r, groups)     series, or parallel, of each group of components, where groups[i] is the group of
+#   group_parallel(r, groups)   component i.  The groups don't have to be contiguous or the same size
+#
+# CompiledGraph turns a dependency_graph.DependencyGraph into arrays, level by level, and then computes the
+# reliability of every node for any number of scenarios at once (each scenario is a row of own reliabilities), the
+# same way that DependencyGraph.propagate does.  That assumes that the alternatives of a requirement fail
+# independently, which they don't if they share a dependency: two routes over the same datalink both fail when the
+# datalink does.  CompiledGraph.simulate does not assume anything: it fails each node at random according to its own
+# reliability, many times over, and counts how often each node ends up working.
+
+import sys
+import time
+import typing
+
+import numpy as np
+
+import constants
+import dependency_graph
+import reliability
+
+# The Monte Carlo trials are run this many at a time, so that the boolean arrays stay small
+SIMULATION_CHUNK = 4096
+
+
+def series(r: np.ndarray, axis: int = -1) -> np.ndarray:
+    """
+    :return: the reliability of components in series (AND) along axis
+    """
+    return np.prod(r, axis=axis)
+
+
+def parallel(r: np.ndarray, axis: int = -1) -> np.ndarray:
+    """
+    :return: the reliability of redundant components (OR) along axis
+    """
+    return 1.0 - np.prod(1.0 - r, axis=axis)
+
+
+def _group_product(values: np.ndarray, groups: np.ndarray, n_groups: int) -> np.ndarray:
+    """
+    :param values: along the last axis, one value per component
+    :param groups: the group of each component, from 0 to n_groups - 1
+    :return: along the last axis, the product of the values in each group, 1.0 for a group with no components
+    """
+    groups = np.asarray(groups)
+    order = np.argsort(groups, kind="stable")
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = np.ones(values.shape[:-1] + (n_groups,), dtype=np.float64)
+    present = counts > 0
+    # reduceat multiplies from each start up to the next one, so only the groups with components can be given
+    result[..., present] = np.multiply.reduceat(values[..., order], starts[present], axis=-1)
+    return result
+
+
+def group_series(r: np.ndarray, groups: np.ndarray, n_groups: int = None) -> np.ndarray:
+    """
+    :param r: the reliability of each component, along the last axis.  Any other axes are scenarios
+    :param groups: the group of each component
+    :param n_groups: how many groups there are.  If None, one more than the highest group
+    :return: the reliability of each group of components in series, 1.0 for an empty group
+    """
+    n_groups = int(np.max(groups)) + 1 if n_groups is None else n_groups
+    return _group_product(np.asarray(r, dtype=np.float64), groups, n_groups)
+
+
+def group_parallel(r: np.ndarray, groups: np.ndarray, n_groups: int = None) -> np.ndarray:
+    """
+    The same as group_series, for redundant components.  An empty group has a reliability of 0.0
+    """
+    n_groups = int(np.max(groups)) + 1 if n_groups is None else n_groups
+    return 1.0 - _group_product(1.0 - np.asarray(r, dtype=np.float64), groups, n_groups)
+
+
+class _Level(object):
+    """
+    The nodes at one level of a graph (see dependency_graph.DependencyGraph._compute_levels), and what they require,
+    as index arrays.  The alternatives of each requirement are contiguous, and so are the requirements of each node,
+    so numpy's reduceat can combine them
+    """
+    __slots__ = ["nodes", "alternatives", "requirement_starts", "node_starts"]
+
+    def __init__(self, nodes: np.ndarray, alternatives: np.ndarray, requirement_starts: np.ndarray,
+                 node_starts: np.ndarray) -> None:
+        self.nodes = nodes  # The index of each node at this level
+        self.alternatives = alternatives  # The index of each alternative of each requirement of each node
+        self.requirement_starts = requirement_starts  # Where each requirement starts in alternatives
+        self.node_starts = node_starts  # Where the requirements of each node start, counting requirements
+
+
+class CompiledGraph(object):
+    """
+    A dependency_graph.DependencyGraph as arrays
+    """
+
+    def __init__(self, graph: dependency_graph.DependencyGraph) -> None:
+        graph.propagate()  # Which computes the levels
+        self.keys: typing.List[str] = sorted(graph.nodes, key=lambda key: (graph.nodes[key].level, key))
+        self.index: typing.Dict[str, int] = {key: i for i, key in enumerate(self.keys)}
+        self.own = np.array([graph.nodes[key].own_reliability for key in self.keys], dtype=np.float64)
+        by_level: typing.Dict[int, typing.List[str]] = dict()
+        for key in self.keys:
+            by_level.setdefault(graph.nodes[key].level, list()).append(key)
+        self.levels: typing.List[_Level] = list()
+        for level in sorted(by_level)[1:]:  # Nodes at level 0 require nothing
+            alternatives, requirement_starts, node_starts = [], [], []
+            for key in by_level[level]:
+                node_starts.append(len(requirement_starts))
+                for group in graph.nodes[key].requires:
+                    requirement_starts.append(len(alternatives))
+                    alternatives.extend(self.index[alternative] for alternative in group)
+            self.levels.append(_Level(np.array([self.index[key] for key in by_level[level]]), np.array(alternatives),
+                                      np.array(requirement_starts), np.array(node_starts)))
+
+    def reliability(self, own: np.ndarray = None) -> np.ndarray:
+        """
+        :param own: the own reliability of every node, in the order of keys, or one row of them per scenario.  If
+        None, the own reliabilities of the graph
+        :return: the reliability of every node taking what it requires into account, the same shape as own
+        """
+        r = np.array(self.own if own is None else own, dtype=np.float64)
+        for level in self.levels:
+            unreliable = np.multiply.reduceat(1.0 - r[..., level.alternatives], level.requirement_starts, axis=-1)
+            requirements = np.multiply.reduceat(1.0 - unreliable, level.node_starts, axis=-1)
+            r[..., level.nodes] *= requirements
+        return r
+
+    def simulate(self, trials: int = constants.RELIABILITY_TRIALS, own: np.ndarray = None,
+                 rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Monte Carlo: in each trial every node fails on its own with probability 1 - its own reliability, and a node
+        that works on its own still fails if all of the alternatives of one of its requirements failed
+
+        :param trials: how many times to fail the nodes
+        :param own: the own reliability of every node, in the order of keys.  If None, the graph's
+        :param rng: where the random numbers come from, e.g. np.random.default_rng(seed) for repeatable results
+        :return: the fraction of the trials in which each node worked
+        """
+        own = self.own if own is None else np.asarray(own, dtype=np.float64)
+        rng = np.random.default_rng() if rng is None else rng
+        working = np.zeros(len(self.keys), dtype=np.int64)
+        for start in range(0, trials, SIMULATION_CHUNK):
+            n = min(SIMULATION_CHUNK, trials - start)
+            up = rng.random((n, len(self.keys))) < own
+            for level in self.levels:
+                requirement_up = np.logical_or.reduceat(up[:, level.alternatives], level.requirement_starts, axis=1)
+                up[:, level.nodes] &= np.logical_and.reduceat(requirement_up, level.node_starts, axis=1)
+            working += up.sum(axis=0)
+        return working / trials
+
+    def as_dict(self, values: np.ndarray) -> typing.Dict[str, float]:
+        """
+        :param values: one value per node, e.g. what reliability or simulate returned
+        :return: the values keyed by node
+        """
+        return dict(zip(self.keys, values.tolist()))
+
+
+if __name__ == "__main__":
+    N = 1000000  # components, in groups of 10
+    rng = np.random.default_rng(1)
+    component_r = rng.uniform(0.9, 1.0, N)
+    component_groups = np.arange(N) // 10
+    t0 = time.perf_counter()
+    scalar = []
+    for g in range(N // 10):
+        total = reliability.Reliability(0.0)
+        for value in component_r[g * 10:(g + 1) * 10].tolist():
+            total = reliability.Reliability(total + value)
+        scalar.append(total.reliability)
+    t1 = time.perf_counter()
+    vectorized = group_parallel(component_r, component_groups)
+    t2 = time.perf_counter()
+    assert np.allclose(scalar, vectorized)
+    print(f"OR of {N // 10} groups of 10: reliability.Reliability took {(t1 - t0) * 1000.0:.0f} ms, group_parallel "
+          f"took {(t2 - t1) * 1000.0:.1f} ms", file=sys.stderr)
+
+    graph = dependency_graph.DependencyGraph()
+    graph.add("dns", node_reliability=0.999)
+    for i in range(1000):
+        graph.add(f"physicals/eth{i}", node_reliability=0.99)
+        graph.add(f"datalinks/eth{i}", node_reliability=0.999)
+        graph.require(f"datalinks/eth{i}", [f"physicals/eth{i}"])
+        for j in range(2):
+            graph.add(f"networks_4/route{i}.{j}", node_reliability=0.9999)
+            graph.require(f"networks_4/route{i}.{j}", [f"datalinks/eth{i}"])
+    graph.require("dns", ["networks_4/route0.0", "networks_4/route0.1"])
+    compiled = CompiledGraph(graph)
+    scenarios = np.tile(compiled.own, (100, 1))
+    scenarios[:, compiled.index["physicals/eth0"]] = np.linspace(0.5, 1.0, 100)
+    t3 = time.perf_counter()
+    compiled.reliability(scenarios)
+    t4 = time.perf_counter()
+    simulated = compiled.simulate(10000, rng=rng)
+    t5 = time.perf_counter()
+    print(f"{len(compiled.keys)} nodes: 100 what-if scenarios took {(t4 - t3) * 1000.0:.1f} ms, 10000 Monte Carlo "
+          f"trials took {(t5 - t4) * 1000.0:.0f} ms", file=sys.stderr)
+    # The two routes of dns share a datalink, so they are not independent and propagate overestimates dns
+    print(f"dns: propagated {graph.reliability('dns'):.6f}, simulated {simulated[compiled.index['dns']]:.6f}, "
+          f"exact {0.999 * 0.99 * 0.999 * (1 - (1 - 0.9999) ** 2):.6f}", file=sys.stderr)
@@ -0,0 +1,391 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Counts how often the routes to each prefix are added, deleted and changed, and which prefixes are flapping.  It
+# listens to a netlink_state.NetlinkStateCache, so it sees every RTM_NEWROUTE and RTM_DELROUTE that changed the model,
+# without opening another netlink socket.  An RTM_NEWROUTE is an add if the cache did not have that route (see
+# netlink_state.route_key) and a change if it did.
+#
+# A prefix that flaps gets a penalty, the way BGP route flap dampening does (RFC 2439): each event adds
+# constants.CHURN_PENALTIES of its kind, and the penalty halves every constants.CHURN_HALF_LIFE seconds.  The decay is
+# computed when the next event comes, from the time of the last one, so nothing has to run in between.  Above
+# constants.CHURN_SUPPRESS a prefix is flapping, and it stays flapping until its penalty decays below
+# constants.CHURN_REUSE.
+#
+# Update storms are what this is for, so the work per event is O(1): a few dictionary lookups, and an update of one
+# row of a few array.array columns, which take 31 bytes per prefix.  The top flapping prefixes are only found when the
+# monitor asks for them, with NumPy over the whole columns.  A prefix that has no routes any more is forgotten, and
+# its row reused, once its penalty has decayed to nothing.
+#
+# The cache does not send events for what changed across a resync, so after one, the routes that the cache has are
+# compared with the routes that were there before.
+
+import array
+import collections
+import sys
+import threading
+import time
+import typing
+
+import numpy as np
+
+import constants
+import netlink_backend
+import netlink_state
+import timing
+
+ADD = "add"
+DELETE = "delete"
+CHANGE = "change"
+KINDS = [ADD, DELETE, CHANGE]
+DEFAULT = "default"
+# A prefix with no routes and a penalty below this has been quiet long enough to forget
+FORGET_PENALTY = 1.0
+
+
+def route_fingerprint(route: dict) -> int:
+    """
+    :return: a hash of the attributes of route that make an RTM_NEWROUTE for a route that exists a change
+    """
+    return hash((route["type"], route["via"], route["dev"], route["proto"], route["scope"], route["src"],
+                 route["linkdown"], tuple((nexthop["via"], nexthop["dev"], nexthop["weight"])
+                                          for nexthop in route["nexthops"])))
+
+
+def gateways(route: dict) -> typing.List[str]:
+    """
+    :return: the gateway of route, or of every next hop of a multipath route
+    """
+    if len(route["nexthops"]) > 0:
+        return [nexthop["via"] for nexthop in route["nexthops"] if nexthop["via"] is not None]
+    return [] if route["via"] is None else [route["via"]]
+
+
+class RouteChurn(object):
+    """
+    Per prefix add, delete and change counters, and flap penalties
+    """
+
+    def __init__(self, penalties: typing.Dict[str, float] = None, half_life: float = constants.CHURN_HALF_LIFE,
+                 suppress: float = constants.CHURN_SUPPRESS, reuse: float = constants.CHURN_REUSE,
+                 max_penalty: float = constants.CHURN_MAX_PENALTY, top: int = constants.CHURN_TOP,
+                 interval: float = constants.CHURN_INTERVAL) -> None:
+        """
+        :param penalties: how much each kind of event adds to the penalty.  If None, constants.CHURN_PENALTIES
+        :param half_life: seconds for a penalty to decay to half
+        :param suppress: a prefix whose penalty goes above this is flapping...
+        :param reuse: ...until its penalty decays below this
+        :param top: how many prefixes the documents list
+        :param interval: seconds between documents, for whoever calls documents
+        """
+        self.penalties = penalties if penalties is not None else constants.CHURN_PENALTIES
+        self.half_life = half_life
+        self.suppress = suppress
+        self.reuse = reuse
+        self.max_penalty = max_penalty
+        self.top_n = top
+        self.interval = interval
+        # A row per prefix.  A prefix is keyed by (family, destination), and keys[row] is None if the row is free
+        self._rows: typing.Dict[typing.Tuple[str, str], int] = dict()
+        self.keys: typing.List[typing.Optional[typing.Tuple[str, str]]] = list()
+        self._free: typing.List[int] = list()
+        self.adds = array.array("I")
+        self.deletes = array.array("I")
+        self.changes = array.array("I")
+        self.present = array.array("H")  # How many routes the prefix has now, e.g. with different metrics
+        self.flapping = array.array("B")
+        self.penalty = array.array("d")  # As of updated
+        self.updated = array.array("d")  # time.monotonic() of the last event, 0.0 if there hasn't been one
+        # The fingerprint of every route, keyed by netlink_state.route_key, and the default routes themselves
+        self._routes: typing.Dict[tuple, int] = dict()
+        self._defaults: typing.Dict[tuple, dict] = dict()
+        self.events: typing.Counter[str] = collections.Counter()
+        self.events_ignored: int = 0
+        self.cache: netlink_state.NetlinkStateCache = None
+        self._loaded: bool = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _row(self, key: typing.Tuple[str, str]) -> int:
+        row = self._rows.get(key)
+        if row is not None:
+            return row
+        if len(self._free) > 0:
+            row = self._free.pop()
+            self.keys[row] = key
+            for column in [self.adds, self.deletes, self.changes, self.present, self.flapping]:
+                column[row] = 0
+            self.penalty[row] = self.updated[row] = 0.0
+        else:
+            row = len(self.keys)
+            self.keys.append(key)
+            for column in [self.adds, self.deletes, self.changes, self.present, self.flapping]:
+                column.append(0)
+            self.penalty.append(0.0)
+            self.updated.append(0.0)
+        self._rows[key] = row
+        return row
+
+    def _count(self, row: int, kind: str, when: float) -> None:
+        column = self.adds if kind == ADD else self.deletes if kind == DELETE else self.changes
+        column[row] += 1
+        penalty = self.penalty[row] * 2.0 ** (-(when - self.updated[row]) / self.half_life) if self.updated[row] \
+            else 0.0
+        if penalty < self.reuse:
+            self.flapping[row] = 0
+        penalty = min(penalty + self.penalties[kind], self.max_penalty)
+        if penalty > self.suppress:
+            self.flapping[row] = 1
+        self.penalty[row] = penalty
+        self.updated[row] = when
+        self.events[kind] += 1
+
+    def _apply(self, kind: str, route_key: tuple, route: dict, fingerprint: typing.Optional[int],
+               when: float) -> None:
+        row = self._row((route["family"], route["destination"]))
+        if kind == DELETE:
+            del self._routes[route_key]
+            self.present[row] -= 1
+            self._defaults.pop(route_key, None)
+        else:
+            self._routes[route_key] = fingerprint
+            if kind == ADD:
+                self.present[row] += 1
+            if route["destination"] == DEFAULT:
+                self._defaults[route_key] = route
+        self._count(row, kind, when)
+
+    def record_event(self, event: str, route: dict, when: float = None) -> typing.Optional[str]:
+        """
+        Count one netlink route event.  This is O(1)
+
+        :param event: "RTM_NEWROUTE" or "RTM_DELROUTE"
+        :param route: a route record, see netlink_backend.py
+        :param when: time.monotonic() of the event.  If None, now
+        :return: ADD, DELETE or CHANGE, or None if the event did not change anything
+        """
+        if event not in netlink_state.ROUTE_EVENTS or route["table"] != netlink_backend.RT_TABLE_MAIN:
+            self.events_ignored += 1
+            return None
+        when = time.monotonic() if when is None else when
+        route_key = netlink_state.route_key(route)
+        with self._lock:
+            old = self._routes.get(route_key)
+            if event == "RTM_DELROUTE":
+                if old is None:
+                    return None
+                kind, fingerprint = DELETE, None
+            else:
+                fingerprint = route_fingerprint(route)
+                if old == fingerprint:
+                    return None
+                kind = ADD if old is None else CHANGE
+            self._apply(kind, route_key, route, fingerprint, when)
+        return kind
+
+    def load(self, routes: typing.Iterable[dict]) -> None:
+        """
+        Start from routes, e.g. a full dump, without counting them as events
+        """
+        with self._lock:
+            for route in routes:
+                if route["table"] != netlink_backend.RT_TABLE_MAIN:
+                    continue
+                route_key = netlink_state.route_key(route)
+                if route_key not in self._routes:
+                    self.present[self._row((route["family"], route["destination"]))] += 1
+                self._routes[route_key] = route_fingerprint(route)
+                if route["destination"] == DEFAULT:
+                    self._defaults[route_key] = route
+            self._loaded = True
+
+    def reconcile(self, routes: typing.Iterable[dict], when: float = None) -> typing.Dict[str, int]:
+        """
+        Count the differences between the routes there were and routes, e.g. after a resync
+
+        :return: how many of each kind of event there were
+        """
+        when = time.monotonic() if when is None else when
+        current = {netlink_state.route_key(route): route for route in routes
+                   if route["table"] == netlink_backend.RT_TABLE_MAIN}
+        counts = collections.Counter()
+        with self._lock:
+            for route_key in [route_key for route_key in self._routes if route_key not in current]:
+                family, _, destination, _ = route_key
+                self._apply(DELETE, route_key, {"family": family, "destination": destination}, None, when)
+                counts[DELETE] += 1
+            for route_key, route in current.items():
+                fingerprint = route_fingerprint(route)
+                old = self._routes.get(route_key)
+                if old != fingerprint:
+                    kind = ADD if old is None else CHANGE
+                    self._apply(kind, route_key, route, fingerprint, when)
+                    counts[kind] += 1
+        return dict(counts)
+
+    def watch(self, cache: netlink_state.NetlinkStateCache) -> "RouteChurn":
+        """
+        Count the route events of cache from now on
+        """
+        self.cache = cache
+        cache.add_listener(self._on_event)
+        self.load(cache.dump().routes)
+        return self
+
+    def _on_event(self, event: str, record: typing.Optional[dict]) -> None:
+        if event == netlink_state.RESYNC:
+            routes = self.cache.dump().routes
+            if self._loaded:
+                self.reconcile(routes)
+            else:
+                self.load(routes)
+        elif event in netlink_state.ROUTE_EVENTS:
+            self.record_event(event, record)
+
+    def _decayed(self, when: float) -> np.ndarray:
+        """
+        :return: the penalty of every row as of when
+        """
+        updated = np.array(self.updated, dtype=np.float64)
+        return np.array(self.penalty, dtype=np.float64) * np.exp2(-(when - updated) / self.half_life)
+
+    def _describe(self, row: int, penalty: float, offset: float) -> dict:
+        family, destination = self.keys[row]
+        return {"family": family, "destination": destination, "adds": self.adds[row], "deletes": self.deletes[row],
+                "changes": self.changes[row], "routes": self.present[row], "penalty": round(penalty, 1),
+                "flapping": bool(self.flapping[row]) and penalty >= self.reuse,
+                "last_event": self.updated[row] + offset if self.updated[row] else None}
+
+    def top(self, n: int = None, when: float = None) -> typing.List[dict]:
+        """
+        :param n: how many prefixes.  If None, top_n
+        :return: the n prefixes with the highest penalties, highest first.  Prefixes with no penalty are left out
+        """
+        n = self.top_n if n is None else n
+        when = time.monotonic() if when is None else when
+        with self._lock:
+            if len(self.keys) == 0 or n <= 0:
+                return []
+            penalties = self._decayed(when)
+            rows = np.argpartition(-penalties, n - 1)[:n] if n < len(penalties) else np.arange(len(penalties))
+            rows = rows[np.argsort(-penalties[rows], kind="stable")]
+            offset = timing.anchor().offset
+            return [self._describe(int(row), float(penalties[row]), offset) for row in rows
+                    if penalties[row] > 0.0 and self.keys[row] is not None]
+
+    def default_route(self, when: float = None) -> typing.Dict[str, dict]:
+        """
+        :return: how stable the default route of each family is, keyed by family
+        """
+        when = time.monotonic() if when is None else when
+        offset = timing.anchor().offset
+        result = dict()
+        with self._lock:
+            for family in sorted(netlink_backend.FAMILY_NAMES.values()):
+                row = self._rows.get((family, DEFAULT))
+                routes = sorted((route for route in self._defaults.values() if route["family"] == family),
+                                key=lambda route: route["metric"])
+                if row is None:
+                    result[family] = {"gateways": [], "routes": 0, "changes": 0, "penalty": 0.0, "flapping": False,
+                                      "last_change": None, "seconds_since_change": None, "stable": False}
+                    continue
+                updated = self.updated[row]
+                penalty = self.penalty[row] * 2.0 ** (-(when - updated) / self.half_life) if updated else 0.0
+                flapping = bool(self.flapping[row]) and penalty >= self.reuse
+                since = when - updated if updated else None
+                result[family] = {"gateways": [gateway for route in routes for gateway in gateways(route)],
+                                  "routes": self.present[row],
+                                  "changes": self.adds[row] + self.deletes[row] + self.changes[row],
+                                  "penalty": round(penalty, 1), "flapping": flapping,
+                                  "last_change": updated + offset if updated else None,
+                                  "seconds_since_change": since,
+                                  "stable": self.present[row] > 0 and not flapping and
+                                  (since is None or since >= constants.CHURN_STABLE_AFTER)}
+        return result
+
+    def forget(self, when: float = None) -> int:
+        """
+        Free the rows of the prefixes that have no routes and whose penalties have decayed to nothing
+
+        :return: how many were forgotten
+        """
+        when = time.monotonic() if when is None else when
+        with self._lock:
+            if len(self.keys) == 0:
+                return 0
+            quiet = (np.array(self.present) == 0) & (self._decayed(when) < FORGET_PENALTY)
+            forgotten = 0
+            for row in np.flatnonzero(quiet).tolist():
+                key = self.keys[row]
+                if key is not None:
+                    del self._rows[key]
+                    self.keys[row] = None
+                    self._free.append(row)
+                    forgotten += 1
+            return forgotten
+
+    def documents(self) -> typing.Dict[str, dict]:
+        """
+        :return: what the monitor serves, keyed by path: /churn is the totals, the top flapping prefixes and the
+        default routes, and /churn/default is just the default routes
+        """
+        when = time.monotonic()
+        self.forget(when)
+        default_route = self.default_route(when)
+        return {"/churn": {"events": {kind: self.events[kind] for kind in KINDS}, "prefixes": len(self),
+                           "routes": len(self._routes), "top": self.top(when=when), "default": default_route},
+                "/churn/default": default_route}
+
+    def __str__(self) -> str:
+        return f"{len(self)} prefixes, {len(self._routes)} routes; {dict(self.events)} events, " \
+               f"{self.events_ignored} ignored"
+
+
+def start_churn() -> typing.Optional[RouteChurn]:
+    """
+    Count the route events of the shared backend, if it is a running netlink_state.NetlinkStateCache (see
+    netlink_state.start_cache)
+
+    :return: the RouteChurn, or None if there are no events to count
+    """
+    backend = netlink_backend.get_backend()
+    if not isinstance(backend, netlink_state.NetlinkStateCache) or not backend.running:
+        print("There is no netlink state cache, so route churn is not counted", file=sys.stderr)
+        return None
+    return RouteChurn().watch(backend)
+
+
+if __name__ == "__main__":
+    import random
+
+    N = 100000  # prefixes
+    EVENTS = 1000000
+    random.seed(1)
+    churn = RouteChurn()
+    records = [{"family": "inet", "type": "unicast", "destination": f"10.{i >> 8 & 255}.{i & 255}.0/24",
+                "via": "192.0.2.1", "dev": "eth0", "proto": "bgp", "scope": "global", "metric": i >> 16,
+                "src": None, "table": netlink_backend.RT_TABLE_MAIN, "linkdown": False, "pref": None, "flags": [],
+                "nexthops": []} for i in range(N)]
+    churn.load(records)
+    alternate = [dict(record, via="192.0.2.254") for record in records]
+    # Most of the events are for a few prefixes, the way a flapping link makes them
+    picks = [min(int(random.paretovariate(1.2)) - 1, N - 1) for _ in range(EVENTS)]
+    events = [("RTM_DELROUTE", records[i]) if random.random() < 0.3 else
+              ("RTM_NEWROUTE", alternate[i] if random.random() < 0.5 else records[i]) for i in picks]
+    t0 = time.perf_counter()
+    fake_time = 1.0
+    for event, record in events:
+        fake_time += 0.0001
+        churn.record_event(event, record, when=fake_time)
+    t1 = time.perf_counter()
+    print(f"{EVENTS} events for {N} prefixes in {t1 - t0:.2f} s: {EVENTS / (t1 - t0):.0f} events/s, "
+          f"{(t1 - t0) / EVENTS * 1e6:.2f} us/event", file=sys.stderr)
+    t2 = time.perf_counter()
+    top = churn.top(5, when=fake_time)
+    t3 = time.perf_counter()
+    print(f"The top 5 of {len(churn)} prefixes took {(t3 - t2) * 1000.0:.1f} ms", file=sys.stderr)
+    for prefix in top:
+        print(prefix)
+    print(churn)
@@ -0,0 +1,321 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Which route does traffic to an address use: the route with the longest prefix that contains the address, and of
+# the routes with that prefix, the one with the lowest metric.  routes.IPv4Route.discover returns a list, and
+# answering that question by scanning the list with ipaddress objects costs microseconds per route per address.
+#
+# A binary trie walked a bit at a time in Python costs a loop iteration per bit, up to 128 of them for IPv6, so
+# instead the routes are kept in one hash table per prefix length, keyed by the prefix as an int.  A lookup masks the
+# address to each prefix length that some route has, longest first, and stops at the first hit.  A routing table has
+# a handful of different prefix lengths even when it has a million routes, so that is a handful of dictionary
+# lookups.  For many addresses at once (e.g. every peer in a connection_table.ConnectionTable), each prefix length
+# also has its prefixes in a sorted NumPy array, and all of the addresses that are still unmatched are masked and
+# looked up with one np.searchsorted per prefix length.
+#
+# The index is updated in place: add and remove change one hash table, and update (give it the routes that were just
+# discovered) adds what is new and removes what is gone.  Only the arrays of the prefix lengths that changed are built
+# again, the next time that lookup_many is called.
+#
+# IPv4 and IPv6 are indexed separately, so that the IPv6 default route never matches an IPv4 mapped address.
+
+import ipaddress
+import socket
+import sys
+import time
+import typing
+
+import numpy as np
+
+ADDRESS_SIZES = {socket.AF_INET: 4, socket.AF_INET6: 16}
+IPV4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"  # The same as connection_table.IPV4_MAPPED_PREFIX
+
+
+def route_fields(route) -> typing.Tuple[int, str, str, typing.Optional[str], int]:
+    """
+    :param route: a routes.IPv4Route, a routes.IPv6Route, a route_table.CompactRoute or a route record from
+    netlink_backend
+    :return: (address family, destination as "prefix/length", device, gateway or None, metric)
+    """
+    if isinstance(route, dict):
+        family = socket.AF_INET6 if route["family"] == "inet6" else socket.AF_INET
+        destination, dev, gateway, metric = route["destination"], route["dev"], route["via"], route["metric"]
+    elif hasattr(route, "prefixlen"):
+        family = route.family
+        destination, dev, gateway, metric = route.destination, route.dev, route.gateway_address, route.metric
+    elif hasattr(route, "ipv4_destination"):
+        family = socket.AF_INET
+        destination, dev, gateway, metric = route.ipv4_destination, route.ipv4_dev, route.ipv4_gateway, \
+            route.ipv4_metric
+    else:
+        family = socket.AF_INET6
+        destination, dev, gateway, metric = route.ipv6_destination, route.ipv6_interface, route.ipv6_next_hop, \
+            route.ipv6_metric
+    if destination == "default":
+        destination = "0.0.0.0/0" if family == socket.AF_INET else "::/0"
+    return family, str(destination), dev, None if gateway is None else str(gateway), metric or 0
+
+
+class _Entry(object):
+    """
+    One route in the index
+    """
+    __slots__ = ["route", "key", "metric", "gateway", "dev", "sequence"]
+
+    def __init__(self, route, key: tuple, metric: int, gateway: typing.Optional[str], dev: str,
+                 sequence: int) -> None:
+        self.route = route
+        self.key = key  # (family, prefix, prefix length, device, metric), which identifies the route
+        self.metric = metric
+        self.gateway = gateway
+        self.dev = dev
+        self.sequence = sequence  # Of two routes with the same prefix and metric, the one added first wins
+
+
+class _FamilyIndex(object):
+    """
+    The routes of one address family, in a hash table per prefix length
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size  # bytes per address
+        self.bits = size * 8
+        # What the arrays hold: IPv4 prefixes are compared as ints, IPv6 prefixes as strings of bytes because NumPy
+        # has no 128 bit int
+        self.dtype = np.dtype(">u4") if size == 4 else np.dtype(f"S{size}")
+        self.masks = [((1 << length) - 1) << (self.bits - length) for length in range(self.bits + 1)]
+        self.byte_masks = [np.frombuffer(mask.to_bytes(size, "big"), dtype=np.uint8) for mask in self.masks]
+        # prefix length -> prefix -> the entries with that prefix, the best one first
+        self.tables: typing.Dict[int, typing.Dict[int, typing.List[_Entry]]] = dict()
+        self.lengths: typing.List[int] = list()  # The prefix lengths that have routes, longest first
+        # prefix length -> (sorted prefixes as self.dtype, the best entry of each).  Built by lookup_many
+        self.arrays: typing.Dict[int, typing.Tuple[np.ndarray, np.ndarray]] = dict()
+
+    def add(self, entry: _Entry, prefix: int, length: int) -> None:
+        table = self.tables.get(length)
+        if table is None:
+            table = self.tables[length] = dict()
+            self.lengths = sorted(self.tables, reverse=True)
+        entries = table.get(prefix)
+        if entries is None:
+            table[prefix] = [entry]
+        else:
+            entries.append(entry)
+            entries.sort(key=lambda e: (e.metric, e.sequence))
+        self.arrays.pop(length, None)
+
+    def remove(self, entry: _Entry, prefix: int, length: int) -> None:
+        table = self.tables[length]
+        entries = table[prefix]
+        entries.remove(entry)
+        if not entries:
+            del table[prefix]
+            if not table:
+                del self.tables[length]
+                self.lengths = sorted(self.tables, reverse=True)
+        self.arrays.pop(length, None)
+
+    def lookup(self, address: int) -> typing.Optional[_Entry]:
+        for length in self.lengths:
+            entries = self.tables[length].get(address & self.masks[length])
+            if entries is not None:
+                return entries[0]
+        return None
+
+    def _array(self, length: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+        arrays = self.arrays.get(length)
+        if arrays is None:
+            table = self.tables[length]
+            prefixes = sorted(table)
+            keys = np.frombuffer(b"".join(prefix.to_bytes(self.size, "big") for prefix in prefixes), dtype=self.dtype)
+            best = np.empty(len(prefixes), dtype=object)
+            best[:] = [table[prefix][0] for prefix in prefixes]
+            arrays = self.arrays[length] = (keys, best)
+        return arrays
+
+    def lookup_many(self, addresses: np.ndarray) -> np.ndarray:
+        """
+        :param addresses: one row of self.size bytes per address, in network byte order, as uint8
+        :return: the best entry for each address, None where no route matches
+        """
+        result = np.full(len(addresses), None, dtype=object)
+        unmatched = np.arange(len(addresses))
+        for length in self.lengths:
+            if len(unmatched) == 0:
+                break
+            keys, best = self._array(length)
+            masked = np.ascontiguousarray(addresses[unmatched] & self.byte_masks[length]).view(self.dtype).ravel()
+            positions = np.minimum(np.searchsorted(keys, masked), len(keys) - 1)
+            hit = keys[positions] == masked
+            result[unmatched[hit]] = best[positions[hit]]
+            unmatched = unmatched[~hit]
+        return result
+
+
+class RouteIndex(object):
+    """
+    Longest prefix match over IPv4 and IPv6 routes
+    """
+
+    def __init__(self, routes: typing.Iterable = ()) -> None:
+        """
+        :param routes: routes.IPv4Route, routes.IPv6Route, route_table.CompactRoute or netlink_backend route records,
+        in any mix, or a route_table.RouteTable
+        """
+        self.families = {family: _FamilyIndex(size) for family, size in ADDRESS_SIZES.items()}
+        self.entries: typing.Dict[tuple, _Entry] = dict()  # keyed by _Entry.key
+        self._sequence = 0
+        self.update(routes)
+
+    def _parse(self, route) -> typing.Tuple[tuple, int, int, int, str, typing.Optional[str], int]:
+        family, destination, dev, gateway, metric = route_fields(route)
+        address, _, length = destination.partition("/")
+        # Parsed with inet_pton rather than ipaddress, which is several times slower
+        address = int.from_bytes(socket.inet_pton(family, address), "big")
+        family_index = self.families[family]
+        length = int(length) if length else family_index.bits
+        prefix = address & family_index.masks[length]
+        return (family, prefix, length, dev, metric), family, prefix, length, dev, gateway, metric
+
+    def add(self, route) -> None:
+        """
+        Add a route.  If a route with the same prefix, device and metric is already in the index, it is replaced
+        """
+        key, family, prefix, length, dev, gateway, metric = self._parse(route)
+        old = self.entries.get(key)
+        if old is not None:
+            if old.gateway == gateway:
+                old.route = route  # Nothing that the lookups use has changed, so the arrays don't change
+                return
+            self.families[family].remove(old, prefix, length)
+        self._sequence += 1
+        entry = self.entries[key] = _Entry(route, key, metric, gateway, dev, self._sequence)
+        self.families[family].add(entry, prefix, length)
+
+    def remove(self, route) -> None:
+        """
+        Remove the route with the same prefix, device and metric as route.  KeyError if there isn't one
+        """
+        key, family, prefix, length, _, _, _ = self._parse(route)
+        entry = self.entries.pop(key)
+        self.families[family].remove(entry, prefix, length)
+
+    def update(self, routes: typing.Iterable) -> typing.Tuple[int, int]:
+        """
+        Make the index hold exactly routes, changing only what changed
+
+        :return: how many routes were added or changed, and how many were removed
+        """
+        seen = set()
+        added = 0
+        for route in routes:
+            key, _, _, _, _, gateway, _ = self._parse(route)
+            seen.add(key)
+            old = self.entries.get(key)
+            if old is None or old.gateway != gateway:
+                added += 1
+            self.add(route)
+        gone = [entry for key, entry in self.entries.items() if key not in seen]
+        for entry in gone:
+            self.remove(entry.route)
+        return added, len(gone)
+
+    def lookup(self, address: str):
+        """
+        :param address: an IPv4 or IPv6 address.  An IPv4 mapped IPv6 address is looked up as IPv4
+        :return: the route that traffic to address uses, None if there isn't one
+        """
+        entry = self._lookup_entry(address)
+        return None if entry is None else entry.route
+
+    def next_hop(self, address: str) -> typing.Optional[typing.Tuple[typing.Optional[str], str]]:
+        """
+        :return: (gateway, device) for traffic to address.  The gateway is None if address is on the link.  None if
+        there is no route
+        """
+        entry = self._lookup_entry(address)
+        return None if entry is None else (entry.gateway, entry.dev)
+
+    def _lookup_entry(self, address: str) -> typing.Optional[_Entry]:
+        packed = pack(address)
+        if packed.startswith(IPV4_MAPPED_PREFIX):
+            return self.families[socket.AF_INET].lookup(int.from_bytes(packed[12:], "big"))
+        return self.families[socket.AF_INET6].lookup(int.from_bytes(packed, "big"))
+
+    def lookup_many(self, addresses) -> list:
+        """
+        :param addresses: a list of address strings, or bytes of packed 16 byte addresses, IPv4 ones mapped to IPv6,
+        like connection_table.ConnectionTable.remote_addresses
+        :return: the route for each address, None where there isn't one
+        """
+        if isinstance(addresses, (bytes, bytearray, memoryview)):
+            packed = np.frombuffer(addresses, dtype=np.uint8).reshape(-1, 16)
+        else:
+            packed = np.frombuffer(b"".join(pack(address) for address in addresses),
+                                   dtype=np.uint8).reshape(-1, 16)
+        result = np.full(len(packed), None, dtype=object)
+        is_ipv4 = (packed[:, :12] == np.frombuffer(IPV4_MAPPED_PREFIX, dtype=np.uint8)).all(axis=1)
+        for family, rows, columns in [(socket.AF_INET, np.flatnonzero(is_ipv4), slice(12, 16)),
+                                      (socket.AF_INET6, np.flatnonzero(~is_ipv4), slice(0, 16))]:
+            if len(rows) > 0:
+                result[rows] = self.families[family].lookup_many(packed[rows, columns])
+        return [None if entry is None else entry.route for entry in result.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def pack(address: str) -> bytes:
+    """
+    :return: address as 16 bytes, an IPv4 address mapped to IPv6
+    """
+    address = address.split("%", 1)[0]
+    if ":" in address:
+        return socket.inet_pton(socket.AF_INET6, address)
+    return IPV4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, address)
+
+
+if __name__ == "__main__":
+    import random
+    N = 100000
+    random.seed(1)
+    synthetic = [{"family": "inet", "destination": "default", "dev": "eth0", "via": "192.0.2.1", "metric": 100}]
+    for i in range(N):
+        length = random.choice([16, 20, 22, 24, 24, 24, 28, 32])
+        network = ipaddress.ip_network((random.getrandbits(32) >> (32 - length)) << (32 - length))
+        network = ipaddress.ip_network(f"{network.network_address}/{length}")
+        synthetic.append({"family": "inet", "destination": str(network), "dev": f"eth{i % 4}",
+                          "via": f"10.0.{i % 4}.1", "metric": i % 3})
+    t0 = time.perf_counter()
+    index = RouteIndex(synthetic)
+    t1 = time.perf_counter()
+    queries = [str(ipaddress.IPv4Address(random.getrandbits(32))) for _ in range(N)]
+    t2 = time.perf_counter()
+    one_at_a_time = [index.lookup(query) for query in queries]
+    t3 = time.perf_counter()
+    packed_queries = b"".join(pack(query) for query in queries)
+    t4 = time.perf_counter()
+    batch = index.lookup_many(packed_queries)
+    t5 = time.perf_counter()
+    batch_again = index.lookup_many(packed_queries)
+    t6 = time.perf_counter()
+    assert batch == one_at_a_time == batch_again
+    print(f"Indexed {len(index)} routes in {(t1 - t0) * 1000.0:.0f} ms.  {N} lookups: "
+          f"{(t3 - t2) / N * 1e6:.2f} us each one at a time, {(t5 - t4) / N * 1e6:.2f} us each in a batch that "
+          f"built the arrays, {(t6 - t5) / N * 1e6:.2f} us each in the next batch", file=sys.stderr)
+    linear = sorted(synthetic[:1000], key=lambda r: -ipaddress.ip_network(route_fields(r)[1]).prefixlen)
+    t7 = time.perf_counter()
+    for query in queries[:1000]:
+        ip = ipaddress.ip_address(query)
+        next(r for r in linear if ip in ipaddress.ip_network(route_fields(r)[1]))
+    t8 = time.perf_counter()
+    print(f"A linear scan of only 1000 routes with ipaddress takes {(t8 - t7) / 1000 * 1e6:.0f} us per lookup",
+          file=sys.stderr)
+
+    import connection_table
+    import netlink_backend
+    live = RouteIndex(netlink_backend.dump().routes)
+    table = connection_table.ConnectionTable.from_kernel()
+    for peer, peer_route in zip(range(len(table)), live.lookup_many(table.remote_addresses)):
+        print(f"{connection_table.unpack(table.remote_address(peer), table.families[peer])}: "
+              f"{None if peer_route is None else route_fields(peer_route)}")
@@ -0,0 +1,279 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Parses the output of the ip route list command into route records (see netlink_backend.py for what a record looks
+# like), as the output comes.  stream_routes reads the pipe from the ip command a line at a time and yields each
+# record as soon as it is complete, so the first route is available before the command has finished, and a table of
+# a million routes never exists as one string, or as a list of lines, or as a list of records, unless the caller
+# makes one.  Memory use stays flat however many routes there are.
+#
+# Every keyword of ip route is understood:
+#
+#   a route type before the destination            unreachable 192.0.2.0/24, blackhole default, local ::1 ...
+#   keywords that are followed by a value           via, dev, proto, scope, metric, src, table, pref, expires, mtu...
+#   flags, which are not                            linkdown, onlink, dead, pervasive, offload, trap...
+#   a multipath route, whose next hops are on the lines after it, indented:
+#       default proto static metric 100
+#               nexthop via 192.0.2.1 dev eth0 weight 1
+#               nexthop via 192.0.2.254 dev eth1 weight 1 linkdown
+#
+# metric, table, weight and nhid are ints, and expires is an int number of seconds.  A value keyword that
+# netlink_backend.NetlinkBackend does not report (expires, mtu, hoplimit...) is only in the record if the route has it.
+
+import subprocess
+import sys
+import threading
+import time
+import typing
+
+import configuration
+import constants
+import osclinter
+
+RT_TABLE_MAIN = 254  # The same as netlink_backend.RT_TABLE_MAIN
+
+ROUTE_TYPES = {"unicast", "local", "broadcast", "multicast", "anycast", "throw", "unreachable", "prohibit",
+               "blackhole", "nat", "xresolve"}
+# Keywords that are followed by a value
+ROUTE_VALUE_KEYWORDS = {"via", "dev", "proto", "scope", "metric", "src", "table", "pref", "expires", "mtu", "advmss",
+                        "hoplimit", "from", "tos", "realm", "realms", "weight", "error", "nhid", "rtt", "rttvar",
+                        "reordering", "window", "cwnd", "initcwnd", "initrwnd", "ssthresh", "rto_min", "features",
+                        "quickack", "congctl", "fastopen_no_cookie", "ttl-propagate", "as", "encap"}
+NEXTHOP_VALUE_KEYWORDS = {"via", "dev", "weight"}
+INT_KEYWORDS = {"metric", "table", "weight", "nhid"}
+# Keywords whose value may be preceded by "lock", e.g. mtu lock 1400
+LOCKABLE_KEYWORDS = {"mtu", "advmss", "window", "cwnd", "initcwnd", "initrwnd", "ssthresh", "rtt", "rttvar",
+                     "reordering", "hoplimit", "rto_min"}
+# Families that may come between via and the address, e.g. via inet6 fe80::1 for an IPv4 route
+VIA_FAMILIES = {"inet", "inet6", "mpls", "bridge", "link"}
+
+
+def _value(keyword: str, fields: typing.List[str], i: int) -> typing.Tuple[typing.Any, int]:
+    """
+    :param i: the index of keyword in fields
+    :return: the value of keyword, converted, and the index of the last field that it used
+    """
+    i += 1
+    value = fields[i]
+    if (keyword == "via" and value in VIA_FAMILIES or keyword in LOCKABLE_KEYWORDS and value == "lock") \
+            and i + 1 < len(fields):
+        i += 1
+        value = fields[i]
+    if keyword in INT_KEYWORDS and value.isdigit():
+        return int(value), i
+    if keyword == "expires" and value.endswith("sec") and value[:-3].lstrip("-").isdigit():
+        return int(value[:-3]), i
+    return value, i
+
+
+def parse_route_line(line: str, family: str) -> dict:
+    """
+    :param line: one line of the output of the ip route list command, e.g.
+    10.0.3.0/24 dev lxcbr0 proto kernel scope link src 10.0.3.1 linkdown
+    :param family: "inet" or "inet6"
+    :return: a route record, without its next hops if it is a multipath route, see parse_nexthop_line
+    """
+    fields = line.split()
+    route_type = "unicast"
+    if fields[0] in ROUTE_TYPES:
+        route_type = fields.pop(0)
+    record = {"family": family, "type": route_type, "destination": fields[0], "via": None, "dev": None,
+              "proto": "boot", "scope": "global", "metric": 0, "src": None, "table": RT_TABLE_MAIN,
+              "linkdown": False, "pref": None, "flags": [], "nexthops": []}
+    i = 1
+    while i < len(fields):
+        keyword = fields[i]
+        if keyword in ROUTE_VALUE_KEYWORDS and i + 1 < len(fields):
+            record[keyword], i = _value(keyword, fields, i)
+        else:
+            record["flags"].append(keyword)
+            if keyword == "linkdown":
+                record["linkdown"] = True
+        i += 1
+    return record
+
+
+def parse_nexthop_line(line: str) -> dict:
+    """
+    :param line: one of the indented lines after a multipath route, e.g.  nexthop via 192.0.2.1 dev eth0 weight 1
+    :return: a next hop, {"via": "192.0.2.1", "dev": "eth0", "weight": 1, "flags": []}
+    """
+    fields = line.split()
+    nexthop = {"via": None, "dev": None, "weight": 1, "flags": []}
+    i = 1 if fields[0] == "nexthop" else 0
+    while i < len(fields):
+        keyword = fields[i]
+        if keyword in NEXTHOP_VALUE_KEYWORDS and i + 1 < len(fields):
+            nexthop[keyword], i = _value(keyword, fields, i)
+        else:
+            nexthop["flags"].append(keyword)
+        i += 1
+    return nexthop
+
+
+def parse_routes(lines: typing.Iterable[str], family: str) -> typing.Iterator[dict]:
+    """
+    :param lines: the output of ip route list, a line at a time, with or without the newlines
+    :return: the route records, each one as soon as the line after it shows that it has no more next hops
+    """
+    record = None
+    for line in lines:
+        if len(line) == 0 or line.isspace():
+            continue
+        if line[0] in " \t":
+            if record is not None:
+                record["nexthops"].append(parse_nexthop_line(line))
+            continue
+        if record is not None:
+            yield record
+        record = parse_route_line(line, family)
+    if record is not None:
+        yield record
+
+
+class _IdleWatchdog(object):
+    """
+    Kills a process when reading its output has waited too long for a line.  Only the time spent waiting counts: the
+    time the caller spends on each route is not the command's fault, and while the caller is busy the pipe fills up and
+    the command has to wait for it anyway.  A generator can't wait for a readline and a timer at once, so this thread
+    kills the command, which ends the readline
+    """
+
+    def __init__(self, process: subprocess.Popen, timeout: float) -> None:
+        self.process = process
+        self.timeout = timeout
+        self.waiting_since: typing.Optional[float] = None  # When the readline that is waiting started, if one is
+        self.timed_out = False
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._watch, name="route_parser watchdog", daemon=True)
+        self._thread.start()
+
+    def lines(self, stream: typing.IO[str]) -> typing.Iterator[str]:
+        while True:
+            self.waiting_since = time.monotonic()
+            line = stream.readline()
+            self.waiting_since = None
+            if not line:
+                return
+            yield line
+
+    def _watch(self) -> None:
+        wait = self.timeout
+        while not self._done.wait(wait):
+            waiting_since = self.waiting_since
+            if waiting_since is None:
+                wait = self.timeout / 4.0  # The caller is busy with a route
+                continue
+            wait = waiting_since + self.timeout - time.monotonic()
+            if wait <= 0.0:
+                self.timed_out = True
+                self.process.kill()
+                return
+
+    def stop(self) -> None:
+        self._done.set()
+
+
+def stream_command(command: typing.List[str], family: str,
+                   timeout: float = constants.COMMAND_TIMEOUT) -> typing.Iterator[dict]:
+    """
+    Run command, which prints routes like ip route list does, and parse its output as it comes
+
+    :param timeout: seconds.  If the command doesn't print a line for this long, it is killed and
+    subprocess.TimeoutExpired is raised.  The time that the caller takes between routes doesn't count.  The routes
+    that were yielded before then stay yielded
+    :return: the route records.  subprocess.CalledProcessError after the last one if the command failed
+    """
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, shell=False, encoding="utf-8", errors="replace")
+    except OSError:
+        osclinter.OsCliInter._record(command, time.monotonic() - start, failed=True)
+        raise
+    watchdog = _IdleWatchdog(process, timeout) if timeout is not None else None
+    finished = False
+    try:
+        yield from parse_routes(process.stdout if watchdog is None else watchdog.lines(process.stdout), family)
+        finished = True
+    finally:
+        if watchdog is not None:
+            watchdog.stop()
+        if not finished:
+            process.kill()  # The caller stopped early
+        stderr = process.stderr.read()
+        process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        timed_out = watchdog is not None and finished and watchdog.timed_out
+        osclinter.OsCliInter._record(command, time.monotonic() - start, timed_out=timed_out)
+    if timed_out:
+        raise subprocess.TimeoutExpired(command, timeout, stderr=stderr)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+
+
+def stream_routes(family: str = "inet", ip_command: str = configuration.IP_COMMAND, table: str = None,
+                  timeout: float = constants.COMMAND_TIMEOUT) -> typing.Iterator[dict]:
+    """
+    :param family: "inet" or "inet6"
+    :param table: e.g. "all" or "local".  If None, the main table
+    :return: the routes, from ip route list, as they come.  See stream_command
+    """
+    command = [ip_command, "--family", family, "route", "list"]
+    if table is not None:
+        command += ["table", table]
+    return stream_command(command, family, timeout=timeout)
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+    import tracemalloc
+
+    N = 1000000
+    random.seed(1)
+    fake_ip_route = os.path.join(tempfile.mkdtemp(), "ip_route.txt")
+    with open(fake_ip_route, "w") as f:
+        f.write("default proto static metric 100\n\tnexthop via 192.0.2.1 dev eth0 weight 1\n"
+                "\tnexthop via 192.0.2.254 dev eth1 weight 1 linkdown\n")
+        for n in range(N):
+            length = random.choice([16, 20, 22, 24, 24, 24])
+            prefix = (random.getrandbits(32) >> (32 - length)) << (32 - length)
+            f.write(f"{prefix >> 24}.{prefix >> 16 & 255}.{prefix >> 8 & 255}.{prefix & 255}/{length} "
+                    f"via 192.0.2.{1 + n % 4} dev eth{n % 4} proto bgp metric 20\n")
+    cat = ["cat", fake_ip_route]
+
+    t0 = time.perf_counter()
+    first = next(stream_command(cat, "inet"))
+    t1 = time.perf_counter()
+    count = sum(1 for _ in stream_command(cat, "inet"))
+    t2 = time.perf_counter()
+    print(f"Streamed {count} routes in {t2 - t1:.2f} s, {(t2 - t1) / count * 1e6:.2f} us/route.  The first one took "
+          f"{(t1 - t0) * 1000.0:.1f} ms: {first}", file=sys.stderr)
+
+    SAMPLE = 200000  # tracemalloc makes everything slower, so measure the memory on fewer routes
+    with open(fake_ip_route) as f:
+        sample = "".join(f.readline() for _ in range(SAMPLE))
+    sample_file = fake_ip_route + ".sample"
+    with open(sample_file, "w") as f:
+        f.write(sample)
+    del sample
+    tracemalloc.start()
+    for _ in stream_command(["cat", sample_file], "inet"):
+        pass
+    _, streaming_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracemalloc.start()
+    # run_command truncates the output to constants.COMMAND_MAX_OUTPUT, which a big table is bigger than
+    stdout, _, _ = osclinter.OsCliInter.run_command(["cat", sample_file], max_output=os.path.getsize(sample_file))
+    all_at_once = list(parse_routes(stdout.split("\n"), "inet"))
+    _, all_at_once_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Peak memory for {SAMPLE} routes: streaming {streaming_peak / 1e6:.1f} MB, reading all of the output and "
+          f"then parsing it {all_at_once_peak / 1e6:.1f} MB", file=sys.stderr)
+    os.remove(fake_ip_route)
+    os.remove(sample_file)
+    for route in stream_routes("inet"):
+        print(route)
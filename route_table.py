@@ -0,0 +1,256 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# A routing table that can hold a full BGP table, 900,000 IPv4 routes or more.  routes.IPv4Route is a Layer with a
+# dozen attributes in a __dict__, two ipaddress objects and a timestamp, which is around a kilobyte per route and
+# takes tens of microseconds to build.  Here, like connection_table.ConnectionTable, each field of a route is a column:
+# the destination, gateway and source addresses are packed 16 bytes apiece into a bytearray (IPv4 ones as IPv4
+# mapped IPv6 addresses, so both families fit the same columns), the prefix length, metric and flags are
+# array.array columns, and the device, protocol and scope, which only take a few different values, are stored as the
+# index of the name in a list of names that every route shares.  That is about 60 bytes per route.
+#
+# CompactRoute objects, which have __slots__ and print the same as routes.IPv4Route, are only made for the rows that
+# a caller asks for.
+
+import array
+import socket
+import sys
+import time
+import typing
+
+ADDRESS_SIZE = 16
+IPV4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff\xff"
+UNSPECIFIED = b"\x00" * ADDRESS_SIZE
+FAMILY_NAMES = {socket.AF_INET: "inet", socket.AF_INET6: "inet6"}
+FAMILIES = {name: family for family, name in FAMILY_NAMES.items()}
+
+# The bits of the flags column
+HAS_GATEWAY = 0x1
+HAS_SRC = 0x2
+LINKDOWN = 0x4
+
+
+def pack(address: typing.Optional[str], family: int) -> bytes:
+    """
+    :return: address in the 16 byte form that the table stores, UNSPECIFIED for None
+    """
+    if address is None:
+        return UNSPECIFIED
+    packed = socket.inet_pton(family, address)
+    return IPV4_MAPPED_PREFIX + packed if family == socket.AF_INET else packed
+
+
+def unpack(packed: bytes, family: int) -> str:
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class CompactRoute(object):
+    """
+    One route of a RouteTable.  Addresses are ints, not ipaddress objects, and the names are the table's
+    """
+    __slots__ = ["family", "prefix", "prefixlen", "gateway", "dev", "metric", "proto", "scope", "src", "linkdown"]
+
+    def __init__(self, family: int, prefix: int, prefixlen: int, gateway: typing.Optional[int], dev: str,
+                 metric: int = 0, proto: str = None, scope: str = None, src: typing.Optional[int] = None,
+                 linkdown: bool = False) -> None:
+        """
+        :param prefix: the destination network address as an int, 32 bits for IPv4 and 128 for IPv6
+        :param gateway: the gateway address as an int, None if the destination is on the link
+        """
+        self.family = family
+        self.prefix = prefix
+        self.prefixlen = prefixlen
+        self.gateway = gateway
+        self.dev = dev
+        self.metric = metric
+        self.proto = proto
+        self.scope = scope
+        self.src = src
+        self.linkdown = linkdown
+
+    def _address(self, value: typing.Optional[int]) -> typing.Optional[str]:
+        if value is None:
+            return None
+        size = 4 if self.family == socket.AF_INET else ADDRESS_SIZE
+        return socket.inet_ntop(self.family, value.to_bytes(size, "big"))
+
+    @property
+    def destination(self) -> str:
+        return f"{self._address(self.prefix)}/{self.prefixlen}"
+
+    @property
+    def gateway_address(self) -> typing.Optional[str]:
+        return self._address(self.gateway)
+
+    @property
+    def src_address(self) -> typing.Optional[str]:
+        return self._address(self.src)
+
+    def __str__(self):
+        # The same as routes.IPv4Route.__str__
+        return f"dest={self.destination} gateway={self.gateway_address} " \
+               f"dev={self.dev} " \
+               f"metric={self.metric} proto={self.proto} " \
+               f"src={self.src_address} scope={self.scope} " + \
+               ("linkdown" if self.linkdown else "linkUP")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CompactRoute) and all(getattr(self, name) == getattr(other, name)
+                                                       for name in self.__slots__)
+
+
+class RouteTable(object):
+    """
+    A columnar table of routes
+    """
+
+    def __init__(self) -> None:
+        self.families = array.array("B")
+        self.prefixlens = array.array("B")
+        self.metrics = array.array("I")
+        self.flags = array.array("B")  # HAS_GATEWAY, HAS_SRC and LINKDOWN
+        self.devs = array.array("H")  # Indexes into names
+        self.protos = array.array("H")
+        self.scopes = array.array("H")
+        self.destinations = bytearray()
+        self.gateways = bytearray()
+        self.srcs = bytearray()
+        # Every device, protocol and scope name once.  None is always 0
+        self.names: typing.List[typing.Optional[str]] = [None]
+        self._name_ids: typing.Dict[typing.Optional[str], int] = {None: 0}
+
+    def __len__(self) -> int:
+        return len(self.prefixlens)
+
+    def _name_id(self, name: typing.Optional[str]) -> int:
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(sys.intern(name))
+        return name_id
+
+    def add(self, family: int, destination: str, dev: str, gateway: str = None, metric: int = 0, proto: str = None,
+            scope: str = None, src: str = None, linkdown: bool = False) -> int:
+        """
+        Add one route
+
+        :param destination: "default", an address, or an address and a prefix length, e.g. "192.0.2.0/24"
+        :param gateway: the address of the gateway, None if the destination is on the link
+        :return: the row number of the new route
+        """
+        if destination == "default":
+            address, prefixlen = None, 0
+        else:
+            address, _, length = destination.partition("/")
+            prefixlen = int(length) if length else (32 if family == socket.AF_INET else 128)
+        row = len(self.prefixlens)
+        self.families.append(family)
+        self.prefixlens.append(prefixlen)
+        self.metrics.append(metric or 0)
+        self.flags.append((HAS_GATEWAY if gateway is not None else 0) | (HAS_SRC if src is not None else 0) |
+                          (LINKDOWN if linkdown else 0))
+        self.devs.append(self._name_id(dev))
+        self.protos.append(self._name_id(proto))
+        self.scopes.append(self._name_id(scope))
+        self.destinations += pack(address, family) if address is not None else \
+            (IPV4_MAPPED_PREFIX + b"\x00" * 4 if family == socket.AF_INET else UNSPECIFIED)
+        self.gateways += pack(gateway, family)
+        self.srcs += pack(src, family)
+        return row
+
+    def add_record(self, record: dict) -> int:
+        """
+        Add a route record from netlink_backend
+        """
+        family = FAMILIES[record["family"]]
+        return self.add(family, record["destination"], record["dev"], record.get("via"), record.get("metric"),
+                        record.get("proto"), record.get("scope"), record.get("src"), record.get("linkdown", False))
+
+    @classmethod
+    def from_records(cls, records: typing.Iterable[dict]) -> 'RouteTable':
+        table = cls()
+        for record in records:
+            table.add_record(record)
+        return table
+
+    @classmethod
+    def from_kernel(cls) -> 'RouteTable':
+        """
+        :return: the routes of the main routing table, IPv4 and IPv6
+        """
+        import netlink_backend
+        return cls.from_records(netlink_backend.dump().routes)
+
+    def _int(self, column: bytearray, row: int, family: int) -> int:
+        offset = row * ADDRESS_SIZE
+        start = offset + 12 if family == socket.AF_INET else offset
+        return int.from_bytes(column[start:offset + ADDRESS_SIZE], "big")
+
+    def route(self, row: int) -> CompactRoute:
+        """
+        :return: the route in row
+        """
+        family = socket.AddressFamily(self.families[row])
+        flags = self.flags[row]
+        return CompactRoute(family, self._int(self.destinations, row, family), self.prefixlens[row],
+                            self._int(self.gateways, row, family) if flags & HAS_GATEWAY else None,
+                            self.names[self.devs[row]], self.metrics[row], self.names[self.protos[row]],
+                            self.names[self.scopes[row]],
+                            self._int(self.srcs, row, family) if flags & HAS_SRC else None, bool(flags & LINKDOWN))
+
+    def __getitem__(self, row: int) -> CompactRoute:
+        if not -len(self) <= row < len(self):
+            raise IndexError(f"There are {len(self)} routes, there is no route {row}")
+        return self.route(row % len(self))
+
+    def __iter__(self) -> typing.Iterator[CompactRoute]:
+        return (self.route(row) for row in range(len(self)))
+
+    def nbytes(self) -> int:
+        """
+        :return: how many bytes the columns take, not counting the names
+        """
+        return sum(len(column) * column.itemsize for column in
+                   [self.families, self.prefixlens, self.metrics, self.flags, self.devs, self.protos, self.scopes]) + \
+            len(self.destinations) + len(self.gateways) + len(self.srcs)
+
+
+if __name__ == "__main__":
+    import random
+    import tracemalloc
+
+    import routes
+
+    N = 1000000
+    random.seed(1)
+    records = []
+    for i in range(N):
+        length = random.choice([16, 19, 20, 22, 23, 24, 24, 24, 24])
+        prefix = (random.getrandbits(32) >> (32 - length)) << (32 - length)
+        records.append({"family": "inet", "destination": f"{socket.inet_ntoa(prefix.to_bytes(4, 'big'))}/{length}",
+                        "dev": f"eth{i % 4}", "via": f"192.0.2.{1 + i % 4}", "metric": 20, "proto": "bgp",
+                        "scope": None, "src": None, "linkdown": False})
+
+    def measure(name: str, build: typing.Callable, n: int):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        built = build()
+        elapsed = time.perf_counter() - t0
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name:34s} {n} routes: {size / n:6.0f} bytes/route, {elapsed / n * 1e6:5.2f} us/route "
+              f"(slower than usual, because of tracemalloc)", file=sys.stderr)
+        return built
+
+    SAMPLE = 20000  # routes.IPv4Route is too slow and too big to build a million of
+    ipv4_routes = measure("list of routes.IPv4Route", lambda: [routes.IPv4Route(r) for r in records[:SAMPLE]], SAMPLE)
+    table = measure("RouteTable", lambda: RouteTable.from_records(records), N)
+    print(f"The columns of the RouteTable take {table.nbytes() / N:.0f} bytes/route", file=sys.stderr)
+    assert str(table[0]) == str(ipv4_routes[0]), f"{table[0]} is not {ipv4_routes[0]}"
+    t0 = time.perf_counter()
+    for _ in table:
+        pass
+    print(f"Iterating over the RouteTable takes {(time.perf_counter() - t0) / N * 1e6:.2f} us/route", file=sys.stderr)
+    print(table[0])
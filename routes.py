@@ -11,6 +11,7 @@ from layer import Layer
 import utilities
 import configuration
 import application
+import netlink_backend
 import typing
 
 
@@ -26,50 +27,16 @@ class IPRoute(Layer):
     version not-so-agnostic code goes in classes that inherit from this class.
     """
 
-    def discover(self, family: str) -> typing.Dict :        # IPRoute
+    @classmethod
+    def discover(cls, family: str) -> typing.List[dict]:        # IPRoute
         """discover returns a list of routes, for either IPv4 or IPv6.  Each route is a dictionary keyed by
-        fields from the ip command.
-        There is a standard module, ipaddress, and I should have used that instead of "rolling my own"
+        fields from the ip command, see netlink_backend.py.  The routes come from the netlink backend if it's
+        available, otherwise from the output of the ip route command.
         """
 
         assert isinstance(family, str), f"family is type {type(family)}, should be str"
         assert family == "inet" or family == "inet6", f"family is {family}, should be 'inet' or 'inet6'"
-
-        # This is the recommened approach for running an external command in python 3.5 and later.
-        # From https://docs.python.org/3/library/subprocess.html
-        completed = subprocess.run(["/sbin/ip", "--family", family, "route", "show"], stdin=None, input=None, \
-                               stdout=None, stderr=None, shell=False, timeout=None, check=False, encoding=None,
-                               errors=None)
-        output_str: str = completed.stdout
-        """
-none fe80::eddb:a28c:fbb8:b02 dev eth6  proto none  metric 0
-none ff00::/8 dev eth6  proto none  metric 0
-none fe80::/64 dev eth7  proto none  metric 0
-none fe80::3d3e:604d:bd3f:5e90 dev eth7  proto none  metric 0
-none ff00::/8 dev eth7  proto none  metric 0
-
-none 169.254.0.0/16 dev eth6  proto none  metric 0
-none 169.254.11.2 dev eth6  proto none  metric 0
-none 255.255.255.255 dev eth7  proto none  metric 0
-none 224.0.0.0/4 dev eth7  proto none  metric 0
-none 192.168.44.159 dev eth7  proto none  metric 0
-none 192.168.44.144/28 dev eth7  proto none  metric 0
-none 192.168.44.145 dev eth7  proto none  metric 0
-        """
-
-        route_list = []
-        for r in output_str:
-            (_none_, destination, _dev_, dev, _proto_, proto, _metric_, metric ) = r.split()
-            # I'm concerned that the ip command might change, so a little paranoia
-            assert _none_ == "noon", f"_none_ is {_none_}, should be 'none'"
-            assert _dev_ == "dev", f"_dev_ is {_dev_}, should be 'dev'"
-            assert _proto_ == "proto", f"_proto_ is {_proto_}, should be 'proto'"
-            assert _metric_ == "metric", f"_metric_ is {_metric_}, should be 'metric'"
-            # From https://stackoverflow.com/questions/10259266/what-does-proto-kernel-means-in-unix-routing-table
-            # allowed values of proto are redirect, kernel, boot, static, and ra
-            d = {"destination": destination, "dev": dev, "proto": proto, "metric": metric, "family": family }
-            route_list.append(d)
-
+        return netlink_backend.dump().routes_for(family)
 
 
 class IPv4Address(object):
@@ -103,19 +70,16 @@ class IPv4Address(object):
     def ping(self, count=4, max_allowed_delay=1000):
         """Verifies that an IPv4 address is pingable.
         :param  count   How many times to ping the IP address
-        :param  max_allowed_delay
+        :param  max_allowed_delay   milliseconds to wait for each reply
 
 
-        :returns False if the remote device is unpingable
-
-        A future version will return a tuple with the package loss percentage, statistics about delay, etc.
+        :returns a pinger.PingResult, with the packet loss and the round trip times.  It is False if the remote
+        device is unpingable
         """
 
-        completed = utilities.OsCliInter.run_command(['ping', self.ipv4_address])
-        # return status = 0 if everything is okay
-        # return status = 2 if DNS fails to look up the name
-        # return status = 1 if the device is not pingable
-        return completed.returncode
+        import pinger  # It brings in asyncio, which most runs of nbmdt don't need
+        result = pinger.ping([str(self)], count=count, timeout=max_allowed_delay / 1000.0)
+        return result[str(self)]
 
 
 # Issue 5 renamed from IPv6_address to IPv6Address, i.e. CamelCase
@@ -153,13 +117,14 @@ Class IPv4Route is a layer, but it uses the standard library ipaddress module
     def __init__(self, route):
         """This returns an IPv4Route object.  """
 
-        destination = route['ipv4_destination']
-        super.__init__(name=destination)
+        destination = route['destination']
+        super().__init__(name=destination)
         assert hasattr(self, 'time')  # A test that my call to the super class is sane, this can be removed later
         # Use caution: routes values are strings, not length 4 bytes
-        self.ipv4_destination = ipaddress.ip_network(destination)  # Destination must be present
+        self.ipv4_destination = ipaddress.ip_network("0.0.0.0/0" if destination == "default" else destination)
         self.ipv4_dev = route['dev']
-        self.ipv4_gateway = ipaddress.ip_address(route.get('via', None))
+        gateway = route.get('via', None)
+        self.ipv4_gateway = ipaddress.ip_address(gateway) if gateway is not None else None
         self.ipv4_proto = route.get('proto', None)
         self.ipv4_scope = route.get('scope', None)
         self.ipv4_metric = route.get('metric', 0)
@@ -170,64 +135,20 @@ Class IPv4Route is a layer, but it uses the standard library ipaddress module
 
     @classmethod
     def discover(cls) -> typing.Dict:
-        """This method finds all of the IPv4 routes by examining the output of the ip route command, and
-        returns a list of IPV4_routes.  This is a class method because all route objects have the same
-         default gateway
+        """This method finds all of the IPv4 routes, and returns a list of IPV4_routes.  This is a class method
+        because all route objects have the same default gateway
 
-         This implementation is not very good, there is the netifaces interface which is socket based and avoids
-         forking a subprocess.
+         The routes come from netlink_backend, which asks the kernel over a netlink socket if it can and falls back
+         to parsing the output of the ip route command if it can't.
          :rtype: object
          """
 
-        def translate_destination(destination: str) -> str:
-            """
-This method translates destination from a dotted quad IPv4 address to a name if it can"""
-            if destination == "0.0.0.0":
-                destination: str = "default"
-            return destination
-
-        # https://docs.python.org/3/library/subprocess.html
-        results: str = utilities.OsCliInter.run_command(command=[configuration.IP_COMMAND, '-4', 'route', 'list'], )
-        lines = results.split('\n')[:-1]  # Don't use the last element, which is empty
-        """
-jeffs@jeffs-desktop:~/nbmdt (blue-sky)*$ ip -4 route
-default via 192.168.0.1 dev eno1 proto static metric 100 
-10.0.3.0/24 dev lxcbr0 proto kernel scope link src 10.0.3.1 linkdown 
-169.254.0.0/16 dev eno1 scope link metric 1000 
-192.168.0.0/24 dev eno1 proto kernel scope link src 192.168.0.16 metric 100 
-192.168.122.0/24 dev virbr0 proto kernel scope link src 192.168.122.1 linkdown 
-jeffs@jeffs-desktop:~/nbmdt (blue-sky)*$ 
-
-        """
-
         route_list = list()
-        for line in lines:  # lines is the output of the ip route list
-            # command
-            fields = line.split()
-            destination = translate_destination(fields[0])
-
-            route = dict()
-            route['ipv4_destination'] = destination
-            for i in range(1, len(fields), 2):
-                if fields[i] == 'linkdown':
-                    route['linkdown'] = True
-                    break
-                route[fields[i]] = fields[i + 1]
+        for route in IPRoute.discover(family="inet"):
             ipv4_route = IPv4Route(route=route)
-            if destination == "default" or destination == "0.0.0.0":
+            if route['destination'] == "default":
                 cls.default_gateway = ipv4_route
             route_list.append(ipv4_route)
-            """
-            route_list.append(self.IPv4_route(name=name,
-                                              ipv4_destination=ipv4_destination,
-                                              ipv4_gateway=ipv4_gateway,
-                                              ipv4_mask=ipv4_mask,
-                                              ipv4_flags=ipv4_flags,
-                                              ipv4_metric=ipv4_metric,
-                                              ipv4_ref=ipv4_ref,
-                                              ipv4_use=ipv4_use,
-                                              ipv4_interface=ipv4_interface))
-            """
         return route_list
 
     def __str__(self):
@@ -240,18 +161,18 @@ jeffs@jeffs-desktop:~/nbmdt (blue-sky)*$
 
     @classmethod
     def get_default_gateway(cls):
-        """Returns the default gateway.  If the default gateway attribute does not exist, then this method ought to
-        invoke find_ipv4_routes, which will define the default gateway"""
+        """Returns the default gateway.  If the default gateway attribute does not exist, then this method
+        invokes discover, which will define the default gateway.  discover gets the routes from
+        netlink_backend.dump, which reuses a recent dump, so calling this often does not ask the kernel every time"""
         if not hasattr(cls, "default_gateway"):
-            # This has some overhead, and ought to be cached somehow.  Deal with that later.
-            cls.find_ipv4_routes()
+            cls.discover()
         return cls.default_gateway
 
 
 class IPv6Route(IPRoute):
     def __init__(self, name, ipv6_destination, ipv6_next_hop, ipv6_flags, ipv6_metric, ipv6_ref, ipv6_use, \
                  ipv6_interface):
-        self.name = name
+        super().__init__(name=name)
         self.ipv6_destination = ipv6_destination
         self.ipv6_next_hop = ipv6_next_hop
         self.ipv6_flags = ipv6_flags
@@ -262,8 +183,9 @@ class IPv6Route(IPRoute):
 
     @classmethod
     def discover(cls) -> typing.Dict:      # in class IPv6Route c
-        """This method returns an IPv6 routing table.  In version 1, this is done by running the route command and
-        scrapping the output.  A future version will query the routing table through the /sys pseudo file system
+        """This method returns an IPv6 routing table, as a list of IPv6Route objects.  In version 1, this was done by
+        running the route command and scrapping the output.  Now the routes come from netlink_backend, which only
+        falls back to the ip command if netlink can't be used
         :rtype: """
 
         # jeffs@jeff-desktop:~ $ ip --family inet6 route show
@@ -299,7 +221,15 @@ class IPv6Route(IPRoute):
         #       >> >
         #
 
-        ipv6_routes: typing.Dict = IPRoute.discover(family="inet6")
+        ipv6_routes = list()
+        for route in IPRoute.discover(family="inet6"):
+            ipv6_route = IPv6Route(name=route['destination'], ipv6_destination=route['destination'],
+                                   ipv6_next_hop=route['via'], ipv6_flags=route['flags'],
+                                   ipv6_metric=route['metric'], ipv6_ref=None, ipv6_use=None,
+                                   ipv6_interface=route['dev'])
+            if route['destination'] == "default":
+                cls.default_gateway = ipv6_route
+            ipv6_routes.append(ipv6_route)
         return ipv6_routes
 
 
@@ -308,7 +238,7 @@ class IPv6Route(IPRoute):
 
 if __name__ in "__main__":
     print(f"Before instantiating IPv4Route, the default gateway is {IPv4Route.get_default_gateway()}")
-    ipv4_route_lst = IPv4Route.find_ipv4_routes()
+    ipv4_route_lst = IPv4Route.discover()
     print(f"The default gateway is {IPv4Route.default_gateway}")
     print(40 * "=")
     for r in ipv4_route_lst:
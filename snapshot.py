@@ -0,0 +1,209 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# The file format of a nominal snapshot, the state of the system saved with --nominal when it was working and read
+# back with --diagnose.  A snapshot file is:
+#
+#   MAGIC, 8 bytes
+#   the length of the header, a 4 byte unsigned big endian integer
+#   the header, JSON in UTF-8
+#   the sections, one per layer, one after the other
+#
+# The header has the schema version, the system name, when the snapshot was taken, and for each layer where its
+# section is (the offset from the end of the header and the length), how it is compressed and how many entities it
+# has.  Each section is the layer, converted by layer.to_jsonable and written as JSON, compressed with zlib or not.
+# A layer that is a single object rather than a collection of them, e.g. presentations, is marked as single in the
+# header, and is read back as a SnapshotObject, so that diff_engine compares it as one entity, the same as it compares
+# the object that was discovered.  Otherwise its fields would be taken for entities.
+#
+# Reading a snapshot reads only the header.  A layer is read, decompressed and parsed the first time it is asked for,
+# so --diagnose only pays for the layers that it compares.  A file that does not start with MAGIC is taken to be the
+# JSON that older versions of nbmdt wrote, schema version 0, which has to be read all at once.
+
+import collections.abc
+import datetime
+import json
+import os
+import struct
+import sys
+import typing
+import zlib
+
+import constants
+import diff_engine
+import layer
+
+MAGIC = b"NBMDTSN\n"
+HEADER_LENGTH = struct.Struct(">I")
+SNAPSHOT_VERSION = 1  # Increment when the format changes in a way that an older nbmdt can't read
+COMPRESSION_LEVEL = 1  # Fast.  A bigger level makes a snapshot of a big routing table a little smaller, but slower
+
+LAYER_NAMES = constants.SYSTEM_LAYERS
+
+
+def write(filename: str, description, compress: bool = True) -> None:
+    """
+    Write a snapshot file
+
+    :param filename: the file to write.  It is replaced if it already exists
+    :param description: a SystemDescription, or a dictionary of layers keyed by layer name
+    :param compress: if True, then the sections are compressed with zlib
+    """
+    sections = []
+    header = {"version": SNAPSHOT_VERSION,
+              "system_name": _get(description, "system_name"),
+              "timestamp": datetime.datetime.now().isoformat(),
+              "layers": dict()}
+    offset = 0
+    for name in LAYER_NAMES:
+        original = _get(description, name)
+        single = diff_engine.is_single_entity(original)
+        value = layer.to_jsonable(original)
+        data = json.dumps(value, separators=(",", ":")).encode("utf-8")
+        if compress:
+            data = zlib.compress(data, COMPRESSION_LEVEL)
+        header["layers"][name] = {"offset": offset, "length": len(data), "compression": "zlib" if compress else None,
+                                  "count": len(value) if isinstance(value, (list, dict)) and not single else 1,
+                                  "single": single}
+        sections.append(data)
+        offset += len(data)
+    header_data = json.dumps(header).encode("utf-8")
+    # Write a temporary file and rename it, so that a snapshot that is being replaced is never half written
+    temporary = filename + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header_data)))
+        f.write(header_data)
+        for data in sections:
+            f.write(data)
+    os.replace(temporary, filename)
+
+
+def _get(description, name: str):
+    if isinstance(description, collections.abc.Mapping):
+        return description.get(name)
+    return getattr(description, name, None)
+
+
+class SnapshotObject(object):
+    """
+    A layer that was a single object when it was written.  Its attributes are the fields that were written
+    """
+
+    def __init__(self, fields: dict) -> None:
+        self.__dict__.update(fields)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SnapshotObject) and vars(self) == vars(other)
+
+    def __repr__(self) -> str:
+        return f"SnapshotObject({vars(self)})"
+
+
+class Snapshot(collections.abc.Mapping):
+    """
+    A snapshot file that has been opened.  It is a read only dictionary of layers keyed by layer name, and each layer
+    is loaded the first time it is looked up
+    """
+
+    def __init__(self, filename: str) -> None:
+        """
+        Read the header of a snapshot file
+
+        :param filename: a file written by write, or the JSON written by an older nbmdt
+        """
+        self.filename = filename
+        self._layers: typing.Dict[str, typing.Any] = dict()  # The layers that have been loaded
+        with open(filename, "rb") as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                # Schema version 0 is a single JSON object, so everything is loaded now
+                f.seek(0)
+                everything = json.load(f)
+                if not isinstance(everything, dict):
+                    raise ValueError(f"{filename} is not a snapshot file")
+                self.version = everything.get("version", 0)
+                self.system_name = everything.get("system_name")
+                self.timestamp = everything.get("timestamp")
+                self._sections = dict()
+                self._layers = {name: everything.get(name) for name in LAYER_NAMES}
+                self._data_start = None
+                return
+            header_length = HEADER_LENGTH.unpack(f.read(HEADER_LENGTH.size))[0]
+            header = json.loads(f.read(header_length).decode("utf-8"))
+        self.version: int = header["version"]
+        if self.version > SNAPSHOT_VERSION:
+            raise ValueError(f"{filename} has snapshot version {self.version}, but this nbmdt can only read up to "
+                             f"version {SNAPSHOT_VERSION}")
+        self.system_name: str = header.get("system_name")
+        self.timestamp: str = header.get("timestamp")
+        self._sections: typing.Dict[str, dict] = header["layers"]
+        self._data_start = len(MAGIC) + HEADER_LENGTH.size + header_length
+
+    def __getitem__(self, name: str):
+        if name in self._layers:
+            return self._layers[name]
+        section = self._sections.get(name)
+        if section is None:
+            raise KeyError(name)
+        with open(self.filename, "rb") as f:
+            f.seek(self._data_start + section["offset"])
+            data = f.read(section["length"])
+        if len(data) != section["length"]:
+            raise ValueError(f"{self.filename} is truncated, the {name} layer should be {section['length']} bytes "
+                             f"but there are only {len(data)}")
+        if section["compression"] == "zlib":
+            data = zlib.decompress(data)
+        elif section["compression"] is not None:
+            raise ValueError(f"The {name} layer of {self.filename} is compressed with {section['compression']}, "
+                             f"which this nbmdt does not know")
+        value = json.loads(data.decode("utf-8"))
+        if section.get("single") and isinstance(value, dict):
+            value = SnapshotObject(value)
+        self._layers[name] = value
+        return value
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(LAYER_NAMES if self._data_start is None else self._sections)
+
+    def __len__(self) -> int:
+        return len(LAYER_NAMES if self._data_start is None else self._sections)
+
+    def count(self, name: str) -> int:
+        """
+        :return: how many entities the layer has, without loading it
+        """
+        if name in self._sections:
+            return self._sections[name]["count"]
+        value = self[name]
+        return len(value) if isinstance(value, (list, dict)) else 1
+
+    def loaded(self) -> typing.List[str]:
+        """
+        :return: the names of the layers that have been loaded so far
+        """
+        return list(self._layers)
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    N = 100000
+    routes = [{"destination": f"10.{i // 65536}.{i // 256 % 256}.{i % 256}/32", "dev": "eth0", "metric": 100,
+               "via": "192.0.2.1", "proto": "bgp"} for i in range(N)]
+    big_router = {"system_name": "router", "networks_4": routes, "networks_6": [], "datalinks": {"eth0": {}}}
+    with tempfile.TemporaryDirectory() as directory:
+        for compressed in [False, True]:
+            path = os.path.join(directory, "nominal.snapshot")
+            t0 = time.monotonic()
+            write(path, big_router, compress=compressed)
+            t1 = time.monotonic()
+            datalinks = Snapshot(path)["datalinks"]
+            t2 = time.monotonic()
+            loaded_routes = Snapshot(path)["networks_4"]
+            t3 = time.monotonic()
+            assert len(loaded_routes) == N and datalinks == {"eth0": {}}
+            print(f"compress={compressed}: {os.path.getsize(path)} bytes, wrote {N} routes in {t1 - t0:.3f} s, "
+                  f"read the datalinks in {(t2 - t1) * 1000.0:.1f} ms and the routes in {t3 - t2:.3f} s",
+                  file=sys.stderr)
@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# How long nbmdt takes to start.  Each run is a new python process, so nothing is imported already:
+#
+#   import      python -c "import nbmdt", which is what every mode pays before it does anything
+#   --boot      python nbmdt.py --boot, start to exit, which is the import and the boot checks (see boot_pipeline.py)
+#
+# and, for one more --boot run with python -X importtime, the modules that took the longest to import, including the
+# modules that they imported.
+#
+#   python3 startup_benchmark.py [runs]
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+import typing
+
+NBMDT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nbmdt.py")
+# Modules that take a long time to import and that only some modes need, so importing nbmdt should not import them
+HEAVY_MODULES = ["numpy", "dns", "pytest", "asyncio", "pyroute2", "monitor_server", "counter_rates", "diff_engine",
+                 "snapshot", "utilities"]
+
+
+def time_command(command: typing.List[str], runs: int) -> typing.List[float]:
+    """
+    :return: the wall clock time of each run, in seconds
+    """
+    elapsed = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       cwd=os.path.dirname(NBMDT))
+        elapsed.append(time.perf_counter() - start)
+    return elapsed
+
+
+def slowest_imports(importtime_output: str, n: int = 10) -> typing.List[typing.Tuple[str, float]]:
+    """
+    :param importtime_output: what python -X importtime wrote to standard error
+    :return: the n modules with the largest cumulative import times, in seconds, slowest first
+    """
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        imports.append((name.strip(), int(cumulative_us) / 1e6))
+    return sorted(imports, key=lambda module: module[1], reverse=True)[:n]
+
+
+def imported_modules(module: str) -> typing.List[str]:
+    """
+    :return: the HEAVY_MODULES that importing module imports
+    """
+    completed = subprocess.run([sys.executable, "-c", f"import sys, {module}; print(' '.join(sys.modules))"],
+                               stdin=subprocess.DEVNULL, capture_output=True, text=True, cwd=os.path.dirname(NBMDT))
+    loaded = set(completed.stdout.split())
+    return [name for name in HEAVY_MODULES if name in loaded]
+
+
+def report(name: str, elapsed: typing.List[float]) -> str:
+    return f"{name}: min {min(elapsed) * 1000.0:.0f} ms, median {statistics.median(elapsed) * 1000.0:.0f} ms, " \
+           f"max {max(elapsed) * 1000.0:.0f} ms over {len(elapsed)} runs"
+
+
+if __name__ == "__main__":
+    RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(report("python (nothing)", time_command([sys.executable, "-c", "pass"], RUNS)))
+    print(report("import nbmdt", time_command([sys.executable, "-c", "import nbmdt"], RUNS)))
+    print(report("nbmdt --boot", time_command([sys.executable, NBMDT, "--boot"], RUNS)))
+    print(f"Importing nbmdt imports {', '.join(imported_modules('nbmdt')) or 'none'} of {', '.join(HEAVY_MODULES)}")
+    boot = subprocess.run([sys.executable, "-X", "importtime", NBMDT, "--boot"], stdin=subprocess.DEVNULL,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, cwd=os.path.dirname(NBMDT))
+    print("The slowest imports of nbmdt --boot:")
+    for module, seconds in slowest_imports(boot.stderr):
+        print(f"  {seconds * 1000.0:7.1f} ms  {module}")
@@ -3,16 +3,17 @@
 #
 # This class provides services for reporting status, logging, etc.
 
-import datetime
 import sys
 import time
 
+import timing
+
 
 class Status(object):
     def __init__(self, resource_name):
         self.__summary = True
         self.__name = resource_name
-        self.__timestamp = datetime.datetime.now()
+        self.__timestamp = timing.now()
 
 
     @property  # when you do lvar = Status.summary, it will call this function
@@ -27,7 +28,7 @@ class Status(object):
             "In the setter, name is %s will become %s" % (self.__name, summary),
             file=sys.stderr)
         self.__summary = summary
-        self.__timestamp = datetime.datetime.now()
+        self.__timestamp = timing.now()
 
     def __str__(self):
         return (f"At {self.__timestamp}, {self.__name} is {self.__summary} ")
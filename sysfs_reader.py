@@ -0,0 +1,195 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Reads the attributes and counters of network interfaces from /sys/class/net, fast enough to poll hundreds of
+# interfaces every second.  See https://www.kernel.org/doc/Documentation/ABI/testing/sysfs-class-net
+#
+# Only the attributes that are asked for are read, instead of every file in the directory.  Each file is opened the
+# first time it is read and the file descriptor is kept, and after that it is read with os.pread at offset 0, which
+# makes sysfs produce the current value: one system call per attribute per poll.  Each value is decoded into the type
+# that the kernel documents for it (see ATTRIBUTES), so the counters are ints, flags is an int, carrier is a bool and
+# so on.
+#
+# An attribute that the kernel refuses to report (e.g. speed or carrier of an interface that is down, which fails with
+# EINVAL) is None.  If an interface goes away, its file descriptors are closed; if another interface comes along with
+# the same name, it is opened again.
+
+import errno
+import os
+import sys
+import time
+import typing
+
+SYSFS_NET = "/sys/class/net"
+
+
+def _decode_str(data: bytes) -> str:
+    return data.decode("utf-8", errors="replace").strip()
+
+
+def _decode_int(data: bytes) -> int:
+    return int(data, 0)  # int() ignores the trailing newline.  Base 0, because flags is written as 0x1003
+
+
+def _decode_bool(data: bytes) -> bool:
+    return data.strip() == b"1"
+
+
+# How to decode each attribute, by its path under /sys/class/net/<interface>
+ATTRIBUTES: typing.Dict[str, typing.Callable[[bytes], typing.Any]] = {
+    "address": _decode_str,
+    "broadcast": _decode_str,
+    "carrier": _decode_bool,
+    "carrier_changes": _decode_int,
+    "dormant": _decode_bool,
+    "duplex": _decode_str,
+    "flags": _decode_int,
+    "ifalias": _decode_str,
+    "ifindex": _decode_int,
+    "iflink": _decode_int,
+    "mtu": _decode_int,
+    "operstate": _decode_str,
+    "speed": _decode_int,  # Mbits/sec, -1 if unknown
+    "tx_queue_len": _decode_int,
+    "type": _decode_int,  # ARPHRD_*, see /usr/include/linux/if_arp.h
+}
+STATISTICS = ["rx_bytes", "tx_bytes", "rx_packets", "tx_packets", "rx_errors", "tx_errors", "rx_dropped",
+              "tx_dropped", "rx_crc_errors", "rx_frame_errors", "rx_fifo_errors", "rx_missed_errors",
+              "tx_carrier_errors", "tx_fifo_errors", "collisions", "multicast"]
+ATTRIBUTES.update({"statistics/" + counter: _decode_int for counter in STATISTICS})
+
+# What link_properties reports
+PROPERTIES = [name for name in ATTRIBUTES if not name.startswith("statistics/")]
+# What the monitor polls every second
+COUNTERS = ["statistics/rx_bytes", "statistics/tx_bytes", "statistics/rx_packets", "statistics/tx_packets",
+            "statistics/rx_errors", "statistics/tx_errors", "statistics/rx_dropped", "statistics/tx_dropped"]
+
+
+class SysfsReader(object):
+    """
+    Reads a fixed set of attributes of network interfaces, keeping the files open from one read to the next.  Use it
+    in a with statement, or call close, to close the files
+    """
+
+    def __init__(self, attributes: typing.List[str] = None, root: str = SYSFS_NET) -> None:
+        """
+        :param attributes: the attributes to read, each one a key of ATTRIBUTES.  If None, then all of them
+        :param root: the directory with a directory for each interface.  Only a test would change this
+        """
+        attributes = list(ATTRIBUTES) if attributes is None else attributes
+        unknown = [name for name in attributes if name not in ATTRIBUTES]
+        if unknown:
+            raise ValueError(f"Don't know how to decode {', '.join(unknown)}, see sysfs_reader.ATTRIBUTES")
+        self.attributes = attributes
+        self.root = root
+        # The open file descriptors, keyed by interface name and then attribute.  A None file descriptor is an
+        # attribute that this interface does not have, so there is no point in trying to open it again
+        self._fds: typing.Dict[str, typing.Dict[str, typing.Optional[int]]] = dict()
+
+    def interfaces(self) -> typing.List[str]:
+        """
+        :return: the names of the interfaces that exist now
+        """
+        return sorted(os.listdir(self.root))
+
+    def read(self, ifname: str) -> typing.Optional[typing.Dict[str, typing.Any]]:
+        """
+        Read the attributes of one interface
+
+        :param ifname: the name of the interface, e.g. eth0
+        :return: the decoded values, keyed by attribute.  None if there is no such interface
+        """
+        fds = self._fds.get(ifname)
+        if fds is None:
+            fds = self._open(ifname)
+            if fds is None:
+                return None
+        values = dict()
+        for name in self.attributes:
+            fd = fds[name]
+            if fd is None:
+                values[name] = None
+                continue
+            try:
+                data = os.pread(fd, 4096, 0)
+            except OSError as e:
+                if e.errno in (errno.ENODEV, errno.ENOENT, errno.ENXIO):
+                    # The interface went away, maybe to be replaced by another one with the same name
+                    self._close(ifname)
+                    return self.read(ifname) if os.path.isdir(os.path.join(self.root, ifname)) else None
+                values[name] = None  # e.g. EINVAL, asking for the speed of an interface that is down
+                continue
+            try:
+                values[name] = ATTRIBUTES[name](data)
+            except ValueError:
+                values[name] = None
+        return values
+
+    def read_all(self, ifnames: typing.Iterable[str] = None) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """
+        Read the attributes of several interfaces
+
+        :param ifnames: the names of the interfaces.  If None, then every interface that exists now
+        :return: the values of each interface, keyed by interface name.  Interfaces that don't exist are left out
+        """
+        if ifnames is None:
+            ifnames = self.interfaces()
+            # Forget about the interfaces that are gone
+            for ifname in set(self._fds) - set(ifnames):
+                self._close(ifname)
+        result = dict()
+        for ifname in ifnames:
+            values = self.read(ifname)
+            if values is not None:
+                result[ifname] = values
+        return result
+
+    def _open(self, ifname: str) -> typing.Optional[typing.Dict[str, typing.Optional[int]]]:
+        directory = os.path.join(self.root, ifname)
+        if not os.path.isdir(directory):
+            return None
+        fds = dict()
+        for name in self.attributes:
+            try:
+                fds[name] = os.open(os.path.join(directory, name), os.O_RDONLY | os.O_CLOEXEC)
+            except OSError:
+                fds[name] = None  # Not every interface has every attribute, e.g. a tunnel has no address
+        self._fds[ifname] = fds
+        return fds
+
+    def _close(self, ifname: str) -> None:
+        for fd in self._fds.pop(ifname, dict()).values():
+            if fd is not None:
+                os.close(fd)
+
+    def close(self) -> None:
+        for ifname in list(self._fds):
+            self._close(ifname)
+
+    def __enter__(self) -> 'SysfsReader':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except (AttributeError, OSError):
+            pass
+
+
+if __name__ == "__main__":
+    N = 1000
+    with SysfsReader(COUNTERS) as reader:
+        names = reader.interfaces()
+        reader.read_all(names)  # Open the files
+        t0 = time.perf_counter()
+        for _ in range(N):
+            counters = reader.read_all(names)
+        t1 = time.perf_counter()
+    print(f"Polled {len(COUNTERS)} counters of {len(names)} interfaces {N} times, "
+          f"{(t1 - t0) / N / len(names) * 1e6:.1f} us per interface", file=sys.stderr)
+    with SysfsReader(PROPERTIES) as reader:
+        for ifname, properties in reader.read_all().items():
+            print(ifname, properties)
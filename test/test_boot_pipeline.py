@@ -0,0 +1,129 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests boot_pipeline.py with checks that only sleep and return a status, so nothing on the network is probed
+
+import asyncio
+import io
+import sys
+import time
+
+import pytest
+
+import boot_pipeline
+from boot_pipeline import BootPipeline, Check
+from constants import ErrorLevels
+
+
+def sleeper(seconds: float, status: ErrorLevels = ErrorLevels.NORMAL, started: list = None):
+    async def run(results, end):
+        if started is not None:
+            started.append(sorted(results))
+        await asyncio.sleep(seconds)
+        return status, f"slept {seconds}", seconds
+    return run
+
+
+def test_independent_checks_run_at_the_same_time():
+    checks = [Check(f"check{i}", sleeper(0.2)) for i in range(5)]
+    t0 = time.monotonic()
+    results = BootPipeline(checks, deadline=2.0).run()
+    elapsed = time.monotonic() - t0
+    assert all(result.status == ErrorLevels.NORMAL for result in results.values()), f"{results}"
+    assert elapsed < 0.6, f"5 checks of 0.2 seconds each took {elapsed:.2f} seconds, so they ran one after another"
+
+
+def test_a_check_gets_the_results_it_requires():
+    started = []
+    checks = [Check("external", sleeper(0.0, started=started), ["gateway", "dns"]),
+              Check("gateway", sleeper(0.1)),
+              Check("dns", sleeper(0.05))]
+    results = BootPipeline(checks, deadline=2.0).run()
+    assert started == [["dns", "gateway"]], f"external got the results of {started}"
+    assert list(results) == ["external", "gateway", "dns"], "The results should be in the order of the checks"
+    assert results["external"].status == ErrorLevels.NORMAL
+
+
+def test_the_checks_after_a_failed_check_are_not_run():
+    started = []
+    checks = [Check("links", sleeper(0.0, ErrorLevels.DOWN)),
+              Check("addresses", sleeper(0.0, started=started), ["links"]),
+              Check("gateway", sleeper(0.0, started=started), ["addresses"]),
+              Check("clock", sleeper(0.0, ErrorLevels.DEGRADED)),
+              Check("ntp", sleeper(0.0), ["clock"])]
+    results = BootPipeline(checks, deadline=2.0).run()
+    assert started == [], f"Checks that require a failed check were run: {started}"
+    assert results["addresses"].status == ErrorLevels.DOWN_DEPENDENCY
+    assert results["gateway"].status == ErrorLevels.DOWN_DEPENDENCY
+    assert results["gateway"].elapsed is None, "A check that was not run did not take any time"
+    assert results["ntp"].status == ErrorLevels.NORMAL, "A degraded check still lets the checks after it run"
+    assert boot_pipeline.worst(results) == ErrorLevels.DOWN_DEPENDENCY
+
+
+def test_the_deadline():
+    checks = [Check("fast", sleeper(0.0)),
+              Check("slow", sleeper(10.0)),
+              Check("after_slow", sleeper(0.0), ["slow"])]
+    t0 = time.monotonic()
+    results = BootPipeline(checks, deadline=0.3).run()
+    elapsed = time.monotonic() - t0
+    assert elapsed < 0.5, f"The pipeline took {elapsed:.2f} seconds, its deadline was 0.3 seconds"
+    assert results["fast"].status == ErrorLevels.NORMAL
+    assert results["slow"].status == ErrorLevels.UNKNOWN, f"slow is {results['slow']}"
+    assert results["after_slow"].status == ErrorLevels.UNKNOWN, f"after_slow is {results['after_slow']}"
+
+
+def test_the_deadline_does_not_wait_for_blocked_threads():
+    async def blocked(results, end):
+        # Like a getaddrinfo that the resolver never answers, which can't be cancelled
+        await asyncio.get_running_loop().run_in_executor(None, time.sleep, 5.0)
+        return ErrorLevels.NORMAL, "woke up", None
+
+    t0 = time.monotonic()
+    results = BootPipeline([Check("blocked", blocked)], deadline=0.5).run()
+    elapsed = time.monotonic() - t0
+    assert elapsed < 1.5, f"The pipeline took {elapsed:.2f} seconds, its deadline was 0.5 seconds"
+    assert results["blocked"].status == ErrorLevels.UNKNOWN, f"blocked is {results['blocked']}"
+
+
+def test_no_time_left_is_unknown():
+    async def ping_at_the_deadline():
+        return await boot_pipeline._ping(["192.0.2.1"], asyncio.get_running_loop().time())
+
+    start = time.monotonic()
+    status, detail, answered = asyncio.run(ping_at_the_deadline())
+    assert time.monotonic() - start < 0.5
+    assert status == ErrorLevels.UNKNOWN and detail == boot_pipeline.NO_TIME_LEFT and answered == [], \
+        "A target that was never pinged has not failed to answer"
+
+
+def test_a_check_that_raises_fails():
+    async def broken(results, end):
+        raise OSError("no such device")
+    results = BootPipeline([Check("broken", broken), Check("after", sleeper(0.0), ["broken"])]).run()
+    assert results["broken"].status == ErrorLevels.DOWN
+    assert "no such device" in results["broken"].detail
+    assert results["after"].status == ErrorLevels.DOWN_DEPENDENCY
+
+
+def test_bad_graphs():
+    with pytest.raises(ValueError):
+        BootPipeline([Check("a", sleeper(0.0), ["b"])])
+    with pytest.raises(ValueError):
+        BootPipeline([Check("a", sleeper(0.0), ["b"]), Check("b", sleeper(0.0), ["a"])])
+    with pytest.raises(ValueError):
+        BootPipeline([Check("a", sleeper(0.0)), Check("a", sleeper(0.0))])
+
+
+def test_report():
+    results = BootPipeline([Check("links", sleeper(0.0)), Check("gateway", sleeper(0.0, ErrorLevels.DOWN))]).run()
+    output = io.StringIO()
+    boot_pipeline.report(results, file=output)
+    lines = output.getvalue().splitlines()
+    assert len(lines) == 2, f"The report is {lines}"
+    assert "links" in lines[0] and "NORMAL" in lines[0]
+    assert "gateway" in lines[1] and "DOWN" in lines[1]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
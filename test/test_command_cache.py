@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests command_cache.py
+
+import sys
+import threading
+import time
+
+import pytest
+
+from command_cache import CommandCache
+
+
+class CountingRunner(object):
+    """
+    Stands in for OsCliInter.run_command, and counts how many times each command was run
+    """
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.counts = dict()
+        self.lock = threading.Lock()
+
+    def __call__(self, command):
+        with self.lock:
+            self.counts[tuple(command)] = self.counts.get(tuple(command), 0) + 1
+            n = self.counts[tuple(command)]
+        time.sleep(self.delay)
+        return f"{' '.join(command)} #{n}", "", 0
+
+
+class FakeStateCache(object):
+    def __init__(self) -> None:
+        self.listeners = []
+
+    def add_listener(self, callback) -> None:
+        self.listeners.append(callback)
+
+    def event(self, event: str, record: dict) -> None:
+        for callback in self.listeners:
+            callback(event, record)
+
+
+def test_output_is_reused_until_it_expires():
+    runner = CountingRunner()
+    cache = CommandCache(runner=runner, default_ttl=0.2, ttls={"lshw": 60.0})
+    assert cache.run_command(["ip", "link", "list"])[0] == "ip link list #1"
+    assert cache.run_command(["ip", "link", "list"])[0] == "ip link list #1", "The output should have been cached"
+    assert cache.run_command(["ip", "addr", "list"])[0] == "ip addr list #1", "Different args, different command"
+    cache.run_command(["/usr/bin/lshw", "-C", "network"])
+    time.sleep(0.3)
+    assert cache.run_command(["ip", "link", "list"])[0] == "ip link list #2", "The output should have expired"
+    assert cache.run_command(["/usr/bin/lshw", "-C", "network"])[0] == "/usr/bin/lshw -C network #1", \
+        "lshw has its own, longer, TTL"
+    assert cache.run_command(["ip", "link", "list"], ttl=0)[0] == "ip link list #3", "A TTL of 0 always runs it"
+
+
+def test_concurrent_callers_share_one_run():
+    runner = CountingRunner(delay=0.3)
+    cache = CommandCache(runner=runner, default_ttl=10.0)
+    outputs = []
+    threads = [threading.Thread(target=lambda: outputs.append(cache.run_command(["ip", "route", "list"])))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert runner.counts == {("ip", "route", "list"): 1}, f"The command should have run once, ran {runner.counts}"
+    assert len(outputs) == 8 and all(output[0] == "ip route list #1" for output in outputs), f"got {outputs}"
+    assert (cache.hits, cache.misses) == (7, 1), f"hits={cache.hits} misses={cache.misses}"
+
+
+def test_failures_are_not_cached():
+    calls = []
+
+    def runner(command):
+        calls.append(command)
+        if len(calls) == 1:
+            raise FileNotFoundError(command[0])
+        return "ok", "", 0
+
+    cache = CommandCache(runner=runner)
+    with pytest.raises(FileNotFoundError):
+        cache.run_command(["ethtool", "eth0"])
+    assert cache.run_command(["ethtool", "eth0"]) == ("ok", "", 0)
+    assert len(calls) == 2, f"The command should have been tried again, calls are {calls}"
+    statuses = [1, 0]
+
+    def failing_runner(command):
+        return "", "Cannot get device settings", statuses.pop(0)
+
+    cache = CommandCache(runner=failing_runner)
+    assert cache.run_command(["ethtool", "eth0"])[2] == 1
+    assert cache.run_command(["ethtool", "eth0"])[2] == 0, "A nonzero exit status should not have been cached"
+
+
+def test_invalidate():
+    runner = CountingRunner()
+    cache = CommandCache(runner=runner, default_ttl=60.0)
+    for command in [["ip", "link"], ["ip", "addr"], ["ps", "-ax"]]:
+        cache.run_command(command)
+    cache.invalidate(["ip", "link"])
+    assert cache.run_command(["ip", "link"])[0] == "ip link #2"
+    assert cache.run_command(["ip", "addr"])[0] == "ip addr #1"
+    cache.invalidate(executable="ip")
+    assert cache.run_command(["ip", "addr"])[0] == "ip addr #2"
+    assert cache.run_command(["ps", "-ax"])[0] == "ps -ax #1"
+    cache.invalidate()
+    assert len(cache) == 0, f"Everything should have been thrown away, {len(cache)} commands are still cached"
+
+
+def test_netlink_events_invalidate_network_commands():
+    runner = CountingRunner()
+    cache = CommandCache(runner=runner, default_ttl=60.0)
+    state = FakeStateCache()
+    cache.watch(state)
+    cache.run_command(["/sbin/ip", "route", "list"])
+    cache.run_command(["ps", "-ax"])
+    state.event("new_route", {"destination": "10.0.0.0/8"})
+    assert cache.run_command(["/sbin/ip", "route", "list"])[0] == "/sbin/ip route list #2", \
+        "A route change should have invalidated ip route list"
+    assert cache.run_command(["ps", "-ax"])[0] == "ps -ax #1", "ps has nothing to do with netlink"
+
+
+def test_output_started_before_an_invalidation_is_not_cached():
+    runner = CountingRunner(delay=0.3)
+    cache = CommandCache(runner=runner, default_ttl=60.0)
+    thread = threading.Thread(target=cache.run_command, args=(["ip", "link"],))
+    thread.start()
+    time.sleep(0.1)
+    cache.invalidate_netlink_commands("new_link", {})
+    thread.join()
+    assert cache.run_command(["ip", "link"])[0] == "ip link #2", "The output might have been stale"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
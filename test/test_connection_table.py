@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests connection_table.py
+
+import socket
+
+from connection_table import ConnectionTable
+from constants import TcpStates
+from transport import Transport
+
+HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+
+def web_server(clients: int) -> ConnectionTable:
+    table = ConnectionTable()
+    table.add(socket.AF_INET, "0.0.0.0", 443, "0.0.0.0", 0, TcpStates.LISTEN, "TCP", 0, 1)
+    table.add(socket.AF_INET6, "::", 443, "::", 0, TcpStates.LISTEN, "TCP", 0, 2)
+    table.add(socket.AF_INET, "127.0.0.53", 53, "0.0.0.0", 0, TcpStates.CLOSE, "UDP", 101, 3)
+    for i in range(clients):
+        table.add(socket.AF_INET, "192.0.2.10", 443, f"10.{i // 65536}.{i // 256 % 256}.{i % 256}", 40000 + i % 20000,
+                  TcpStates.ESTABLISHED, "TCP", 33, 100 + i)
+    return table
+
+
+def test_listeners():
+    table = web_server(10)
+    listeners = table.listeners()
+    assert list(listeners.keys()) == [443], f"listeners is {listeners}"
+    assert [c.src_host for c in listeners[443]] == ["0.0.0.0", "::"], "Both address families listen on 443"
+    assert table.listeners(80) == dict()
+    udp = table.listeners(transport=Transport.TransportNames.UDP)
+    assert udp[53][0].src_host == "127.0.0.53", f"udp listeners is {udp}"
+
+
+def test_connection_round_trip():
+    table = web_server(3)
+    connection = table.connection(4)
+    assert connection.ip_proto == socket.AF_INET
+    assert (connection.src_host, connection.src_port) == ("192.0.2.10", 443)
+    assert (connection.dst_host, connection.dst_port) == ("10.0.0.1", 40001)
+    assert connection.state == TcpStates.ESTABLISHED
+    assert connection.protocol == Transport.TransportNames.TCP
+    assert (connection.uid, connection.inode) == (33, 101)
+    assert table.connection(1).src_host == "::"
+    assert len(list(table)) == len(table) == 6
+
+
+def test_remote_address_index_survives_rehash():
+    # More rows than the first size of the remote address index, so it has been rehashed
+    table = web_server(5000)
+    table.add(socket.AF_INET, "192.0.2.10", 443, "10.0.1.7", 12345, TcpStates.TIME_WAIT, "TCP", 33, 9999)
+    to_peer = table.by_remote_address("10.0.1.7")
+    assert [(c.dst_port, c.state) for c in to_peer] == [(40263, TcpStates.ESTABLISHED), (12345, TcpStates.TIME_WAIT)], \
+        f"to_peer is {[str(c) for c in to_peer]}"
+    assert table.by_remote_address("198.51.100.1") == []
+    assert len(table.by_local_port(443)) == 5003
+    assert table.count_by_state()[TcpStates.ESTABLISHED] == 5000
+
+
+def test_transport_uses_the_indexes():
+    transport = Transport(web_server(10))
+    assert list(transport.find_all_listeners().keys()) == [443]
+    transport.add_connection(443, 5555, "198.51.100.9")
+    assert [c.dst_port for c in transport.find_connections_to("198.51.100.9")] == [5555]
+
+
+def test_from_kernel(tmp_path):
+    (tmp_path / "tcp").write_text(
+        HEADER + "   0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1001 1\n"
+                 "   1: 0202000A:D431 0100A8C0:01BB 01 00000000:00000000 02:000A7A3A 00000000  1000        0 1002 2\n")
+    (tmp_path / "tcp6").write_text(
+        HEADER + "   0: 00000000000000000000000001000000:0016 00000000000000000000000000000000:0000 0A "
+                 "00000000:00000000 00:00000000 00000000     0        0 2001 1\n")
+    table = ConnectionTable.from_kernel(proc_net_dir=str(tmp_path))
+    assert len(table) == 3
+    assert sorted(table.listeners().keys()) == [22, 3306]
+    assert table.listeners(22)[22][0].src_host == "::1"
+    assert table.by_remote_address("192.168.0.1")[0].inode == 1002
@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests counter_rates.py
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import counter_rates
+from counter_rates import RateEngine, RingBuffer
+
+
+def write_counters(root, ifname: str, rx_bytes: int, tx_bytes: int) -> None:
+    os.makedirs(os.path.join(root, ifname, "statistics"), exist_ok=True)
+    for name, value in [("rx_bytes", rx_bytes), ("tx_bytes", tx_bytes)]:
+        with open(os.path.join(root, ifname, "statistics", name), "w") as f:
+            f.write(f"{value}\n")
+
+
+def test_ring_buffer_keeps_the_newest_samples():
+    buffer = RingBuffer(capacity=4, width=1)
+    for i in range(10):
+        buffer.append(float(i), [i * 10])
+    times, values = buffer.ordered()
+    assert times.tolist() == [6.0, 7.0, 8.0, 9.0], f"times are {times}"
+    assert values[:, 0].tolist() == [60, 70, 80, 90], f"values are {values}"
+    assert len(buffer) == 4 and buffer.values.shape == (4, 1), "The buffer should never grow"
+
+
+def test_counter_wraps_and_resets():
+    values = np.array([[2 ** 32 - 100, 2 ** 64 - 10, 10 ** 12, 7],
+                       [50, 20, 5000, 9]], dtype=np.uint64)
+    deltas = counter_rates.counter_deltas(values)
+    assert deltas[0].tolist() == [150, 30, 5000, 2], \
+        f"deltas are {deltas}: the 32 bit counter wrapped, the 64 bit one wrapped, and the big one was reset"
+
+
+def test_rates_ewma_and_percentiles():
+    times = np.array([0.0, 1.0, 2.0, 4.0, 5.0])
+    values = np.array([[0], [100], [300], [700], [700]], dtype=np.uint64)
+    rates = counter_rates.counter_rates(times, values)
+    assert rates[:, 0].tolist() == [100.0, 200.0, 200.0, 0.0], f"rates are {rates}"
+    smoothed = 100.0
+    for rate in [200.0, 200.0, 0.0]:
+        smoothed = 0.5 * rate + 0.5 * smoothed
+    assert counter_rates.ewma(rates, alpha=0.5)[0] == pytest.approx(smoothed)
+    summary = counter_rates.summarize(times, values, ["rx_bytes"], percentiles=[50], alpha=0.5)["rx_bytes"]
+    assert summary == {"rate": 0.0, "ewma": pytest.approx(smoothed), "p50": 150.0, "max": 200.0}, f"got {summary}"
+    # Two samples at the same moment have no rate, which JSON can't say as NaN
+    summary = counter_rates.summarize(np.array([1.0, 1.0]), values[:2], ["rx_bytes"], percentiles=[50])["rx_bytes"]
+    assert summary["rate"] is None and summary["max"] is None, f"got {summary}"
+    json.dumps(summary, allow_nan=False)
+
+
+def test_engine(tmp_path):
+    write_counters(tmp_path, "eth0", 1000, 0)
+    write_counters(tmp_path, "eth1", 0, 0)
+    engine = RateEngine(counters=["statistics/rx_bytes", "statistics/tx_bytes"], history=3, root=str(tmp_path))
+    engine.sample(when=10.0)
+    assert engine.summary("eth0")["rx_bytes"]["rate"] is None, "One sample has no rate"
+    for i in range(1, 5):
+        write_counters(tmp_path, "eth0", 1000 + i * 500, i * 10)
+        engine.sample(when=10.0 + i * 0.5)
+    summary = engine.summary("eth0")
+    assert summary["rx_bytes"]["rate"] == 1000.0 and summary["tx_bytes"]["max"] == 20.0, f"got {summary}"
+    series = engine.series("eth0")
+    assert series["rx_bytes"] == [1000.0, 1000.0] and len(series["time"]) == 2, \
+        f"3 samples should have been kept, which is 2 rates.  series is {series}"
+    os.remove(os.path.join(tmp_path, "eth1", "statistics", "rx_bytes"))
+    os.remove(os.path.join(tmp_path, "eth1", "statistics", "tx_bytes"))
+    os.rmdir(os.path.join(tmp_path, "eth1", "statistics"))
+    os.rmdir(os.path.join(tmp_path, "eth1"))
+    engine.sample(when=13.0)
+    assert sorted(engine.buffers) == ["eth0"], "The buffer of an interface that went away should be gone"
+    assert sorted(engine.documents()) == ["/rates", "/rates/eth0"]
+    engine.close()
+
+
+def test_a_counter_that_could_not_be_read(tmp_path, monkeypatch):
+    write_counters(tmp_path, "eth0", 3000000000, 0)
+    engine = RateEngine(counters=["statistics/rx_bytes", "statistics/tx_bytes"], history=8, root=str(tmp_path))
+    engine.sample(when=1.0)
+    read_all = engine.reader.read_all
+    monkeypatch.setattr(engine.reader, "read_all", lambda: {ifname: dict.fromkeys(values)
+                                                            for ifname, values in read_all().items()})
+    engine.sample(when=2.0)
+    monkeypatch.undo()
+    write_counters(tmp_path, "eth0", 3000001000, 0)
+    engine.sample(when=3.0)
+    rates = engine.series("eth0")["rx_bytes"]
+    assert rates == [0.0, 1000.0], f"A failed read is not a wrap or a reset, rates are {rates}"
+    engine.close()
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
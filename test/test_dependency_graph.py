@@ -0,0 +1,149 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests dependency_graph.py
+
+import ipaddress
+import sys
+
+import pytest
+
+import dependency_graph
+from constants import ErrorLevels
+from dependency_graph import DependencyGraph
+
+
+def small_graph() -> DependencyGraph:
+    """
+    Two interfaces, a route on each, and DNS over either route
+    """
+    graph = DependencyGraph()
+    for ifname in ["eth0", "eth1"]:
+        graph.add(f"physicals/{ifname}", status=ErrorLevels.NORMAL)
+        graph.add(f"datalinks/{ifname}", status=ErrorLevels.NORMAL)
+        graph.require(f"datalinks/{ifname}", [f"physicals/{ifname}"])
+        graph.add(f"networks_4/default dev {ifname}", status=ErrorLevels.NORMAL)
+        graph.require(f"networks_4/default dev {ifname}", [f"datalinks/{ifname}"])
+    graph.add("dns", status=ErrorLevels.NORMAL)
+    graph.require("dns", ["networks_4/default dev eth0", "networks_4/default dev eth1"])
+    graph.add("applications/1", status=ErrorLevels.NORMAL)
+    graph.require("applications/1", ["dns"])
+    graph.propagate()
+    return graph
+
+
+def test_redundancy():
+    graph = small_graph()
+    assert graph.status("applications/1") == ErrorLevels.NORMAL
+    graph.set("physicals/eth0", ErrorLevels.DOWN)
+    changed = graph.propagate()
+    assert graph.status("datalinks/eth0") == ErrorLevels.DOWN_DEPENDENCY
+    assert graph.status("networks_4/default dev eth0") == ErrorLevels.DOWN_DEPENDENCY
+    assert graph.status("dns") == ErrorLevels.DEGRADED, "DNS lost one of its two routes"
+    assert graph.status("applications/1") == ErrorLevels.NORMAL, "The application only needs DNS to be up"
+    assert changed[0] == "physicals/eth0", f"The changes should be lowest level first, are {changed}"
+    assert "applications/1" not in changed
+    graph.set("physicals/eth1", ErrorLevels.DOWN)
+    graph.propagate()
+    assert graph.status("dns") == ErrorLevels.DOWN_DEPENDENCY
+    assert graph.status("applications/1") == ErrorLevels.DOWN_DEPENDENCY
+    assert graph.root_causes("applications/1") == ["physicals/eth0", "physicals/eth1"]
+    graph.set("physicals/eth0", ErrorLevels.NORMAL)
+    graph.propagate()
+    assert graph.status("applications/1") == ErrorLevels.NORMAL
+    assert graph.root_causes("applications/1") == []
+
+
+def test_reliability():
+    graph = small_graph()
+    graph.set("physicals/eth0", node_reliability=0.5)
+    graph.set("physicals/eth1", node_reliability=0.4)
+    graph.set("dns", node_reliability=0.9)
+    graph.propagate()
+    assert graph.reliability("networks_4/default dev eth0") == 0.5
+    # The two routes are in parallel: 0.5 OR 0.4 is 0.7, and in series with DNS itself
+    assert graph.reliability("dns") == pytest.approx(0.9 * 0.7)
+    assert graph.reliability("applications/1") == pytest.approx(0.9 * 0.7)
+    with pytest.raises(ValueError):
+        graph.set("dns", node_reliability=1.5)
+
+
+def test_only_the_affected_nodes_are_recomputed():
+    graph = DependencyGraph()
+    graph.add("dns", status=ErrorLevels.NORMAL)
+    for i in range(1000):
+        graph.add(f"datalinks/eth{i}", status=ErrorLevels.NORMAL)
+        graph.add(f"networks_4/route{i}", status=ErrorLevels.NORMAL)
+        graph.require(f"networks_4/route{i}", [f"datalinks/eth{i}"])
+    graph.require("dns", ["networks_4/route0", "networks_4/route1"])
+    graph.propagate()
+    before = graph.recomputed
+    graph.set("datalinks/eth500", ErrorLevels.DOWN)
+    changed = graph.propagate()
+    assert changed == ["datalinks/eth500", "networks_4/route500"], f"changed is {changed}"
+    assert graph.recomputed - before == 2, f"{graph.recomputed - before} nodes were recomputed for one change"
+    before = graph.recomputed
+    assert graph.propagate() == [] and graph.recomputed == before, "Nothing changed, so nothing is recomputed"
+
+
+def test_circles():
+    graph = DependencyGraph()
+    graph.add("a", status=ErrorLevels.NORMAL)
+    graph.add("b", status=ErrorLevels.NORMAL)
+    graph.require("a", ["b"])
+    graph.require("b", ["a"])
+    with pytest.raises(ValueError):
+        graph.propagate()
+    with pytest.raises(KeyError):
+        graph.require("a", ["c"])
+
+
+class FakeRoute(object):
+    def __init__(self, name: str, dev: str, metric: int = 0) -> None:
+        self.name = name
+        self.ipv4_destination = ipaddress.IPv4Network("0.0.0.0/0") if name == "default" else \
+            ipaddress.IPv4Network(name)
+        self.ipv4_dev = dev
+        self.ipv4_metric = metric
+
+    def get_status(self) -> ErrorLevels:
+        return ErrorLevels.NORMAL
+
+
+class FakeDataLink(object):
+    def __init__(self, state_up: bool) -> None:
+        self.state_up = state_up
+
+
+class FakeApplication(object):
+    def get_status(self) -> ErrorLevels:
+        return ErrorLevels.NORMAL
+
+
+class FakeSystem(object):
+    def __init__(self, eth1_up: bool = True) -> None:
+        self.physicals = dict()
+        self.datalinks = {"eth0:": FakeDataLink(True), "eth1:": FakeDataLink(eth1_up)}
+        self.networks_4 = [FakeRoute("default", "eth0"), FakeRoute("10.1.0.0/16", "eth1"),
+                           FakeRoute("10.1.2.0/24", "eth1")]
+        self.networks_6 = []
+        self.applications = {"1": FakeApplication()}
+
+
+def test_from_system_description():
+    graph = DependencyGraph.from_system_description(FakeSystem(), resolvers=["8.8.8.8", "10.1.2.3"])
+    assert graph.nodes["networks_4/default dev eth0 metric 0"].requires == [["datalinks/eth0"]]
+    assert graph.nodes["resolvers/10.1.2.3"].requires == [["networks_4/10.1.2.0/24 dev eth1 metric 0"]], \
+        "A resolver depends on the most specific route to it"
+    assert graph.nodes["resolvers/8.8.8.8"].requires == [["networks_4/default dev eth0 metric 0"]]
+    assert graph.nodes["applications/1"].requires == [[dependency_graph.DNS_KEY]]
+    assert graph.status("applications/1") == ErrorLevels.NORMAL
+    changed = graph.refresh(FakeSystem(eth1_up=False))
+    assert changed[0] == "datalinks/eth1", f"changed is {changed}"
+    assert graph.status("resolvers/10.1.2.3") == ErrorLevels.DOWN_DEPENDENCY
+    assert graph.status(dependency_graph.DNS_KEY) == ErrorLevels.DEGRADED
+    assert graph.status("applications/1") == ErrorLevels.NORMAL
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
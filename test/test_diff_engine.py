@@ -0,0 +1,77 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests diff_engine.py
+
+import socket
+
+import diff_engine
+from connection_table import ConnectionTable
+from constants import ErrorLevels, TcpStates
+from layer import Layer
+
+
+def route(destination: str, dev: str = "eth0", metric: int = 100, via: str = "192.0.2.1") -> dict:
+    return {"destination": destination, "dev": dev, "metric": metric, "via": via}
+
+
+class Nic(Layer):
+    def __init__(self, name: str, mtu: int) -> None:
+        super().__init__(name=name)
+        self.mtu = mtu
+
+
+def test_added_removed_changed():
+    nominal = {"networks_4": [route("default"), route("10.0.0.0/8"), route("172.16.0.0/12")],
+               "physicals": {"eth0": Nic("eth0", 1500), "eth1": Nic("eth1", 1500)}}
+    current = {"networks_4": [route("172.16.0.0/12"), route("default", via="192.0.2.254"), route("192.168.0.0/16")],
+               "physicals": {"eth0": Nic("eth0", 1500), "eth1": Nic("eth1", 9000)}}
+    report = diff_engine.diff(nominal, current)
+    routes = report["networks_4"]
+    assert [item.key for item in routes.removed] == ["10.0.0.0/8 eth0 100"], str(routes)
+    assert [item.key for item in routes.added] == ["192.168.0.0/16 eth0 100"], str(routes)
+    assert [item.key for item in routes.changed] == ["default eth0 100"], str(routes)
+    assert routes.changed[0].fields == {"via": ("192.0.2.1", "192.0.2.254")}
+    # The time a Nic was made is different every time, but that is not a change
+    physicals = report["physicals"]
+    assert len(physicals) == 1 and physicals.changed[0].fields == {"mtu": (1500, 9000)}, str(physicals)
+    assert report.get_status() == ErrorLevels.CHANGED
+    assert report["applications"].get_status() == ErrorLevels.NORMAL and len(report["applications"]) == 0
+
+
+def test_same_state_is_normal():
+    state = {"networks_4": [route("default"), route("10.0.0.0/8")]}
+    report = diff_engine.diff(state, {"networks_4": list(reversed(state["networks_4"]))})
+    assert report.get_status() == ErrorLevels.NORMAL, str(report)
+
+
+def test_key_does_not_depend_on_the_entity_before():
+    ipv4_route = {"ipv4_destination": "0.0.0.0/0", "ipv4_dev": "eth0", "ipv4_metric": 100, "name": "default"}
+    key = diff_engine.entity_key(ipv4_route)
+    assert diff_engine.entity_key({"name": "tcp"}) == "tcp"
+    assert diff_engine.entity_key(ipv4_route) == key == "0.0.0.0/0 eth0 100", "The first KEY_FIELDS that match win"
+    state = {"transports": [{"name": "tcp"}], "networks_4": [dict(ipv4_route)]}
+    report = diff_engine.diff(state, {"networks_4": [dict(ipv4_route)], "transports": [{"name": "tcp"}]})
+    assert report.get_status() == ErrorLevels.NORMAL, str(report)
+
+
+def test_duplicate_keys_are_all_compared():
+    nominal = {"networks_4": [route("10.0.0.0/8", via="192.0.2.1"), route("10.0.0.0/8", via="192.0.2.2")]}
+    current = {"networks_4": [route("10.0.0.0/8", via="192.0.2.1")]}
+    report = diff_engine.diff(nominal, current)
+    assert [item.key for item in report["networks_4"].removed] == ["10.0.0.0/8 eth0 100 #2"], str(report)
+
+
+def test_connection_tables_and_index_reuse():
+    def table(ports):
+        t = ConnectionTable()
+        for port in ports:
+            t.add(socket.AF_INET, "192.0.2.10", 443, "198.51.100.7", port, TcpStates.ESTABLISHED, "TCP", 33, port)
+        return t
+
+    index = diff_engine.NominalIndex({"transports": table(range(40000, 41000))}, layer_names=["transports"])
+    first = index.diff({"transports": table(range(40001, 41001))})
+    assert [item.key for item in first["transports"].removed] == ["TCP 192.0.2.10 443 198.51.100.7 40000"]
+    assert [item.key for item in first["transports"].added] == ["TCP 192.0.2.10 443 198.51.100.7 41000"]
+    second = index.diff({"transports": table(range(40000, 41000))})
+    assert len(second["transports"]) == 0, "The index should not have been changed by the first diff"
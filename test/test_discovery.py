@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests discovery.py
+
+import time
+
+from constants import ErrorLevels
+from discovery import DiscoveryScheduler
+
+NAP = 0.3
+
+
+def nap(seconds: float, value=None):
+    def probe():
+        time.sleep(seconds)
+        return value
+    return probe
+
+
+def test_layers_run_concurrently():
+    probes = {name: nap(NAP, value=name) for name in ["datalinks", "networks_4", "networks_6", "physicals"]}
+    start = time.monotonic()
+    results, timings = DiscoveryScheduler(probes).run()
+    elapsed = time.monotonic() - start
+    # Run one after another, the probes would take 4 * NAP
+    assert elapsed < 2 * NAP, f"4 probes of {NAP} seconds took {elapsed} seconds, they are not concurrent"
+    for name in probes:
+        assert results[name] == name, f"results[{name}] is {results[name]}, should be {name}"
+        assert timings[name].status == ErrorLevels.NORMAL
+        assert timings[name].elapsed >= NAP, f"{name} took {timings[name].elapsed}, should be at least {NAP}"
+
+
+def test_layer_timeout():
+    probes = {"physicals": nap(NAP, value="physicals"), "hung": nap(10.0, value="hung")}
+    start = time.monotonic()
+    results, timings = DiscoveryScheduler(probes, timeouts={"hung": NAP / 2}).run()
+    assert time.monotonic() - start < 2 * NAP, "The scheduler waited for a layer that timed out"
+    assert results["hung"] is None
+    assert timings["hung"].status == ErrorLevels.UNKNOWN, f"status is {timings['hung'].status}, should be UNKNOWN"
+    assert results["physicals"] == "physicals"
+
+
+def test_layer_exception():
+    def broken():
+        raise FileNotFoundError("/sbin/ip")
+
+    results, timings = DiscoveryScheduler({"broken": broken, "ok": nap(0.0, value=17)}).run()
+    assert results["broken"] is None
+    assert timings["broken"].status == ErrorLevels.DOWN
+    assert "FileNotFoundError" in timings["broken"].error
+    assert results["ok"] == 17
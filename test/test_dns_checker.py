@@ -0,0 +1,137 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests dns_checker.py against a DNS server that runs in the test and answers from a table
+
+import socket
+import threading
+import time
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import pytest
+
+import dns_checker
+from constants import ErrorLevels
+
+LOCALHOST = "127.0.0.1"
+# name: {type: (ttl, [addresses])}.  A name that is not here gets NXDOMAIN
+ZONE = {"www.example.com.": {dns.rdatatype.A: (300, ["192.0.2.80", "192.0.2.81"]),
+                             dns.rdatatype.AAAA: (1, ["2001:db8::80"])},
+        "v4only.example.com.": {dns.rdatatype.A: (300, ["192.0.2.4"])}}
+
+
+class StubDnsServer(object):
+    """
+    A DNS server on the loopback interface, in a thread of its own, that counts the queries it gets
+    """
+
+    def __init__(self, silent: bool = False) -> None:
+        """
+        :param silent: if True, then the server never answers
+        """
+        self.silent = silent
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((LOCALHOST, 0))
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                data, client = self.sock.recvfrom(512)
+            except OSError:
+                return
+            self.queries += 1
+            if self.silent:
+                continue
+            query = dns.message.from_wire(data)
+            question = query.question[0]
+            response = dns.message.make_response(query)
+            records = ZONE.get(question.name.to_text())
+            if records is None:
+                response.set_rcode(dns.rcode.NXDOMAIN)
+                response.authority.append(dns.rrset.from_text("example.com.", 3600, "IN", "SOA",
+                                                               "ns.example.com. root.example.com. 1 2 3 4 30"))
+            elif question.rdtype in records:
+                ttl, addresses = records[question.rdtype]
+                response.answer.append(dns.rrset.from_text_list(question.name, ttl, "IN", question.rdtype,
+                                                                addresses))
+            self.sock.sendto(response.to_wire(), client)
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+@pytest.fixture
+def server():
+    stub = StubDnsServer()
+    yield stub
+    stub.close()
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_answers_and_stats(server):
+    checker = dns_checker.DnsChecker(resolvers=[LOCALHOST], port=server.port)
+    answers, stats = checker.check(["www.example.com", "v4only.example.com", "nowhere.example.com"])
+    assert len(answers) == 6 and server.queries == 6, f"answers is {[str(a) for a in answers]}"
+    by_query = {(a.name, a.rdtype): a for a in answers}
+    assert sorted(by_query[("www.example.com", dns.rdatatype.A)].addresses) == ["192.0.2.80", "192.0.2.81"]
+    assert by_query[("www.example.com", dns.rdatatype.AAAA)].addresses == ["2001:db8::80"]
+    assert by_query[("v4only.example.com", dns.rdatatype.AAAA)].addresses == []
+    assert by_query[("nowhere.example.com", dns.rdatatype.A)].rcode == dns.rcode.NXDOMAIN
+    assert stats[LOCALHOST].queries == 6 and len(stats[LOCALHOST].latencies) == 6, str(stats[LOCALHOST])
+    assert stats[LOCALHOST].get_status() == ErrorLevels.NORMAL
+
+
+def test_cache_respects_ttl(server):
+    clock = FakeClock()
+    checker = dns_checker.DnsChecker(resolvers=[LOCALHOST], port=server.port, clock=clock)
+    names = ["www.example.com", "nowhere.example.com"]
+    checker.check(names)
+    assert server.queries == 4
+    answers, stats = checker.check(names)
+    assert server.queries == 4, "Everything should have come from the cache"
+    assert all(a.cached for a in answers) and stats[LOCALHOST].queries == 0
+    # The AAAA record has a TTL of 1 second, the negative answers are cached for the 30 seconds of the SOA
+    clock.now += 2
+    checker.check(names)
+    assert server.queries == 5, f"Only the AAAA record should have expired, but there were {server.queries} queries"
+    clock.now += 30
+    checker.check(names)
+    assert server.queries == 8, f"Only the A record should still be cached, but there were {server.queries} queries"
+
+
+def test_timeouts_are_concurrent_and_not_cached():
+    silent = StubDnsServer(silent=True)
+    try:
+        checker = dns_checker.DnsChecker(resolvers=[LOCALHOST], port=silent.port, timeout=0.3)
+        t0 = time.monotonic()
+        answers, stats = checker.check(["a.example.com", "b.example.com"])
+        elapsed = time.monotonic() - t0
+        assert elapsed < 1.0, f"4 queries with a 0.3 second timeout took {elapsed:.2f} seconds"
+        assert all(a.error == "timed out" for a in answers)
+        assert stats[LOCALHOST].timeouts == 4 and stats[LOCALHOST].get_status() == ErrorLevels.DOWN
+        checker.check(["a.example.com"])
+        assert silent.queries == 6, "A query that timed out should be asked again"
+    finally:
+        silent.close()
+
+
+def test_configured_names(tmp_path):
+    ini = tmp_path / "nbmdt.ini"
+    ini.write_text("[default]\nping_targets: redhat.com, 192.0.2.1, 2001:db8::1, canonical.com\n")
+    assert dns_checker.configured_names(str(ini)) == ["redhat.com", "canonical.com"]
+    ini.write_text("[default]\nping_targets: redhat.com\ndns_names: example.com\n")
+    assert dns_checker.configured_names(str(ini)) == ["example.com"]
@@ -0,0 +1,27 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests entities.py
+
+import sys
+
+import pytest
+
+from constants import OSILevels
+from entities import Entity, ErrorLevels
+
+
+def test_entities_with_the_same_name_have_their_own_history():
+    physical = Entity("eth0", OSILevels.PHYSICAL)
+    datalink = Entity("eth0", OSILevels.DATALINK)
+    nominal = Entity("eth0", OSILevels.DATALINK)
+    datalink.event_record(ErrorLevels.DOWN, "carrier lost")
+    assert datalink.current_status == ErrorLevels.DOWN
+    assert physical.current_status == ErrorLevels.UNKNOWN and nominal.current_status == ErrorLevels.UNKNOWN
+    assert [status for _, status, _ in datalink.log] == [ErrorLevels.UNKNOWN, ErrorLevels.DOWN], f"{datalink.log}"
+    assert [status for _, status, _ in physical.log] == [ErrorLevels.UNKNOWN], f"{physical.log}"
+    assert [status for _, status, _ in nominal.log] == [ErrorLevels.UNKNOWN], f"{nominal.log}"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
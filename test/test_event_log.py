@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests event_log.py
+
+import datetime
+import os
+import sys
+
+import pytest
+
+import timing
+from constants import ErrorLevels
+from event_log import EventLog, Ring, read_segments, segment_numbers
+
+SECOND = 10 ** 9  # in nanoseconds
+START = 1000 * SECOND
+
+
+def at(seconds: float) -> timing.Timestamp:
+    return timing.Timestamp(START + int(seconds * SECOND))
+
+
+def test_ring():
+    ring = Ring(4, ["q", None])
+    for i in range(6):
+        ring.append(i * 10, f"row {i}")
+    assert list(ring.rows()) == [(20, "row 2"), (30, "row 3"), (40, "row 4"), (50, "row 5")], \
+        f"rows are {list(ring.rows())}"
+    assert ring.bisect_left(35) == 2 and ring.bisect_left(0) == 0 and ring.bisect_left(99) == 4
+    assert list(ring.rows(3)) == [(50, "row 5")]
+
+
+def test_only_changes_are_recorded():
+    log = EventLog()
+    assert log.record("eth0", ErrorLevels.UNKNOWN, "started", when=at(0))
+    assert log.record("eth0", ErrorLevels.NORMAL, "ping", when=at(1))
+    assert not log.record("eth0", ErrorLevels.NORMAL, "ping", when=at(2)), "The same status again is not a change"
+    assert [(event.status, event.reporter) for event in log.history("eth0")] == \
+        [(ErrorLevels.UNKNOWN, "started"), (ErrorLevels.NORMAL, "ping")]
+    assert log.current_status("eth0") == ErrorLevels.NORMAL and log.current_status("eth1") is None
+
+
+def test_history_is_bounded():
+    log = EventLog(capacity=8, recent=16)
+    for i in range(1000):
+        for entity in ["eth0", "eth1", "eth2"]:
+            log.record(entity, ErrorLevels.NORMAL if i % 2 else ErrorLevels.DOWN, when=at(i))
+    history = log.history("eth0")
+    assert len(history) == 8 and history[-1].time == at(999), f"history is {history}"
+    assert len(log.transitions(10 ** 6, now=at(1000))) == 16, "Only the last 16 changes of all entities are kept"
+
+
+def test_entities_are_bounded():
+    log = EventLog(capacity=8, max_entities=100)
+    log.record("eth0", ErrorLevels.NORMAL, when=at(0))
+    for i in range(1000):
+        log.record(f"connection {i}", ErrorLevels.NORMAL, when=at(i))
+        if i % 10 == 0:
+            log.record("eth0", ErrorLevels.DOWN if i % 20 else ErrorLevels.NORMAL, when=at(i))
+    assert len(log.entities()) == 100 and log.forgotten == 901, f"{len(log.entities())} entities, {log.forgotten}"
+    assert "eth0" in log.entities(), "eth0 keeps changing, so it should not have been forgotten"
+    assert log.current_status("connection 0") is None and log.current_status("connection 999") == ErrorLevels.NORMAL
+
+
+def test_transitions_in_the_last_seconds():
+    log = EventLog()
+    for i, (entity, status) in enumerate([("eth0", ErrorLevels.NORMAL), ("dns", ErrorLevels.NORMAL),
+                                          ("eth0", ErrorLevels.DOWN), ("dns", ErrorLevels.SLOW),
+                                          ("eth0", ErrorLevels.NORMAL)]):
+        log.record(entity, status, when=at(i * 60))
+    recent = log.transitions(150, now=at(241))
+    assert [(event.entity, event.status) for event in recent] == \
+        [("eth0", ErrorLevels.DOWN), ("dns", ErrorLevels.SLOW), ("eth0", ErrorLevels.NORMAL)], f"got {recent}"
+    assert [event.status for event in log.transitions(150, entity="eth0", now=at(241))] == \
+        [ErrorLevels.DOWN, ErrorLevels.NORMAL]
+    assert log.transitions(60, entity="nothing") == []
+
+
+def test_time_in_states():
+    log = EventLog(capacity=2)
+    log.record("eth0", ErrorLevels.NORMAL, when=at(0))
+    log.record("eth0", ErrorLevels.DOWN, when=at(100))
+    log.record("eth0", ErrorLevels.NORMAL, when=at(130))
+    log.record("eth0", ErrorLevels.DOWN, when=at(200))
+    log.record("dns", ErrorLevels.NORMAL, when=at(50))
+    # eth0's first change has been overwritten, but its time in NORMAL still counts
+    assert log.time_in_states("eth0", now=at(210)) == {ErrorLevels.NORMAL: datetime.timedelta(seconds=170),
+                                                       ErrorLevels.DOWN: datetime.timedelta(seconds=40)}
+    assert log.time_in_states(now=at(210)) == {ErrorLevels.NORMAL: datetime.timedelta(seconds=330),
+                                               ErrorLevels.DOWN: datetime.timedelta(seconds=40)}
+
+
+def test_segments(tmp_path):
+    directory = str(tmp_path / "events")
+    log = EventLog(directory=directory, segment_size=100, segments=3)
+    for i in range(40):
+        log.record(f"entity{i % 4}", ErrorLevels.NORMAL if i % 8 < 4 else ErrorLevels.DEGRADED, "héllo", when=at(i))
+    log.close()
+    numbers = segment_numbers(directory)
+    assert len(numbers) == 3 and numbers == list(range(numbers[0], numbers[0] + 3)), \
+        f"Only the last 3 segments should be kept, there are {numbers}"
+    assert all(os.path.getsize(os.path.join(directory, name)) <= 100 for name in os.listdir(directory))
+    changes = list(read_segments(directory))
+    assert changes[-1][1] == (at(39), "entity3", ErrorLevels.DEGRADED, "héllo"), f"got {changes[-1]}"
+    assert [event.time for _, event in changes] == sorted(event.time for _, event in changes)
+    assert changes[-1][0] - changes[0][0] == datetime.timedelta(seconds=len(changes) - 1)
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,222 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests monitor_server.py
+
+import asyncio
+import json
+import time
+
+from constants import ErrorLevels
+from counter_rates import RateEngine
+from discovery import LayerTiming
+from monitor_server import MonitorServer
+from route_churn import RouteChurn
+
+LOCALHOST = "127.0.0.1"  # With port=0, each address family would get a different port
+
+
+class FakeSystem(object):
+    """Has the attributes of a SystemDescription that the monitor server looks at"""
+
+    def __init__(self, gateway: str = "192.0.2.1", datalinks_status: ErrorLevels = ErrorLevels.NORMAL):
+        self.system_name = "testhost"
+        self.networks_4 = {"default": {"gateway": gateway, "metric": 100}}
+        self.datalinks = {"eth0": {"mtu": 1500}}
+        self.discovery_timings = {"networks_4": LayerTiming("networks_4", 0.01, ErrorLevels.NORMAL),
+                                  "datalinks": LayerTiming("datalinks", 10.0, datalinks_status, "timed out")}
+
+
+async def request(port: int, path: str, headers: dict = None) -> (int, dict, bytes):
+    reader, writer = await asyncio.open_connection(LOCALHOST, port)
+    lines = [f"GET {path} HTTP/1.1", "Host: localhost", "Connection: close"]
+    lines.extend(f"{key}: {value}" for key, value in (headers or {}).items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b"\r\n\r\n", 1)
+    head_lines = head.decode("latin-1").split("\r\n")
+    status = int(head_lines[0].split()[1])
+    response_headers = {line.split(":", 1)[0].lower(): line.split(":", 1)[1].strip() for line in head_lines[1:]}
+    return status, response_headers, body
+
+
+def run(server: MonitorServer, client) -> None:
+    async def main():
+        await server.start()
+        try:
+            await client(server.port)
+        finally:
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def test_layers_and_etag():
+    server = MonitorServer(discover=FakeSystem, port=0, host=LOCALHOST,
+                           initial=FakeSystem(datalinks_status=ErrorLevels.UNKNOWN), refresh_interval=3600.0)
+
+    async def client(port):
+        status, headers, body = await request(port, "/")
+        assert status == 200, f"status is {status}, should be 200"
+        document = json.loads(body)
+        assert document["system_name"] == "testhost"
+        assert document["status"] == "UNKNOWN", "The worst layer was UNKNOWN, so the system should be too"
+        assert document["layers"]["networks_4"]["status"] == "NORMAL"
+        assert document["layers"]["networks_4"]["state"]["default"]["gateway"] == "192.0.2.1"
+        assert document["layers"]["datalinks"]["error"] == "timed out"
+        assert document["layers"]["physicals"]["status"] == "UNKNOWN", "A layer that wasn't discovered is UNKNOWN"
+
+        status, headers_304, body = await request(port, "/", headers={"If-None-Match": headers["etag"]})
+        assert status == 304, f"status is {status}, the ETag matched so it should be 304"
+        assert body == b""
+
+        status, headers, body = await request(port, "/layers/networks_4")
+        assert status == 200 and json.loads(body)["status"] == "NORMAL"
+        status, headers, body = await request(port, "/layers/no_such_layer")
+        assert status == 404, f"status is {status}, should be 404"
+
+    run(server, client)
+    assert server.not_modified == 1
+
+
+def test_refresh_in_background():
+    gateways = ["192.0.2.1", "192.0.2.254"]
+
+    def slow_discover():
+        time.sleep(0.2)  # A probe that takes a while must not hold up requests
+        return FakeSystem(gateway=gateways[-1])
+
+    server = MonitorServer(discover=slow_discover, port=0, host=LOCALHOST, initial=FakeSystem(gateway=gateways[0]),
+                           refresh_interval=0.05)
+
+    async def client(port):
+        status, headers, body = await request(port, "/layers/networks_4")
+        first_etag = headers["etag"]
+        start = time.monotonic()
+        await request(port, "/health")
+        assert time.monotonic() - start < 0.1, "The request waited for a discovery"
+        await asyncio.sleep(0.5)
+        status, headers, body = await request(port, "/layers/networks_4", headers={"If-None-Match": first_etag})
+        assert status == 200, "The gateway changed, so the ETag should have too"
+        assert json.loads(body)["state"]["default"]["gateway"] == gateways[-1]
+        generation = server.snapshot.generation
+        await asyncio.sleep(0.5)
+        # Nothing changed since, so the snapshot was kept, and so was its ETag
+        assert server.snapshot.generation == generation, "A snapshot that did not change should not replace the last"
+
+    run(server, client)
+
+
+def test_etag_ignores_the_discovery_time():
+    def discover():
+        system = FakeSystem()
+        system.networks_4["default"]["time"] = time.time()  # Every discovery has a new time, see diff_engine
+        return system
+
+    server = MonitorServer(discover=discover, port=0, host=LOCALHOST, refresh_interval=3600.0)
+    first = server.update(discover())
+    time.sleep(0.01)
+    assert server.update(discover()) is first, "Only the time changed, so the snapshot and its ETags should be kept"
+    assert b'"time"' not in first.resources["/layers/networks_4"].body
+
+
+class Link(object):
+    """A datalink, as far as dependency_graph is concerned"""
+
+    def __init__(self, state_up: bool):
+        self.state_up = state_up
+
+
+def test_dependencies():
+    systems = [FakeSystem(), FakeSystem()]
+    systems[0].datalinks = {"eth0": Link(True), "eth1": Link(True)}
+    systems[1].datalinks = {"eth0": Link(True), "eth1": Link(False)}
+    server = MonitorServer(discover=lambda: systems[-1], port=0, host=LOCALHOST, initial=systems[0],
+                           refresh_interval=0.05, dependencies=True)
+
+    async def client(port):
+        status, headers, body = await request(port, "/dependencies")
+        assert status == 200 and json.loads(body)["datalinks/eth1"]["status"] == "NORMAL"
+        graph = server.graph
+        await asyncio.sleep(0.5)
+        status, headers, body = await request(port, "/dependencies", headers={"If-None-Match": headers["etag"]})
+        assert status == 200, "eth1 went down, so the dependencies changed"
+        assert json.loads(body)["datalinks/eth1"]["status"] == "DOWN"
+        assert server.graph is graph, "No entity came or went, so the graph should have been refreshed, not rebuilt"
+
+    run(server, client)
+
+
+def test_rates(tmp_path):
+    statistics = tmp_path / "eth0" / "statistics"
+    statistics.mkdir(parents=True)
+    (statistics / "rx_bytes").write_text("0\n")
+    rates = RateEngine(counters=["statistics/rx_bytes"], interval=0.05, root=str(tmp_path))
+    server = MonitorServer(discover=FakeSystem, port=0, host=LOCALHOST, initial=FakeSystem(), refresh_interval=3600.0,
+                           rates=rates)
+
+    async def client(port):
+        await asyncio.sleep(0.1)
+        (statistics / "rx_bytes").write_text("1000000\n")
+        await asyncio.sleep(0.3)
+        status, headers, body = await request(port, "/rates")
+        assert status == 200, f"status is {status}, should be 200"
+        assert json.loads(body)["eth0"]["rx_bytes"]["max"] > 0.0, f"rx_bytes went up, the rates are {body}"
+        status, headers, body = await request(port, "/rates/eth0")
+        document = json.loads(body)
+        assert status == 200 and len(document["series"]["time"]) == len(document["series"]["rx_bytes"]) > 0
+        status, headers, body = await request(port, "/rates/eth1")
+        assert status == 404, f"status is {status}, there is no eth1"
+
+    run(server, client)
+
+
+def test_churn():
+    churn = RouteChurn(interval=0.05)
+    route = {"family": "inet", "type": "unicast", "destination": "default", "via": "192.0.2.1", "dev": "eth0",
+             "proto": "static", "scope": "global", "metric": 0, "src": None, "table": 254, "linkdown": False,
+             "pref": None, "flags": [], "nexthops": []}
+    server = MonitorServer(discover=FakeSystem, port=0, host=LOCALHOST, initial=FakeSystem(), refresh_interval=3600.0,
+                           churn=churn)
+
+    async def client(port):
+        churn.record_event("RTM_NEWROUTE", route)
+        churn.record_event("RTM_DELROUTE", route)
+        await asyncio.sleep(0.2)
+        status, headers, body = await request(port, "/churn")
+        assert status == 200, f"status is {status}, should be 200"
+        document = json.loads(body)
+        assert document["events"] == {"add": 1, "delete": 1, "change": 0}, f"the churn is {body}"
+        assert document["top"][0]["destination"] == "default"
+        status, headers, body = await request(port, "/churn/default")
+        assert status == 200 and json.loads(body)["inet"]["changes"] == 2, f"the default route is {body}"
+
+    run(server, client)
+
+
+def test_many_concurrent_clients():
+    server = MonitorServer(discover=FakeSystem, port=0, host=LOCALHOST, initial=FakeSystem(),
+                           refresh_interval=3600.0)
+
+    async def client(port):
+        results = await asyncio.gather(*[request(port, "/health") for _ in range(300)])
+        assert all(status == 200 for status, headers, body in results)
+
+    run(server, client)
+    assert server.requests == 300, f"server.requests is {server.requests}, should be 300"
+
+
+def test_too_many_connections():
+    server = MonitorServer(discover=FakeSystem, port=0, host=LOCALHOST, initial=FakeSystem(),
+                           refresh_interval=3600.0, max_connections=1, request_timeout=0.5)
+
+    async def client(port):
+        idle_reader, idle_writer = await asyncio.open_connection(LOCALHOST, port)  # Holds the only slot
+        await asyncio.sleep(0.05)
+        status, headers, body = await request(port, "/health")
+        assert status == 503, f"status is {status}, should be 503 because the server is full"
+        idle_writer.close()
+
+    run(server, client)
+    assert server.rejected == 1
@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests netlink_backend.py
+
+import os
+
+import pytest
+
+import netlink_backend
+from netlink_backend import IpCommandBackend, NetlinkBackend
+
+
+def test_parse_link_line():
+    line = r"4: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1400 qdisc pfifo_fast state UP mode DEFAULT group " \
+           r"default qlen 1000\    link/ether 02:fc:00:00:00:01 brd ff:ff:ff:ff:ff:ff"
+    link = IpCommandBackend.parse_link_line(line)
+    assert link["index"] == 4, f"index is {link['index']}, should be 4"
+    assert link["name"] == "eth0", f"name is {link['name']}, should be eth0 (no trailing colon)"
+    assert link["flags"] == ["BROADCAST", "MULTICAST", "UP", "LOWER_UP"], f"flags is {link['flags']}"
+    assert link["mtu"] == 1400 and link["qlen"] == 1000, "mtu and qlen should be ints"
+    assert link["qdisc"] == "pfifo_fast"
+    assert link["state"] == "UP"
+    assert link["link_type"] == "ether"
+    assert link["link_addr"] == "02:fc:00:00:00:01", f"link_addr is {link['link_addr']}"
+    assert link["broadcast_addr"] == "ff:ff:ff:ff:ff:ff"
+
+
+def test_parse_address_line():
+    line = r"4: eth0    inet 192.0.2.2/24 brd 192.0.2.255 scope global eth0\       valid_lft forever " \
+           r"preferred_lft forever"
+    address = IpCommandBackend.parse_address_line(line)
+    assert address["dev"] == "eth0"
+    assert address["family"] == "inet"
+    assert address["address"] == "192.0.2.2", f"address is {address['address']}, should not have the prefix length"
+    assert address["prefixlen"] == 24
+    assert address["broadcast"] == "192.0.2.255"
+    assert address["scope"] == "global"
+
+
+def test_parse_route_line():
+    route = IpCommandBackend.parse_route_line("10.0.3.0/24 dev lxcbr0 proto kernel scope link src 10.0.3.1 linkdown",
+                                              "inet")
+    assert route["destination"] == "10.0.3.0/24"
+    assert route["via"] is None, f"via is {route['via']}, should be None for a directly connected network"
+    assert route["dev"] == "lxcbr0"
+    assert route["proto"] == "kernel"
+    assert route["scope"] == "link"
+    assert route["src"] == "10.0.3.1"
+    assert route["linkdown"], "The route is linkdown, but linkdown is False"
+
+    route = IpCommandBackend.parse_route_line("default via fe80::1 dev eth0 proto ra metric 1024 pref medium",
+                                              "inet6")
+    assert route["family"] == "inet6"
+    assert route["destination"] == "default"
+    assert route["via"] == "fe80::1"
+    assert route["metric"] == 1024
+    assert route["pref"] == "medium"
+    assert not route["linkdown"]
+
+
+def test_dump_is_shared():
+    # Two callers within DUMP_MAX_AGE of each other get the same dump
+    first = netlink_backend.dump()
+    second = netlink_backend.dump()
+    assert first is second, "The second dump should have reused the first"
+
+
+@pytest.mark.skipif(netlink_backend.IPRoute is None or not os.path.exists(netlink_backend.configuration.IP_COMMAND),
+                    reason="Needs both pyroute2 and the ip command")
+def test_backends_agree():
+    try:
+        netlink = NetlinkBackend()
+    except OSError as e:
+        pytest.skip(f"The netlink socket can't be opened: {str(e)}")
+    netlink_dump = netlink.dump()
+    netlink.close()
+    ip_dump = IpCommandBackend().dump()
+
+    def key(record):
+        return sorted((k, str(v)) for k, v in record.items())
+
+    assert netlink_dump.links == ip_dump.links, \
+        f"netlink found links {netlink_dump.links}, the ip command found links {ip_dump.links}"
+    assert sorted(netlink_dump.addresses, key=key) == sorted(ip_dump.addresses, key=key)
+    for family in ["inet", "inet6"]:
+        assert netlink_dump.routes_for(family) == ip_dump.routes_for(family), f"The {family} routes differ"
@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests netlink_state.py
+
+import errno
+import time
+
+import pytest
+
+import netlink_state
+from netlink_backend import LinkStateBackend, LinkStateDump, RT_TABLE_MAIN
+from netlink_state import NetlinkStateCache, RESYNC
+
+ETH0 = {"index": 2, "name": "eth0", "flags": ["BROADCAST", "MULTICAST", "UP", "LOWER_UP"], "mtu": 1500,
+        "qdisc": "fq_codel", "state": "UP", "mode": "DEFAULT", "group": "default", "qlen": 1000, "master": None,
+        "link_type": "ether", "link_addr": "02:fc:00:00:00:01", "broadcast_addr": "ff:ff:ff:ff:ff:ff"}
+ADDRESS = {"index": 2, "dev": "eth0", "family": "inet", "address": "192.0.2.2", "prefixlen": 24,
+           "broadcast": "192.0.2.255", "scope": "global", "label": "eth0", "flags": []}
+
+
+def route(destination: str, via: str = None, metric: int = 0, table: int = RT_TABLE_MAIN) -> dict:
+    return {"family": "inet", "type": "unicast", "destination": destination, "via": via, "dev": "eth0",
+            "proto": "static", "scope": "global", "metric": metric, "src": None, "table": table, "linkdown": False,
+            "pref": None, "flags": [], "nexthops": []}
+
+
+class FixedBackend(LinkStateBackend):
+    """A backend that always dumps the same links, addresses and routes"""
+    name = "fixed"
+
+    def __init__(self):
+        super().__init__()
+        self.dumps = 0
+
+    def _dump(self) -> LinkStateDump:
+        self.dumps += 1
+        return LinkStateDump(links=[dict(ETH0)], addresses=[dict(ADDRESS)], routes=[route("default", "192.0.2.1")],
+                             backend=self.name)
+
+
+def test_apply_events():
+    cache = NetlinkStateCache(backend=FixedBackend())
+    cache.resync()
+    generation = cache.generation
+
+    new_address = dict(ADDRESS, address="192.0.2.3")
+    assert cache.apply("RTM_NEWADDR", new_address), "Adding an address should change the model"
+    assert cache.apply("RTM_NEWROUTE", route("198.51.100.0/24", "192.0.2.254"))
+    assert cache.generation == generation + 2, f"generation is {cache.generation}, should be {generation + 2}"
+    snapshot = cache.dump()
+    assert len(snapshot.addresses) == 2, f"There should be 2 addresses, there are {snapshot.addresses}"
+    assert len(snapshot.routes) == 2
+
+    assert cache.apply("RTM_DELADDR", new_address)
+    # Deleting something that isn't there does not change the model, but it is still counted
+    assert not cache.apply("RTM_DELADDR", new_address)
+    assert cache.events_applied["RTM_DELADDR"] == 2, f"events_applied is {cache.events_applied}"
+    # Only the main table is modeled, the same as a dump
+    assert not cache.apply("RTM_NEWROUTE", route("local 192.0.2.2", table=255))
+    assert cache.events_ignored == 1
+    assert [a["address"] for a in cache.dump().addresses] == ["192.0.2.2"]
+
+
+def test_route_replaced_in_place():
+    cache = NetlinkStateCache(backend=FixedBackend())
+    cache.resync()
+    # Same destination and metric, so this is the same route with a new gateway
+    cache.apply("RTM_NEWROUTE", route("default", "192.0.2.254"))
+    routes = cache.dump().routes
+    assert len(routes) == 1 and routes[0]["via"] == "192.0.2.254", f"routes is {routes}"
+    # A different metric is a different route
+    cache.apply("RTM_NEWROUTE", route("default", "192.0.2.1", metric=100))
+    assert len(cache.dump().routes) == 2
+
+
+def test_snapshot_is_reused():
+    backend = FixedBackend()
+    cache = NetlinkStateCache(backend=backend)
+    cache.resync()
+    cache._thread = type("Running", (), {"is_alive": lambda self: True})()  # pretend that events keep it current
+    first = cache.dump()
+    assert cache.dump() is first, "Nothing changed, so the snapshot should not have been rebuilt"
+    cache.apply("RTM_NEWLINK", dict(ETH0, mtu=9000))
+    second = cache.dump()
+    assert second is not first
+    assert second.links[0]["mtu"] == 9000
+    assert backend.dumps == 1, f"The backend was dumped {backend.dumps} times, the events should have been enough"
+
+
+def test_listeners_and_resync():
+    heard = []
+    cache = NetlinkStateCache(backend=FixedBackend())
+    cache.add_listener(lambda event, record: heard.append(event))
+    cache.resync()
+    cache.apply("RTM_NEWADDR", dict(ADDRESS, address="192.0.2.9"))
+    cache.apply("RTM_NEWADDR", dict(ADDRESS, address="192.0.2.9"))  # No change, so no one is told
+    assert heard == [RESYNC, "RTM_NEWADDR"], f"heard is {heard}"
+    cache.resync()
+    assert cache.resyncs == 2
+    assert len(cache.dump().addresses) == 1, "A resync should throw away what the events did"
+
+
+def test_link_flags_change_needs_resync():
+    cache = NetlinkStateCache(backend=FixedBackend())
+    cache.resync()
+    cache.apply("RTM_NEWLINK", dict(ETH0, flags=["BROADCAST", "MULTICAST"]))
+    assert cache._resync_needed, "IPv4 routes are flushed without RTM_DELROUTE when a link goes down"
+
+
+class FailingEventSocket(object):
+    """Stands in for pyroute2's IPRoute: drops messages, sends one that can't be applied, and then fails"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def bind(self, groups):
+        pass
+
+    def get(self):
+        self.calls += 1
+        if self.calls == 1:
+            time.sleep(0.2)  # Until start has done its resync
+            raise netlink_state.NetlinkError(errno.ENOBUFS, "No buffer space available")
+        if self.calls == 2:
+            return [{"event": "RTM_NEWADDR"}]  # No attributes, so it can't be applied
+        raise netlink_state.NetlinkError(errno.EBADF, "Bad file descriptor")
+
+    def close(self):
+        pass
+
+
+@pytest.mark.skipif(netlink_state.IPRoute is None, reason="This test needs pyroute2")
+def test_event_thread_failures(monkeypatch):
+    backend = FixedBackend()
+    monkeypatch.setattr(netlink_state, "IPRoute", FailingEventSocket)
+    cache = NetlinkStateCache(backend=backend).start()
+    cache._thread.join(timeout=5.0)
+    # The first resync is start's, then one for the dropped messages and one for the message that wasn't applied
+    assert cache.resyncs == 3 and cache.events_ignored == 1, str(cache)
+    assert not cache.running, "The event thread stopped, so the cache is not current any more"
+    dumps = backend.dumps
+    cache.dump()
+    assert backend.dumps == dumps + 1, "A cache that is not running should dump again"
+    cache.close()
@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests osclinter.py
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from osclinter import OsCliInter
+
+PYTHON = sys.executable
+
+
+def test_run_command():
+    stdout, stderr, status = OsCliInter.run_command(
+        [PYTHON, "-c", "import sys; print('h\\u00e9llo'); print('oops', file=sys.stderr); sys.exit(3)"])
+    assert (stdout, stderr, status) == ("héllo\n", "oops\n", 3), f"got {(stdout, stderr, status)}"
+
+
+def test_timeout_kills_the_command():
+    t0 = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        OsCliInter.run_command([PYTHON, "-c", "import time; print('started', flush=True); time.sleep(30)"],
+                               timeout=0.5)
+    assert time.monotonic() - t0 < 5.0, "The command should have been killed after 0.5 seconds"
+    assert OsCliInter.stats()[os.path.basename(PYTHON)].timeouts >= 1
+
+
+def test_output_is_capped():
+    # Much more output than the cap, on both outputs, and the command must not block on a full pipe
+    stdout, stderr, status = OsCliInter.run_command(
+        [PYTHON, "-c", "import sys; sys.stdout.write('x' * 1000000); sys.stderr.write('y' * 1000000)"],
+        max_output=1000)
+    assert status == 0 and stdout == "x" * 1000 and stderr == "y" * 1000
+
+
+def test_batch_runs_at_the_same_time():
+    sleep = [PYTHON, "-c", "import time; time.sleep(0.5)"]
+    t0 = time.monotonic()
+    results = OsCliInter.run_commands([sleep] * 4 + [["/nonexistent/command"]])
+    elapsed = time.monotonic() - t0
+    assert elapsed < 1.5, f"4 commands of 0.5 seconds each took {elapsed:.2f} seconds"
+    assert [r[2] for r in results[:4]] == [0, 0, 0, 0]
+    assert isinstance(results[4], OSError)
+
+
+def test_async():
+    import asyncio
+
+    async def two():
+        return await asyncio.gather(OsCliInter.run_command_async([PYTHON, "-c", "print(1)"]),
+                                    OsCliInter.run_command_async([PYTHON, "-c", "print(2)"]))
+
+    assert [stdout for stdout, _, _ in asyncio.run(two())] == ["1\n", "2\n"]
@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests pinger.py.  Pinging needs a ping socket or a raw socket, so the tests that send anything are skipped if
+# neither can be opened
+
+import asyncio
+import itertools
+import socket
+import time
+
+import pytest
+
+import pinger
+from constants import ErrorLevels
+
+
+def can_ping(family: int) -> bool:
+    for kind in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+        try:
+            socket.socket(family, kind, pinger.ICMP_PROTOCOL[family]).close()
+            return True
+        except OSError:
+            pass
+    return False
+
+
+needs_icmp = pytest.mark.skipif(not can_ping(socket.AF_INET), reason="This test needs an ICMP socket")
+
+
+def test_checksum():
+    # An echo request with identifier 1, sequence 1 and no payload
+    header = pinger.ICMP_HEADER.pack(8, 0, 0, 1, 1)
+    assert pinger.checksum(header) == 0xF7FD, f"The checksum is {pinger.checksum(header):04X}"
+    assert pinger.checksum(pinger.ICMP_HEADER.pack(8, 0, 0xF7FD, 1, 1)) == 0, "A correct checksum checks to 0"
+
+
+def test_ping_result():
+    result = pinger.PingResult("example.com", "203.0.113.9")
+    result.sent = 4
+    result.rtts = [1.0, 2.0, 3.0]
+    assert (result.rtt_min, result.rtt_avg, result.rtt_max) == (1.0, 2.0, 3.0)
+    assert result.loss == 0.25 and result.get_status() == ErrorLevels.DEGRADED and result
+    unresolved = pinger.PingResult("no.such.name.invalid", error="could not resolve")
+    assert not unresolved and unresolved.get_status() == ErrorLevels.UNKNOWN
+
+
+@needs_icmp
+def test_ping_loopback():
+    targets = ["127.0.0.1", "localhost"]
+    if can_ping(socket.AF_INET6) and socket.has_ipv6:
+        targets.append("::1")
+    results = pinger.Pinger(count=3, interval=0.01).ping(targets)
+    for target in targets:
+        result = results[target]
+        assert result.sent == 3 and result.received == 3, f"{target}: {result}"
+        assert result.get_status() == ErrorLevels.NORMAL and 0.0 <= result.rtt_min <= result.rtt_max
+
+
+@needs_icmp
+def test_sequence_numbers_waiting_for_replies_are_skipped():
+    async def main():
+        icmp_socket = pinger.IcmpSocket(socket.AF_INET, asyncio.get_running_loop())
+        try:
+            # The reply can't come back before the loop runs again, so the request is still waiting
+            waiting = icmp_socket.send("127.0.0.1")
+            sequence = next(number for number, request in icmp_socket.pending.items() if request[2] is waiting)
+            with pytest.raises(ValueError):
+                icmp_socket.send("127.0.0.1", sequence)
+            icmp_socket._sequence = itertools.count(sequence + 0x10000)  # As if the sequence numbers wrapped around
+            assert icmp_socket.next_sequence() == (sequence + 1) & 0xFFFF
+            waiting.cancel()  # Timed out, so its sequence number is free again
+            await asyncio.sleep(0)
+            assert sequence not in icmp_socket.pending, "A cancelled request should stop waiting"
+        finally:
+            icmp_socket.close()
+
+    asyncio.run(main())
+
+
+@needs_icmp
+def test_deadline():
+    # 203.0.113.0/24 is TEST-NET-3, which never answers.  The unreachable target must not hold up the run
+    t0 = time.monotonic()
+    results = pinger.Pinger(count=10, interval=0.1, timeout=5.0, deadline=0.5).ping(["203.0.113.9", "127.0.0.1"])
+    elapsed = time.monotonic() - t0
+    assert elapsed < 1.5, f"The deadline was 0.5 seconds, but the run took {elapsed:.2f} seconds"
+    assert results["203.0.113.9"].received == 0 and results["203.0.113.9"].get_status() == ErrorLevels.DOWN
+    # The last request goes out just before the deadline, so its reply may not be counted
+    loopback = results["127.0.0.1"]
+    assert 0 < loopback.received <= loopback.sent <= 6, str(loopback)
+
+
+def test_default_targets(tmp_path):
+    ini = tmp_path / "nbmdt.ini"
+    ini.write_text("[default]\nping_targets: redhat.com, canonical.com\n")
+    targets = pinger.default_targets(str(ini), resolvers=["10.0.0.53", "redhat.com"], gateways=["10.0.0.1"])
+    assert targets == ["redhat.com", "canonical.com", "10.0.0.1", "10.0.0.53"], f"targets is {targets}"
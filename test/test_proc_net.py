@@ -0,0 +1,81 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests proc_net.py and the parts of transport.py that use it
+
+import os
+import socket
+
+import pytest
+
+import proc_net
+from constants import TcpStates
+from transport import Transport
+
+HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+TCP = HEADER + \
+      "   0: 0100007F:0CEA 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1001 1 " \
+      "0000000000000000 100 0 0 10 0\n" \
+      "   1: 0202000A:D431 0100A8C0:01BB 01 00000000:00000000 02:000A7A3A 00000000  1000        0 1002 2 " \
+      "0000000000000000 20 4 30 10 -1\n" \
+      "   2: 0202000A:D432 0100A8C0:01BB 06 00000000:00000000 03:00000A12 00000000     0        0 0 3 " \
+      "0000000000000000\n"
+TCP6 = HEADER + \
+       "   0: 00000000000000000000000001000000:0016 00000000000000000000000000000000:0000 0A 00000000:00000000 " \
+       "00:00000000 00000000     0        0 2001 1 0000000000000000 100 0 0 10 0\n"
+UDP = HEADER + \
+      "  123: 3500007F:0035 00000000:0000 07 00000000:00000000 00:00000000 00000000   101        0 3001 2 " \
+      "0000000000000000 0\n"
+
+
+@pytest.fixture
+def proc_net_dir(tmp_path):
+    for name, contents in [("tcp", TCP), ("tcp6", TCP6), ("udp", UDP), ("udp6", HEADER)]:
+        (tmp_path / name).write_text(contents)
+    return str(tmp_path)
+
+
+def test_read_connections(proc_net_dir):
+    connections = list(proc_net.read_connections(proc_net=proc_net_dir))
+    assert len(connections) == 5, f"There should be 5 sockets, found {connections}"
+    family, local, local_port, remote, remote_port, state, protocol, uid, inode = connections[1]
+    assert (local, local_port) == ("10.0.2.2", 0xD431), f"local is {local}:{local_port}"
+    assert (remote, remote_port) == ("192.168.0.1", 443), f"remote is {remote}:{remote_port}"
+    assert state == TcpStates.ESTABLISHED
+    assert (protocol, uid, inode) == ("TCP", 1000, 1002)
+    family, local, local_port = connections[3][:3]
+    assert family == socket.AF_INET6 and local == "::1" and local_port == 22, f"connections[3] is {connections[3]}"
+    assert connections[4][6] == "UDP" and connections[4][1] == "127.0.0.53"
+
+
+def test_filters(proc_net_dir):
+    listeners = list(proc_net.read_connections(protocols=["TCP"], states={TcpStates.LISTEN}, proc_net=proc_net_dir))
+    assert [c[2] for c in listeners] == [3306, 22], f"listeners are {listeners}"
+    https = list(proc_net.read_connections(remote_ports={443}, family=socket.AF_INET, proc_net=proc_net_dir))
+    assert len(https) == 2
+    assert list(proc_net.read_connections(local_ports={9}, proc_net=proc_net_dir)) == []
+
+
+def test_lines_across_chunks(tmp_path, monkeypatch):
+    # A small buffer makes lines straddle the reads, and one line is longer than the buffer
+    monkeypatch.setattr(proc_net, "CHUNK_SIZE", 64)
+    (tmp_path / "tcp").write_text(TCP)
+    connections = list(proc_net.read_table(str(tmp_path / "tcp"), "TCP", socket.AF_INET))
+    assert [c[8] for c in connections] == [1001, 1002, 0], f"connections are {connections}"
+
+
+def test_transport_listeners():
+    if not os.path.exists("/proc/net/tcp"):
+        pytest.skip("This test needs /proc/net/tcp")
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+    try:
+        transport = Transport(Transport.find_all_connections(Transport.TransportNames.TCP, af_family=socket.AF_INET))
+        listeners = transport.find_all_listeners()
+        assert port in listeners, f"Port {port} is listening, but find_all_listeners found {listeners.keys()}"
+        assert listeners[port][0].src_host == "127.0.0.1"
+        assert Transport.find_all_connections(ports=[port])[0].state == TcpStates.LISTEN
+    finally:
+        server.close()
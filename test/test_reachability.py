@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests reachability.py
+
+import asyncio
+import sys
+import time
+
+import pytest
+
+import reachability
+from constants import ErrorLevels
+from reachability import ReachabilityMatrix
+
+
+def test_specification(tmp_path):
+    spec_file = tmp_path / "spec.txt"
+    spec_file.write_text("# target  probes\n"
+                         "192.0.2.1   icmp TCP:22 tcp/443\n"
+                         "www.example.com dns   # a comment\n"
+                         "\n"
+                         "198.51.100.0/30\n"
+                         "192.0.2.1 icmp\n"
+                         "concurrency=10\n"
+                         "deadline = 0.5\n"
+                         "resolvers=192.0.2.53,198.51.100.53\n")
+    test_matrix = ReachabilityMatrix.from_specification(str(spec_file))
+    assert test_matrix.probes == [("192.0.2.1", "icmp"), ("192.0.2.1", "tcp/22"), ("192.0.2.1", "tcp/443"),
+                                  ("www.example.com", "dns"), ("198.51.100.1", "icmp"), ("198.51.100.2", "icmp")], \
+        f"probes is {test_matrix.probes}"
+    assert test_matrix.concurrency == 10 and test_matrix.deadline == 0.5
+    assert test_matrix.resolvers == ["192.0.2.53", "198.51.100.53"]
+    inline = ReachabilityMatrix.from_specification("192.0.2.1 tcp/80; 192.0.2.2")
+    assert inline.probes == [("192.0.2.1", "tcp/80"), ("192.0.2.2", "icmp")]
+    for bad in ["192.0.2.1 udp/53", "192.0.2.1 tcp/0", "192.0.2.1 dns", "timeout=1", "# nothing", "10.0.0.0/8"]:
+        with pytest.raises(ValueError):
+            ReachabilityMatrix.from_specification(bad)
+
+
+def test_tcp_and_icmp():
+    async def probe():
+        server = await asyncio.start_server(lambda reader, writer: writer.close(), host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        # Nothing listens on port on 127.0.0.2, so the connection is refused
+        test_matrix = ReachabilityMatrix.from_specification(f"127.0.0.1 tcp/{port} icmp; 127.0.0.2 tcp/{port}; "
+                                                            f"deadline=1.0")
+        try:
+            return await test_matrix.run_async()
+        finally:
+            server.close()
+
+    results = asyncio.run(probe())
+    rows = reachability.matrix(results)
+    accepted, icmp = rows["127.0.0.1"].values()
+    assert accepted.status == ErrorLevels.NORMAL, f"{accepted}"
+    assert icmp.status in (ErrorLevels.NORMAL, ErrorLevels.DEGRADED), f"127.0.0.1 should answer a ping: {icmp}"
+    refused = list(rows["127.0.0.2"].values())[0]
+    assert refused.status == ErrorLevels.DOWN and refused.detail == "refused", f"{refused}"
+    assert reachability.worst(results) == ErrorLevels.DOWN
+
+
+def test_streaming_and_concurrency(monkeypatch):
+    running = []
+    most = []
+
+    async def fake_tcp(self, target: str, port: int):
+        running.append(target)
+        most.append(len(running))
+        # The first target is slow, the rest answer right away
+        await asyncio.sleep(0.5 if target == "192.0.2.1" else 0.01)
+        running.remove(target)
+        return ErrorLevels.NORMAL, "connected"
+
+    monkeypatch.setattr(ReachabilityMatrix, "_tcp", fake_tcp)
+    test_matrix = ReachabilityMatrix([(f"192.0.2.{i}", "tcp/80") for i in range(1, 101)], concurrency=10)
+    order = []
+    start = time.monotonic()
+    results = test_matrix.run(on_result=lambda result: order.append(result.target))
+    assert time.monotonic() - start < 2.0, "The probes should run at the same time"
+    assert max(most) == 10, f"No more than 10 probes should run at once, {max(most)} did"
+    assert order[-1] == "192.0.2.1", "The slow probe should be reported last, when it finishes"
+    assert [result.target for result in results][0] == "192.0.2.1", "The results are in the order of the probes"
+
+
+def test_deadline_does_not_wait_for_blocked_threads(monkeypatch):
+    async def resolving_tcp(self, target: str, port: int):
+        # Like open_connection to a name that the resolver never answers: getaddrinfo can't be cancelled
+        blocked = asyncio.get_running_loop().run_in_executor(None, time.sleep, 5.0)
+        try:
+            await asyncio.wait_for(blocked, timeout=self.deadline)
+        except asyncio.TimeoutError:
+            return ErrorLevels.DOWN, "timed out"
+        return ErrorLevels.NORMAL, "connected"
+
+    monkeypatch.setattr(ReachabilityMatrix, "_tcp", resolving_tcp)
+    start = time.monotonic()
+    results = ReachabilityMatrix([("unanswered.example", "tcp/80")], deadline=0.3).run()
+    elapsed = time.monotonic() - start
+    assert elapsed < 1.5, f"The matrix took {elapsed:.2f} seconds, its deadline was 0.3 seconds"
+    assert results[0].status == ErrorLevels.DOWN
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
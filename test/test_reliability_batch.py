@@ -0,0 +1,86 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests reliability_batch.py against reliability.Reliability and dependency_graph.DependencyGraph
+
+import sys
+
+import numpy as np
+import pytest
+
+import reliability
+import reliability_batch
+from dependency_graph import DependencyGraph
+
+
+def test_series_and_parallel():
+    r = np.array([0.5, 0.4])
+    assert reliability_batch.series(r) == pytest.approx(0.2)
+    assert reliability_batch.parallel(r) == pytest.approx(reliability.Reliability(0.5) + 0.4)
+    scenarios = np.array([[0.5, 0.4], [1.0, 0.0]])
+    assert reliability_batch.parallel(scenarios).tolist() == pytest.approx([0.7, 1.0])
+
+
+def test_groups():
+    r = np.array([0.5, 0.9, 0.4, 0.8])
+    groups = np.array([0, 2, 0, 2])
+    # Group 1 has no components
+    assert reliability_batch.group_series(r, groups).tolist() == pytest.approx([0.2, 1.0, 0.72])
+    assert reliability_batch.group_parallel(r, groups).tolist() == pytest.approx([0.7, 0.0, 0.98])
+    assert reliability_batch.group_parallel(r, groups, n_groups=4).shape == (4,)
+    rng = np.random.default_rng(7)
+    many = rng.uniform(0.0, 1.0, 1000)
+    many_groups = rng.integers(0, 50, 1000)
+    vectorized = reliability_batch.group_parallel(many, many_groups, n_groups=50)
+    for g in range(50):
+        total = reliability.Reliability(0.0)
+        for value in many[many_groups == g].tolist():
+            total = reliability.Reliability(total + value)
+        assert vectorized[g] == pytest.approx(total.reliability), f"Group {g} is wrong"
+
+
+def diamond() -> DependencyGraph:
+    """
+    dns needs either of two routes, and both routes go over the same datalink
+    """
+    graph = DependencyGraph()
+    graph.add("datalinks/eth0", node_reliability=0.9)
+    graph.add("networks_4/a", node_reliability=0.8)
+    graph.add("networks_4/b", node_reliability=0.7)
+    graph.require("networks_4/a", ["datalinks/eth0"])
+    graph.require("networks_4/b", ["datalinks/eth0"])
+    graph.add("dns", node_reliability=0.99)
+    graph.require("dns", ["networks_4/a", "networks_4/b"])
+    graph.add("applications/1", node_reliability=1.0)
+    graph.require("applications/1", ["dns"])
+    graph.propagate()
+    return graph
+
+
+def test_compiled_graph_matches_propagate():
+    graph = diamond()
+    compiled = reliability_batch.CompiledGraph(graph)
+    propagated = compiled.as_dict(compiled.reliability())
+    for key, node in graph.nodes.items():
+        assert propagated[key] == pytest.approx(node.reliability), f"{key} is {propagated[key]}"
+    # What if the datalink were perfect, or dead
+    scenarios = np.tile(compiled.own, (2, 1))
+    scenarios[:, compiled.index["datalinks/eth0"]] = [1.0, 0.0]
+    what_if = compiled.reliability(scenarios)
+    dns = compiled.index["dns"]
+    assert what_if[0, dns] == pytest.approx(0.99 * (1 - 0.2 * 0.3))
+    assert what_if[1, dns] == 0.0
+
+
+def test_simulate():
+    compiled = reliability_batch.CompiledGraph(diamond())
+    simulated = compiled.as_dict(compiled.simulate(20000, rng=np.random.default_rng(1)))
+    # The routes share the datalink, so the exact reliability of dns is less than what propagate says
+    exact = 0.99 * 0.9 * (1 - 0.2 * 0.3)
+    assert simulated["dns"] == pytest.approx(exact, abs=0.01), f"dns worked {simulated['dns']} of the time"
+    assert simulated["datalinks/eth0"] == pytest.approx(0.9, abs=0.01)
+    assert simulated["applications/1"] == simulated["dns"], "applications/1 never fails on its own"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests route_churn.py
+
+import sys
+
+import pytest
+
+from netlink_backend import LinkStateBackend, LinkStateDump, RT_TABLE_MAIN
+from netlink_state import NetlinkStateCache
+from route_churn import ADD, CHANGE, DELETE, RouteChurn
+
+
+def route(destination: str, via: str = "192.0.2.1", metric: int = 0, table: int = RT_TABLE_MAIN,
+          family: str = "inet") -> dict:
+    return {"family": family, "type": "unicast", "destination": destination, "via": via, "dev": "eth0",
+            "proto": "static", "scope": "global", "metric": metric, "src": None, "table": table, "linkdown": False,
+            "pref": None, "flags": [], "nexthops": []}
+
+
+def test_counting_events():
+    churn = RouteChurn()
+    churn.load([route("default"), route("10.0.0.0/8")])
+    assert churn.record_event("RTM_NEWROUTE", route("default"), when=1.0) is None, "The route did not change"
+    assert churn.record_event("RTM_NEWROUTE", route("default", via="192.0.2.254"), when=2.0) == CHANGE
+    assert churn.record_event("RTM_DELROUTE", route("10.0.0.0/8"), when=3.0) == DELETE
+    assert churn.record_event("RTM_DELROUTE", route("10.0.0.0/8"), when=4.0) is None, "It was already deleted"
+    assert churn.record_event("RTM_NEWROUTE", route("10.0.0.0/8"), when=5.0) == ADD
+    # Another metric is another route to the same prefix
+    assert churn.record_event("RTM_NEWROUTE", route("10.0.0.0/8", metric=100), when=6.0) == ADD
+    assert churn.record_event("RTM_NEWROUTE", route("local 192.0.2.2", table=255), when=7.0) is None
+    assert churn.events == {ADD: 2, DELETE: 1, CHANGE: 1}, f"events is {churn.events}"
+    assert churn.events_ignored == 1
+    top = churn.top(when=6.0)
+    assert [prefix["destination"] for prefix in top] == ["10.0.0.0/8", "default"], f"top is {top}"
+    assert top[0]["adds"] == 2 and top[0]["deletes"] == 1 and top[0]["routes"] == 2
+    assert top[1]["changes"] == 1 and top[1]["routes"] == 1
+
+
+def test_penalty_decays_and_flapping():
+    churn = RouteChurn(penalties={ADD: 0.0, DELETE: 1000.0, CHANGE: 500.0}, half_life=10.0, suppress=2000.0,
+                       reuse=750.0)
+    prefix = route("198.51.100.0/24")
+    when = 0.0
+    for _ in range(3):
+        when += 0.001
+        churn.record_event("RTM_NEWROUTE", prefix, when=when)
+        when += 0.001
+        churn.record_event("RTM_DELROUTE", prefix, when=when)
+    top = churn.top(when=when)[0]
+    assert top["penalty"] == pytest.approx(3000.0, rel=0.01) and top["flapping"], f"top is {top}"
+    # Two half lives later the penalty is a quarter, which is still above reuse
+    top = churn.top(when=when + 20.0)[0]
+    assert top["penalty"] == pytest.approx(750.0, rel=0.01), f"top is {top}"
+    assert not churn.top(when=when + 30.0)[0]["flapping"], "Below reuse, the prefix is not flapping any more"
+    # It has no routes, so once its penalty is gone, it is forgotten and its row is reused
+    assert churn.forget(when=when + 200.0) == 1 and len(churn) == 0
+    churn.record_event("RTM_NEWROUTE", route("203.0.113.0/24"), when=when + 201.0)
+    assert len(churn.keys) == 1, "The row should have been reused"
+
+
+def test_default_route_stability():
+    churn = RouteChurn()
+    churn.load([route("default"), route("default", via="fe80::1", family="inet6")])
+    stability = churn.default_route(when=1000.0)
+    assert stability["inet"]["stable"] and stability["inet"]["gateways"] == ["192.0.2.1"], f"{stability}"
+    assert stability["inet6"]["gateways"] == ["fe80::1"]
+    churn.record_event("RTM_NEWROUTE", route("default", via="192.0.2.254"), when=1000.0)
+    stability = churn.default_route(when=1010.0)["inet"]
+    assert not stability["stable"] and stability["changes"] == 1 and stability["gateways"] == ["192.0.2.254"]
+    assert stability["seconds_since_change"] == pytest.approx(10.0)
+    churn.record_event("RTM_DELROUTE", route("default", via="192.0.2.254"), when=1020.0)
+    assert churn.default_route(when=1020.0)["inet"]["gateways"] == [] and \
+        not churn.default_route(when=5000.0)["inet"]["stable"], "There is no default route"
+
+
+class ChangingBackend(LinkStateBackend):
+    """A backend that dumps whatever routes it is given"""
+    name = "changing"
+
+    def __init__(self, routes):
+        super().__init__()
+        self.routes = routes
+
+    def _dump(self) -> LinkStateDump:
+        return LinkStateDump(links=[], addresses=[], routes=[dict(r) for r in self.routes], backend=self.name)
+
+
+def test_watching_a_cache():
+    backend = ChangingBackend([route("default"), route("10.0.0.0/8")])
+    cache = NetlinkStateCache(backend=backend)
+    cache.resync()
+    churn = RouteChurn().watch(cache)
+    assert sum(churn.events.values()) == 0, "What was there to start with is not churn"
+    cache.apply("RTM_NEWROUTE", route("172.16.0.0/12"))
+    assert churn.events[ADD] == 1
+    # A resync has no events, so the routes are compared
+    backend.routes = [route("default", via="192.0.2.254"), route("172.16.0.0/12")]
+    cache.resync()
+    assert churn.events == {ADD: 1, DELETE: 1, CHANGE: 1}, f"events is {churn.events}"
+    documents = churn.documents()
+    assert documents["/churn"]["routes"] == 2 and documents["/churn/default"]["inet"]["changes"] == 1
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests route_index.py with netlink_backend style route records
+
+import ipaddress
+import random
+import socket
+import sys
+
+import pytest
+
+import connection_table
+import route_index
+from route_index import RouteIndex
+
+
+def route(destination: str, dev: str, via: str = None, metric: int = 0) -> dict:
+    family = "inet6" if ":" in destination or ":" in (via or "") else "inet"
+    return {"family": family, "destination": destination, "dev": dev, "via": via, "metric": metric}
+
+
+ROUTES = [route("default", "eth0", "192.0.2.1", 100),
+          route("default", "wlan0", "198.51.100.1", 600),
+          route("10.0.0.0/8", "tun0", "10.255.0.1"),
+          route("10.1.0.0/16", "eth1"),
+          route("10.1.2.3", "eth2"),
+          route("fd00::/64", "eth0"),
+          route("default", "eth0", "fe80::1", 1024)]
+
+
+def test_longest_prefix_and_metric():
+    index = RouteIndex(ROUTES)
+    assert index.next_hop("10.1.2.3") == (None, "eth2"), "A host route is a /32"
+    assert index.next_hop("10.1.2.4") == (None, "eth1")
+    assert index.next_hop("10.200.0.1") == ("10.255.0.1", "tun0")
+    assert index.next_hop("8.8.8.8") == ("192.0.2.1", "eth0"), "Of two default routes, the lower metric wins"
+    assert index.next_hop("::ffff:8.8.8.8") == ("192.0.2.1", "eth0"), "An IPv4 mapped address is IPv4"
+    assert index.next_hop("fd00::5") == (None, "eth0")
+    assert index.next_hop("2001:db8::1") == ("fe80::1", "eth0")
+    assert index.lookup("2001:db8::1") is ROUTES[-1]
+    assert RouteIndex(ROUTES[2:4]).lookup("8.8.8.8") is None
+
+
+def test_updates():
+    index = RouteIndex(ROUTES)
+    index.lookup_many(["10.1.2.4"])  # Build the arrays, so that the update has to throw some of them away
+    index.remove(route("10.1.0.0/16", "eth1"))
+    assert index.next_hop("10.1.2.4") == ("10.255.0.1", "tun0")
+    assert index.lookup_many(["10.1.2.4"])[0] is ROUTES[2]
+    added, removed = index.update(ROUTES[:2] + [route("10.1.2.3", "eth2"), route("10.9.0.0/16", "eth3")])
+    assert (added, removed) == (1, 3), f"{added} added and {removed} removed"
+    assert index.next_hop("10.9.9.9") == (None, "eth3")
+    assert index.next_hop("10.1.2.3") == (None, "eth2")
+    assert index.next_hop("2001:db8::1") is None
+    index.add(route("default", "eth0", "192.0.2.254", 100))
+    assert index.next_hop("8.8.8.8") == ("192.0.2.254", "eth0"), "The same prefix, device and metric is replaced"
+    assert len(index) == 4
+    with pytest.raises(KeyError):
+        index.remove(route("172.16.0.0/12", "eth0"))
+
+
+def test_lookup_many_agrees_with_lookup():
+    rng = random.Random(3)
+    routes = [route("default", "eth0", "192.0.2.1"), route("::/0", "eth0", "fe80::1")]
+    for i in range(2000):
+        length = rng.choice([8, 16, 24, 32])
+        network = ipaddress.ip_network(((rng.getrandbits(32) >> (32 - length)) << (32 - length), length))
+        routes.append(route(str(network), f"eth{i % 5}", metric=i % 3))
+        length = rng.choice([32, 48, 64, 128])
+        network = ipaddress.ip_network(((rng.getrandbits(128) >> (128 - length)) << (128 - length), length))
+        routes.append(route(str(network), f"eth{i % 5}", metric=i % 3))
+    index = RouteIndex(routes)
+    # Some addresses in the routes, some at random
+    addresses = [str(ipaddress.ip_network(r["destination"]).network_address + 1) for r in routes[2:500]]
+    addresses += [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(500)]
+    addresses += [str(ipaddress.IPv6Address(rng.getrandbits(128))) for _ in range(500)]
+    expected = [index.lookup(address) for address in addresses]
+    assert index.lookup_many(addresses) == expected
+    packed = b"".join(route_index.pack(address) for address in addresses)
+    assert index.lookup_many(packed) == expected
+    networks = [(ipaddress.ip_network(route_index.route_fields(r)[1]), r) for r in routes]
+    for address, found in zip(addresses[:200], expected[:200]):
+        ip = ipaddress.ip_address(address)
+        best = max(((network, r) for network, r in networks if network.version == ip.version and ip in network),
+                   key=lambda match: (match[0].prefixlen, -match[1]["metric"]))[1]
+        assert route_index.route_fields(found)[1:] == route_index.route_fields(best)[1:], f"{address}"
+
+
+def test_connection_table_peers():
+    table = connection_table.ConnectionTable()
+    table.add(socket.AF_INET, "10.1.1.1", 40000, "10.1.2.3", 443)
+    table.add(socket.AF_INET6, "fd00::2", 40001, "fd00::9", 443)
+    table.add(socket.AF_INET, "10.1.1.1", 40002, "8.8.8.8", 53, protocol="UDP")
+    found = RouteIndex(ROUTES).lookup_many(table.remote_addresses)
+    assert [route_index.route_fields(r)[2] for r in found] == ["eth2", "eth0", "eth0"]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
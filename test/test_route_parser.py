@@ -0,0 +1,87 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests route_parser.py
+
+import subprocess
+import sys
+import time
+
+import pytest
+
+import route_parser
+
+MULTIPATH = """default proto static metric 100
+\tnexthop via 192.0.2.1 dev eth0 weight 1
+\tnexthop via 192.0.2.254 dev eth1 weight 2 onlink linkdown
+10.0.3.0/24 dev lxcbr0 proto kernel scope link src 10.0.3.1 linkdown
+"""
+
+
+def test_parse_route_line_keywords():
+    route = route_parser.parse_route_line("unreachable 2001:db8::/64 dev lo proto static metric 1024 error -113 "
+                                          "pref medium", "inet6")
+    assert route["type"] == "unreachable" and route["destination"] == "2001:db8::/64", f"route is {route}"
+    assert route["error"] == "-113" and route["pref"] == "medium" and route["metric"] == 1024
+    route = route_parser.parse_route_line("2001:db8:1::/64 via fe80::1 dev eth0 proto ra metric 100 expires 1583sec "
+                                          "mtu lock 1400 hoplimit 64 pref high", "inet6")
+    assert route["expires"] == 1583, f"expires is {route['expires']!r}, should be an int number of seconds"
+    assert route["mtu"] == "1400", "lock is not the mtu"
+    assert route["hoplimit"] == "64" and route["via"] == "fe80::1" and route["flags"] == []
+    route = route_parser.parse_route_line("default via inet6 fe80::1 dev eth0 onlink", "inet")
+    assert route["via"] == "fe80::1", "The family of the gateway is not the gateway"
+    assert route["flags"] == ["onlink"] and not route["linkdown"]
+
+
+def test_multipath():
+    routes = list(route_parser.parse_routes(MULTIPATH.split("\n"), "inet"))
+    assert len(routes) == 2, f"The next hops are not routes: {routes}"
+    default, lxcbr0 = routes
+    assert default["via"] is None and default["dev"] is None and default["metric"] == 100
+    assert default["nexthops"] == [{"via": "192.0.2.1", "dev": "eth0", "weight": 1, "flags": []},
+                                   {"via": "192.0.2.254", "dev": "eth1", "weight": 2, "flags": ["onlink", "linkdown"]}], \
+        f"nexthops is {default['nexthops']}"
+    assert lxcbr0["linkdown"] and lxcbr0["nexthops"] == []
+
+
+def test_stream_command(tmp_path):
+    path = tmp_path / "routes.txt"
+    path.write_text(MULTIPATH + "".join(f"10.{i >> 8}.{i & 255}.0/24 via 192.0.2.1 dev eth0\n" for i in range(10000)))
+    routes = list(route_parser.stream_command(["cat", str(path)], "inet"))
+    assert len(routes) == 10002, f"There should be 10002 routes, not {len(routes)}"
+    assert len(routes[0]["nexthops"]) == 2
+    assert routes[-1]["destination"] == "10.39.15.0/24"
+    with pytest.raises(subprocess.CalledProcessError):
+        list(route_parser.stream_command(["cat", str(tmp_path / "missing")], "inet"))
+
+
+def test_first_route_before_the_command_ends():
+    # The second route comes a second after the first one
+    command = [sys.executable, "-c", "import sys, time; print('10.0.0.0/8 dev eth0'); print('192.0.2.0/24 dev eth0');"
+                                     "sys.stdout.flush(); time.sleep(1.0); print('default via 192.0.2.1 dev eth0')"]
+    start = time.monotonic()
+    routes = route_parser.stream_command(command, "inet")
+    first = next(routes)
+    assert time.monotonic() - start < 0.9, "The first route should not wait for the command to finish"
+    assert first["destination"] == "10.0.0.0/8"
+    assert [route["destination"] for route in routes] == ["192.0.2.0/24", "default"]
+    sleeper = route_parser.stream_command([sys.executable, "-c", "import time; print('default dev eth0', flush=True); "
+                                                                 "time.sleep(10)"], "inet", timeout=0.5)
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        list(sleeper)
+    assert time.monotonic() - start < 5.0
+
+
+def test_timeout_does_not_count_the_callers_time(tmp_path):
+    path = tmp_path / "routes.txt"
+    path.write_text("".join(f"10.{i >> 8}.{i & 255}.0/24 via 192.0.2.1 dev eth0\n" for i in range(20)))
+    count = 0
+    for _ in route_parser.stream_command(["cat", str(path)], "inet", timeout=0.2):
+        time.sleep(0.05)  # The caller takes 1 second in all, much longer than the timeout
+        count += 1
+    assert count == 20, f"There should be 20 routes, not {count}"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
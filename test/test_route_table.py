@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests route_table.py
+
+import socket
+import sys
+
+import pytest
+
+import route_index
+import routes
+from route_table import RouteTable, CompactRoute
+
+RECORDS = [{"family": "inet", "destination": "default", "dev": "eth0", "via": "192.0.2.1", "metric": 100,
+            "proto": "dhcp", "scope": None, "src": "192.0.2.2", "linkdown": False},
+           {"family": "inet", "destination": "10.0.3.0/24", "dev": "lxcbr0", "via": None, "metric": 0,
+            "proto": "kernel", "scope": "link", "src": "10.0.3.1", "linkdown": True},
+           {"family": "inet", "destination": "203.0.113.7", "dev": "eth0", "via": "192.0.2.1", "metric": 0,
+            "proto": "static", "scope": None, "src": None, "linkdown": False},
+           {"family": "inet6", "destination": "fd00::/64", "dev": "eth0", "via": None, "metric": 256,
+            "proto": "kernel", "scope": None, "src": None, "linkdown": False},
+           {"family": "inet6", "destination": "default", "dev": "eth0", "via": "fe80::1", "metric": 1024,
+            "proto": "ra", "scope": None, "src": None, "linkdown": False}]
+
+
+def test_round_trip():
+    table = RouteTable.from_records(RECORDS)
+    assert len(table) == len(RECORDS)
+    default = table[0]
+    assert (default.family, default.prefix, default.prefixlen) == (socket.AF_INET, 0, 0)
+    assert default.gateway == 0xC0000201 and default.gateway_address == "192.0.2.1"
+    assert default.src_address == "192.0.2.2"
+    assert table[1].destination == "10.0.3.0/24" and table[1].gateway is None and table[1].linkdown
+    assert table[2].destination == "203.0.113.7/32", "A destination without a prefix length is a host route"
+    assert table[3].destination == "fd00::/64" and table[3].prefix == 0xFD00 << 112
+    assert table[-1].gateway_address == "fe80::1" and table[-1].metric == 1024
+    assert table[4] == CompactRoute(socket.AF_INET6, 0, 0, 0xFE80 << 112 | 1, "eth0", 1024, "ra")
+    with pytest.raises(IndexError):
+        table[5]
+
+
+def test_names_are_shared():
+    table = RouteTable.from_records(RECORDS * 100)
+    assert len(table.names) == len({None, "eth0", "lxcbr0", "dhcp", "kernel", "static", "ra", "link"})
+    assert table[0].dev is table[495].dev
+    assert table.nbytes() < 70 * len(table)
+
+
+def test_str_is_the_same_as_ipv4route():
+    table = RouteTable.from_records(RECORDS)
+    for row in range(3):
+        assert str(table[row]) == str(routes.IPv4Route(RECORDS[row])), f"Row {row} prints differently"
+
+
+def test_route_index():
+    index = route_index.RouteIndex(RouteTable.from_records(RECORDS))
+    assert index.next_hop("10.0.3.9") == (None, "lxcbr0")
+    assert index.next_hop("203.0.113.7") == ("192.0.2.1", "eth0")
+    assert index.next_hop("2001:db8::1") == ("fe80::1", "eth0")
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
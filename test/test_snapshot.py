@@ -0,0 +1,99 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests snapshot.py
+
+import json
+
+import pytest
+
+import diff_engine
+import snapshot
+from layer import Layer
+
+
+class Nic(Layer):
+    def __init__(self, name: str, mtu: int) -> None:
+        super().__init__(name=name)
+        self.mtu = mtu
+
+
+class Description(object):
+    """
+    Enough of a utilities.SystemDescription for a snapshot
+    """
+
+    def __init__(self, **layers):
+        self.system_name = "testhost"
+        for name in snapshot.LAYER_NAMES:
+            setattr(self, name, layers.get(name))
+
+
+ROUTES = [{"destination": f"10.0.{i}.0/24", "dev": "eth0", "metric": 100, "via": "192.0.2.1"} for i in range(200)]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_round_trip(tmp_path, compress):
+    path = str(tmp_path / "nominal.snapshot")
+    snapshot.write(path, Description(networks_4=ROUTES, physicals={"eth0": Nic("eth0", 1500)}), compress=compress)
+    loaded = snapshot.Snapshot(path)
+    assert loaded.version == snapshot.SNAPSHOT_VERSION and loaded.system_name == "testhost"
+    assert loaded.loaded() == [], "Opening a snapshot should not read any layers"
+    assert loaded.count("networks_4") == 200
+    assert loaded["physicals"]["eth0"]["mtu"] == 1500
+    assert loaded.loaded() == ["physicals"], f"Only physicals should have been read, not {loaded.loaded()}"
+    assert loaded["networks_4"] == ROUTES
+    assert loaded["applications"] is None and sorted(loaded) == sorted(snapshot.LAYER_NAMES)
+
+
+def test_diagnose_reads_only_the_layers_it_compares(tmp_path):
+    path = str(tmp_path / "nominal.snapshot")
+    snapshot.write(path, Description(networks_4=ROUTES, datalinks={"eth0": {"mtu": 1500}}))
+    nominal = snapshot.Snapshot(path)
+    index = diff_engine.NominalIndex(nominal, layer_names=["networks_4"])
+    assert nominal.loaded() == ["networks_4"]
+    report = index.diff(Description(networks_4=ROUTES[1:]))
+    assert [item.key for item in report["networks_4"].removed] == ["10.0.0.0/24 eth0 100"]
+
+
+def test_version_0_and_future_versions(tmp_path):
+    old = tmp_path / "old.json"
+    old.write_text(json.dumps({"version": "0.01", "timestamp": "Sat Jan 12 18:39:16 PST 2019",
+                               "datalinks": {"eth0": {"mtu": 1500}}}))
+    loaded = snapshot.Snapshot(str(old))
+    assert loaded.version == "0.01" and loaded["datalinks"] == {"eth0": {"mtu": 1500}}
+    future = tmp_path / "future.snapshot"
+    header = json.dumps({"version": snapshot.SNAPSHOT_VERSION + 1, "layers": {}}).encode()
+    future.write_bytes(snapshot.MAGIC + snapshot.HEADER_LENGTH.pack(len(header)) + header)
+    with pytest.raises(ValueError):
+        snapshot.Snapshot(str(future))
+
+
+class Presentation(Layer):
+    """A layer that is a single object, not a dictionary of them"""
+
+    def __init__(self) -> None:
+        super().__init__(name="presentations")
+        self.locale = "en_US.UTF-8"
+        self.timezone = "UTC"
+
+
+def test_nominal_then_diagnose_has_no_differences(tmp_path):
+    path = str(tmp_path / "nominal.snapshot")
+    snapshot.write(path, Description(presentations=Presentation(), networks_4=ROUTES,
+                                     physicals={"eth0": Nic("eth0", 1500)}))
+    nominal = snapshot.Snapshot(path)
+    assert isinstance(nominal["presentations"], snapshot.SnapshotObject) and nominal.count("presentations") == 1
+    # Discovered again, so the time is different, which is not a change
+    report = diff_engine.NominalIndex(nominal).diff(Description(presentations=Presentation(), networks_4=ROUTES,
+                                                                physicals={"eth0": Nic("eth0", 1500)}))
+    changed = {name: str(layer_diff) for name, layer_diff in report.layers.items() if len(layer_diff) > 0}
+    assert changed == {}, f"Nothing changed, but the diff is {changed}"
+
+
+def test_truncated_file(tmp_path):
+    path = tmp_path / "nominal.snapshot"
+    snapshot.write(str(path), Description(networks_4=ROUTES))
+    path.write_bytes(path.read_bytes()[:-10])
+    with pytest.raises(ValueError):
+        snapshot.Snapshot(str(path))["physicals"]
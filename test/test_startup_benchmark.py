@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests startup_benchmark.py, and that nbmdt starts without importing what it does not need
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import startup_benchmark
+
+PACKAGE = os.path.dirname(startup_benchmark.NBMDT)
+
+
+def test_importing_nbmdt_is_quiet_and_light():
+    completed = subprocess.run([sys.executable, "-c", "import nbmdt"], capture_output=True, text=True, cwd=PACKAGE)
+    assert completed.returncode == 0, f"import nbmdt failed: {completed.stderr}"
+    assert completed.stdout == "" and completed.stderr == "", \
+        f"Importing nbmdt should not print anything, it printed {completed.stdout + completed.stderr!r}"
+    assert startup_benchmark.imported_modules("nbmdt") == [], "Importing nbmdt imported modules that it doesn't need"
+
+
+@pytest.mark.parametrize("module", ["constants", "osclinter", "utilities", "application", "physical", "routes"])
+def test_no_module_prints_when_imported(module):
+    completed = subprocess.run([sys.executable, "-c", f"import {module}"], capture_output=True, text=True,
+                               cwd=PACKAGE)
+    assert completed.returncode == 0, f"import {module} failed: {completed.stderr}"
+    assert completed.stdout == "" and completed.stderr == "", \
+        f"Importing {module} printed {completed.stdout + completed.stderr!r}"
+
+
+def test_slowest_imports():
+    output = "\n".join(["import time: self [us] | cumulative | imported package",
+                        "import time:       100 |        100 |   constants",
+                        "import time:      2000 |     150000 |     pyroute2",
+                        "import time:       500 |     160000 |   utilities",
+                        "import time:        50 |     170000 | nbmdt"])
+    assert startup_benchmark.slowest_imports(output, n=2) == [("nbmdt", 0.17), ("utilities", 0.16)]
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
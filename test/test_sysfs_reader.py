@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests sysfs_reader.py, on a fake /sys/class/net and on the real one
+
+import os
+import shutil
+import sys
+
+import pytest
+
+import sysfs_reader
+from sysfs_reader import SysfsReader
+
+
+def make_interface(root, ifname: str, **attributes) -> None:
+    os.makedirs(os.path.join(root, ifname, "statistics"), exist_ok=True)
+    for name, value in attributes.items():
+        name = name.replace("__", "/")
+        with open(os.path.join(root, ifname, name), "w") as f:
+            f.write(f"{value}\n")
+
+
+def test_values_are_decoded(tmp_path):
+    make_interface(tmp_path, "eth0", address="52:54:00:12:34:56", carrier=1, flags="0x1003", mtu=1500,
+                   operstate="up", statistics__rx_bytes=123456789012)
+    with SysfsReader(["address", "carrier", "flags", "mtu", "operstate", "speed", "statistics/rx_bytes"],
+                     root=str(tmp_path)) as reader:
+        values = reader.read("eth0")
+    assert values == {"address": "52:54:00:12:34:56", "carrier": True, "flags": 0x1003, "mtu": 1500,
+                      "operstate": "up", "speed": None, "statistics/rx_bytes": 123456789012}, f"got {values}"
+
+
+def test_files_are_kept_open_and_read_again(tmp_path):
+    make_interface(tmp_path, "eth0", statistics__rx_bytes=100)
+    with SysfsReader(["statistics/rx_bytes"], root=str(tmp_path)) as reader:
+        assert reader.read("eth0")["statistics/rx_bytes"] == 100
+        fd = reader._fds["eth0"]["statistics/rx_bytes"]
+        make_interface(tmp_path, "eth0", statistics__rx_bytes=250)
+        assert reader.read("eth0")["statistics/rx_bytes"] == 250
+        assert reader._fds["eth0"]["statistics/rx_bytes"] == fd, "The file should not have been opened again"
+    assert reader._fds == {}, "Leaving the with statement should have closed the files"
+
+
+def test_interfaces_that_come_and_go(tmp_path):
+    make_interface(tmp_path, "eth0", mtu=1500)
+    make_interface(tmp_path, "eth1", mtu=9000)
+    reader = SysfsReader(["mtu"], root=str(tmp_path))
+    assert reader.read_all() == {"eth0": {"mtu": 1500}, "eth1": {"mtu": 9000}}
+    shutil.rmtree(os.path.join(tmp_path, "eth1"))
+    assert reader.read_all() == {"eth0": {"mtu": 1500}}
+    assert "eth1" not in reader._fds, "The files of eth1 should have been closed"
+    assert reader.read("eth1") is None
+    make_interface(tmp_path, "eth1", mtu=1280)
+    assert reader.read_all(["eth0", "eth1", "eth2"]) == {"eth0": {"mtu": 1500}, "eth1": {"mtu": 1280}}
+    reader.close()
+
+
+def test_unknown_attribute():
+    with pytest.raises(ValueError):
+        SysfsReader(["mtu", "favorite_color"])
+
+
+@pytest.mark.skipif(not os.path.isdir(sysfs_reader.SYSFS_NET + "/lo"), reason="needs /sys/class/net/lo")
+def test_loopback():
+    with SysfsReader() as reader:
+        values = reader.read("lo")
+    assert values["mtu"] > 0 and values["ifindex"] > 0, f"got {values}"
+    assert values["type"] == 772, f"lo should be ARPHRD_LOOPBACK, type is {values['type']}"
+    assert all(isinstance(values[name], int) for name in sysfs_reader.COUNTERS), f"got {values}"
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
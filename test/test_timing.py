@@ -0,0 +1,100 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Tests timing.py, and the things that use it, with a wall clock that jumps
+
+import datetime
+import os
+import sys
+
+import pytest
+
+import layer
+import timing
+from counter_rates import RateEngine
+
+HOUR = 3600 * 10 ** 9  # in nanoseconds
+
+
+class FakeClocks(object):
+    """
+    A monotonic clock and a wall clock that only move when told to
+    """
+
+    def __init__(self, monkeypatch) -> None:
+        self.monotonic = 1000 * 10 ** 9
+        self.wall = 1700000000 * 10 ** 9
+        monkeypatch.setattr(timing, "monotonic_ns", lambda: self.monotonic)
+        monkeypatch.setattr(timing, "wall_ns", lambda: self.wall)
+        timing.reanchor()
+
+    def sleep(self, seconds: float) -> None:
+        self.monotonic += int(seconds * 1e9)
+        self.wall += int(seconds * 1e9)
+
+    def jump(self, ns: int) -> None:
+        """The wall clock is set, e.g. by NTP.  The monotonic clock does not notice"""
+        self.wall += ns
+
+
+@pytest.fixture
+def clocks(monkeypatch):
+    yield FakeClocks(monkeypatch)
+    timing.reanchor()
+
+
+def test_layer_difference_ignores_wall_clock_jumps(clocks):
+    before = layer.Layer("eth0")
+    clocks.sleep(2.0)
+    clocks.jump(-HOUR)
+    timing.reanchor()
+    after = layer.Layer("eth0")
+    delta = after - before
+    assert delta.time == datetime.timedelta(seconds=2), f"delta.time is {delta.time}, the wall clock jump leaked in"
+
+
+def test_one_anchor_per_snapshot(clocks):
+    first = timing.now()
+    clocks.sleep(1.0)
+    clocks.jump(HOUR)
+    second = timing.now()
+    assert second.wall() - first.wall() == datetime.timedelta(seconds=1), \
+        "Timestamps with the same anchor should not see the jump"
+    timing.reanchor()
+    third = timing.now()
+    assert third.wall() - first.wall() == datetime.timedelta(seconds=3601), "A new anchor should see the jump"
+    assert first.wall() == datetime.datetime.fromtimestamp(1700000000), "The old timestamps keep their anchor"
+    assert third - first == datetime.timedelta(seconds=1)
+    assert first < second <= third and first == timing.Timestamp(first.ns)
+
+
+def test_wall_clock_going_backwards(clocks):
+    start = timing.now()
+    clocks.sleep(0.5)
+    clocks.jump(-HOUR)
+    timing.reanchor()
+    end = timing.now()
+    assert end > start and (end - start).total_seconds() == 0.5
+    assert end.wall() < start.wall(), "The wall clock went back an hour, and the wall time should say so"
+
+
+def test_rates_ignore_wall_clock_jumps(clocks, tmp_path):
+    os.makedirs(tmp_path / "eth0" / "statistics")
+    counter = tmp_path / "eth0" / "statistics" / "rx_bytes"
+    engine = RateEngine(counters=["statistics/rx_bytes"], root=str(tmp_path))
+    for i, jump in enumerate([0, HOUR, -2 * HOUR, 0]):
+        counter.write_text(f"{i * 1000}\n")
+        engine.sample()
+        clocks.sleep(1.0)
+        clocks.jump(jump)
+        timing.reanchor()
+    assert engine.series("eth0")["rx_bytes"] == [1000.0, 1000.0, 1000.0], f"series is {engine.series('eth0')}"
+    engine.close()
+
+
+def test_to_jsonable(clocks):
+    assert layer.to_jsonable({"time": timing.now()}) == {"time": datetime.datetime.fromtimestamp(1700000000).isoformat()}
+
+
+if __name__ == "__main__":
+    sys.exit(pytest.main([__file__]))
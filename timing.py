@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Timestamps for layers, entities, statuses, counter rates and the event log.
+#
+# The time between two events comes from the monotonic clock, which never jumps.  The wall clock does jump: NTP
+# steps it, an administrator sets it, a virtual machine is resumed.  A rate or an age computed from the wall clock
+# across a jump is wrong, or negative.  So a Timestamp is a reading of time.monotonic_ns(), which is also cheaper than
+# building a datetime, and the wall clock is only read once per anchor: an Anchor pairs one wall clock reading with
+# one monotonic reading, and a Timestamp's wall clock time is its anchor's wall clock time plus however long after
+# the anchor it was taken.
+#
+# reanchor() is called once per snapshot of the system (see utilities.SystemDescription.discover), so every Timestamp
+# in a snapshot agrees about the wall clock, and a jump in the wall clock shows up in the next snapshot.
+#
+# monotonic_ns and wall_ns are the clocks.  A test can replace them to make the wall clock jump.
+
+import datetime
+import functools
+import sys
+import time
+
+monotonic_ns = time.monotonic_ns
+wall_ns = time.time_ns
+
+
+class Anchor(object):
+    """
+    One reading of the wall clock, and the monotonic clock at the same moment
+    """
+    __slots__ = ["monotonic_ns", "wall_ns"]
+
+    def __init__(self) -> None:
+        self.monotonic_ns: int = monotonic_ns()
+        self.wall_ns: int = wall_ns()
+
+    def wall_ns_at(self, ns: int) -> int:
+        """
+        :param ns: a reading of the monotonic clock
+        :return: the wall clock at that moment, in nanoseconds since the epoch
+        """
+        return self.wall_ns + (ns - self.monotonic_ns)
+
+    @property
+    def offset(self) -> float:
+        """
+        :return: what to add to a time.monotonic() to make it a time.time(), in seconds
+        """
+        return (self.wall_ns - self.monotonic_ns) / 1e9
+
+
+_anchor = Anchor()
+
+
+def anchor() -> Anchor:
+    """
+    :return: the anchor that new Timestamps get
+    """
+    return _anchor
+
+
+def reanchor() -> Anchor:
+    """
+    Read the wall clock again.  Timestamps that were already taken keep their anchor
+    """
+    global _anchor
+    _anchor = Anchor()
+    return _anchor
+
+
+@functools.total_ordering
+class Timestamp(object):
+    """
+    A moment, by the monotonic clock.  Subtracting one Timestamp from another gives a datetime.timedelta
+    """
+    __slots__ = ["ns", "anchor"]
+
+    def __init__(self, ns: int = None, anchor: Anchor = None) -> None:
+        """
+        :param ns: a reading of monotonic_ns.  If None, then now
+        :param anchor: the Anchor to find the wall clock time with.  If None, the current one
+        """
+        self.ns: int = monotonic_ns() if ns is None else ns
+        self.anchor: Anchor = _anchor if anchor is None else anchor
+
+    @property
+    def seconds(self) -> float:
+        """
+        :return: the monotonic clock in seconds, like time.monotonic()
+        """
+        return self.ns / 1e9
+
+    def wall(self) -> datetime.datetime:
+        """
+        :return: the wall clock time, in the local time zone like datetime.datetime.now()
+        """
+        return datetime.datetime.fromtimestamp(self.anchor.wall_ns_at(self.ns) / 1e9)
+
+    def isoformat(self) -> str:
+        return self.wall().isoformat()
+
+    def __sub__(self, other: 'Timestamp') -> datetime.timedelta:
+        if not isinstance(other, Timestamp):
+            return NotImplemented
+        return datetime.timedelta(microseconds=(self.ns - other.ns) / 1000)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Timestamp) and self.ns == other.ns
+
+    def __lt__(self, other: 'Timestamp') -> bool:
+        return self.ns < other.ns
+
+    def __hash__(self) -> int:
+        return hash(self.ns)
+
+    def __str__(self):
+        return str(self.wall())
+
+    def __repr__(self):
+        return f"Timestamp({self.ns})"
+
+
+def now() -> Timestamp:
+    return Timestamp()
+
+
+if __name__ == "__main__":
+    N = 1000000
+    t0 = time.perf_counter()
+    for _ in range(N):
+        datetime.datetime.now()
+    t1 = time.perf_counter()
+    for _ in range(N):
+        Timestamp()
+    t2 = time.perf_counter()
+    print(f"datetime.datetime.now() takes {(t1 - t0) / N * 1e9:.0f} ns, Timestamp() takes {(t2 - t1) / N * 1e9:.0f} ns",
+          file=sys.stderr)
+    print(f"It is now {now()}")
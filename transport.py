@@ -8,10 +8,11 @@ from enum import Enum
 # from network import IPv4Address as ipv4
 # from network import IPv6Address as ipv6
 from socket import AF_INET, AF_INET6
-from typing import List
+from typing import Dict, List
 
 import layer
-from constants import ErrorLevels
+import proc_net
+from constants import ErrorLevels, TcpStates
 
 
 class Transport(object):
@@ -32,8 +33,20 @@ class Transport(object):
         UDP = 17
 
     class TcpConnection(object):
-
-        def __init__(self, ip_proto, src_host, src_port, dst_host, dst_port) -> None:
+        """
+        One socket.  There can be hundreds of thousands of these, so they have __slots__ instead of a __dict__
+        """
+        __slots__ = ["ip_proto", "src_host", "src_port", "dst_host", "dst_port", "state", "protocol", "uid", "inode"]
+
+        def __init__(self, ip_proto, src_host, src_port, dst_host, dst_port, state: TcpStates = None,
+                     protocol="TCP", uid: int = None, inode: int = None) -> None:
+            """
+            :param ip_proto: socket.AF_INET or socket.AF_INET6
+            :param state: the state of the socket, None if it isn't known
+            :param protocol: a Transport.TransportNames, or its name
+            :param uid: the user ID of the owner of the socket
+            :param inode: the inode of the socket, which is how to find the process that has it open
+            """
             if ip_proto != socket.AF_INET and ip_proto != socket.AF_INET6:
                 raise ValueError("ip_proto may be AF_INET or AF_INET6, but not " + str(ip_proto))
             self.ip_proto = ip_proto
@@ -41,38 +54,88 @@ class Transport(object):
             self.src_port = src_port
             self.dst_host = dst_host
             self.dst_port = dst_port
+            self.state = state
+            self.protocol = Transport.TransportNames[protocol] if isinstance(protocol, str) else protocol
+            self.uid = uid
+            self.inode = inode
+
+        def is_listener(self) -> bool:
+            if self.protocol == Transport.TransportNames.TCP:
+                return self.state == TcpStates.LISTEN
+            return self.state == proc_net.UDP_LISTEN_STATE
 
-    def __init__(self, connections: List[TcpConnection]) -> None:
-        self.connections: connections
-        pass
+        def __str__(self):
+            state = "" if self.state is None else " " + self.state.name
+            return f"{self.protocol.name} {self.src_host}:{self.src_port} {self.dst_host}:{self.dst_port}{state}"
+
+    def __init__(self, connections: List[TcpConnection] = None) -> None:
+        """
+        :param connections: a list of TcpConnection, or a connection_table.ConnectionTable, which is much smaller
+        and has indexes for find_all_listeners and find_connections_to
+        """
+        self._connections: List[Transport.TcpConnection] = connections if connections is not None else list()
 
     def find_all_listeners(self, transport: TransportNames = TransportNames.TCP) -> dict:
-        pass
+        """
+        :return: a dictionary of the sockets that are listening for connections (TCP) or datagrams (UDP), keyed by
+        local port.  The values are lists, because there can be a socket for each address family or local address
+        """
+        if hasattr(self._connections, "listeners"):  # A ConnectionTable
+            return self._connections.listeners(transport=transport)
+        listeners: Dict[int, List[Transport.TcpConnection]] = dict()
+        for connection in self._connections:
+            if connection.protocol == transport and connection.is_listener():
+                listeners.setdefault(connection.src_port, []).append(connection)
+        return listeners
+
+    def find_connections_to(self, remote_address: str) -> List[TcpConnection]:
+        """
+        :param remote_address: e.g. "192.0.2.7"
+        :return: every socket connected to remote_address
+        """
+        if hasattr(self._connections, "by_remote_address"):  # A ConnectionTable
+            return self._connections.by_remote_address(remote_address)
+        return [connection for connection in self._connections if connection.dst_host == remote_address]
 
     def add_connection(self, source_port: int, destination_port: int,
                        #                       remote_address : Union[ipv4, ipv6],
                        remote_address,
                        transport: TransportNames = TransportNames.TCP) -> None:
-        connection = (source_port, destination_port, remote_address, transport)
-        self._connections.append(connection)
+        family = AF_INET6 if ":" in str(remote_address) else AF_INET
+        connection = Transport.TcpConnection(family, None, source_port, str(remote_address), destination_port,
+                                             protocol=transport)
+        if hasattr(self._connections, "add_connection"):  # A ConnectionTable
+            self._connections.add_connection(connection)
+        else:
+            self._connections.append(connection)
 
     @property
     def list_all_connections(self) -> list:
         return self._connections
 
     @classmethod
-    def find_all_connections(cls, transport=TransportNames.TCP, af_family=None) -> list:
+    def find_all_connections(cls, transport=TransportNames.TCP, af_family=None, states=None, ports=None,
+                             proc_net_dir: str = proc_net.PROC_NET) -> list:
         """
-
-
-        :return: A list of all of the connections.  Each connection is a
+        Read the sockets of this system from the kernel, see proc_net.py
+
+        :param transport: Transport.TransportNames.TCP or Transport.TransportNames.UDP
+        :param af_family: AF_INET, AF_INET6 or None for both
+        :param states: if not None, only the sockets in these TcpStates
+        :param ports: if not None, only the sockets with one of these local ports
+        :param proc_net_dir: where the kernel's socket tables are
+        :return: A list of all of the connections.  Each connection is a Transport.TcpConnection
         """
         if af_family != AF_INET and af_family != AF_INET6 and af_family is not None:
             raise ValueError("af_family has a bad value " + str(af_family))
-        print(transport)
-        return []
+        return list(proc_net.read_connections(protocols=[transport.name], family=af_family,
+                                              factory=cls.TcpConnection, states=states, local_ports=ports,
+                                              proc_net=proc_net_dir))
 
 
 if __name__ == "__main__":
     transports: Transport = Transport.discover()
     print(transports)
+    tcp = Transport(Transport.find_all_connections())
+    for port, sockets in tcp.find_all_listeners().items():
+        print(port, [str(s) for s in sockets])
@@ -3,21 +3,26 @@
 # This file has utility functions that will be generally useful
 
 
-import json
 import os
 import platform
 import subprocess
 import sys
+import typing
 from typing import List, Tuple
 
+# OsCliInter, os_name and the_os have to be here before the layers are imported, because some of them import them
+# from utilities, e.g. from utilities import OsCliInter
+from osclinter import OsCliInter, os_name, the_os
 # import application, presentation, session, transport, routes, datalink, physical
 import application
 import constants
 import datalink
+import discovery
 import physical
 import presentation
 import routes
 import session
+import timing
 import transport
 from constants import ErrorLevels
 from constants import OperatingSystems
@@ -98,86 +103,107 @@ class SystemDescription(object):
         self.physicals = physicals
         self.configuration_filename: str = configuration_filename
         self.system_name: str = system_name
+        # Filled in by discover, keyed by layer name.  The values are discovery.LayerTiming objects
+        self.discovery_timings: typing.Dict[str, discovery.LayerTiming] = dict()
 
     @classmethod
-    def discover(cls):              # class SystemDescription
+    def discover(cls, timeouts: typing.Dict[str, float] = None) -> 'SystemDescription':  # class SystemDescription
         """
+        Examine each layer in the protocol stack and discover what's in it.  The layers are independent of each other,
+        so their discover methods run at the same time, see discovery.DiscoveryScheduler.
+
+        :param timeouts: optional per-layer timeouts in seconds, keyed by the layer name, e.g. "physicals"
         :return: SystemDescription  this method returns a SystemDescription object based on examining the
-        current system
+        current system.  The discovery_timings attribute has how long each layer took
         """
-        print(f"In {cls.__name__}, the type of cls is {type(cls)}.", file=sys.stderr)
-
-        # Examine each layer in the protocol stack and discover what's in it
-        applications: type_application_dict = application.Application.discover()
-        presentations: type_presentation_dict = presentation.Presentation.discover()
-        sessions: type_session_dict = session.Session.discover()
-        transports: constants.type_transport_dict = transport.Transport.discover()
-        networks_4: constants.type_network_4_dict = routes.IPv4Route.discover()
-        networks_6: type_network_6_dict = routes.IPv6Route.discover()
-        datalinks: constants.type_datalink_dict = datalink.DataLink.discover()
-        physicals: constants.type_physical_dict = physical.Physical.discover()
-
-        # cls.__init__(cls,
-
-        sd: SystemDescription = SystemDescription (
-                     sessions=sessions,
-                     applications=applications,
-                     presentations=presentations,
-                     transports=transports,
-                     networks_4=networks_4,
-                     networks_6=networks_6,
-                     datalinks=datalinks,
-                     physicals=physicals)
 
+        probes = {"applications": application.Application.discover,
+                  "presentations": presentation.Presentation.discover,
+                  "sessions": session.Session.discover,
+                  "transports": transport.Transport.discover,
+                  "networks_4": routes.IPv4Route.discover,
+                  "networks_6": routes.IPv6Route.discover,
+                  "datalinks": datalink.DataLink.discover,
+                  "physicals": physical.Physical.discover}
+        # Every timestamp in this description finds its wall clock time from the same reading of the wall clock
+        timing.reanchor()
+        layers, timings = discovery.DiscoveryScheduler(probes=probes, timeouts=timeouts).run()
+
+        sd: SystemDescription = SystemDescription(**layers)
+        sd.discovery_timings = timings
         return sd
 
     @classmethod
     def system_description_from_file(cls, filename: str) -> 'SystemDescription':
         """
-        Read a system description from a file and create a SystemDescription object.
-        I couldn't figure out how to return a SystemDescription object, so I return an object
-        :param filename:
+        Read a system description from a file and create a SystemDescription object.  This reads every layer, use
+        snapshot.Snapshot to read only some of them
+        :param filename:    a file written by file_from_system_description
         :return:
         """
         if not os.path.isfile(filename):
             raise FileNotFoundError(f"The file {filename} does not exist")
-        with open(filename, "r") as f:
-            so = json.load(f)
+        import snapshot
+        so = snapshot.Snapshot(filename)
 
-        # There might be an issue some day because the output from the json.load is going to be a dictionary of
-        # dictionaries
+        # There might be an issue some day because the layers are going to be dictionaries of dictionaries, not
+        # layer objects
 
         return SystemDescription(
-            applications=so.applications,
-            presentations=so.presentations,
-            sessions=so.presentations,
-            transports=so.transports,
-            networks_4=so.networks_4,
-            networks_6=so.networks_6,
-            datalinks=so.datalinks,
-            physicals=so.physicals,
+            applications=so.get("applications"),
+            presentations=so.get("presentations"),
+            sessions=so.get("sessions"),
+            transports=so.get("transports"),
+            networks_4=so.get("networks_4"),
+            networks_6=so.get("networks_6"),
+            datalinks=so.get("datalinks"),
+            physicals=so.get("physicals"),
             configuration_filename=filename,
             system_name=so.system_name
         )
 
+    # Nominal files that have already been indexed for diagnose, keyed by file name.  The values are the
+    # modification time of the file when it was indexed and the diff_engine.NominalIndex
+    _nominal_indexes: 'typing.Dict[str, typing.Tuple[int, diff_engine.NominalIndex]]' = dict()
+
+    @classmethod
+    def nominal_index(cls, filename: str, layers: List[str] = None) -> 'diff_engine.NominalIndex':
+        """
+        Read and index a nominal file, unless it has been indexed already and has not changed since
+
+        :param filename: a file written by file_from_system_description
+        :param layers: the layers to index, all of them if None.  Only these layers are read from the file
+        :return: a diff_engine.NominalIndex, which can be compared to the current state as often as needed
+        """
+        import diff_engine
+        import snapshot
+        mtime = os.stat(filename).st_mtime_ns
+        key = filename if layers is None else filename + ":" + ",".join(layers)
+        cached = cls._nominal_indexes.get(key)
+        if cached is None or cached[0] != mtime:
+            cached = cls._nominal_indexes[key] = \
+                (mtime, diff_engine.NominalIndex(snapshot.Snapshot(filename), layer_names=layers))
+        return cached[1]
+
     # Method discover has to be moved out of utilities and put somewhere
     # else because discover depends on classes Application, Presentation,
     # Session, Transport, Routes, Interfaces, Datalink, and Physical.
     # But these classes all depend on module utilities, so there are
     # circular dependencies.
-    print("Log the above comment as a bug", file=sys.stderr)
+    # Log the above comment as a bug
 
     # method discover was here, but is now moved to nbmdt.py
 
-    def file_from_system_description(self, filename: str) -> None:
-        """Write a system description to a file
+    def file_from_system_description(self, filename: str, compress: bool = True) -> None:
+        """Write a system description to a file, in the format in snapshot.py
         :param  filename
+        :param  compress    if True, then each layer is compressed with zlib
         :return:
         """
         # In the future, detect if a configuration file already exists, and if so, create
         # a new version.
-        with open(filename, "w") as f:
-            json.dump(self, f)
+        import snapshot
+        snapshot.write(filename, self, compress=compress)
 
     """
         def __init__(self, configuration_file: str = None, description: Descriptions = None) -> None:
@@ -274,23 +300,65 @@ class SystemDescription(object):
         self.file_from_system_description(filename)
         return ErrorLevels.NORMAL
 
-    def boot(self) -> None:
-        print("Going to test in boot mode", file=sys.stderr)
-        raise NotImplementedError
+    def boot(self, deadline: float = constants.BOOT_DEADLINE) -> ErrorLevels:
+        """
+        Check the links, the addresses, the default gateway, DNS and the hosts outside, and print the result of each
+        check color coded.  The checks run at the same time where they can, see boot_pipeline.py.  The checks probe the
+        system themselves, so this system description does not have to be discovered first
+
+        :param deadline: seconds after which whatever is still being checked is reported as ErrorLevels.UNKNOWN
+        :return: the worst status of the checks
+        """
+        import boot_pipeline
+        results = boot_pipeline.BootPipeline(deadline=deadline).run()
+        boot_pipeline.report(results)
+        return boot_pipeline.worst(results)
+
+    def monitor(self, port: int = constants.PORT) -> None:
+        """
+        Serve the state of this system over HTTP until interrupted, see monitor_server.py.  This system description is
+        the first snapshot, after that the layers are discovered again in the background.
 
-    def monitor(self, port) -> None:
+        :param port: the TCP port to listen on
+        """
+        if port is None:
+            port = constants.PORT
         print(f"going to monitor on port {port}", file=sys.stderr)
-        raise NotImplementedError
+        import counter_rates
+        import monitor_server
+        import route_churn
+        monitor_server.MonitorServer(discover=SystemDescription.discover, port=port, initial=self,
+                                     rates=counter_rates.RateEngine(), churn=route_churn.start_churn(),
+                                     dependencies=True).run()
+
+    def diagnose(self, filename, layers: List[str] = None) -> ErrorLevels:
+        """
+        Compare this system with the nominal state in filename, and print what is different, layer by layer
 
-    def diagnose(self, filename) -> ErrorLevels:
+        :param filename: a file written by file_from_system_description when the system was working
+        :param layers: the names of the layers to compare, e.g. ["networks_4", "datalinks"].  All of them if None
+        :return: ErrorLevels.NORMAL if nothing is different, otherwise the worst ErrorLevels of the differences
+        """
         print(f"In diagnostic mode, nomminal filename is {filename}", file=sys.stderr)
-        nominal_system: SystemDescription = SystemDescription.system_description_from_file(filename)
-        print(nominal_system)
-        return ErrorLevels.NORMAL
+        report: diff_engine.DiffReport = self.nominal_index(filename, layers).diff(self)
+        print(report)
+        return report.get_status()
 
-    def test(self, test_specification) -> None:
-        print(f"The test_specification is {test_specification}", file=sys.stderr)
-        raise NotImplementedError
+    def test(self, test_specification: str) -> ErrorLevels:
+        """
+        Probe the targets of a specification (ICMP, TCP connect and DNS, see reachability.py) and print the result of
+        each probe color coded as soon as it finishes, then how many targets passed each probe.  The probes probe the
+        targets themselves, so this system description does not have to be discovered first
+
+        :param test_specification: the name of a specification file, or the specification itself
+        :return: the worst status of the probes
+        """
+        import reachability
+        test_matrix = reachability.ReachabilityMatrix.from_specification(test_specification)
+        print(f"Running {len(test_matrix.probes)} probes, {test_matrix.concurrency} at a time", file=sys.stderr)
+        results = test_matrix.run(on_result=reachability.print_result)
+        reachability.summary(results)
+        return reachability.worst(results)
 
 
 class SystemDescriptionFile(SystemDescription):
@@ -300,55 +368,44 @@ class SystemDescriptionFile(SystemDescription):
 
     def __init__(self, configuration_filename):
         """Create a SystemDescription object which has all of the information in a system configuration file"""
-        system_name="FAKE_NAME"
-        with open(configuration_filename, "r") as json_fp:
-            c_dict = json.load(json_fp)  # Configuration dictionary
+        import snapshot
+        c_dict = snapshot.Snapshot(configuration_filename)  # Configuration dictionary
         # Issue 31 Instead of raising a KeyError exception, just use None
         super(SystemDescriptionFile, self).__init__(applications=c_dict.get("applications"),
                                                     presentations=c_dict.get("presentations"),
                                                     sessions=c_dict.get("sessions"),
-                                                    transports=c_dict.get("networks"),
+                                                    transports=c_dict.get("transports"),
+                                                    networks_4=c_dict.get("networks_4"),
+                                                    networks_6=c_dict.get("networks_6"),
                                                     datalinks=c_dict.get("datalinks"),
                                                     physicals=c_dict.get("physicals"),
                                                     configuration_filename=configuration_filename,
-                                                    system_name=system_name  # for now.
+                                                    system_name=c_dict.system_name
                                                     )
-        self.version = c_dict['version']
-        self.timestamp = c_dict['timestamp']
+        self.version = c_dict.version
+        self.timestamp = c_dict.timestamp
+        self._nominal_index = None  # Made by compare_state the first time it is called
 
     def save_state(self, filename):
-        with open(filename, "w") as json_fp:
-            json.dump(self, json_fp, ensure_ascii=False)
+        self.file_from_system_description(filename)
 
-    def compare_state(self, the_other):
+    def compare_state(self, the_other) -> 'diff_engine.DiffReport':
         """This method compares the 'nominal' state, which is in self, with another state, 'the_other'.  The output is
-    a dictionary which is keyed by field.  The values of the dictionary are a dictionary with three keys:
-    Comparison.NOMINAL, Comparison.OTHER.  The values of these dictonaries will be objects
-    appropriate for what is being compared.  If something is not in Comparison.NOMINAL and not in Comparison.DIFFERENT,
-     then there is no change.  
-    
+    a diff_engine.DiffReport, which is keyed by layer.  For each layer, there are the entities that were added,
+    removed and changed, each with an ErrorLevels severity.  For an entity that changed, there are the fields that
+    changed, with the nominal value and the other value.  If an entity is in none of them, then there is no change.
+    self is indexed the first time, after that the index is reused.
+
         """
-        pass
-
-
-# Globally note the operating system name.  Note that this section of the code *must* follow the definition
-# of class OsCliInter or else the compiler will raise a NameError exception at compile time
-# Access the_os using utilities.the_os  The variable is so named to avoid confusion with the os package name
-print("About to import osCliInter", file="sys.stderr")
-os_name: str = osclinter.OsCliInter.system.lower()
-the_os = constants.OperatingSystems.UNKNOWN
-if 'linux' == os_name:
-    the_os = constants.OperatingSystems.LINUX
-elif 'windows' == os_name:
-    the_os = constants.OperatingSystems.WINDOWS
-elif 'darwin' == os_name:
-    the_os = constants.OperatingSystems.MAC_OS_X
-else:
-    raise ValueError(f"System is {os_name} and I don't recognize it")
+        if self._nominal_index is None:
+            import diff_engine
+            self._nominal_index = diff_engine.NominalIndex(self)
+        return self._nominal_index.diff(the_other)
+
 
 if "__main__" == __name__:
     print(f"System is {os_name} A.K.A. {the_os}")
     if OperatingSystems.LINUX == the_os:
-        print(f"In linux, the uname -a command output is \n{OsCliInter.run_command(['uname', '-a'])}\n.")
+        print(f"In linux, the uname -a command output is \n{OsCliInter.run_command(['uname', '-a'])[0]}\n.")
     else:
         raise NotImplemented("This program ONLY runs on linux at this time")